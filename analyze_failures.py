@@ -2,24 +2,27 @@
 分析下載失敗原因
 """
 
-import json
 from collections import Counter
 
+from config import STATE_DB_FILE, PROGRESS_FILE
+from state_store import RunStateStore
+
 
 def analyze_failures():
     print("=" * 70)
     print("📊 下載失敗原因分析")
     print("=" * 70)
 
-    with open("download_progress.json", "r", encoding="utf-8") as f:
-        data = json.load(f)
-
-    completed = data.get("completed", [])
-    failed = data.get("failed", [])
+    store = RunStateStore(STATE_DB_FILE)
+    if store.get_meta("json_imported") is None:
+        store.import_json_progress(PROGRESS_FILE)
+    completed = store.completed_ids()
+    failed = store.failed_entries()
 
     print(f"\n✅ 已完成: {len(completed)} 個樣本")
     print(f"❌ 失敗: {len(failed)} 個樣本")
-    print(f"📊 成功率: {len(completed)/(len(completed)+len(failed))*100:.1f}%")
+    if completed or failed:
+        print(f"📊 成功率: {len(completed)/(len(completed)+len(failed))*100:.1f}%")
 
     if not failed:
         print("\n🎉 沒有失敗的樣本!")
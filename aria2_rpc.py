@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+共用的 aria2 常駐程序（JSON-RPC）
+原本每個下載線程各自啟動一個 aria2c（每個 ARIA2_CONNECTIONS 條連線），
+8 個線程就可能同時對 NCBI 開 128 條連線，且每個樣本都要付一次程序啟動成本。
+
+改為整個程式共用一個長駐的 aria2c --enable-rpc:
+- 下載以 aria2.addUri 排入 aria2 的佇列，同時進行的下載數由 --max-concurrent-downloads 限制
+- 全域連線上限: 每個下載的連線數 = min(ARIA2_CONNECTIONS, ARIA2_GLOBAL_CONNECTIONS // 同時下載數)
+- 全域頻寬上限: --max-overall-download-limit（執行中可用 set_bandwidth_limit() 調整）
+- session 檔: 定期儲存未完成的下載，aria2 重啟後以 --input-file 續傳
+- 即時速度: speeds() 回傳每個下載目前的速度與進度，供主程式顯示或排程使用
+
+已有程序在同一個 RPC 埠上監聽時直接沿用（例如主程式重啟，但 aria2 仍在下載）。
+
+用法:
+    python aria2_rpc.py            # 顯示目前所有下載的即時速度
+    python aria2_rpc.py --stop     # 儲存 session 並關閉常駐程序
+"""
+
+import itertools
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+import requests
+
+
+class Aria2RPCError(Exception):
+    """aria2 RPC 呼叫失敗或常駐程序無法啟動"""
+
+
+class Aria2Daemon:
+    """aria2c 常駐程序與 JSON-RPC 客戶端（線程安全）"""
+
+    def __init__(
+        self,
+        session_file,
+        port=6800,
+        secret="",
+        max_concurrent=4,
+        global_connections=64,
+        per_download_connections=16,
+        max_download_limit="0",
+        aria2c="aria2c",
+    ):
+        """
+        Args:
+            session_file: session 檔（未完成的下載清單）
+            port: RPC 埠（只監聽本機）
+            secret: RPC 密碼（空字串表示不使用）
+            max_concurrent: 同時進行的下載數，其餘在 aria2 佇列中等待
+            global_connections: 所有下載合計的連線上限
+            per_download_connections: 單一下載最多使用的連線數
+            max_download_limit: 全域頻寬上限（aria2 格式，例如 "50M"，"0" 表示不限制）
+            aria2c: aria2c 執行檔
+        """
+        self.session_file = Path(session_file)
+        self.port = port
+        self.secret = secret
+        self.max_concurrent = max(1, max_concurrent)
+        self.global_connections = global_connections
+        self.connections = max(1, min(per_download_connections, global_connections // self.max_concurrent))
+        self.max_download_limit = max_download_limit
+        self.aria2c = aria2c
+        self.url = f"http://127.0.0.1:{port}/jsonrpc"
+        self._process = None
+        self._session = requests.Session()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        # gid → run_id（speeds() 用來標示樣本）
+        self._runs = {}
+
+    # ==================== RPC ====================
+
+    def call(self, method, *params, timeout=30):
+        """呼叫 aria2 RPC 方法，回傳 result"""
+        if self.secret:
+            params = (f"token:{self.secret}",) + params
+        payload = {"jsonrpc": "2.0", "id": str(next(self._ids)), "method": method, "params": list(params)}
+        try:
+            response = self._session.post(self.url, json=payload, timeout=timeout)
+            body = response.json()
+        except (requests.RequestException, ValueError) as e:
+            raise Aria2RPCError(f"{method} 失敗: {e}")
+        if "error" in body:
+            raise Aria2RPCError(f"{method} 失敗: {body['error'].get('message', body['error'])}")
+        return body["result"]
+
+    def is_running(self):
+        try:
+            self.call("aria2.getVersion", timeout=5)
+            return True
+        except Aria2RPCError:
+            return False
+
+    # ==================== 常駐程序 ====================
+
+    def start(self, wait=15):
+        """啟動常駐程序（已在執行時直接沿用）"""
+        with self._lock:
+            if self.is_running():
+                return
+            if shutil.which(self.aria2c) is None:
+                raise Aria2RPCError(f"找不到 {self.aria2c}")
+
+            self.session_file.parent.mkdir(parents=True, exist_ok=True)
+            cmd = [
+                self.aria2c,
+                "--enable-rpc=true",
+                "--rpc-listen-all=false",
+                f"--rpc-listen-port={self.port}",
+                f"--max-concurrent-downloads={self.max_concurrent}",
+                f"--max-overall-download-limit={self.max_download_limit}",
+                f"--save-session={self.session_file}",
+                "--save-session-interval=30",
+                # 只保存未完成的下載；完成的結果由呼叫端處理
+                "--force-save=false",
+                "--continue=true",
+                "--quiet=true",
+            ]
+            if self.secret:
+                cmd.append(f"--rpc-secret={self.secret}")
+            if self.session_file.exists():
+                cmd.append(f"--input-file={self.session_file}")
+
+            # 獨立的 session，主程式被 Ctrl+C 時不會一起被中止，重啟後可以沿用
+            self._process = subprocess.Popen(
+                cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True
+            )
+            deadline = time.time() + wait
+            while time.time() < deadline:
+                if self._process.poll() is not None:
+                    raise Aria2RPCError(f"aria2c 啟動失敗 (返回碼 {self._process.returncode})")
+                if self.is_running():
+                    print(f"🚀 aria2 常駐程序已啟動 (埠 {self.port}, 同時 {self.max_concurrent} 個下載 × "
+                          f"{self.connections} 連線, 頻寬上限 {self.max_download_limit})")
+                    return
+                time.sleep(0.5)
+            self._process.kill()
+            raise Aria2RPCError("aria2c 啟動逾時")
+
+    def shutdown(self):
+        """儲存 session 並關閉常駐程序"""
+        try:
+            self.call("aria2.saveSession")
+            self.call("aria2.shutdown")
+        except Aria2RPCError:
+            pass
+        if self._process is not None:
+            try:
+                self._process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+            self._process = None
+
+    def set_bandwidth_limit(self, limit):
+        """調整全域頻寬上限（例如 "50M"，"0" 表示不限制）"""
+        self.call("aria2.changeGlobalOption", {"max-overall-download-limit": str(limit)})
+        self.max_download_limit = str(limit)
+
+    # ==================== 下載 ====================
+
+    def find(self, path):
+        """尋找目標路徑相同、尚未結束的下載（例如從 session 檔恢復的），回傳 gid 或 None"""
+        path = str(Path(path).resolve())
+        keys = ["gid", "status", "files"]
+        downloads = self.call("aria2.tellActive", keys) + self.call("aria2.tellWaiting", 0, 1000, keys)
+        for download in downloads:
+            for f in download.get("files", []):
+                if f.get("path") and str(Path(f["path"]).resolve()) == path:
+                    return download["gid"]
+        return None
+
+    def add(self, urls, output_file, run_id=None, options=None):
+        """
+        加入下載（同一個目標已在佇列中時沿用原本的下載）
+
+        Args:
+            urls: 同一個檔案的鏡像網址（aria2 以 adaptive 方式在鏡像間分配連線）
+            output_file: 輸出檔案路徑
+            run_id: 樣本 ID（顯示用）
+            options: 額外的 aria2 選項
+
+        Returns:
+            str: gid
+        """
+        output_file = Path(output_file)
+        gid = self.find(output_file)
+        if gid is not None:
+            self.call("aria2.changeUri", gid, 1, [], list(urls))
+            if self.call("aria2.tellStatus", gid, ["status"])["status"] == "paused":
+                self.call("aria2.unpause", gid)
+            print(f"    ♻️  沿用 aria2 佇列中的下載 ({gid})")
+        else:
+            opts = {
+                "dir": str(output_file.parent),
+                "out": output_file.name,
+                "split": str(self.connections),
+                "max-connection-per-server": str(self.connections),
+                "min-split-size": "1M",
+                "uri-selector": "adaptive",
+                "continue": "true",
+                "max-tries": "5",
+                "retry-wait": "3",
+                "timeout": "60",
+                "connect-timeout": "30",
+            }
+            opts.update(options or {})
+            gid = self.call("aria2.addUri", list(urls), opts)
+        with self._lock:
+            self._runs[gid] = run_id or output_file.stem
+        return gid
+
+    def status(self, gid):
+        """
+        Returns:
+            dict: {"gid", "status", "completed", "total", "speed", "connections", "error"}
+            status 為 active / waiting / paused / error / complete / removed
+        """
+        info = self.call("aria2.tellStatus", gid, [
+            "gid", "status", "completedLength", "totalLength", "downloadSpeed", "connections",
+            "errorCode", "errorMessage",
+        ])
+        return {
+            "gid": gid,
+            "status": info["status"],
+            "completed": int(info.get("completedLength", 0)),
+            "total": int(info.get("totalLength", 0)),
+            "speed": int(info.get("downloadSpeed", 0)),
+            "connections": int(info.get("connections", 0)),
+            "error": info.get("errorMessage") or (
+                f"錯誤碼 {info['errorCode']}" if info.get("errorCode") not in (None, "0") else ""
+            ),
+        }
+
+    def remove(self, gid):
+        """中止並移除下載（已下載的部分與 .aria2 控制檔保留，之後可以續傳）"""
+        try:
+            self.call("aria2.forceRemove", gid)
+        except Aria2RPCError:
+            pass
+        # forceRemove 是非同步的，等到狀態變成 removed 才能清除結果
+        for _ in range(20):
+            try:
+                if self.call("aria2.tellStatus", gid, ["status"])["status"] in ("removed", "complete", "error"):
+                    break
+            except Aria2RPCError:
+                break
+            time.sleep(0.25)
+        self.forget(gid)
+
+    def forget(self, gid):
+        """清除已結束下載的結果"""
+        try:
+            self.call("aria2.removeDownloadResult", gid)
+        except Aria2RPCError:
+            pass
+        with self._lock:
+            self._runs.pop(gid, None)
+
+    def wait(self, gid, poll_interval=2.0, progress=None, should_stop=None):
+        """
+        等待下載結束
+
+        Args:
+            progress: 每次輪詢以 status() 的結果呼叫（停滯偵測用）
+            should_stop: 回傳 True 時停止等待（下載本身不會被移除）
+
+        Returns:
+            dict: 最後一次的 status()
+        """
+        while True:
+            state = self.status(gid)
+            if progress is not None:
+                progress(state)
+            if state["status"] in ("complete", "error", "removed"):
+                return state
+            if should_stop is not None and should_stop():
+                return state
+            time.sleep(poll_interval)
+
+    def speeds(self):
+        """
+        目前所有下載的即時狀態（供主程式讀取）
+
+        Returns:
+            list: [{"run_id", "gid", "status", "completed", "total", "speed", "connections"}, ...]
+        """
+        keys = ["gid", "status", "completedLength", "totalLength", "downloadSpeed", "connections", "files"]
+        downloads = self.call("aria2.tellActive", keys) + self.call("aria2.tellWaiting", 0, 1000, keys)
+        with self._lock:
+            runs = dict(self._runs)
+        result = []
+        for info in downloads:
+            files = info.get("files") or [{}]
+            name = Path(files[0].get("path") or "").stem
+            result.append({
+                "run_id": runs.get(info["gid"]) or name or info["gid"],
+                "gid": info["gid"],
+                "status": info["status"],
+                "completed": int(info.get("completedLength", 0)),
+                "total": int(info.get("totalLength", 0)),
+                "speed": int(info.get("downloadSpeed", 0)),
+                "connections": int(info.get("connections", 0)),
+            })
+        return result
+
+    def global_stat(self):
+        """{"speed", "active", "waiting"}"""
+        stat = self.call("aria2.getGlobalStat")
+        return {
+            "speed": int(stat["downloadSpeed"]),
+            "active": int(stat["numActive"]),
+            "waiting": int(stat["numWaiting"]),
+        }
+
+
+_default_daemon = None
+_default_daemon_lock = threading.Lock()
+
+
+def get_aria2_daemon():
+    """取得依 config.py 設定建立並啟動的共用 aria2 常駐程序"""
+    global _default_daemon
+    with _default_daemon_lock:
+        if _default_daemon is None:
+            from config import (
+                ARIA2_CONNECTIONS, ARIA2_GLOBAL_CONNECTIONS, ARIA2_MAX_CONCURRENT, ARIA2_MAX_DOWNLOAD_LIMIT,
+                ARIA2_RPC_PORT, ARIA2_RPC_SECRET, ARIA2_SESSION_FILE,
+            )
+
+            daemon = Aria2Daemon(
+                ARIA2_SESSION_FILE,
+                port=ARIA2_RPC_PORT,
+                secret=ARIA2_RPC_SECRET,
+                max_concurrent=ARIA2_MAX_CONCURRENT,
+                global_connections=ARIA2_GLOBAL_CONNECTIONS,
+                per_download_connections=ARIA2_CONNECTIONS,
+                max_download_limit=ARIA2_MAX_DOWNLOAD_LIMIT,
+            )
+            daemon.start()
+            _default_daemon = daemon
+        return _default_daemon
+
+
+def shutdown_aria2_daemon():
+    """關閉共用的常駐程序（沒有啟動過時不做任何事）"""
+    global _default_daemon
+    with _default_daemon_lock:
+        if _default_daemon is not None:
+            _default_daemon.shutdown()
+            _default_daemon = None
+
+
+if __name__ == "__main__":
+    from config import ARIA2_RPC_PORT, ARIA2_RPC_SECRET, ARIA2_SESSION_FILE
+
+    daemon = Aria2Daemon(ARIA2_SESSION_FILE, port=ARIA2_RPC_PORT, secret=ARIA2_RPC_SECRET)
+    if not daemon.is_running():
+        print(f"⚠️  埠 {ARIA2_RPC_PORT} 上沒有 aria2 常駐程序")
+        sys.exit(1)
+
+    if "--stop" in sys.argv:
+        daemon.shutdown()
+        print("✅ 已儲存 session 並關閉 aria2 常駐程序")
+        sys.exit(0)
+
+    stat = daemon.global_stat()
+    print("=" * 70)
+    print(f"🚀 aria2 常駐程序: {stat['speed'] / 1024**2:.2f} MB/s, "
+          f"{stat['active']} 個下載中, {stat['waiting']} 個等待")
+    print("=" * 70)
+    for item in daemon.speeds():
+        percent = item["completed"] / item["total"] * 100 if item["total"] else 0
+        print(f"   {item['run_id']:<14}{item['status']:<9}{percent:>6.1f}%  "
+              f"{item['completed'] / 1024**3:>7.2f}/{item['total'] / 1024**3:.2f} GB  "
+              f"{item['speed'] / 1024**2:>7.2f} MB/s  {item['connections']:>3} 連線")
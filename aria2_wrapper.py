@@ -46,7 +46,15 @@ def download_with_aria2(url, output_path, connections=16):
         return False
 
 
-def get_sra_download_url(run_id):
+# NCBI SRA 檔案的下載鏡像（{prefix} 為 run ID 前 6 個字元）
+SRA_MIRRORS = [
+    "https://sra-downloadb.be-md.ncbi.nlm.nih.gov/sos4/sra-pub-run-28/{prefix}/{run_id}/{run_id}.sra",
+    "https://sra-download.ncbi.nlm.nih.gov/traces/sra68/SRZ/{prefix}/{run_id}/{run_id}.sra",
+    "https://sra-pub-run-odp.s3.amazonaws.com/sra/{run_id}/{run_id}",
+]
+
+
+def get_sra_download_url(run_id, ranked=True, verbose=False):
     """
     構建 SRA 檔案的直接下載 URL
     
@@ -54,16 +62,25 @@ def get_sra_download_url(run_id):
     https://sra-downloadb.be-md.ncbi.nlm.nih.gov/sos4/sra-pub-run-28/{run_id}/{run_id}.sra
     
     其中 run-28 是批次號，前 6 個字元相同的 ID 在同一批次
+    
+    Args:
+        run_id: 樣本 ID
+        ranked: 依鏡像記分板（過去的成功率與速度）排序；False 則使用固定順序
+        verbose: 顯示每個鏡像的統計
     """
     # SRA ID 格式: ERR123456 或 SRR123456
     prefix = run_id[:6]  # 前 6 個字元
     
     # NCBI 有多個下載鏡像
-    mirrors = [
-        f"https://sra-downloadb.be-md.ncbi.nlm.nih.gov/sos4/sra-pub-run-28/{prefix}/{run_id}/{run_id}.sra",
-        f"https://sra-download.ncbi.nlm.nih.gov/traces/sra68/SRZ/{prefix}/{run_id}/{run_id}.sra",
-        f"https://sra-pub-run-odp.s3.amazonaws.com/sra/{run_id}/{run_id}",
-    ]
+    mirrors = [template.format(prefix=prefix, run_id=run_id) for template in SRA_MIRRORS]
+    
+    if ranked:
+        try:
+            from mirror_scoreboard import get_mirror_scoreboard
+
+            mirrors = get_mirror_scoreboard().rank(mirrors, run_id, verbose=verbose)
+        except Exception as e:
+            print(f"⚠️  讀取鏡像記分板失敗，使用預設順序: {e}")
     
     return mirrors
 
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+asyncio 管線與子程序
+StagePipeline 每個階段固定開 workers 個線程，樣本在階段之間等待、或阻塞在
+subprocess.run(capture_output=True) 時都佔著一個大部分時間在睡眠的線程。
+
+這裡改為單一事件迴圈（在背景線程中執行）:
+- 每個樣本是一個 coroutine，同時處理的樣本數由 max_in_flight 限制，可以遠大於 MAX_WORKERS
+- 階段函數是 coroutine 時直接在事件迴圈中執行（vdb-validate、fasterq-dump 以
+  asyncio.create_subprocess_exec 執行，逐行讀取輸出，支援 async 超時與取消）
+- 一般（阻塞）函數在該階段專屬的有界線程池中執行（SFTP 上傳、HTTP / aria2 下載）
+- 每個階段同時執行的數量仍由 Stage.workers 限制
+
+介面與 StagePipeline 相同（start / submit / join / shutdown），可以直接替換。
+"""
+
+import asyncio
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+# ==================== 子程序 ====================
+
+async def run_process(cmd, timeout=None, line_callback=None, on_start=None):
+    """
+    以 asyncio 執行子程序並逐行讀取輸出（取代 subprocess.run(capture_output=True, text=True, timeout=...)）
+
+    Args:
+        cmd: 指令
+        timeout: 超時（秒），超過時終止子程序並拋出 subprocess.TimeoutExpired
+        line_callback: 每讀到一行輸出時呼叫 line_callback(stream_name, line)
+        on_start: 子程序啟動後以 asyncio.subprocess.Process 呼叫
+
+    Returns:
+        subprocess.CompletedProcess
+
+    被取消（CancelledError）時會終止子程序再往上拋出。
+    """
+    process = await asyncio.create_subprocess_exec(
+        *[str(c) for c in cmd], stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+    if on_start is not None:
+        on_start(process)
+    output = {"stdout": [], "stderr": []}
+
+    async def reader(name, stream):
+        async for raw in stream:
+            line = raw.decode("utf-8", errors="replace")
+            output[name].append(line)
+            if line_callback is not None:
+                line_callback(name, line)
+
+    readers = asyncio.gather(reader("stdout", process.stdout), reader("stderr", process.stderr))
+    try:
+        await asyncio.wait_for(process.wait(), timeout)
+        await readers
+    except asyncio.TimeoutError:
+        _kill(process)
+        await process.wait()
+        readers.cancel()
+        raise subprocess.TimeoutExpired(cmd, timeout)
+    except asyncio.CancelledError:
+        _kill(process)
+        await process.wait()
+        readers.cancel()
+        raise
+
+    return subprocess.CompletedProcess(
+        cmd, process.returncode, stdout="".join(output["stdout"]), stderr="".join(output["stderr"])
+    )
+
+
+def _kill(process):
+    try:
+        process.kill()
+    except ProcessLookupError:
+        pass
+
+
+async def run_monitored_async(watchdog, cmd, stage, run_id, window, progress_fn=None, line_parser=None,
+                              timeout=None, detail=None, on_start=None):
+    """
+    StallWatchdog.run_monitored() 的 asyncio 版本
+
+    Raises:
+        StallDetected: 停滯，子程序已被終止
+        subprocess.TimeoutExpired: 超過整體超時
+    """
+    loop = asyncio.get_running_loop()
+    holder = {}
+
+    def kill_from_watchdog():
+        # 停滯判定在監控線程中，終止子程序要交回事件迴圈執行
+        process = holder.get("process")
+        if process is not None:
+            loop.call_soon_threadsafe(_kill, process)
+
+    def started(process):
+        holder["process"] = process
+        if on_start is not None:
+            on_start(process)
+
+    with watchdog.watch(stage, run_id, window, progress_fn, on_stall=kill_from_watchdog, detail=detail) as watch:
+        def on_line(_, line):
+            if line_parser is not None:
+                value = line_parser(line)
+                if value is not None:
+                    watch.progress(value)
+
+        result = await run_process(cmd, timeout=timeout, line_callback=on_line, on_start=started)
+        watch.check()
+    return result
+
+
+# ==================== 管線 ====================
+
+class AsyncStagePipeline:
+    """
+    以 asyncio 執行的多階段管線（與 StagePipeline 相同的介面與回呼）
+
+    stages 使用 pipeline.Stage；Stage.workers 是該階段同時執行的數量，
+    阻塞函數的階段也以此作為專屬線程池的大小。
+    """
+
+    def __init__(self, stages, max_in_flight=32, on_done=None, on_error=None):
+        """
+        Args:
+            stages: Stage 列表（依執行順序）
+            max_in_flight: 同時在管線中的 job 數上限（submit 達到上限時阻塞，形成背壓）
+            on_done: 完成回呼 on_done(job)
+            on_error: 失敗回呼 on_error(job, stage_name, exception)
+        """
+        self.stages = list(stages)
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.on_done = on_done
+        self.on_error = on_error
+
+        self._loop = None
+        self._thread = None
+        self._semaphores = []
+        self._executors = []
+        self._running = {}  # stage name -> 執行中的 job 數
+        self._tasks = set()
+        self._outstanding = 0
+        self._cond = threading.Condition()
+        self._started = False
+
+    def start(self):
+        """在背景線程中啟動事件迴圈"""
+        if self._started:
+            return
+        self._started = True
+        self._loop = asyncio.new_event_loop()
+        ready = threading.Event()
+
+        def run_loop():
+            asyncio.set_event_loop(self._loop)
+            self._semaphores = [asyncio.Semaphore(stage.workers) for stage in self.stages]
+            ready.set()
+            self._loop.run_forever()
+
+        self._executors = [
+            None if asyncio.iscoroutinefunction(stage.func)
+            else ThreadPoolExecutor(max_workers=stage.workers, thread_name_prefix=stage.name)
+            for stage in self.stages
+        ]
+        self._running = {stage.name: 0 for stage in self.stages}
+        self._thread = threading.Thread(target=run_loop, name="async-pipeline", daemon=True)
+        self._thread.start()
+        ready.wait()
+
+    def submit(self, job):
+        """提交 job（可從任何線程呼叫；管線中的 job 達到 max_in_flight 時阻塞）"""
+        if not self._started:
+            self.start()
+        with self._cond:
+            while self._outstanding >= self.max_in_flight:
+                self._cond.wait()
+            self._outstanding += 1
+        self._loop.call_soon_threadsafe(self._spawn, job)
+
+    def join(self):
+        """等待所有已提交的 job 離開管線"""
+        with self._cond:
+            while self._outstanding > 0:
+                self._cond.wait()
+
+    def shutdown(self):
+        """取消尚未完成的 job（子程序會被終止），停止事件迴圈並關閉線程池"""
+        if not self._started:
+            return
+
+        async def cancel_all():
+            for task in list(self._tasks):
+                task.cancel()
+            if self._tasks:
+                await asyncio.gather(*self._tasks, return_exceptions=True)
+
+        asyncio.run_coroutine_threadsafe(cancel_all(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        for executor in self._executors:
+            if executor is not None:
+                executor.shutdown(wait=True)
+        self._executors = []
+        self._started = False
+
+    def queue_sizes(self):
+        """回傳各階段目前執行中的 job 數（用於顯示狀態）"""
+        return dict(self._running)
+
+    def _spawn(self, job):
+        task = self._loop.create_task(self._process(job))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _finish(self):
+        with self._cond:
+            self._outstanding -= 1
+            self._cond.notify_all()
+
+    async def _callback(self, func, *args):
+        # 回呼會清理檔案、寫入進度檔，放到預設線程池避免阻塞事件迴圈
+        if func is not None:
+            await self._loop.run_in_executor(None, func, *args)
+
+    async def _process(self, job):
+        try:
+            for index, stage in enumerate(self.stages):
+                try:
+                    async with self._semaphores[index]:
+                        self._running[stage.name] += 1
+                        try:
+                            if self._executors[index] is None:
+                                job = await stage.func(job)
+                            else:
+                                job = await self._loop.run_in_executor(self._executors[index], stage.func, job)
+                        finally:
+                            self._running[stage.name] -= 1
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    await self._callback(self.on_error, job, stage.name, e)
+                    return
+            await self._callback(self.on_done, job)
+        finally:
+            self._finish()
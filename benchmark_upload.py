@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+NAS 多通道上傳速度測試
+以不同的 SFTP 通道數上傳同一個檔案，比較每增加一個通道得到的吞吐量。
+
+用法:
+    python benchmark_upload.py                    # 產生 1 GB 測試檔，測試 1/2/4/8 通道
+    python benchmark_upload.py --size-mb 2048
+    python benchmark_upload.py --file data/fastq_output/SRR123_1.fastq --channels 1,2,4,6,8
+"""
+
+import argparse
+import os
+import posixpath
+import tempfile
+import time
+from pathlib import Path
+
+from config import NAS_HOST, NAS_PORT, NAS_USER, NAS_PASS, NAS_FASTQ_PATH, UPLOAD_CHUNK_MB
+from nas_uploader import PARTIAL_SUFFIX, NASUploader
+
+
+def make_test_file(size_mb):
+    """產生指定大小的隨機內容測試檔（避免傳輸層壓縮影響結果）"""
+    fd, path = tempfile.mkstemp(prefix="upload_bench_", suffix=".bin")
+    block = os.urandom(1024 * 1024)
+    with os.fdopen(fd, "wb") as f:
+        for _ in range(size_mb):
+            f.write(block)
+    return Path(path)
+
+
+def remove_remote(uploader, *paths):
+    for path in paths:
+        try:
+            uploader.sftp.remove(path)
+        except Exception:
+            pass
+
+
+def run_benchmark(local_file, channel_counts, chunk_mb, remote_dir):
+    uploader = NASUploader(NAS_HOST, NAS_PORT, NAS_USER, NAS_PASS)
+    if not uploader.connect():
+        return []
+
+    size_mb = local_file.stat().st_size / (1024 * 1024)
+    remote_path = posixpath.join(remote_dir, f".upload_bench_{os.getpid()}.bin")
+    results = []
+    try:
+        for channels in channel_counts:
+            print(f"\n🧪 {channels} 通道...")
+            # 上一輪失敗留下的 .partial 會被續傳，速度就不是完整上傳的速度
+            remove_remote(uploader, remote_path + PARTIAL_SUFFIX)
+            start = time.time()
+            try:
+                ok = uploader.upload_file(
+                    local_file, remote_path, show_progress=False,
+                    channels=channels, chunk_size=chunk_mb * 1024 * 1024, parallel_min_size=0,
+                )
+            except Exception as e:
+                # SFTP 連線中斷，之後的通道數也無法測試
+                print(f"❌ 連線中斷: {e}")
+                results.append((channels, 0.0))
+                break
+            elapsed = time.time() - start
+            results.append((channels, size_mb / elapsed if ok and elapsed > 0 else 0.0))
+    finally:
+        remove_remote(uploader, remote_path, remote_path + PARTIAL_SUFFIX)
+        uploader.disconnect()
+    return results
+
+
+def print_report(results):
+    print("\n" + "=" * 60)
+    print("📊 上傳速度比較")
+    print("=" * 60)
+    print(f"{'通道數':>8}{'MB/s':>12}{'相對單通道':>12}{'每增加通道':>12}")
+    base = results[0][1] if results and results[0][1] else None
+    prev = None
+    for channels, speed in results:
+        ratio = f"{speed / base:.2f}x" if base else "-"
+        if prev and channels > prev[0]:
+            gain = f"{(speed - prev[1]) / (channels - prev[0]):+.2f}"
+        else:
+            gain = "-"
+        print(f"{channels:>8}{speed:>12.2f}{ratio:>12}{gain:>12}")
+        prev = (channels, speed)
+    if results:
+        best = max(results, key=lambda r: r[1])
+        print(f"\n💡 最快: {best[0]} 通道 ({best[1]:.2f} MB/s)，可設定 UPLOAD_CHANNELS={best[0]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NAS 多通道上傳速度測試")
+    parser.add_argument("--file", help="用來測試的本地檔案（預設產生隨機測試檔）")
+    parser.add_argument("--size-mb", type=int, default=1024, help="產生的測試檔大小 (MB)")
+    parser.add_argument("--channels", default="1,2,4,8", help="要測試的通道數，以逗號分隔")
+    parser.add_argument("--chunk-mb", type=int, default=UPLOAD_CHUNK_MB, help="每塊大小 (MB)")
+    parser.add_argument("--remote-dir", default=NAS_FASTQ_PATH, help="NAS 上的測試目錄")
+    args = parser.parse_args()
+
+    channel_counts = [int(c) for c in args.channels.split(",") if c.strip()]
+    generated = args.file is None
+    local_file = make_test_file(args.size_mb) if generated else Path(args.file)
+
+    try:
+        results = run_benchmark(local_file, channel_counts, args.chunk_mb, args.remote_dir)
+        print_report(results)
+    finally:
+        if generated:
+            local_file.unlink()
+
+
+if __name__ == "__main__":
+    main()
@@ -8,8 +8,9 @@ import sys
 from pathlib import Path
 sys.path.insert(0, str(Path(__file__).parent))
 
-from config import NAS_HOST, NAS_PORT, NAS_USER, NAS_PASS, NAS_FASTQ_PATH
+from config import NAS_HOST, NAS_PORT, NAS_USER, NAS_PASS
 from nas_uploader import NASUploader
+from nas_inventory import get_fastq_inventory
 
 def check_recent_uploads():
     """檢查最近上傳的 ERR372354 和 ERR372355"""
@@ -25,7 +26,7 @@ def check_recent_uploads():
         return
     
     try:
-        all_files = nas.sftp.listdir(NAS_FASTQ_PATH)
+        all_files = get_fastq_inventory().snapshot(nas, refresh="--refresh" in sys.argv)
         
         for sample in samples:
             matching_files = [f for f in all_files if f.startswith(sample)]
@@ -33,12 +34,8 @@ def check_recent_uploads():
             if matching_files:
                 print(f"📁 {sample}:")
                 for filename in sorted(matching_files):
-                    try:
-                        stat = nas.sftp.stat(f"{NAS_FASTQ_PATH}/{filename}")
-                        size_mb = stat.st_size / (1024 * 1024)
-                        print(f"   - {filename} ({size_mb:.1f} MB)")
-                    except:
-                        print(f"   - {filename} (無法獲取大小)")
+                    size_mb = all_files[filename]['size'] / (1024 * 1024)
+                    print(f"   - {filename} ({size_mb:.1f} MB)")
             else:
                 print(f"❌ {sample}: 沒有檔案")
             print()
@@ -2,12 +2,16 @@
 # -*- coding: utf-8 -*-
 """
 檢查樣本的 Layout (SINGLE 或 PAIRED)
-使用 NCBI Entrez API 查詢
+使用 NCBI Entrez API 查詢（結果存在 metadata 快取，重複執行不需要連網）
 """
 
-import requests
-import time
-import xml.etree.ElementTree as ET
+from metadata_cache import get_metadata_cache
+
+
+def fetch_layouts(run_ids):
+    """批次取得 layout: {run_id: 'SINGLE'/'PAIRED'/'UNKNOWN'}"""
+    values = get_metadata_cache().ensure(run_ids, ['layout'])
+    return {run_id: values.get(run_id, {}).get('layout') or 'UNKNOWN' for run_id in run_ids}
 
 def check_sample_layout(run_id):
     """
@@ -20,29 +24,7 @@ def check_sample_layout(run_id):
         'SINGLE', 'PAIRED', 或 'UNKNOWN'
     """
     try:
-        # 使用 NCBI E-utilities API
-        url = f"https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi"
-        params = {
-            'db': 'sra',
-            'id': run_id,
-            'rettype': 'xml'
-        }
-        
-        response = requests.get(url, params=params, timeout=30)
-        response.raise_for_status()
-        
-        # 解析 XML
-        root = ET.fromstring(response.text)
-        
-        # 查找 LIBRARY_LAYOUT
-        for layout in root.iter('LIBRARY_LAYOUT'):
-            if layout.find('SINGLE') is not None:
-                return 'SINGLE'
-            elif layout.find('PAIRED') is not None:
-                return 'PAIRED'
-        
-        return 'UNKNOWN'
-    
+        return fetch_layouts([run_id])[run_id]
     except Exception as e:
         print(f"  ❌ 查詢失敗: {e}")
         return 'ERROR'
@@ -69,11 +51,16 @@ def main():
     print("🔍 檢查樣本的 Layout (SINGLE/PAIRED)...")
     print("=" * 60)
     
-    results = {}
+    # 一次查詢所有樣本
+    try:
+        results = fetch_layouts(samples_with_files)
+    except Exception as e:
+        print(f"  ❌ 查詢失敗: {e}")
+        results = {run_id: 'ERROR' for run_id in samples_with_files}
+
     for run_id in samples_with_files:
-        print(f"📊 {run_id}...", end=" ", flush=True)
-        layout = check_sample_layout(run_id)
-        results[run_id] = layout
+        layout = results[run_id]
+        print(f"📊 {run_id}...", end=" ")
         
         if layout == 'SINGLE':
             print("✅ SINGLE-END")
@@ -81,9 +68,6 @@ def main():
             print("⚠️  PAIRED-END (缺少另一個檔案)")
         else:
             print(f"❓ {layout}")
-        
-        # 避免 API 限制
-        time.sleep(0.5)
     
     print()
     print("=" * 60)
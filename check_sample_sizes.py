@@ -2,42 +2,34 @@
 # -*- coding: utf-8 -*-
 """
 檢查 ERR372353-355 的預期大小
+（資料來自 metadata 快取，缺少或過期時才向 ENA 查詢）
 """
 
-import requests
+from metadata_cache import get_metadata_cache
+
+SIZE_FIELDS = ['fastq_bytes', 'read_count', 'base_count']
+
+
+def check_sample_sizes(run_ids):
+    """批次查詢樣本的預期大小: {run_id: info 或 None}"""
+    values = get_metadata_cache().ensure(run_ids, SIZE_FIELDS)
+    results = {}
+    for run_id in run_ids:
+        info = values.get(run_id, {})
+        if info.get('fastq_bytes') is None:
+            results[run_id] = None
+            continue
+        results[run_id] = {
+            'fastq_mb': info['fastq_bytes'] / (1024 * 1024),
+            'reads': info.get('read_count') or 0,
+            'bases': info.get('base_count') or 0,
+        }
+    return results
+
 
 def check_sample_size(run_id):
     """查詢樣本的預期大小"""
-    try:
-        url = f"https://www.ebi.ac.uk/ena/portal/api/filereport"
-        params = {
-            'accession': run_id,
-            'result': 'read_run',
-            'fields': 'run_accession,fastq_bytes,read_count,base_count'
-        }
-        
-        response = requests.get(url, params=params, timeout=30)
-        response.raise_for_status()
-        
-        lines = response.text.strip().split('\n')
-        if len(lines) > 1:
-            header = lines[0].split('\t')
-            data = lines[1].split('\t')
-            
-            result = dict(zip(header, data))
-            
-            fastq_bytes = int(result.get('fastq_bytes', 0))
-            read_count = int(result.get('read_count', 0))
-            base_count = int(result.get('base_count', 0))
-            
-            return {
-                'fastq_mb': fastq_bytes / (1024 * 1024),
-                'reads': read_count,
-                'bases': base_count
-            }
-    except Exception as e:
-        print(f"  ❌ 查詢失敗: {e}")
-        return None
+    return check_sample_sizes([run_id])[run_id]
 
 def main():
     samples = ['ERR372353', 'ERR372354', 'ERR372355']
@@ -45,9 +37,10 @@ def main():
     print("🔍 檢查樣本預期大小...")
     print("=" * 70)
     
+    results = check_sample_sizes(samples)
     for run_id in samples:
         print(f"\n📊 {run_id}:")
-        info = check_sample_size(run_id)
+        info = results[run_id]
         
         if info:
             print(f"   預期 FASTQ 大小: {info['fastq_mb']:.1f} MB")
@@ -3,11 +3,16 @@
 """
 清理 sra_temp 和 fastq_output 中的空資料夾和殘留檔案
 釋放磁碟空間
+
+sra_temp 中的部分下載預設保留（重啟後續傳），只回收超過 PARTIAL_MAX_AGE_HOURS 沒有更新的；
+加上 --all 則連同可續傳的部分下載一起刪除。
 """
 
 import shutil
+import sys
 from pathlib import Path
-from config import SRA_TEMP_DIR, FASTQ_OUTPUT_DIR, FASTQ_TEMP_DIR
+from config import SRA_TEMP_DIR, FASTQ_OUTPUT_DIR, FASTQ_TEMP_DIR, PARTIAL_MAX_AGE_HOURS
+from sra_partials import gc_stale_partials
 
 def cleanup_empty_dirs(base_dir):
     """刪除空資料夾"""
@@ -102,8 +107,13 @@ if __name__ == "__main__":
     
     # 1. 清理 SRA_TEMP_DIR
     print(f"\n清理 SRA 目錄: {SRA_TEMP_DIR}")
-    temp_files = cleanup_temp_files(SRA_TEMP_DIR)
-    incomplete = cleanup_incomplete_sra(SRA_TEMP_DIR)
+    if "--all" in sys.argv:
+        temp_files = cleanup_temp_files(SRA_TEMP_DIR)
+        incomplete = cleanup_incomplete_sra(SRA_TEMP_DIR)
+    else:
+        print(f"  (保留 {PARTIAL_MAX_AGE_HOURS:.0f} 小時內更新過的部分下載，加上 --all 全部刪除)")
+        temp_files = 0
+        incomplete, _ = gc_stale_partials(SRA_TEMP_DIR, PARTIAL_MAX_AGE_HOURS)
     empty_dirs = cleanup_empty_dirs(SRA_TEMP_DIR)
     
     # 2. 清理 FASTQ_OUTPUT_DIR
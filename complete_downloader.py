@@ -8,13 +8,12 @@
 - 可移動到任何有 Python 和 SRA Toolkit 的環境
 """
 
-import json
+import asyncio
 import subprocess
 import time
 import shutil
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from datetime import datetime
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 import sys
 import os
 import threading
@@ -22,8 +21,30 @@ import threading
 # 導入配置和工具
 try:
     from config import *
-    from nas_uploader import NASUploader
+    from nas_pool import NASConnectionError, get_nas_pool
+    from nas_inventory import fastq_files, get_fastq_inventory
+    from pipeline import Stage, StagePipeline
+    from async_orchestrator import AsyncStagePipeline, run_monitored_async, run_process
+    from disk_admission import DiskAdmissionController, GB
+    from failure_policy import FAILURE_LABELS, RetryScheduler, classify_error, get_retry_policy
+    from cpu_scheduler import get_cpu_scheduler
+    from ena_fastq import ENAFastqUnavailable, decompress_fastq, download_ena_fastq, ena_fastq_plan, pigz_available
+    from aria2_wrapper import get_sra_download_url
+    from aria2_rpc import Aria2RPCError, get_aria2_daemon, shutdown_aria2_daemon
+    from http_downloader import DownloadError, SegmentedDownload, probe_mirrors
+    from mirror_scoreboard import get_mirror_scoreboard
+    from sra_checksum import file_md5, get_validation_stats, print_summary as print_validation_summary
+    from sra_checksum import read_md5_sidecar, should_audit, write_md5_sidecar
+    from sra_partials import discard_partial, gc_stale_partials, prepare_resume
+    from stall_watchdog import StallDetected, get_stall_watchdog, parse_aria2_progress, path_progress
+    from scheduler import load_expected_sizes, order_runs, report_policies
+    from metadata_cache import get_metadata_cache
+    from state_store import RunStateStore, get_run_state_store
+    from stream_uploader import StreamingUnavailable, stream_dump_to_nas
+    from upload_spool import SpoolError, UploadSpool
+    from work_queue import get_work_queue
     from tqdm import tqdm
+    import paramiko
 except ImportError as e:
     print(f"❌ 導入失敗: {e}")
     if "tqdm" in str(e):
@@ -59,240 +80,338 @@ PREFETCH_TIMEOUT = int(os.environ.get("PREFETCH_TIMEOUT", 10800))  # 3小時（
 FASTERQ_TIMEOUT = int(os.environ.get("FASTERQ_TIMEOUT", 10800))  # 3小時
 UPLOAD_TIMEOUT = int(os.environ.get("UPLOAD_TIMEOUT", 7200))  # 2小時
 
-# ==================== 進度管理 ====================
-# 注意: NASUploader 已從 nas_uploader.py 導入
+# ==================== 磁碟空間預約 ====================
+
+_disk_admission = None
+_disk_admission_lock = threading.Lock()
+
+
+def get_disk_admission():
+    """取得共用的磁碟空間准入控制器（第一次使用時建立）"""
+    global _disk_admission
+    with _disk_admission_lock:
+        if _disk_admission is None:
+            SRA_TEMP_DIR.mkdir(parents=True, exist_ok=True)
+            _disk_admission = DiskAdmissionController(
+                SRA_TEMP_DIR,
+                floor_bytes=int(DISK_FLOOR_GB * GB),
+                budget_bytes=int(DISK_BUDGET_GB * GB) if DISK_BUDGET_GB > 0 else None,
+                history_file=DISK_HISTORY_FILE,
+                default_sra_bytes=int(DEFAULT_SRA_GB * GB),
+                fastq_ratio=FASTQ_SIZE_RATIO,
+                temp_ratio=DUMP_TEMP_RATIO,
+            )
+            print(f"💾 磁碟預約預算: {_disk_admission.budget_bytes / GB:.1f} GB "
+                  f"(保留 {DISK_FLOOR_GB:.0f} GB)")
+        return _disk_admission
 
 
-class ProgressManager:
-    def __init__(self, progress_file="download_progress.json"):
-        self.progress_file = Path(progress_file)
-        self.progress = self.load_progress()
-        self.save_count = 0  # 追蹤保存次數
-        self.last_backup_time = None  # 上次備份時間
+# ==================== 上傳暫存區 ====================
 
-    def load_progress(self):
-        """載入進度檔案,自動處理錯誤並恢復備份"""
-        if self.progress_file.exists():
-            try:
-                # 檢查檔案是否為空
-                if self.progress_file.stat().st_size == 0:
-                    print("⚠️  進度檔案為空,嘗試恢復備份...")
-                    return self._restore_from_backup()
+# 在 main() 中建立；None 表示直接在上傳階段上傳（USE_UPLOAD_SPOOL=no）
+_upload_spool = None
 
-                # 嘗試載入 JSON
-                with open(self.progress_file, "r", encoding="utf-8") as f:
-                    return json.load(f)
 
-            except json.JSONDecodeError as e:
-                print(f"⚠️  進度檔案格式錯誤: {e}")
-                print("   嘗試恢復備份...")
-                return self._restore_from_backup()
+def start_upload_spool(progress_mgr):
+    """建立並啟動上傳暫存區，樣本上傳完成後才標記為完成"""
+    global _upload_spool
 
-            except Exception as e:
-                print(f"⚠️  載入進度檔案失敗: {e}")
-                print("   使用新的進度記錄")
+    def upload_spooled_file(local_file):
+        run_id = local_file.parent.name
+        if lease_lost(run_id):
+            # 不再上傳其他節點接手的樣本，暫存區清除這個樣本後呼叫 on_failed
+            raise SpoolError(f"{run_id} 的租約已被其他節點接手")
+        # 暫存區自己負責退避重試，這裡每次只嘗試一輪（仍會從 .partial 續傳）
+        upload_with_resume(local_file, f"{NAS_CONFIG['fastq_path']}/{local_file.name}", retries=1)
 
-        return {"completed": [], "failed": [], "remaining": []}
-
-    def _restore_from_backup(self):
-        """從備份檔案恢復"""
-        import glob
+    def on_uploaded(run_id):
+        if lease_lost(run_id):
+            abandon_run(run_id)
+            return
+        progress_mgr.mark_completed(run_id)
+        sra_dir = SRA_TEMP_DIR / run_id
+        if sra_dir.exists():
+            shutil.rmtree(sra_dir)
+        get_disk_admission().release(run_id)
+        release_lease(run_id)
+        print(f"\n✅ 樣本完成: {run_id}")
 
-        # 尋找最新的備份檔案
-        backup_pattern = str(
-            self.progress_file.parent / "download_progress_backup_*.json"
-        )
-        backups = sorted(glob.glob(backup_pattern), reverse=True)
+    def on_failed(run_id, error):
+        if lease_lost(run_id):
+            abandon_run(run_id)
+            return
+        progress_mgr.mark_failed(run_id, "upload", str(error))
+        get_disk_admission().release(run_id)
+        release_lease(run_id)
+        print(f"\n❌ 樣本失敗: {run_id} (上傳暫存區)")
+
+    _upload_spool = UploadSpool(
+        UPLOAD_SPOOL_DIR,
+        budget_bytes=int(SPOOL_BUDGET_GB * GB),
+        upload_func=upload_spooled_file,
+        on_uploaded=on_uploaded,
+        workers=UPLOAD_WORKERS,
+        retry_delay=SPOOL_RETRY_DELAY,
+        max_retry_delay=SPOOL_MAX_RETRY_DELAY,
+        on_failed=on_failed,
+        max_attempts=SPOOL_MAX_ATTEMPTS,
+    )
+    _upload_spool.start()
+    return _upload_spool
+
+
+def resume_spooled_runs(spool):
+    """
+    排入上次留在暫存區的樣本，回傳暫存區中所有的樣本（不需重新下載）
+
+    WORK_QUEUE 時只續傳取得租約的樣本。租約由其他節點持有的樣本留在磁碟上，
+    在背景經 claims() 等待: 其他節點完成時清除，租約過期或被釋放時才接手續傳
+    （兩個節點同時續傳同一個 .partial 會混入彼此寫入的內容）。
+    """
+    run_ids = spool.scan_pending()
+    if not WORK_QUEUE:
+        spool.load_pending(run_ids)
+        return run_ids
+
+    queue = get_work_queue()
+    held_back = []
+    for run_id in run_ids:
+        try:
+            claimed = queue.claim(run_id)
+        except Exception as e:
+            print(f"    ⚠️  無法取得 {run_id} 的租約: {e}")
+            claimed = False
+        if claimed:
+            spool.load_pending([run_id])
+        else:
+            held_back.append(run_id)
 
-        if backups:
-            latest_backup = backups[0]
-            try:
-                print(f"   找到備份: {Path(latest_backup).name}")
-                with open(latest_backup, "r", encoding="utf-8") as f:
-                    data = json.load(f)
+    if held_back:
+        print(f"    🤝 {len(held_back)} 個暫存區樣本的租約由其他節點持有，暫不上傳")
 
-                # 恢復備份到主檔案
-                import shutil
+        def done_elsewhere():
+            done = get_nas_samples()
+            for run_id in held_back:
+                if run_id in done:
+                    print(f"    🗑️  {run_id} 已由其他節點完成，清除暫存區")
+                    spool.discard(run_id)
+            return done
 
-                shutil.copy(latest_backup, self.progress_file)
-                print(f"✅ 已恢復備份!")
-                return data
+        def worker():
+            for run_id in queue.claims(held_back, is_done=done_elsewhere):
+                spool.load_pending([run_id])
 
-            except Exception as e:
-                print(f"❌ 恢復備份失敗: {e}")
-        else:
-            print("   找不到備份檔案")
+        threading.Thread(target=worker, name="spool-claims", daemon=True).start()
+    return run_ids
 
-        return {"completed": [], "failed": [], "remaining": []}
 
-    def save_progress(self):
-        """安全地儲存進度檔案 (先寫臨時檔,再重命名)"""
-        import os
-        from datetime import datetime
+# ==================== 進度管理 ====================
 
-        try:
-            # 每10次保存或每30分鐘創建一個帶時間戳的備份
-            self.save_count += 1
-            current_time = datetime.now()
-
-            should_backup = False
-            if self.save_count % 10 == 0:  # 每10次保存
-                should_backup = True
-            elif (
-                self.last_backup_time is None
-                or (current_time - self.last_backup_time).total_seconds() > 1800
-            ):  # 30分鐘
-                should_backup = True
-
-            if should_backup:
-                backup_name = f"download_progress_backup_{current_time.strftime('%Y%m%d_%H%M%S')}.json"
-                backup_path = self.progress_file.parent / backup_name
-                try:
-                    if self.progress_file.exists():
-                        import shutil
-
-                        shutil.copy2(self.progress_file, backup_path)
-                        self.last_backup_time = current_time
-                        print(f"💾 已創建備份: {backup_name}")
-                except Exception as e:
-                    print(f"⚠️  創建備份失敗 (繼續執行): {e}")
-
-            # 寫入臨時檔案
-            temp_file = self.progress_file.with_suffix(".tmp")
-            with open(temp_file, "w", encoding="utf-8") as f:
-                json.dump(self.progress, f, indent=2, ensure_ascii=False)
-
-            # 驗證 JSON 格式正確
-            with open(temp_file, "r", encoding="utf-8") as f:
-                json.load(f)
-
-            # 原子性替換 - Windows 安全做法
-            # 先創建備份,再替換,最後刪除備份
-            backup_file = None
-            try:
-                if self.progress_file.exists():
-                    # 創建備份
-                    backup_file = self.progress_file.with_suffix(".bak")
-                    if backup_file.exists():
-                        backup_file.unlink()
-                    self.progress_file.rename(backup_file)
 
-                # 重命名臨時檔案為正式檔案
-                temp_file.rename(self.progress_file)
+class ProgressManager:
+    """
+    進度管理（SQLite 狀態資料庫）
 
-                # 成功後刪除備份
-                if backup_file and backup_file.exists():
-                    backup_file.unlink()
+    第一次使用時自動匯入舊的 download_progress.json 與所有備份，
+    之後所有狀態都寫入資料庫，不再重寫 JSON 檔案。
+    """
 
-            except Exception as e:
-                # 如果替換失敗,恢復備份
-                if backup_file and backup_file.exists():
-                    if not self.progress_file.exists():
-                        backup_file.rename(self.progress_file)
-                        print(f"⚠️  儲存失敗,已恢復備份: {e}")
-                raise
+    def __init__(self, progress_file=PROGRESS_FILE, db_file=STATE_DB_FILE):
+        self.progress_file = Path(progress_file)
+        self.store = RunStateStore(db_file)
 
-        except Exception as e:
-            print(f"⚠️  儲存進度檔案失敗: {e}")
-            # 清理臨時檔案
-            if temp_file.exists():
-                try:
-                    temp_file.unlink()
-                except:
-                    pass
+        if self.store.get_meta("json_imported") is None:
+            if self.progress_file.exists() or any(
+                self.progress_file.parent.glob(f"{self.progress_file.stem}_backup_*.json")
+            ):
+                print(f"📥 首次使用狀態資料庫，匯入 {self.progress_file.name} 與其備份...")
+            result = self.store.import_json_progress(self.progress_file)
+            if result["files"]:
+                print(f"✅ 已匯入 {result['files']} 個檔案: "
+                      f"{result['completed']} 個完成, {result['failed']} 個失敗")
+
+    @property
+    def progress(self):
+        """與舊 JSON 格式相容的唯讀快照"""
+        return {
+            "completed": sorted(self.store.completed_ids()),
+            "failed": self.store.failed_entries(),
+            "remaining": [],
+        }
 
     def mark_completed(self, run_id):
         """標記為完成"""
-        if run_id not in self.progress["completed"]:
-            self.progress["completed"].append(run_id)
-            self.progress["completed"].sort()
-
-        # 從failed移除
-        self.progress["failed"] = [
-            f
-            for f in self.progress.get("failed", [])
-            if (isinstance(f, dict) and f.get("run_id") != run_id) or f != run_id
-        ]
-
-        self.save_progress()
+        try:
+            self.store.mark_completed(run_id)
+        except Exception as e:
+            print(f"⚠️  儲存進度失敗: {e}")
 
     def mark_failed(self, run_id, step, error):
         """標記為失敗"""
-        failure_entry = {
-            "run_id": run_id,
-            "step": step,
-            "error": str(error),
-            "time": datetime.now().isoformat(),
-        }
+        try:
+            self.store.mark_failed(run_id, step, error)
+        except Exception as e:
+            print(f"⚠️  儲存進度失敗: {e}")
 
-        # 更新或新增失敗記錄
-        failed_list = self.progress.get("failed", [])
-        if (
-            isinstance(failed_list, list)
-            and len(failed_list) > 0
-            and isinstance(failed_list[0], dict)
-        ):
-            # 移除舊記錄
-            failed_list = [f for f in failed_list if f.get("run_id") != run_id]
-        else:
-            failed_list = []
 
-        failed_list.append(failure_entry)
-        self.progress["failed"] = failed_list
+# ==================== 階段 checkpoint ====================
+# validate: 已校驗的 SRA（或 ENA 的 fastq.gz）與大小
+# dump:     解壓出的 FASTQ 與大小
+# upload:   已上傳到 NAS 的檔名
+# 失敗時保留 checkpoint 涵蓋的檔案，重試或重新啟動時從第一個未完成的階段繼續；樣本完成時清除
 
-        self.save_progress()
 
+def _file_entries(files):
+    return [[str(f), Path(f).stat().st_size] for f in files]
 
-# ==================== 下載器 ====================
 
+def _files_intact(entries):
+    """checkpoint 記錄的檔案是否都還在且大小不變"""
+    if not entries:
+        return False
+    for path, size in entries:
+        path = Path(path)
+        if not path.exists() or path.stat().st_size != size:
+            return False
+    return True
 
-def get_nas_samples():
-    """獲取NAS上已有的樣本（檢查是否有完整的 FASTQ 檔案）"""
-    uploader = NASUploader(
-        NAS_CONFIG["host"],
-        NAS_CONFIG["port"],
-        NAS_CONFIG["username"],
-        NAS_CONFIG["password"],
-    )
 
+def save_checkpoint(run_id, stage, **data):
     try:
-        if not uploader.connect():
-            print(f"⚠️ 無法連接到NAS")
-            return set()
+        get_run_state_store().save_checkpoint(run_id, stage, data)
+    except Exception as e:
+        # checkpoint 只影響重試時能否跳過已完成的階段，不讓樣本因此失敗
+        print(f"    ⚠️  儲存 checkpoint 失敗 ({stage}): {e}")
 
-        samples = set()
-        try:
-            files = uploader.sftp.listdir(NAS_CONFIG["fastq_path"])
-            
-            # 統計每個樣本有幾個檔案
-            sample_files = {}
-            for f in files:
-                if f.endswith(".fastq"):
-                    # ERR2696422_1.fastq -> ERR2696422
-                    sample = f.rsplit("_", 1)[0]
-                    if sample not in sample_files:
-                        sample_files[sample] = []
-                    sample_files[sample].append(f)
-            
-            # 只加入有檔案的樣本（SINGLE-END 有 _1，PAIRED-END 有 _1 和 _2）
-            for sample, files_list in sample_files.items():
-                # 只要有至少一個 _1.fastq，就算完整
-                # （SINGLE-END 只有 _1，PAIRED-END 會有 _1 和 _2）
-                has_file_1 = any(f.endswith("_1.fastq") for f in files_list)
-                if has_file_1:
-                    samples.add(sample)
-        except Exception as e:
-            print(f"⚠️ 檢查NAS檔案時出錯: {e}")
 
-        uploader.disconnect()
-        return samples
+def load_checkpoints(run_id):
+    try:
+        return get_run_state_store().checkpoints(run_id)
+    except Exception as e:
+        print(f"    ⚠️  讀取 checkpoint 失敗: {e}")
+        return {}
+
+
+def resume_from_checkpoint(job):
+    """
+    依 checkpoint 還原 job，回傳要從哪個階段繼續（"dump" / "upload"）
+    檔案已不存在或大小不符時清除 checkpoint，回傳 None（從下載開始）
+    """
+    run_id = job["run_id"]
+    checkpoints = load_checkpoints(run_id)
+    if not checkpoints:
+        return None
+
+    dumped = checkpoints.get("dump", {}).get("fastq_files")
+    uploaded = set(checkpoints.get("upload", {}).get("uploaded", []))
+    if dumped and {Path(path).name for path, _ in dumped} <= uploaded:
+        # 全部已上傳，只差標記完成（上次在清理本地檔案之後中斷）
+        job["fastq_files"] = []
+        return "upload"
+    if _files_intact(dumped):
+        job["fastq_files"] = [Path(path) for path, _ in dumped]
+        job["uploaded"] = uploaded
+        return "upload"
+
+    validated = checkpoints.get("validate", {})
+    if _files_intact(validated.get("ena_files")):
+        job["ena_files"] = [Path(path) for path, _ in validated["ena_files"]]
+        return "dump"
+    if validated.get("sra_file") and _files_intact([validated["sra_file"]]):
+        job["sra_file"] = Path(validated["sra_file"][0])
+        return "dump"
+
+    print(f"    🗑️  {run_id} 的 checkpoint 檔案已不存在或大小不符，從頭開始")
+    try:
+        get_run_state_store().clear_checkpoints(run_id)
+    except Exception:
+        pass
+    return None
+
+
+# ==================== 多節點工作佇列 ====================
+
+
+def claimed_runs(run_ids):
+    """依序產生這個節點要處理的樣本（WORK_QUEUE 時只產生取得租約的樣本）"""
+    if not WORK_QUEUE:
+        return iter(run_ids)
+    return get_work_queue().claims(run_ids, is_done=get_nas_samples)
+
+
+def release_lease(run_id):
+    if WORK_QUEUE:
+        get_work_queue().release(run_id)
+
+
+class LeaseLost(Exception):
+    """租約已被其他節點接手（續約太晚），這個節點停止處理該樣本"""
+
+
+def lease_lost(run_id):
+    return WORK_QUEUE and run_id in get_work_queue().lost()
+
+
+def check_lease(run_id):
+    """每個階段開始與每次上傳前呼叫: 租約已被其他節點接手時拋出 LeaseLost"""
+    if lease_lost(run_id):
+        raise LeaseLost(f"{run_id} 的租約已被其他節點接手，停止處理")
+
+
+def abandon_run(run_id):
+    """租約被接手的樣本: 清除本地檔案與 checkpoint，不標記失敗也不重試（由接手的節點完成）"""
+    print(f"\n🤝 {run_id} 已由其他節點接手，停止處理並清除本地檔案")
+    try:
+        get_run_state_store().clear_checkpoints(run_id)
+    except Exception as e:
+        print(f"    ⚠️  清除 checkpoint 失敗: {e}")
+    cleanup_failed_run(run_id)
+
+
+# ==================== 下載器 ====================
+
 
+def get_nas_samples():
+    """獲取NAS上已有的樣本（檢查是否有完整的 FASTQ 檔案）"""
+    try:
+        with get_nas_pool().connection() as uploader:
+            return _list_nas_samples(uploader)
+    except NASConnectionError:
+        print(f"⚠️ 無法連接到NAS")
+        return set()
     except Exception as e:
         print(f"⚠️ 無法檢查NAS: {e}")
-        uploader.disconnect()
         return set()
 
 
+def _list_nas_samples(uploader):
+    """列出 NAS FASTQ 目錄，回傳至少有 _1.fastq 的樣本"""
+    samples = set()
+    try:
+        files = fastq_files(get_fastq_inventory().snapshot(uploader))
+        
+        # 統計每個樣本有幾個檔案
+        sample_files = {}
+        for f in files:
+            # ERR2696422_1.fastq -> ERR2696422
+            sample = f.rsplit("_", 1)[0]
+            if sample not in sample_files:
+                sample_files[sample] = []
+            sample_files[sample].append(f)
+        
+        # 只加入有檔案的樣本（SINGLE-END 有 _1，PAIRED-END 有 _1 和 _2）
+        for sample, files_list in sample_files.items():
+            # 只要有至少一個 _1.fastq，就算完整
+            # （SINGLE-END 只有 _1，PAIRED-END 會有 _1 和 _2）
+            has_file_1 = any(f.endswith("_1.fastq") for f in files_list)
+            if has_file_1:
+                samples.add(sample)
+    except Exception as e:
+        print(f"⚠️ 檢查NAS檔案時出錯: {e}")
+
+    return samples
+
+
 def get_all_runs_from_file():
     """從runs.txt讀取所有樣本 (SRR, ERR, DRR)"""
     # 支援透過環境變數指定不同的 runs 檔案
@@ -318,8 +437,13 @@ def get_all_runs_from_file():
     return all_runs
 
 
-def get_missing_samples():
-    """獲取需要下載的樣本清單（606個runs.txt - NAS已有的 - 進度檔案已完成的）"""
+def get_missing_samples(pending=()):
+    """
+    獲取需要下載的樣本清單（606個runs.txt - NAS已有的 - 進度檔案已完成的）
+
+    Args:
+        pending: 已在上傳暫存區等待上傳的樣本（不需要重新下載）
+    """
     # 從runs.txt讀取所有SRR樣本
     all_runs = get_all_runs_from_file()
 
@@ -327,7 +451,7 @@ def get_missing_samples():
 
     # 獲取進度管理器
     progress_mgr = ProgressManager()
-    completed_from_progress = set(progress_mgr.progress.get("completed", []))
+    completed_from_progress = progress_mgr.store.completed_ids()
     
     print(f"📋 進度檔案記錄已完成: {len(completed_from_progress)} 個")
 
@@ -343,351 +467,798 @@ def get_missing_samples():
 
     # 計算缺少的
     missing = all_runs - completed_samples
+    # 有 checkpoint 的樣本尚未完成（例如雙端只上傳了 _1），即使 NAS 上已有檔案也要繼續
+    resumable = (get_run_state_store().checkpointed_ids() & all_runs) - completed_from_progress
+    if resumable:
+        missing |= resumable
+        print(f"↩️  有 checkpoint 可續做: {len(resumable)} 個")
+    if pending:
+        missing -= set(pending)
+        print(f"📦 上傳暫存區中: {len(set(pending) & all_runs)} 個（不需重新下載）")
 
     print(f"📊 需要下載: {len(missing)} 個")
 
-    return sorted(list(missing))
-
-
-def download_sample(run_id, progress_mgr):
-    """下載、解壓、上傳單個樣本 (每個線程獨立連接NAS)"""
-    print(f"\n{'='*70}")
-    print(f"🔄 處理樣本: {run_id}")
-    print(f"{'='*70}")
+    if SCHEDULE_POLICY == "alphabetical":
+        return sorted(list(missing))
 
-    nas_uploader = NASUploader(
-        NAS_CONFIG["host"],
-        NAS_CONFIG["port"],
-        NAS_CONFIG["username"],
-        NAS_CONFIG["password"],
+    # 依預期大小排序
+    sizes = load_expected_sizes(sorted(missing))
+    report_policies(
+        sorted(missing), sizes, DOWNLOAD_WORKERS if USE_PIPELINE else MAX_WORKERS,
+        EXPECTED_MBPS_PER_WORKER * 1e6 / 8, RUN_OVERHEAD_MINUTES * 60,
     )
+    try:
+        ordered = order_runs(missing, sizes, SCHEDULE_POLICY)
+    except ValueError as e:
+        print(f"⚠️  {e}，改用 alphabetical")
+        return sorted(list(missing))
+    print(f"📋 排序策略: {SCHEDULE_POLICY}")
+    return ordered
+
+
+def select_download_engine():
+    """依 DOWNLOAD_ENGINE 決定下載引擎: aria2 / http / prefetch"""
+    engine = DOWNLOAD_ENGINE
+    if engine == "auto":
+        return "aria2" if USE_ARIA2 and shutil.which("aria2c") is not None else "http"
+    if engine == "aria2" and shutil.which("aria2c") is None:
+        print("    ⚠️ 找不到 aria2c，改用內建 HTTP 引擎")
+        return "http"
+    if engine not in ("aria2", "http", "prefetch"):
+        print(f"    ⚠️ 未知的 DOWNLOAD_ENGINE={engine}，改用內建 HTTP 引擎")
+        return "http"
+    return engine
+
+
+def download_mirror_aria2(urls, sra_file, run_id=None):
+    """
+    以 aria2 下載，回傳 CompletedProcess
+    傳入多個鏡像時先探測並依速度排序，aria2 以 adaptive 方式在鏡像間分配連線
+    ARIA2_RPC 開啟時排入共用的 aria2 常駐程序（全域連線與頻寬上限），否則單獨執行一次 aria2c
+    停滯時拋出 StallDetected（detail 為排第一的鏡像）
+    """
+    scoreboard = get_mirror_scoreboard()
+    if len(urls) > 1:
+        probes = []
+        ranked = probe_mirrors(urls, HEDGE_PROBE_KB * 1024, all_results=probes)
+        scoreboard.record_probes(probes, run_id)
+        if ranked:
+            urls = [m["source"] for m in ranked]
+
+    if ARIA2_RPC:
+        try:
+            daemon = get_aria2_daemon()
+        except Aria2RPCError as e:
+            print(f"    ⚠️ 無法使用 aria2 常駐程序，改為單獨執行 aria2c: {e}")
+        else:
+            return download_mirror_aria2_rpc(daemon, urls, sra_file, run_id)
+
+    aria2_cmd = [
+        "aria2c",
+        f"--max-connection-per-server={ARIA2_CONNECTIONS}",
+        f"--split={ARIA2_CONNECTIONS}",
+        "--min-split-size=1M",
+        "--max-concurrent-downloads=1",
+        "--uri-selector=adaptive",
+        "--continue=true",
+        "--max-tries=5",
+        "--retry-wait=3",
+        "--timeout=60",
+        "--connect-timeout=30",
+        "--summary-interval=10",
+        f"--dir={sra_file.parent}",
+        f"--out={sra_file.name}",
+        *urls
+    ]
+    start_time = time.time()
+    try:
+        result = get_stall_watchdog().run_monitored(
+            aria2_cmd, "download", run_id, DOWNLOAD_STALL_SECONDS,
+            line_parser=parse_aria2_progress, timeout=PREFETCH_TIMEOUT, detail=urls[0],
+        )
+    except (subprocess.TimeoutExpired, StallDetected):
+        scoreboard.record(urls[0], False, run_id=run_id)
+        raise
+    # aria2 無法區分各鏡像的貢獻，記在排第一的鏡像上（以連線秒數計，與其他引擎的統計一致）
+    ok = result.returncode == 0 and sra_file.exists()
+    scoreboard.record(
+        urls[0],
+        ok,
+        nbytes=sra_file.stat().st_size if ok else 0,
+        seconds=(time.time() - start_time) * ARIA2_CONNECTIONS if ok else 0.0,
+        run_id=run_id,
+    )
+    return result
+
+
+def download_mirror_aria2_rpc(daemon, urls, sra_file, run_id=None):
+    """排入共用的 aria2 常駐程序並等待完成（在 aria2 佇列中等待的時間不算停滯）"""
+    scoreboard = get_mirror_scoreboard()
+    gid = daemon.add(urls, sra_file, run_id)
+    timing = {"active_since": None, "last_report": 0.0}
+
+    with get_stall_watchdog().watch("download", run_id, DOWNLOAD_STALL_SECONDS, detail=urls[0]) as watch:
+        def progress(state):
+            if state["status"] != "active":
+                watch.touch()
+                return
+            watch.progress(state["completed"])
+            now = time.time()
+            if timing["active_since"] is None:
+                timing["active_since"] = now
+            if now - timing["last_report"] >= 60:
+                timing["last_report"] = now
+                percent = state["completed"] / state["total"] * 100 if state["total"] else 0
+                print(f"    📶 {run_id}: {percent:.0f}% ({state['completed'] / 1024**3:.2f} GB), "
+                      f"{state['speed'] / 1024**2:.2f} MB/s, {state['connections']} 連線", flush=True)
+
+        state = daemon.wait(gid, progress=progress, should_stop=lambda: watch.stalled)
+        if watch.stalled:
+            # 移除後保留 .aria2 控制檔，換鏡像重新加入時續傳
+            daemon.remove(gid)
+            scoreboard.record(urls[0], False, run_id=run_id)
+            watch.check()
+
+    daemon.forget(gid)
+    ok = state["status"] == "complete" and sra_file.exists()
+    active = time.time() - (timing["active_since"] or time.time())
+    scoreboard.record(
+        urls[0],
+        ok,
+        nbytes=sra_file.stat().st_size if ok else 0,
+        seconds=active * daemon.connections if ok else 0.0,
+        run_id=run_id,
+    )
+    if not ok:
+        return subprocess.CompletedProcess(urls, 1, stdout="", stderr=state["error"] or state["status"])
+    speed = state["total"] / max(active, 0.001) / 1024**2
+    summary = f"{state['total'] / 1024**2:.1f} MB, {speed:.2f} MB/s (aria2 常駐程序 {gid})"
+    print(f"    📊 {summary}")
+    return subprocess.CompletedProcess(urls, 0, stdout=summary, stderr="")
+
+
+def download_mirror_http(urls, sra_file, run_id=None):
+    """
+    以內建多段 HTTP 引擎下載（多個鏡像時自動挑選最快的，變慢時中途改用其他鏡像）
+    回傳與 subprocess 相同形式的 CompletedProcess，方便與其他引擎共用後續檢查
+    所有連線都沒有進度時中止下載（保留段落記錄）並拋出 StallDetected（detail 為當時使用的鏡像）
+    """
+    download = SegmentedDownload(
+        urls,
+        sra_file,
+        connections=HTTP_DOWNLOAD_CONNECTIONS,
+        segment_size=HTTP_SEGMENT_MB * 1024 * 1024,
+        reroute_interval=HEDGE_CHECK_SECONDS,
+        switch_ratio=HEDGE_SWITCH_RATIO,
+        probe_bytes=HEDGE_PROBE_KB * 1024,
+    )
+    def current_mirror():
+        return download.mirrors[download.primary]["source"] if download.mirrors else urls[0]
 
+    watch = get_stall_watchdog().watch(
+        "download", run_id, DOWNLOAD_STALL_SECONDS, download.downloaded_bytes,
+        on_stall=download.cancel, detail=current_mirror,
+    )
+    info = None
+    try:
+        with watch:
+            info = download.run()
+    except DownloadError as e:
+        watch.check()
+        return subprocess.CompletedProcess(urls, 1, stdout="", stderr=str(e))
+    finally:
+        scoreboard = get_mirror_scoreboard()
+        scoreboard.record_download(download, run_id)
+        if watch.stalled and info is None:
+            scoreboard.record(current_mirror(), False, run_id=run_id)
+    # 下載時已串流計算 MD5，記錄下來讓校驗階段不必重新讀檔
+    write_md5_sidecar(sra_file, info["md5"])
+    speed = info["size"] / max(info["elapsed"], 0.001) / 1024**2
+    summary = (f"{info['size'] / 1024**2:.1f} MB, {speed:.2f} MB/s, MD5 {info['md5']} "
+               f"(鏡像 {info['mirror']}, 換鏡像 {info['reroutes']} 次)")
+    print(f"    📊 {summary}")
+    return subprocess.CompletedProcess(urls, 0, stdout=summary, stderr="")
+
+
+def stage_download(job):
+    """階段1: 下載 SRA 檔案（aria2 或內建 HTTP 引擎多鏡像，失敗則回退到 prefetch）"""
+    run_id = job["run_id"]
     sra_file = SRA_TEMP_DIR / run_id / f"{run_id}.sra"
-    fastq_1 = FASTQ_OUTPUT_DIR / f"{run_id}_1.fastq"
-    fastq_2 = FASTQ_OUTPUT_DIR / f"{run_id}_2.fastq"
+    check_lease(run_id)
 
-    try:
-        # ==================== 建立獨立的NAS連接 ====================
-        if not nas_uploader.connect():
-            raise Exception("NAS連接失敗")
-        print(f"    🔌 樣本 {run_id} 的獨立NAS連接已建立")
-        # ==================== 步驟1: 下載 SRA ====================
-        print(f"\n[1/5] 📥 下載SRA...", flush=True)
-        
-        # 檢查磁碟空間
-        import shutil as shutil_disk
-        disk_usage = shutil_disk.disk_usage(str(SRA_TEMP_DIR))
-        free_gb = disk_usage.free / (1024**3)
-        print(f"    💾 可用磁碟空間: {free_gb:.2f} GB", flush=True)
-        
-        # 如果空間不足，警告但不自動清理其他樣本的目錄（避免並行衝突）
-        if free_gb < 50:
-            print(f"    ⚠️  磁碟空間偏低: {free_gb:.2f} GB")
-            print(f"    提示: 建議手動執行 cleanup_disk.py 清理殘留檔案")
+    print(f"\n[1/5] 📥 {run_id} 下載SRA...", flush=True)
+
+    # 上次已完成校驗或解壓時從 checkpoint 繼續（仍需預約這些檔案之後的磁碟用量）
+    resume = resume_from_checkpoint(job)
+    if resume:
+        admission = get_disk_admission()
+        if resume == "upload":
+            footprint = {"sra": 0, "temp": 0, "fastq": sum(f.stat().st_size for f in job["fastq_files"])}
+            print(f"    ↩️  從 checkpoint 繼續: FASTQ 已解壓，跳過下載、校驗與解壓", flush=True)
+        else:
+            footprint = admission.estimate(run_id, job.get("size_hint"), job.get("sra_hint"))
+            if job.get("ena_files"):
+                footprint.update(sra=sum(f.stat().st_size for f in job["ena_files"]), temp=0)
+            else:
+                footprint.update(sra=job["sra_file"].stat().st_size)
+            print(f"    ↩️  從 checkpoint 繼續: 下載的檔案已校驗，跳過下載與校驗", flush=True)
+        admission.acquire(run_id, footprint)
+        job["resume"] = resume
+        return job
+
+    # 檢查磁碟空間
+    import shutil as shutil_disk
+    disk_usage = shutil_disk.disk_usage(str(SRA_TEMP_DIR))
+    free_gb = disk_usage.free / (1024**3)
+    print(f"    💾 可用磁碟空間: {free_gb:.2f} GB", flush=True)
+    
+    # 如果空間不足，警告但不自動清理其他樣本的目錄（避免並行衝突）
+    if free_gb < 50:
+        print(f"    ⚠️  磁碟空間偏低: {free_gb:.2f} GB")
+        print(f"    提示: 建議手動執行 cleanup_disk.py 清理殘留檔案")
+    
+    # 預約此樣本的尖峰磁碟用量，空間不足時等待其他樣本釋放
+    # ENA 有現成的 fastq.gz（且有 MD5）時直接下載，跳過 SRA、校驗與 fasterq-dump
+    ena_plan = []
+    if ENA_FASTQ:
+        try:
+            ena_plan = ena_fastq_plan(run_id)
+        except Exception as e:
+            print(f"    ⚠️ 無法取得 ENA FASTQ 清單: {e}")
+
+    admission = get_disk_admission()
+    footprint = admission.estimate(run_id, job.get("size_hint"), job.get("sra_hint"))
+    if ena_plan:
+        # gzip 檔（ENA fastq_bytes）+ 解壓後的 FASTQ，沒有 fasterq-dump 暫存
+        footprint.update(sra=job.get("size_hint") or footprint["sra"], temp=0)
+    print(f"    📐 預估尖峰用量: {sum(footprint.values()) / GB:.1f} GB "
+          f"(SRA {footprint['sra'] / GB:.1f} + 暫存 {footprint['temp'] / GB:.1f} + FASTQ {footprint['fastq'] / GB:.1f})",
+          flush=True)
+    admission.acquire(run_id, footprint)
+    
+    # 保留上次留下的部分下載（重啟或重試時續傳），只清除無法續傳的狀態
+    sra_file.parent.mkdir(parents=True, exist_ok=True)
+    
+    # 確認目錄創建成功
+    if not sra_file.parent.exists():
+        raise Exception(f"無法創建目錄: {sra_file.parent}")
+
+    if ena_plan:
+        print(f"    📦 ENA 提供 {len(ena_plan)} 個 fastq.gz，直接下載（跳過 SRA 與 fasterq-dump）", flush=True)
+        try:
+            job["ena_files"] = download_ena_fastq(
+                run_id, ena_plan, sra_file.parent,
+                connections=ENA_FASTQ_CONNECTIONS,
+                segment_size=HTTP_SEGMENT_MB * 1024 * 1024,
+                stall_seconds=DOWNLOAD_STALL_SECONDS,
+                watchdog=get_stall_watchdog(),
+            )
+        except ENAFastqUnavailable as e:
+            print(f"    ⚠️ ENA FASTQ 下載失敗，改走 SRA 流程: {e}")
+            for leftover in sra_file.parent.glob(f"{run_id}*.fastq.gz*"):
+                leftover.unlink()
+            admission.adjust(run_id, **admission.estimate(run_id, job.get("size_hint"), job.get("sra_hint")))
+        else:
+            admission.adjust(run_id, sra=sum(f.stat().st_size for f in job["ena_files"]))
+            return job
+    
+    # 決定下載引擎（aria2 / 內建 HTTP / prefetch）
+    engine = select_download_engine()
+    start_time = time.time()
+    result = None
+
+    partial = prepare_resume(sra_file, engine, job.get("sra_hint"))
+    if partial["kind"] == "complete":
+        engine = "existing"
+        result = subprocess.CompletedProcess([], 0, stdout="", stderr="")
+    
+    if engine in ("aria2", "http"):
+        if engine == "aria2":
+            print(f"    🚀 使用 aria2 多連接加速下載（{ARIA2_CONNECTIONS} 連接"
+                  f"{f'，全域上限 {ARIA2_GLOBAL_CONNECTIONS}' if ARIA2_RPC else ''}）...")
+        else:
+            print(f"    🚀 使用內建 HTTP 多段下載（{HTTP_DOWNLOAD_CONNECTIONS} 連接）...")
         
-        if free_gb < 10:
-            raise Exception(f"磁碟空間不足: 僅剩 {free_gb:.2f} GB，請手動清理或增加磁碟空間")
+        # SRA 下載 URL（依鏡像記分板排序：過去在這個時段與前綴的成功率與速度）
+        mirrors = get_sra_download_url(run_id, verbose=True)
         
-        # 只清理當前樣本的舊目錄（避免誤刪其他執行緒的目錄）
-        if sra_file.parent.exists():
-            # 先清理所有臨時檔案和鎖檔
-            for tmp_file in sra_file.parent.glob("*.tmp"):
-                try:
-                    tmp_file.unlink()
-                    print(f"    🗑️  已刪除臨時檔: {tmp_file.name}")
-                except:
-                    pass
-            for lock_file in sra_file.parent.glob("*.lock"):
-                try:
-                    lock_file.unlink()
-                    print(f"    🗑️  已刪除鎖檔: {lock_file.name}")
-                except:
-                    pass
+        # hedged: 同時探測所有鏡像，一次下載中自動挑選/切換；否則依序嘗試每個鏡像直到成功
+        attempts = [mirrors] if DOWNLOAD_HEDGE else [[url] for url in mirrors]
+        download_success = False
+        for mirror_idx, urls in enumerate(attempts, 1):
+            if DOWNLOAD_HEDGE:
+                print(f"    🌐 探測 {len(urls)} 個鏡像")
+            else:
+                print(f"    🌐 嘗試鏡像 {mirror_idx}/{len(attempts)}")
             
-            # 然後刪除整個目錄
-            shutil.rmtree(sra_file.parent)
-            print(f"    🗑️  已刪除舊的 SRA 目錄: {sra_file.parent}")
+            try:
+                if engine == "aria2":
+                    result = download_mirror_aria2(urls, sra_file, run_id)
+                else:
+                    result = download_mirror_http(urls, sra_file, run_id)
+                
+                if result.returncode == 0 and sra_file.exists():
+                    download_success = True
+                    print(f"    ✅ {engine} 下載成功！")
+                    break
+                else:
+                    print(f"    ⚠️ 鏡像 {mirror_idx} 失敗，嘗試下一個...")
+                    
+            except StallDetected as e:
+                # hedged 模式下停滯的是排第一 / 正在使用的鏡像，排除它後以其餘鏡像續傳
+                remaining = [url for url in urls if url != e.detail]
+                if DOWNLOAD_HEDGE and remaining and len(remaining) < len(urls):
+                    print(f"    ⚠️ {e}，改用其餘 {len(remaining)} 個鏡像續傳...")
+                    attempts.append(remaining)
+                else:
+                    print(f"    ⚠️ {e}，嘗試下一個...")
+            except subprocess.TimeoutExpired:
+                print(f"    ⚠️ 鏡像 {mirror_idx} 超時，嘗試下一個...")
+            except Exception as e:
+                print(f"    ⚠️ 鏡像 {mirror_idx} 錯誤: {e}")
         
-        # 重新創建乾淨的目錄
-        sra_file.parent.mkdir(parents=True, exist_ok=True)
+        # 如果所有鏡像都失敗，回退到 prefetch
+        if not download_success:
+            print(f"    ⚠️ {engine} 所有鏡像都失敗，回退到 prefetch...")
+            if engine == "aria2":
+                # aria2 的部分檔案與 prefetch 的輸出同名，必須先移除
+                discard_partial(sra_file)
+            engine = "prefetch"
+    
+    # 如果指定 prefetch 或其他引擎失敗，使用傳統 prefetch
+    if engine == "prefetch":
+        # 構建 prefetch 命令
+        cmd = [
+            PREFETCH_EXE,
+            run_id,
+            "--output-directory",
+            str(SRA_TEMP_DIR),
+            "--max-size",
+            "100GB",
+            "--resume", "yes",
+            "--type", "sra",
+            "--progress",
+        ]
         
-        # 確認目錄創建成功
-        if not sra_file.parent.exists():
-            raise Exception(f"無法創建目錄: {sra_file.parent}")
+        # 嘗試啟用 Aspera 加速
+        use_aspera = os.environ.get("USE_ASPERA", "yes").lower() in ["yes", "true", "1"]
+        if use_aspera:
+            pass  # prefetch 會自動偵測並使用 Aspera
         
-        # 檢查是否使用 aria2 加速下載
-        use_aria2 = USE_ARIA2 and shutil.which("aria2c") is not None
-        start_time = time.time()
-        result = None
+        print(f"    執行指令: {' '.join(cmd)}")
         
-        if use_aria2:
-            print(f"    🚀 使用 aria2 多連接加速下載（{ARIA2_CONNECTIONS} 連接）...")
-            
-            # 構建 SRA 下載 URL（嘗試多個鏡像）
-            prefix = run_id[:6]
-            mirrors = [
-                f"https://sra-downloadb.be-md.ncbi.nlm.nih.gov/sos4/sra-pub-run-28/{prefix}/{run_id}/{run_id}.sra",
-                f"https://sra-download.ncbi.nlm.nih.gov/traces/sra68/SRZ/{prefix}/{run_id}/{run_id}.sra",
-                f"https://sra-pub-run-odp.s3.amazonaws.com/sra/{run_id}/{run_id}",
-            ]
-            
-            # 嘗試每個鏡像直到成功
-            download_success = False
-            for mirror_idx, url in enumerate(mirrors, 1):
-                print(f"    🌐 嘗試鏡像 {mirror_idx}/{len(mirrors)}")
-                
-                aria2_cmd = [
-                    "aria2c",
-                    f"--max-connection-per-server={ARIA2_CONNECTIONS}",
-                    f"--split={ARIA2_CONNECTIONS}",
-                    "--min-split-size=1M",
-                    "--max-concurrent-downloads=1",
-                    "--continue=true",
-                    "--max-tries=5",
-                    "--retry-wait=3",
-                    "--timeout=60",
-                    "--connect-timeout=30",
-                    f"--dir={sra_file.parent}",
-                    f"--out={sra_file.name}",
-                    url
-                ]
-                
-                try:
-                    result = subprocess.run(
-                        aria2_cmd, capture_output=True, text=True, timeout=PREFETCH_TIMEOUT
-                    )
-                    
-                    if result.returncode == 0 and sra_file.exists():
-                        download_success = True
-                        print(f"    ✅ aria2 下載成功！")
-                        break
-                    else:
-                        print(f"    ⚠️ 鏡像 {mirror_idx} 失敗，嘗試下一個...")
-                        
-                except subprocess.TimeoutExpired:
-                    print(f"    ⚠️ 鏡像 {mirror_idx} 超時，嘗試下一個...")
-                except Exception as e:
-                    print(f"    ⚠️ 鏡像 {mirror_idx} 錯誤: {e}")
-            
-            # 如果 aria2 全部失敗，回退到 prefetch
-            if not download_success:
-                print(f"    ⚠️ aria2 所有鏡像都失敗，回退到 prefetch...")
-                use_aria2 = False
+        # 加入重試機制（最多 3 次）
+        max_retries = 3
+        retry_delay = 10
         
-        # 如果不使用 aria2 或 aria2 失敗，使用傳統 prefetch
-        if not use_aria2:
-            # 構建 prefetch 命令
-            cmd = [
-                PREFETCH_EXE,
-                run_id,
-                "--output-directory",
-                str(SRA_TEMP_DIR),
-                "--max-size",
-                "100GB",
-                "--force", "all",
-                "--type", "sra",
-                "--progress",
-            ]
-            
-            # 嘗試啟用 Aspera 加速
-            use_aspera = os.environ.get("USE_ASPERA", "yes").lower() in ["yes", "true", "1"]
-            if use_aspera:
-                pass  # prefetch 會自動偵測並使用 Aspera
-            
-            print(f"    執行指令: {' '.join(cmd)}")
-            
-            # 加入重試機制（最多 3 次）
-            max_retries = 3
-            retry_delay = 10
-            
-            for attempt in range(1, max_retries + 1):
-                try:
-                    result = subprocess.run(
-                        cmd, capture_output=True, text=True, timeout=PREFETCH_TIMEOUT
-                    )
-                    
-                    # 如果成功或非網路錯誤，跳出重試
-                    if result.returncode == 0:
-                        break
-                        
-                    # 檢查是否為網路/連接錯誤
-                    error_msg = result.stderr.lower()
-                    is_network_error = any(keyword in error_msg for keyword in [
-                        "connection failed", "timeout", "network", "failed to download"
-                    ])
+        for attempt in range(1, max_retries + 1):
+            try:
+                # prefetch 的進度輸出不穩定，以樣本目錄（.tmp 檔）的增長判斷是否停滯
+                result = get_stall_watchdog().run_monitored(
+                    cmd, "download", run_id, DOWNLOAD_STALL_SECONDS,
+                    progress_fn=lambda: path_progress(sra_file.parent),
+                    timeout=PREFETCH_TIMEOUT, detail="prefetch",
+                )
+                
+                # 如果成功或非網路錯誤，跳出重試
+                if result.returncode == 0:
+                    break
                     
-                    if is_network_error and attempt < max_retries:
-                        print(f"    ⚠️ 網路錯誤，{retry_delay}秒後重試 ({attempt}/{max_retries})...")
-                        time.sleep(retry_delay)
-                        continue
-                    else:
-                        break
-                        
-                except subprocess.TimeoutExpired:
-                    if attempt < max_retries:
-                        print(f"    ⚠️ 超時，{retry_delay}秒後重試 ({attempt}/{max_retries})...")
-                        time.sleep(retry_delay)
-                        continue
-                    else:
-                        raise
-        
-        elapsed = time.time() - start_time
-
-        # 給檔案系統一點時間同步（Docker volume 可能需要）
-        time.sleep(2)
-
-        # 如果檔案還沒有出現，嘗試輪詢並搜尋可能的位置（例如 NCBI cache）
-        file_exists = sra_file.exists()
-        postcheck_wait = int(os.environ.get("PREFETCH_POSTCHECK_WAIT", 120))
-        poll_interval = 2
-        checked_alt = []
-
-        if not file_exists and result.returncode == 0:
-            print(f"    ⚠️ Prefetch 返回成功但檔案尚未可見，開始輪詢最多 {postcheck_wait}s...")
-            t0 = time.time()
-            while time.time() - t0 < postcheck_wait:
-                if sra_file.exists():
-                    file_exists = True
+                # 檢查是否為網路/連接錯誤
+                error_msg = result.stderr.lower()
+                is_network_error = any(keyword in error_msg for keyword in [
+                    "connection failed", "timeout", "network", "failed to download"
+                ])
+                
+                if is_network_error and attempt < max_retries:
+                    print(f"    ⚠️ 網路錯誤，{retry_delay}秒後重試 ({attempt}/{max_retries})...")
+                    time.sleep(retry_delay)
+                    continue
+                else:
                     break
-                # 搜尋同目錄下的候選檔案
-                if sra_file.parent.exists():
-                    for f in sra_file.parent.iterdir():
-                        try:
-                            if f.is_file():
-                                name = f.name.lower()
-                                # 常見情況: 檔名包含 run id 或副檔名為 .sra
-                                if run_id.lower() in name or name.endswith(".sra"):
-                                    # 嘗試將它移到預期位置（如果不同）
-                                    try:
-                                        if f.resolve() != sra_file.resolve():
-                                            print(f"    🔁 發現候選檔案，嘗試重命名: {f} -> {sra_file}")
-                                            f.rename(sra_file)
-                                    except Exception:
-                                        # 解析路徑可能失敗，改用 copy
-                                        try:
-                                            shutil.copy2(f, sra_file)
-                                        except Exception:
-                                            pass
-                                    file_exists = sra_file.exists()
-                                    break
-                        except Exception:
-                            continue
-                # 搜尋 NCBI 預設快取位置
-                try:
-                    home_cache = Path.home() / ".ncbi" / "public" / "sra"
-                    if home_cache.exists() and home_cache not in checked_alt:
-                        checked_alt.append(home_cache)
-                        for f in home_cache.rglob("*"):
-                            if f.is_file() and run_id.lower() in f.name.lower():
-                                print(f"    🔎 在 NCBI cache 發現候選: {f}，複製到 {sra_file}")
+                    
+            except (subprocess.TimeoutExpired, StallDetected) as e:
+                if attempt < max_retries:
+                    reason = "停滯" if isinstance(e, StallDetected) else "超時"
+                    print(f"    ⚠️ {reason}，{retry_delay}秒後續傳 ({attempt}/{max_retries})...")
+                    time.sleep(retry_delay)
+                    continue
+                else:
+                    raise
+    
+    elapsed = time.time() - start_time
+
+    # 給檔案系統一點時間同步（Docker volume 可能需要）
+    time.sleep(2)
+
+    # 如果檔案還沒有出現，嘗試輪詢並搜尋可能的位置（例如 NCBI cache）
+    file_exists = sra_file.exists()
+    postcheck_wait = int(os.environ.get("PREFETCH_POSTCHECK_WAIT", 120))
+    poll_interval = 2
+    checked_alt = []
+
+    if not file_exists and result.returncode == 0:
+        print(f"    ⚠️ Prefetch 返回成功但檔案尚未可見，開始輪詢最多 {postcheck_wait}s...")
+        t0 = time.time()
+        while time.time() - t0 < postcheck_wait:
+            if sra_file.exists():
+                file_exists = True
+                break
+            # 搜尋同目錄下的候選檔案
+            if sra_file.parent.exists():
+                for f in sra_file.parent.iterdir():
+                    try:
+                        if f.is_file():
+                            name = f.name.lower()
+                            # 常見情況: 檔名包含 run id 或副檔名為 .sra
+                            if run_id.lower() in name or name.endswith(".sra"):
+                                # 嘗試將它移到預期位置（如果不同）
                                 try:
-                                    shutil.copy2(f, sra_file)
+                                    if f.resolve() != sra_file.resolve():
+                                        print(f"    🔁 發現候選檔案，嘗試重命名: {f} -> {sra_file}")
+                                        f.rename(sra_file)
                                 except Exception:
-                                    pass
+                                    # 解析路徑可能失敗，改用 copy
+                                    try:
+                                        shutil.copy2(f, sra_file)
+                                    except Exception:
+                                        pass
                                 file_exists = sra_file.exists()
                                 break
-                except Exception:
-                    pass
+                    except Exception:
+                        continue
+            # 搜尋 NCBI 預設快取位置
+            try:
+                home_cache = Path.home() / ".ncbi" / "public" / "sra"
+                if home_cache.exists() and home_cache not in checked_alt:
+                    checked_alt.append(home_cache)
+                    for f in home_cache.rglob("*"):
+                        if f.is_file() and run_id.lower() in f.name.lower():
+                            print(f"    🔎 在 NCBI cache 發現候選: {f}，複製到 {sra_file}")
+                            try:
+                                shutil.copy2(f, sra_file)
+                            except Exception:
+                                pass
+                            file_exists = sra_file.exists()
+                            break
+            except Exception:
+                pass
+
+            if file_exists:
+                break
+            time.sleep(poll_interval)
+
+    # 檢查 prefetch 是否成功（檢查檔案而非目錄，避免誤判）
+    if result.returncode != 0 or not file_exists:
+        # 輸出完整錯誤訊息以便除錯
+        print(f"    ❌ Prefetch返回碼: {result.returncode}")
+        print(f"    📋 STDOUT: {result.stdout}")
+        print(f"    📋 STDERR: {result.stderr}")
+        print(f"    📁 檔案存在: {file_exists}")
+        print(f"    📂 預期路徑: {sra_file}")
+
+        # 列出實際下載的內容（如果目錄存在）
+        if sra_file.parent.exists():
+            actual_files = list(sra_file.parent.rglob("*"))
+            print(f"    📂 實際檔案: {[str(f) for f in actual_files[:20]]}")
+
+        # 檢查是否為路徑問題（可能是並行衝突）
+        error_msg = result.stderr.lower()
+        if "path not found" in error_msg or "cannot openfilewrite" in error_msg:
+            raise Exception(f"Prefetch路徑錯誤（可能是並行衝突或權限問題）: {result.stderr}")
+
+        # 檢查是否為樣本不存在的錯誤
+        if "item not found" in error_msg or "cannot resolve" in error_msg:
+            raise Exception(f"樣本不存在於SRA數據庫（可能已下架）: {run_id}")
+
+        # 檢查是否僅為參考序列下載失敗（但 SRA 本身已下載成功）
+        is_refseq_only_error = (
+            "failed to download" in error_msg and 
+            "refseq" in error_msg and 
+            sra_file.exists()
+        )
+        
+        if is_refseq_only_error:
+            print(f"    ⚠️ 參考序列下載失敗，但 SRA 本身已下載完成，繼續處理...")
+            # 不拋出異常，讓流程繼續
+        elif result.returncode == 0 and not file_exists:
+            # 如果返回碼是0但檔案不存在，可能是網路問題或檔案格式問題
+            raise Exception(f"Prefetch顯示成功但檔案不存在（可能是網路中斷或格式錯誤）。STDOUT: {result.stdout[:200]}")
+        else:
+            raise Exception(f"Prefetch失敗: {result.stderr}")
 
-                if file_exists:
-                    break
-                time.sleep(poll_interval)
-
-        # 檢查 prefetch 是否成功（檢查檔案而非目錄，避免誤判）
-        if result.returncode != 0 or not file_exists:
-            # 輸出完整錯誤訊息以便除錯
-            print(f"    ❌ Prefetch返回碼: {result.returncode}")
-            print(f"    📋 STDOUT: {result.stdout}")
-            print(f"    📋 STDERR: {result.stderr}")
-            print(f"    📁 檔案存在: {file_exists}")
-            print(f"    📂 預期路徑: {sra_file}")
-
-            # 列出實際下載的內容（如果目錄存在）
-            if sra_file.parent.exists():
-                actual_files = list(sra_file.parent.rglob("*"))
-                print(f"    📂 實際檔案: {[str(f) for f in actual_files[:20]]}")
-
-            # 檢查是否為路徑問題（可能是並行衝突）
-            error_msg = result.stderr.lower()
-            if "path not found" in error_msg or "cannot openfilewrite" in error_msg:
-                raise Exception(f"Prefetch路徑錯誤（可能是並行衝突或權限問題）: {result.stderr}")
-
-            # 檢查是否為樣本不存在的錯誤
-            if "item not found" in error_msg or "cannot resolve" in error_msg:
-                raise Exception(f"樣本不存在於SRA數據庫（可能已下架）: {run_id}")
-
-            # 檢查是否僅為參考序列下載失敗（但 SRA 本身已下載成功）
-            is_refseq_only_error = (
-                "failed to download" in error_msg and 
-                "refseq" in error_msg and 
-                sra_file.exists()
-            )
-            
-            if is_refseq_only_error:
-                print(f"    ⚠️ 參考序列下載失敗，但 SRA 本身已下載完成，繼續處理...")
-                # 不拋出異常，讓流程繼續
-            elif result.returncode == 0 and not file_exists:
-                # 如果返回碼是0但檔案不存在，可能是網路問題或檔案格式問題
-                raise Exception(f"Prefetch顯示成功但檔案不存在（可能是網路中斷或格式錯誤）。STDOUT: {result.stdout[:200]}")
-            else:
-                raise Exception(f"Prefetch失敗: {result.stderr}")
+    if not sra_file.exists():
+        raise Exception(f"SRA檔案不存在: {sra_file}")
 
-        if not sra_file.exists():
-            raise Exception(f"SRA檔案不存在: {sra_file}")
+    sra_bytes = sra_file.stat().st_size
+    sra_size = sra_bytes / (1024**3)
+    print(f"✅ Prefetch完成 ({elapsed:.1f}秒, {sra_size:.2f} GB)")
 
-        sra_size = sra_file.stat().st_size / (1024**3)
-        print(f"✅ Prefetch完成 ({elapsed:.1f}秒, {sra_size:.2f} GB)")
+    admission.record_actual(run_id, sra_bytes=sra_bytes)
+    admission.adjust(run_id, sra=sra_bytes)
 
-        # ==================== 步驟1.5: 驗證SRA檔案完整性 ====================
-        print(f"\n[1.5/5] 🔍 驗證SRA檔案完整性...", flush=True)
-        
-        cmd_validate = [
-            VDB_VALIDATE_EXE,
-            str(sra_file)
-        ]
-        
+    job["sra_file"] = sra_file
+    return job
+
+
+def stage_validate(job):
+    """階段1.5: 驗證 SRA 檔案完整性（線程模式，見 stage_validate_async）"""
+    return asyncio.run(stage_validate_async(job))
+
+
+async def stage_validate_async(job):
+    """
+    階段1.5: 驗證 SRA 檔案完整性
+    與 NCBI metadata 記錄的 MD5 相符時跳過 vdb-validate（內建 HTTP 引擎在下載時已算好 MD5，不必重新讀檔），
+    沒有 MD5、不相符或被抽中做抽樣稽核時才執行 vdb-validate
+    """
+    run_id = job["run_id"]
+    check_lease(run_id)
+    if job.get("resume"):
+        print(f"\n[1.5/5] ⏭️  {run_id} 上次已校驗通過 (checkpoint)，跳過", flush=True)
+        return job
+    if job.get("ena_files"):
+        print(f"\n[1.5/5] ⏭️  {run_id} ENA FASTQ 已在下載時比對 MD5，跳過 vdb-validate", flush=True)
+        save_checkpoint(run_id, "validate", ena_files=_file_entries(job["ena_files"]))
+        return job
+
+    sra_file = job["sra_file"]
+    sra_bytes = sra_file.stat().st_size
+    sra_size = sra_bytes / (1024**3)
+    stats = get_validation_stats()
+
+    print(f"\n[1.5/5] 🔍 {run_id} 驗證SRA檔案完整性...", flush=True)
+
+    audit = False
+    expected_md5 = (job.get("sra_md5") or "").lower()
+    if expected_md5:
         start_time = time.time()
-        result_validate = subprocess.run(
-            cmd_validate, capture_output=True, text=True, timeout=1800  # 30分鐘超時
-        )
-        elapsed_validate = time.time() - start_time
+        actual_md5 = read_md5_sidecar(sra_file)
+        streamed = actual_md5 is not None
+        if not streamed:
+            actual_md5 = await asyncio.to_thread(file_md5, sra_file)
+        elapsed_md5 = time.time() - start_time
+
+        if actual_md5 == expected_md5:
+            audit = should_audit(VALIDATE_AUDIT_RATE)
+            if not audit:
+                saved_seconds, saved_bytes = stats.record_skip(sra_bytes, elapsed_md5, streamed)
+                source = "下載時計算" if streamed else f"讀檔計算 {elapsed_md5:.1f}秒"
+                print(f"✅ SRA檔案 MD5 與 NCBI 記錄相符 ({source})，跳過 vdb-validate "
+                      f"(省下約 {saved_seconds:.0f}秒、{saved_bytes / 1024**3:.2f} GB 讀取)")
+                save_checkpoint(run_id, "validate", sra_file=[str(sra_file), sra_bytes])
+                return job
+            print(f"    🎲 MD5 相符，抽樣稽核: 仍執行 vdb-validate")
+        else:
+            stats.record_mismatch()
+            print(f"    ⚠️  MD5 與 NCBI 記錄不符 ({actual_md5} != {expected_md5})，改用 vdb-validate 確認")
+
+    cmd_validate = [
+        VDB_VALIDATE_EXE,
+        str(sra_file)
+    ]
+    
+    start_time = time.time()
+    result_validate = await run_process(cmd_validate, timeout=1800)  # 30分鐘超時
+    elapsed_validate = time.time() - start_time
+    stats.record_validate(sra_bytes, elapsed_validate, audit=audit, ok=result_validate.returncode == 0)
+    
+    if result_validate.returncode != 0:
+        # 校驗失敗，表示SRA檔案不完整或損壞
+        print(f"    ❌ SRA檔案校驗失敗 ({elapsed_validate:.1f}秒)")
+        print(f"    錯誤訊息: {result_validate.stderr[:200]}")
+        if audit:
+            print(f"    ⚠️  抽樣稽核: MD5 相符但 vdb-validate 失敗")
         
-        if result_validate.returncode != 0:
-            # 校驗失敗，表示SRA檔案不完整或損壞
-            print(f"    ❌ SRA檔案校驗失敗 ({elapsed_validate:.1f}秒)")
-            print(f"    錯誤訊息: {result_validate.stderr[:200]}")
-            
-            # 刪除損壞的SRA檔案
-            if sra_file.parent.exists():
-                shutil.rmtree(sra_file.parent)
-                print(f"    🗑️  已刪除損壞的SRA檔案: {sra_file.parent}")
-            
-            raise Exception(f"SRA檔案完整性校驗失敗，檔案可能下載不完整 (實際大小: {sra_size:.2f} GB)")
+        # 刪除損壞的SRA檔案
+        if sra_file.parent.exists():
+            shutil.rmtree(sra_file.parent)
+            print(f"    🗑️  已刪除損壞的SRA檔案: {sra_file.parent}")
         
-        print(f"✅ SRA檔案校驗通過 ({elapsed_validate:.1f}秒)")
+        raise Exception(f"SRA檔案完整性校驗失敗，檔案可能下載不完整 (實際大小: {sra_size:.2f} GB)")
+    
+    print(f"✅ SRA檔案校驗通過 ({elapsed_validate:.1f}秒)")
+    save_checkpoint(run_id, "validate", sra_file=[str(sra_file), sra_bytes])
+
+    return job
+
+
+def build_fasterq_cmd(sra_file, output_dir, temp_dir=TMP_DIR, threads=FASTERQ_THREADS):
+    """構建 fasterq-dump 指令"""
+    return [
+        FASTERQ_DUMP_EXE,  # 使用配置中的路徑
+        str(sra_file),
+        "-e",
+        str(threads),
+        "-O",
+        str(output_dir),
+        "-t",
+        str(temp_dir),
+        "--split-files",  # 分離成 _1.fastq 和 _2.fastq
+        "-f",
+    ]
+
+
+def remove_sra_dir(sra_file):
+    """步驟2.5: 解壓完成後立即刪除SRA檔案釋放空間"""
+    print(f"\n[2.5/5] 🗑️  刪除SRA檔案釋放空間...", flush=True)
+    if sra_file.parent.exists():
+        sra_size_gb = sra_file.stat().st_size / (1024**3) if sra_file.exists() else 0
+        shutil.rmtree(sra_file.parent)
+        print(f"    ✅ 已刪除SRA檔案 (釋放 {sra_size_gb:.2f} GB): {sra_file.parent}")
+
+
+def acquire_cpu(run_id, input_bytes, max_threads=None):
+    """決定這次解壓的線程數（CPU_SCHEDULER=no 時固定為 FASTERQ_THREADS，max_threads 為上限）"""
+    if not CPU_SCHEDULER:
+        return FASTERQ_THREADS if max_threads is None else min(FASTERQ_THREADS, max_threads)
+    scheduler = get_cpu_scheduler()
+    threads = scheduler.acquire(run_id, input_bytes, max_threads)
+    print(f"    🖥️  分配 {threads} 個線程 (已分配 {scheduler.allocated_threads()}/{scheduler.total_threads})",
+          flush=True)
+    return threads
+
+
+def track_cpu(run_id):
+    """回傳登記子程序 pid 的 on_start 回呼，讓排程器追蹤實際 CPU 使用"""
+    if not CPU_SCHEDULER:
+        return None
+    return lambda process: get_cpu_scheduler().attach(run_id, process.pid)
+
+
+def release_cpu(run_id):
+    if not CPU_SCHEDULER:
+        return
+    usage = get_cpu_scheduler().release(run_id)
+    if usage and usage["cores_used"] is not None:
+        print(f"    🖥️  {run_id} 分配 {usage['threads']} 個線程，實際平均使用 {usage['cores_used']:.1f} 個核心")
 
-        # ==================== 步驟2: Fasterq-dump ====================
-        print(f"\n[2/5] 🔓 解壓FASTQ...", flush=True)
-        FASTQ_OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
-        cmd = [
-            FASTERQ_DUMP_EXE,  # 使用配置中的路徑
-            str(sra_file),
-            "-e",
-            str(FASTERQ_THREADS),
-            "-O",
-            str(FASTQ_OUTPUT_DIR),
-            "-t",
-            str(TMP_DIR),
-            "--split-files",  # 分離成 _1.fastq 和 _2.fastq
-            "-f",
-        ]
+def stream_dump(run_id, sra_file, threads=FASTERQ_THREADS):
+    """串流模式: fasterq-dump 透過 FIFO 直接寫入 NAS，失敗時拋出 StreamingUnavailable"""
+    print(f"    🔀 串流模式: FASTQ 直接寫入 NAS，不落地本地磁碟", flush=True)
+    fifo_dir = TMP_DIR / f"{run_id}_stream"
+
+    pool = get_nas_pool()
+    try:
+        nas_uploader = pool.checkout()
+    except NASConnectionError as e:
+        raise StreamingUnavailable(str(e))
+
+    broken = True
+    try:
+        with get_stall_watchdog().watch("dump", run_id, DUMP_STALL_SECONDS, detail="stream") as watch:
+            streamed = stream_dump_to_nas(
+                run_id,
+                build_fasterq_cmd(sra_file, fifo_dir, threads=threads),
+                fifo_dir,
+                nas_uploader,
+                NAS_CONFIG["fastq_path"],
+                FASTQ_OUTPUT_DIR,
+                FASTERQ_TIMEOUT,
+                watch=watch,
+                on_start=track_cpu(run_id),
+            )
+        broken = False
+        return streamed
+    finally:
+        pool.checkin(nas_uploader, broken=broken)
+
+
+def dump_ena_fastq(job, threads=FASTERQ_THREADS):
+    """ENA 的 fastq.gz 只需要解壓（取代 fasterq-dump），完成後刪除樣本目錄"""
+    run_id = job["run_id"]
+    FASTQ_OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+
+    start_time = time.time()
+    fastq_files_to_upload = [
+        decompress_fastq(gz_file, FASTQ_OUTPUT_DIR, threads, on_start=track_cpu(run_id))
+        for gz_file in job["ena_files"]
+    ]
+    elapsed = time.time() - start_time
+    total_bytes = sum(f.stat().st_size for f in fastq_files_to_upload)
+    layout = "雙端" if len(fastq_files_to_upload) > 1 else "單端"
+    print(f"✅ 解壓完成 (ENA {layout}, {elapsed:.1f}秒, {total_bytes / 1024**3:.2f} GB)")
+
+    run_dir = SRA_TEMP_DIR / run_id
+    if run_dir.exists():
+        shutil.rmtree(run_dir)
+
+    admission = get_disk_admission()
+    admission.record_actual(run_id, fastq_bytes=total_bytes)
+    admission.release(run_id, ["sra", "temp"])
+
+    job["fastq_files"] = fastq_files_to_upload
+    return job
+
+
+def stage_dump(job):
+    """階段2: 解壓 FASTQ（線程模式，見 stage_dump_async）"""
+    return asyncio.run(stage_dump_async(job))
+
+
+async def stage_dump_async(job):
+    """階段2: 解壓 FASTQ（線程數由 CPU 排程器依剩餘核心與輸入大小決定）"""
+    run_id = job["run_id"]
+    check_lease(run_id)
+    if job.get("resume") == "upload":
+        print(f"\n[2/5] ⏭️  {run_id} 上次已解壓完成 (checkpoint)，跳過", flush=True)
+        return job
+    max_threads = None
+    if job.get("ena_files"):
+        print(f"\n[2/5] 🔓 {run_id} 解壓 ENA fastq.gz...", flush=True)
+        input_bytes = sum(f.stat().st_size for f in job["ena_files"])
+        if not pigz_available():
+            # 沒有 pigz 時以 gzip 模組單線程解壓，不佔用其他樣本的線程
+            max_threads = 1
+    else:
+        print(f"\n[2/5] 🔓 {run_id} 解壓FASTQ...", flush=True)
+        input_bytes = job["sra_file"].stat().st_size
+
+    threads = await asyncio.to_thread(acquire_cpu, run_id, input_bytes, max_threads)
+    try:
+        if job.get("ena_files"):
+            job = await asyncio.to_thread(dump_ena_fastq, job, threads)
+        else:
+            job = await dump_sra(job, threads)
+    finally:
+        release_cpu(run_id)
+
+    if job.get("fastq_files"):
+        # 串流模式已直接寫入 NAS，不需要 checkpoint
+        save_checkpoint(run_id, "dump", fastq_files=_file_entries(job["fastq_files"]))
+    return job
+
+
+async def dump_sra(job, threads=FASTERQ_THREADS):
+    """fasterq-dump 解壓 FASTQ，完成後立即刪除 SRA 釋放空間"""
+    run_id = job["run_id"]
+    sra_file = job["sra_file"]
+    fastq_1 = FASTQ_OUTPUT_DIR / f"{run_id}_1.fastq"
+    fastq_2 = FASTQ_OUTPUT_DIR / f"{run_id}_2.fastq"
+
+    FASTQ_OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+
+    materialized = []
+    start_time = time.time()
+
+    if STREAM_TO_NAS:
+        try:
+            job["streamed"] = await asyncio.to_thread(stream_dump, run_id, sra_file, threads)
+        except StreamingUnavailable as e:
+            print(f"    ⚠️  串流模式無法使用，改用檔案模式: {e}")
+            materialized = e.files
+        else:
+            remove_sra_dir(sra_file)
+            get_disk_admission().record_actual(run_id, fastq_bytes=sum(size for _, size in job["streamed"]))
+            get_disk_admission().release(run_id)
+            job["fastq_files"] = []
+            return job
+
+    if not materialized:
+        # 每個樣本使用自己的暫存目錄，停滯偵測才不會把其他樣本的寫入當成進度
+        dump_tmp = TMP_DIR / f"{run_id}_dump"
+        dump_tmp.mkdir(parents=True, exist_ok=True)
+        cmd = build_fasterq_cmd(sra_file, FASTQ_OUTPUT_DIR, dump_tmp, threads)
 
         start_time = time.time()
-        result = subprocess.run(
-            cmd, capture_output=True, text=True, timeout=FASTERQ_TIMEOUT
-        )
-        elapsed = time.time() - start_time
+        for attempt in range(1, DUMP_STALL_RETRIES + 2):
+            try:
+                result = await run_monitored_async(
+                    get_stall_watchdog(), cmd, "dump", run_id, DUMP_STALL_SECONDS,
+                    progress_fn=lambda: path_progress(dump_tmp, *FASTQ_OUTPUT_DIR.glob(f"{run_id}*.fastq")),
+                    timeout=FASTERQ_TIMEOUT,
+                    on_start=track_cpu(run_id),
+                )
+                break
+            except StallDetected as e:
+                # 停滯不代表 SRA 損壞，保留 SRA 重新解壓（-f 會覆蓋已產生的部分輸出）
+                shutil.rmtree(dump_tmp, ignore_errors=True)
+                dump_tmp.mkdir(parents=True, exist_ok=True)
+                if attempt > DUMP_STALL_RETRIES:
+                    raise
+                print(f"    ⚠️ {e}，重新解壓 ({attempt}/{DUMP_STALL_RETRIES})...", flush=True)
+        shutil.rmtree(dump_tmp, ignore_errors=True)
 
         if result.returncode != 0:
             # 如果解壓失敗，很有可能是SRA檔案損壞，刪除它以便重試
@@ -695,148 +1266,553 @@ def download_sample(run_id, progress_mgr):
                 shutil.rmtree(sra_file.parent)
                 print(f"    ⚠️  偵測到解壓失敗，已刪除損壞的SRA目錄: {sra_file.parent}")
             raise Exception(f"Fasterq-dump失敗: {result.stderr}")
+    elapsed = time.time() - start_time
 
-        # 增加對單端(Single-End)和雙端(Paired-End)的檢查
-        is_paired = fastq_1.exists() and fastq_2.exists()
-        
-        # 檢查是否至少有一個 FASTQ 檔案存在
-        # Note: This logic is simplified. A more robust check might be needed if single-end files don't follow {run_id}.fastq pattern
-        if not is_paired and not next(FASTQ_OUTPUT_DIR.glob(f"{run_id}*.fastq"), None):
-            # 如果SRA檔案存在，則刪除它，因為它可能已損壞
+    # 增加對單端(Single-End)和雙端(Paired-End)的檢查
+    is_paired = fastq_1.exists() and fastq_2.exists()
+    
+    # 檢查是否至少有一個 FASTQ 檔案存在
+    # Note: This logic is simplified. A more robust check might be needed if single-end files don't follow {run_id}.fastq pattern
+    if not is_paired and not next(FASTQ_OUTPUT_DIR.glob(f"{run_id}*.fastq"), None):
+        # 如果SRA檔案存在，則刪除它，因為它可能已損壞
+        if sra_file.parent.exists():
+            shutil.rmtree(sra_file.parent)
+            print(f"    ⚠️  解壓後未生成任何FASTQ檔案，已刪除可能損壞的SRA目錄: {sra_file.parent}")
+        raise Exception(f"FASTQ檔案不完整或未生成")
+
+    fastq_files_to_upload = []
+    if is_paired:
+        fastq_files_to_upload.extend([fastq_1, fastq_2])
+        total_size = (fastq_1.stat().st_size + fastq_2.stat().st_size) / (1024**3)
+        print(f"✅ 解壓完成 (雙端, {elapsed:.1f}秒, {total_size:.2f} GB)")
+    else:
+        # 處理單端情況或檔名不為 _1/_2 的情況
+        single_fastq = next(FASTQ_OUTPUT_DIR.glob(f"{run_id}*.fastq"), None)
+        if single_fastq and single_fastq.exists():
+            fastq_files_to_upload.append(single_fastq)
+            total_size = single_fastq.stat().st_size / (1024**3)
+            print(f"✅ 解壓完成 (單端, {elapsed:.1f}秒, {total_size:.2f} GB)")
+        else:
+            # This case should be caught by the check above, but as a fallback
             if sra_file.parent.exists():
                 shutil.rmtree(sra_file.parent)
-                print(f"    ⚠️  解壓後未生成任何FASTQ檔案，已刪除可能損壞的SRA目錄: {sra_file.parent}")
-            raise Exception(f"FASTQ檔案不完整或未生成")
-
-        fastq_files_to_upload = []
-        if is_paired:
-            fastq_files_to_upload.extend([fastq_1, fastq_2])
-            total_size = (fastq_1.stat().st_size + fastq_2.stat().st_size) / (1024**3)
-            print(f"✅ 解壓完成 (雙端, {elapsed:.1f}秒, {total_size:.2f} GB)")
-        else:
-            # 處理單端情況或檔名不為 _1/_2 的情況
-            single_fastq = next(FASTQ_OUTPUT_DIR.glob(f"{run_id}*.fastq"), None)
-            if single_fastq and single_fastq.exists():
-                fastq_files_to_upload.append(single_fastq)
-                total_size = single_fastq.stat().st_size / (1024**3)
-                print(f"✅ 解壓完成 (單端, {elapsed:.1f}秒, {total_size:.2f} GB)")
-            else:
-                # This case should be caught by the check above, but as a fallback
-                if sra_file.parent.exists():
-                    shutil.rmtree(sra_file.parent)
-                raise Exception("找不到解壓後的FASTQ檔案，已清理SRA檔案以便重試")
+            raise Exception("找不到解壓後的FASTQ檔案，已清理SRA檔案以便重試")
 
-        # ==================== 步驟2.5: 立即刪除SRA檔案釋放空間 ====================
-        print(f"\n[2.5/5] 🗑️  刪除SRA檔案釋放空間...", flush=True)
-        if sra_file.parent.exists():
-            sra_size_gb = sra_file.stat().st_size / (1024**3) if sra_file.exists() else 0
-            shutil.rmtree(sra_file.parent)
-            print(f"    ✅ 已刪除SRA檔案 (釋放 {sra_size_gb:.2f} GB): {sra_file.parent}")
+    remove_sra_dir(sra_file)
+
+    # SRA 已刪除、解壓暫存已清空，只保留 FASTQ 的預約直到上傳完成
+    admission = get_disk_admission()
+    admission.record_actual(run_id, fastq_bytes=sum(f.stat().st_size for f in fastq_files_to_upload))
+    admission.release(run_id, ["sra", "temp"])
 
-        # ==================== 步驟3: 上傳FASTQ到NAS ====================
-        print(f"\n[3/5] 📤 上傳FASTQ到NAS...", flush=True)
+    job["fastq_files"] = fastq_files_to_upload
+    return job
 
+
+def upload_with_resume(local_file, remote_path, retries=None):
+    """
+    上傳單一檔案，失敗時在上傳階段內重試（每次從 NAS 上的 .partial 續傳），
+    而不是讓整個樣本失敗後重新下載、解壓
+    """
+    retries = retries or UPLOAD_RETRIES
+    delay = UPLOAD_RETRY_DELAY
+    run_id = local_file.name.split("_")[0].split(".")[0]
+    for attempt in range(1, retries + 1):
+        try:
+            with get_nas_pool().connection() as nas_uploader:
+                # 停滯時關閉 SSH 連線讓卡住的寫入立即失敗，再以 StallDetected 讓連接池丟棄這個連接
+                with get_stall_watchdog().watch(
+                    "upload", run_id, UPLOAD_STALL_SECONDS,
+                    on_stall=nas_uploader.transport.close, detail=local_file.name,
+                ) as watch:
+                    try:
+                        uploaded = nas_uploader.upload_file(
+                            local_file, remote_path, show_progress=True,
+                            channels=UPLOAD_CHANNELS,
+                            chunk_size=UPLOAD_CHUNK_MB * 1024 * 1024,
+                            parallel_min_size=UPLOAD_PARALLEL_MIN_MB * 1024 * 1024,
+                            progress_callback=watch.progress,
+                        )
+                    finally:
+                        # 停滯時關閉連線造成的 SFTP 錯誤以 StallDetected 回報
+                        watch.check()
+                if uploaded:
+                    return
+        except NASConnectionError as e:
+            print(f"    ⚠️  {e}")
+        except StallDetected as e:
+            print(f"    ⚠️  {e}，換一個連接續傳")
+        except (OSError, EOFError, paramiko.SSHException) as e:
+            # SFTP 連線中途斷開（upload_file 拋出，連接池丟棄這個連接），下一次借出新的連接續傳
+            print(f"    ⚠️  SFTP 連線錯誤: {e}，換一個連接續傳")
+
+        if attempt < retries:
+            print(f"    🔄 {local_file.name} 上傳中斷，{delay}秒後續傳 ({attempt}/{retries})...", flush=True)
+            time.sleep(delay)
+            delay = min(delay * 2, 600)
+
+    raise Exception(f"FASTQ上傳失敗: {local_file.name} (已嘗試 {retries} 次)")
+
+
+def stage_upload(job):
+    """階段3: 上傳 FASTQ 到 NAS 並清理本地檔案（從連接池借用 NAS 連接）"""
+    run_id = job["run_id"]
+    sra_file = SRA_TEMP_DIR / run_id / f"{run_id}.sra"
+    fastq_files_to_upload = job["fastq_files"]
+    check_lease(run_id)
+
+    print(f"\n[3/5] 📤 {run_id} 上傳FASTQ到NAS...", flush=True)
+
+    if job.get("streamed"):
+        print(f"    ⏭️  已在解壓階段串流上傳: {', '.join(name for name, _ in job['streamed'])}")
+    elif not fastq_files_to_upload:
+        print(f"    ⏭️  所有 FASTQ 上次已上傳 (checkpoint)")
+    elif _upload_spool is not None:
+        # 移入暫存區由背景上傳，NAS 斷線時不影響下載與解壓；完成後由暫存區標記樣本完成
+        # （等待暫存區空間時租約可能被接手，移入前再檢查一次）
+        check_lease(run_id)
+        _upload_spool.add(run_id, fastq_files_to_upload)
+        job["spooled"] = True
+        # 暫存區自己記錄待上傳的檔案並在重新啟動時續傳，checkpoint 中的路徑已失效
+        get_run_state_store().clear_checkpoints(run_id)
+        return job
+    else:
+        uploaded = job.setdefault("uploaded", set())
         for fastq_file in fastq_files_to_upload:
-            remote_path = f"{NAS_CONFIG['fastq_path']}/{fastq_file.name}"
-            if not nas_uploader.upload_file(fastq_file, remote_path, show_progress=True):
-                raise Exception(f"FASTQ上傳失敗: {fastq_file.name}")
-
-        # ==================== 步驟4: 上傳SRA到NAS（已停用） ====================
-        # 註解：由於 SRA 檔案上傳經常失敗且不是必需的（FASTQ 已足夠），因此停用此步驟
-        # print(f"\n[4/5] 📤 上傳SRA到NAS...")
-        # sra_remote_dir = f"{NAS_CONFIG['sra_path']}/{run_id}"
-        # sra_remote_path = f"{sra_remote_dir}/{sra_file.name}"
-        # nas_uploader.create_remote_dir(sra_remote_dir)
-        # if not nas_uploader.upload_file(sra_file, sra_remote_path, show_progress=True):
-        #     raise Exception("SRA上傳失敗")
-        
-        print(f"\n[4/5] ⏭️  跳過SRA上傳（FASTQ已足夠）", flush=True)
+            if fastq_file.name in uploaded:
+                print(f"    ⏭️  {fastq_file.name} 上次已上傳 (checkpoint)")
+                continue
+            check_lease(run_id)
+            upload_with_resume(fastq_file, f"{NAS_CONFIG['fastq_path']}/{fastq_file.name}")
+            uploaded.add(fastq_file.name)
+            save_checkpoint(run_id, "upload", uploaded=sorted(uploaded))
+
+    # ==================== 步驟4: 上傳SRA到NAS（已停用） ====================
+    # 註解：由於 SRA 檔案上傳經常失敗且不是必需的（FASTQ 已足夠），因此停用此步驟
+    # print(f"\n[4/5] 📤 上傳SRA到NAS...")
+    # sra_remote_dir = f"{NAS_CONFIG['sra_path']}/{run_id}"
+    # sra_remote_path = f"{sra_remote_dir}/{sra_file.name}"
+    # nas_uploader.create_remote_dir(sra_remote_dir)
+    # if not nas_uploader.upload_file(sra_file, sra_remote_path, show_progress=True):
+    #     raise Exception("SRA上傳失敗")
+    
+    print(f"\n[4/5] ⏭️  跳過SRA上傳（FASTQ已足夠）", flush=True)
+
+    # ==================== 步驟5: 清理本地檔案 ====================
+    print(f"\n[5/5] 🧹 {run_id} 清理本地檔案...", flush=True)
+
+    # 刪除FASTQ
+    for f in fastq_files_to_upload:
+        if f.exists():
+            f.unlink()
+            print(f"    ✅ 已刪除: {f.name}")
+
+    # SRA 已在步驟 2.5 刪除，這裡不需要再刪除
+    # 但保留檢查以防萬一
+    if sra_file.parent.exists():
+        shutil.rmtree(sra_file.parent)
+        print(f"    ⚠️  發現殘留的SRA目錄，已刪除: {sra_file.parent}")
+
+    get_disk_admission().release(run_id)
 
-        # ==================== 步驟5: 清理本地檔案 ====================
-        print(f"\n[5/5] 🧹 清理本地檔案...", flush=True)
+    return job
 
-        # 刪除FASTQ
-        for f in fastq_files_to_upload:
-            if f.exists():
+
+def cleanup_failed_run(run_id, keep_partial=False):
+    """
+    清理失敗樣本留下的部分 FASTQ 和 SRA 目錄
+    checkpoint 記錄的檔案（已校驗的 SRA / fastq.gz、解壓完成的 FASTQ）保留到樣本完成，下次從該階段繼續
+
+    Args:
+        run_id: 樣本 ID
+        keep_partial: 保留 SRA 目錄（下載階段失敗時，下次重試從部分下載續傳）
+    """
+    try:
+        sra_file_parent = SRA_TEMP_DIR / run_id
+        checkpoints = load_checkpoints(run_id)
+        kept_fastq = {Path(path).name for path, _ in checkpoints.get("dump", {}).get("fastq_files", [])}
+
+        # Clean up any partial fastq files
+        for f in list(FASTQ_OUTPUT_DIR.glob(f"{run_id}*.fastq")):
+            if f.exists() and f.name not in kept_fastq:
                 f.unlink()
-                print(f"    ✅ 已刪除: {f.name}")
+        if kept_fastq:
+            print(f"    ↩️  保留 {run_id} 已解壓的 FASTQ，下次重試時直接上傳")
+
+        # Clean up SRA directory
+        if keep_partial:
+            print(f"    ↩️  保留 {run_id} 的部分下載，下次重試時續傳")
+        elif "validate" in checkpoints and not kept_fastq:
+            print(f"    ↩️  保留 {run_id} 已校驗的下載檔案，下次重試時直接解壓")
+        elif sra_file_parent.exists():
+            shutil.rmtree(sra_file_parent)
+
+        # Clean up streaming FIFO directory and fasterq-dump temp directory
+        for temp_dir in (TMP_DIR / f"{run_id}_stream", TMP_DIR / f"{run_id}_dump"):
+            if temp_dir.exists():
+                shutil.rmtree(temp_dir)
+    except Exception as cleanup_error:
+        print(f"    ⚠️ 清理失敗檔案時發生錯誤: {cleanup_error}")
+
+    get_disk_admission().release(run_id)
+
+
+# 管線階段名稱對應到進度檔案中的 step 名稱
+STAGE_STEPS = {
+    "download": "prefetch",
+    "validate": "validate",
+    "dump": "dumping",
+    "upload": "upload",
+}
 
-        # SRA 已在步驟 2.5 刪除，這裡不需要再刪除
-        # 但保留檢查以防萬一
-        if sra_file.parent.exists():
-            shutil.rmtree(sra_file.parent)
-            print(f"    ⚠️  發現殘留的SRA目錄，已刪除: {sra_file.parent}")
+
+def classify_failure_step(error, stage=None):
+    """
+    判斷失敗發生在哪個步驟
+
+    Args:
+        error: 例外物件或錯誤訊息
+        stage: 管線階段名稱（若已知，優先使用）
+    """
+    failure = classify_error(error, stage)
+
+    # 區分不同類型的失敗
+    if failure == "not_found":
+        return "sample_not_found"  # 樣本在數據庫中不存在
+    if stage in STAGE_STEPS:
+        return STAGE_STEPS[stage]
+    if failure == "nas":
+        return "nas_connect"
+
+    # 依工具名稱判斷（錯誤訊息中的 FASTQ 檔名不代表失敗在解壓）
+    error_str = str(error).lower()
+    if "fasterq-dump" in error_str:
+        return "dumping"
+    if "prefetch" in error_str:
+        return "prefetch"
+    if "upload" in error_str or "上傳" in error_str:
+        return "upload"
+    return "unknown_process"
+
+
+def handle_failure(run_id, stage, error, progress_mgr):
+    """
+    記錄失敗、清理檔案，並依錯誤類型決定是否在本次執行中重試
+
+    Args:
+        run_id: 樣本 ID
+        stage: 失敗的階段名稱（download / validate / dump / upload）
+        error: 例外物件
+        progress_mgr: ProgressManager
+
+    Returns:
+        float: 重試前的等待秒數；不重試時回傳 None（租約已釋放）
+    """
+    failure = classify_error(error, stage)
+    progress_mgr.mark_failed(run_id, classify_failure_step(error, stage), str(error))
+
+    if failure == "corrupt":
+        # 損毀的下載不能續傳或沿用，連同 checkpoint 一起捨棄後重新下載
+        get_run_state_store().clear_checkpoints(run_id)
+    # 清理失敗的檔案（下載階段的部分檔案保留，重試時續傳；損毀或樣本不存在時不保留）
+    cleanup_failed_run(run_id, keep_partial=(stage == "download" and failure not in ("corrupt", "not_found")))
+
+    policy = get_retry_policy()
+    delay = policy.decide(run_id, failure) if RETRY_FAILED else None
+    label = FAILURE_LABELS[failure]
+    if delay is not None:
+        # 等待重試期間保留租約，其他節點不會接手
+        print(f"   🔁 {label}，{delay:.0f}秒後重試 (本次執行第 {policy.retries(run_id)} 次)")
+        return delay
+
+    if failure == "not_found":
+        print(f"   ⛔ {label}，不重試")
+    elif RETRY_FAILED:
+        print(f"   ⛔ {label}，本次執行的重試次數已用完")
+    release_lease(run_id)
+    return None
+
+
+def retry_job(job):
+    """重試時從第一個階段重新提交（stage_download 依 checkpoint 決定從哪個階段繼續）"""
+    return {key: job.get(key) for key in ("run_id", "size_hint", "sra_hint", "sra_md5")}
+
+
+def download_sample(run_id, progress_mgr, size_hint=None, sra_hint=None, sra_md5=None, schedule_retry=None):
+    """
+    下載、解壓、上傳單個樣本（在同一個線程中依序執行所有階段）
+
+    Args:
+        schedule_retry: schedule_retry(job, delay) 排定重試（RetryScheduler.schedule）；
+            None 表示失敗時不在本次執行中重試
+
+    Returns:
+        True 成功、False 失敗；其他節點處理中或已排定重試時回傳 None
+    """
+    print(f"\n{'='*70}")
+    print(f"🔄 處理樣本: {run_id}")
+    print(f"{'='*70}")
+
+    if WORK_QUEUE and not get_work_queue().claim(run_id):
+        print(f"\n🤝 {run_id} 由其他節點處理中，跳過")
+        return None
+
+    job = {"run_id": run_id, "size_hint": size_hint, "sra_hint": sra_hint, "sra_md5": sra_md5}
+    stage = None
+
+    try:
+        for stage in (stage_download, stage_validate, stage_dump, stage_upload):
+            job = stage(job)
+
+        if job.get("spooled"):
+            print(f"\n📦 樣本已排入上傳暫存區: {run_id}")
+            return True
+
+        # 不標記其他節點接手的樣本
+        check_lease(run_id)
 
         # 標記為完成
         progress_mgr.mark_completed(run_id)
+        release_lease(run_id)
 
         print(f"\n✅ 樣本完成: {run_id}")
         return True
 
+    except LeaseLost:
+        abandon_run(run_id)
+        return None
+
     except Exception as e:
         print(f"\n❌ 樣本失敗: {run_id}")
         print(f"   錯誤: {e}")
 
-        # 清理失敗的檔案
-        try:
-            # Re-define paths for cleanup in case of early failure
-            fastq_1 = FASTQ_OUTPUT_DIR / f"{run_id}_1.fastq"
-            fastq_2 = FASTQ_OUTPUT_DIR / f"{run_id}_2.fastq"
-            sra_file_parent = SRA_TEMP_DIR / run_id
-
-            # Clean up any partial fastq files
-            for f in list(FASTQ_OUTPUT_DIR.glob(f"{run_id}*.fastq")):
-                if f.exists():
-                    f.unlink()
-            
-            # Clean up SRA directory
-            if sra_file_parent.exists():
-                shutil.rmtree(sra_file_parent)
-        except Exception as cleanup_error:
-            print(f"    ⚠️ 清理失敗檔案時發生錯誤: {cleanup_error}")
-
-        # 標記為失敗
-        # Extract step from error message if possible
-        error_str = str(e).lower()
-        
-        # 區分不同類型的失敗
-        if "樣本不存在" in error_str or "item not found" in error_str:
-            step = "sample_not_found"  # 樣本在數據庫中不存在
-        else:
-            step = "unknown_process"
-        if "prefetch" in error_str:
-            step = "prefetch"
-        elif "fasterq-dump" in error_str or "fastq" in error_str:
-            step = "dumping"
-        elif "upload" in error_str:
-            step = "upload"
-        elif "nas" in error_str:
-            step = "nas_connect"
-        
-        progress_mgr.mark_failed(run_id, step, str(e))
-
-        return False
-    
-    finally:
-        # 無論成功或失敗，都確保斷開NAS連接
-        if nas_uploader and nas_uploader.sftp:
-            nas_uploader.disconnect()
-            print(f"    🔌 樣本 {run_id} 的獨立NAS連接已關閉")
+        stage_name = stage.__name__[len("stage_"):] if stage is not None else None
+        delay = handle_failure(run_id, stage_name, e, progress_mgr)
+        if delay is None:
+            return False
+        if schedule_retry is None:
+            release_lease(run_id)
+            return False
+        # 等待期間不佔用工作線程，到期後重新提交到線程池
+        schedule_retry(retry_job(job), delay)
+        return None
 
 
 # ==================== 主程序 ====================
 
 
+def run_thread_pool(missing_samples, progress_mgr, size_hints):
+    """
+    舊模式: 每個樣本在一個線程中依序完成所有步驟
+    WORK_QUEUE 時在線程開始處理樣本時才取得租約，其他節點處理中的樣本直接跳過（不會等待接手）
+    失敗後要重試的樣本由 RetryScheduler 在到期後重新提交到線程池
+    """
+    success_count = 0
+    fail_count = 0
+    futures = {}  # future -> run_id
+    retrying = set()  # 已排定重試、結果不計入進度條的樣本
+    lock = threading.Lock()
+
+    # 使用 tqdm 進度條
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+
+        def schedule_retry(job, delay):
+            with lock:
+                retrying.add(job["run_id"])
+            retries.schedule(job, delay)
+
+        def submit(job):
+            # 將 progress_mgr 傳遞給每個任務，不再傳遞共享的 nas_uploader
+            future = executor.submit(
+                download_sample, job["run_id"], progress_mgr,
+                job.get("size_hint"), job.get("sra_hint"), job.get("sra_md5"),
+                schedule_retry if RETRY_FAILED else None,
+            )
+            with lock:
+                futures[future] = job["run_id"]
+
+        retries = RetryScheduler(submit)
+        for run_id in missing_samples:
+            hints = size_hints.get(run_id, {})
+            submit({
+                "run_id": run_id,
+                "size_hint": hints.get("fastq_bytes"),
+                "sra_hint": hints.get("sra_size"),
+                "sra_md5": hints.get("sra_md5"),
+            })
+
+        # 創建進度條
+        with tqdm(total=len(missing_samples), desc="總體進度", unit="樣本", 
+                  ncols=100, bar_format='{l_bar}{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}]') as pbar:
+
+            while True:
+                with lock:
+                    running = set(futures)
+                if not running:
+                    if not retries.pending():
+                        break
+                    # 只剩等待重試的樣本
+                    retries.wait_idle()
+                    continue
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    with lock:
+                        run_id = futures.pop(future)
+                    try:
+                        result = future.result()
+                        if result is None:
+                            with lock:
+                                if run_id in retrying:
+                                    # 已排定重試，完成時才更新進度條
+                                    retrying.discard(run_id)
+                                    continue
+                            # 其他節點處理中
+                        elif result:
+                            success_count += 1
+                            pbar.set_postfix({"成功": success_count, "失敗": fail_count})
+                        else:
+                            fail_count += 1
+                            pbar.set_postfix({"成功": success_count, "失敗": fail_count})
+                    except Exception as e:
+                        print(f"\n❌ 執行錯誤 {run_id}: {e}")
+                        fail_count += 1
+                        pbar.set_postfix({"成功": success_count, "失敗": fail_count})
+
+                    # 更新進度條
+                    pbar.update(1)
+
+        retries.shutdown()
+
+    return success_count, fail_count
+
+
+def run_pipeline(missing_samples, progress_mgr, size_hints):
+    """分階段管線模式: 下載、校驗、解壓、上傳各自使用獨立的工作線程（ASYNC_PIPELINE 時校驗與解壓改以 asyncio 執行）"""
+    counts = {"success": 0, "fail": 0}
+    lock = threading.Lock()
+
+    with tqdm(total=len(missing_samples), desc="總體進度", unit="樣本",
+              ncols=100, bar_format='{l_bar}{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}]') as pbar:
+
+        def on_done(job):
+            run_id = job["run_id"]
+            if job.get("spooled"):
+                # 上傳完成後由暫存區標記完成
+                print(f"\n📦 樣本已排入上傳暫存區: {run_id}")
+            elif lease_lost(run_id):
+                # 不標記其他節點接手的樣本
+                abandon_run(run_id)
+                with lock:
+                    pbar.update(1)
+                return
+            else:
+                progress_mgr.mark_completed(run_id)
+                release_lease(run_id)
+                print(f"\n✅ 樣本完成: {run_id}")
+            with lock:
+                counts["success"] += 1
+                pbar.set_postfix({"成功": counts["success"], "失敗": counts["fail"]})
+                pbar.update(1)
+
+        def on_error(job, stage_name, error):
+            run_id = job["run_id"]
+            if isinstance(error, LeaseLost):
+                abandon_run(run_id)
+                with lock:
+                    pbar.update(1)
+                return
+            print(f"\n❌ 樣本失敗: {run_id} (階段: {stage_name})")
+            print(f"   錯誤: {error}")
+            delay = handle_failure(run_id, stage_name, error, progress_mgr)
+            if delay is not None:
+                # 在 job 離開管線前排入，join() 之後的等待迴圈不會漏掉
+                retries.schedule(retry_job(job), delay)
+                return
+            with lock:
+                counts["fail"] += 1
+                pbar.set_postfix({"成功": counts["success"], "失敗": counts["fail"]})
+                pbar.update(1)
+
+        if ASYNC_PIPELINE:
+            # 校驗與解壓是 coroutine，直接在事件迴圈中執行；下載與上傳在有界線程池中執行
+            pipeline = AsyncStagePipeline(
+                [
+                    Stage("download", stage_download, DOWNLOAD_WORKERS),
+                    Stage("validate", stage_validate_async, VALIDATE_WORKERS),
+                    Stage("dump", stage_dump_async, DUMP_WORKERS),
+                    Stage("upload", stage_upload, UPLOAD_WORKERS),
+                ],
+                max_in_flight=ASYNC_MAX_RUNS,
+                on_done=on_done,
+                on_error=on_error,
+            )
+        else:
+            pipeline = StagePipeline(
+                [
+                    Stage("download", stage_download, DOWNLOAD_WORKERS),
+                    Stage("validate", stage_validate, VALIDATE_WORKERS),
+                    Stage("dump", stage_dump, DUMP_WORKERS),
+                    Stage("upload", stage_upload, UPLOAD_WORKERS),
+                ],
+                queue_size=STAGE_QUEUE_SIZE,
+                on_done=on_done,
+                on_error=on_error,
+            )
+        pipeline.start()
+        retries = RetryScheduler(pipeline.submit)
+
+        # 多節點時逐一取得租約後才提交（提交因背壓阻塞時不會預先佔住其他節點可以處理的樣本）
+        for run_id in claimed_runs(missing_samples):
+            hints = size_hints.get(run_id, {})
+            pipeline.submit({
+                "run_id": run_id,
+                "size_hint": hints.get("fastq_bytes"),
+                "sra_hint": hints.get("sra_size"),
+                "sra_md5": hints.get("sra_md5"),
+            })
+
+        pipeline.join()
+        # 等待重試的樣本到期後重新提交，直到沒有樣本在管線中或等待重試
+        while retries.pending():
+            retries.wait_idle()
+            pipeline.join()
+        retries.shutdown()
+        pipeline.shutdown()
+
+    return counts["success"], counts["fail"]
+
+
 def main():
     print("=" * 80)
     print("🚀 自動化下載、解壓、上傳系統")
     print("=" * 80)
     print(f"\n系統配置:")
     print(f"  CPU優化: I7-11代 (8核16線程)")
-    print(f"  並行數: {MAX_WORKERS} 個樣本同時處理")
-    print(f"  每個樣本解壓線程: {FASTERQ_THREADS}")
-    print(f"  總解壓線程數: {MAX_WORKERS * FASTERQ_THREADS}")
+    if USE_PIPELINE:
+        print(f"  模式: 分階段管線")
+        print(f"  下載線程: {DOWNLOAD_WORKERS} / 校驗線程: {VALIDATE_WORKERS}")
+        if CPU_SCHEDULER:
+            print(f"  解壓線程: {DUMP_WORKERS} 個樣本共用 {CPU_TOTAL_THREADS} 線程 "
+                  f"(每個 {FASTERQ_MIN_THREADS}-{FASTERQ_MAX_THREADS}，依 CPU 使用率與 SRA 大小分配)")
+        else:
+            print(f"  解壓線程: {DUMP_WORKERS} × {FASTERQ_THREADS} = {DUMP_WORKERS * FASTERQ_THREADS}")
+        print(f"  上傳線程: {UPLOAD_WORKERS}")
+        if ASYNC_PIPELINE:
+            print(f"  asyncio 管線: 最多 {ASYNC_MAX_RUNS} 個樣本同時在管線中")
+        else:
+            print(f"  階段佇列容量: {STAGE_QUEUE_SIZE}")
+    else:
+        print(f"  並行數: {MAX_WORKERS} 個樣本同時處理")
+        if CPU_SCHEDULER:
+            print(f"  解壓線程: 共用 {CPU_TOTAL_THREADS} 線程 (每個樣本 {FASTERQ_MIN_THREADS}-{FASTERQ_MAX_THREADS})")
+        else:
+            print(f"  每個樣本解壓線程: {FASTERQ_THREADS}")
+            print(f"  總解壓線程數: {MAX_WORKERS * FASTERQ_THREADS}")
     print(f"  系統預留: 2線程")
+    if RETRY_FAILED:
+        print(f"  失敗重試: 每個樣本最多 {MAX_RETRIES} 次 (依錯誤類型，退避 {RETRY_BACKOFF_SECONDS:.0f}-"
+              f"{RETRY_MAX_BACKOFF_SECONDS:.0f} 秒)")
 
     # 創建必要目錄（更安全的方式）
     try:
@@ -869,9 +1845,26 @@ def main():
     # 初始化進度管理
     progress_mgr = ProgressManager()
 
+    # 先續傳上次留在暫存區的樣本，再排程新的下載
+    pending_uploads = []
+    if USE_UPLOAD_SPOOL:
+        spool = start_upload_spool(progress_mgr)
+        # 已下載好的樣本續傳完成前保留租約，避免其他節點重新下載
+        pending_uploads = resume_spooled_runs(spool)
+        if pending_uploads:
+            print(f"\n📦 續傳上次未完成的上傳: {len(spool.pending_ids())} 個樣本 "
+                  f"({spool.spooled_bytes() / GB:.1f} GB)")
+
     # 獲取缺少的樣本
     print(f"\n🔍 正在檢查缺少的樣本...")
-    missing_samples = get_missing_samples()
+    missing_samples = get_missing_samples(pending_uploads)
+
+    # 回收太久沒有更新的部分下載（正在等待處理的樣本保留，稍後續傳）
+    removed, freed = gc_stale_partials(
+        SRA_TEMP_DIR, PARTIAL_MAX_AGE_HOURS, active=set(missing_samples) | set(pending_uploads)
+    )
+    if removed:
+        print(f"🗑️  回收 {removed} 個過期的部分下載，釋放 {freed / GB:.1f} GB")
 
     print(f"\n📊 統計:")
     print(f"  需要下載: {len(missing_samples)} 個樣本")
@@ -880,6 +1873,11 @@ def main():
     print(f"    SRA: {NAS_CONFIG['sra_path']}")
 
     if not missing_samples:
+        if _upload_spool is not None and _upload_spool.pending_ids():
+            _upload_spool.wait_idle()
+            _upload_spool.shutdown()
+        if WORK_QUEUE:
+            get_work_queue().shutdown()
         print("\n✅ 所有樣本都已在NAS上！")
         # nas_uploader.disconnect() # No longer needed here
         return
@@ -898,39 +1896,31 @@ def main():
 
     # 開始處理
     start_time = time.time()
-    success_count = 0
-    fail_count = 0
 
     print(f"\n🚀 開始處理...")
 
-    # 使用 tqdm 進度條
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        # 將 progress_mgr 傳遞給每個任務，不再傳遞共享的 nas_uploader
-        futures = {
-            executor.submit(download_sample, run_id, progress_mgr): run_id
-            for run_id in missing_samples
-        }
+    # 預期 FASTQ / SRA 大小（用於磁碟預約估算，來自 metadata 快取）
+    # ENA 直接下載需要的 fastq.gz 位置與 MD5、校驗用的 SRA MD5 也一併批次查詢，各階段只讀快取
+    hint_fields = ["fastq_bytes", "sra_size", "sra_md5"] + (["fastq_ftp", "fastq_md5"] if ENA_FASTQ else [])
+    size_hints = get_metadata_cache().ensure(missing_samples, hint_fields)
 
-        # 創建進度條
-        with tqdm(total=len(missing_samples), desc="總體進度", unit="樣本", 
-                  ncols=100, bar_format='{l_bar}{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}]') as pbar:
-            
-            for future in as_completed(futures):
-                run_id = futures[future]
-                try:
-                    if future.result():
-                        success_count += 1
-                        pbar.set_postfix({"成功": success_count, "失敗": fail_count})
-                    else:
-                        fail_count += 1
-                        pbar.set_postfix({"成功": success_count, "失敗": fail_count})
-                except Exception as e:
-                    print(f"\n❌ 執行錯誤 {run_id}: {e}")
-                    fail_count += 1
-                    pbar.set_postfix({"成功": success_count, "失敗": fail_count})
-                
-                # 更新進度條
-                pbar.update(1)
+    if USE_PIPELINE:
+        success_count, fail_count = run_pipeline(missing_samples, progress_mgr, size_hints)
+    else:
+        success_count, fail_count = run_thread_pool(missing_samples, progress_mgr, size_hints)
+
+    # 等待暫存區中的 FASTQ 全部上傳（中斷也沒關係，下次啟動會續傳）
+    if _upload_spool is not None:
+        _upload_spool.wait_idle()
+        _upload_spool.shutdown()
+        print(f"\n📦 暫存區上傳完成: {_upload_spool.uploaded_count} 個樣本"
+              + (f"，{_upload_spool.failed_count} 個失敗" if _upload_spool.failed_count else ""))
+
+    # 釋放剩下的租約，關閉連接池中閒置的 NAS 連接與 aria2 常駐程序（未完成的下載保存在 session 檔）
+    if WORK_QUEUE:
+        get_work_queue().shutdown()
+    get_nas_pool().close_all()
+    shutdown_aria2_daemon()
 
     # 完成
     elapsed = time.time() - start_time
@@ -941,6 +1931,7 @@ def main():
     print(f"總耗時: {elapsed/3600:.2f} 小時")
     print(f"成功: {success_count} 個")
     print(f"失敗: {fail_count} 個")
+    print_validation_summary(get_validation_stats())
 
     # 顯示不存在的樣本列表
     if fail_count > 0:
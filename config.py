@@ -6,6 +6,7 @@
 """
 
 import os
+import socket
 from pathlib import Path
 
 # ============================================
@@ -23,10 +24,39 @@ NAS_PORT = int(os.environ.get("NAS_PORT", 22))
 NAS_USER = os.environ.get("NAS_USER", "bioailab")
 NAS_PASS = "Ncueailab403"
 
+# SFTP 連接池: 最多同時保持的連接數、建立連接的重試次數、閒置多久後關閉 (秒)
+NAS_POOL_SIZE = int(os.environ.get("NAS_POOL_SIZE", 4))
+NAS_CONNECT_RETRIES = int(os.environ.get("NAS_CONNECT_RETRIES", 5))
+NAS_IDLE_TIMEOUT = float(os.environ.get("NAS_IDLE_TIMEOUT", 300))
+
+# 多通道上傳: 大檔案切塊後透過多個 SFTP 通道並行寫入（benchmark_upload.py 可測試最佳通道數）
+UPLOAD_CHANNELS = int(os.environ.get("UPLOAD_CHANNELS", 4))
+UPLOAD_CHUNK_MB = int(os.environ.get("UPLOAD_CHUNK_MB", 64))
+# 小於此大小的檔案仍使用單一通道 (MB)
+UPLOAD_PARALLEL_MIN_MB = int(os.environ.get("UPLOAD_PARALLEL_MIN_MB", 256))
+
+# 上傳中斷時在上傳階段內重試的次數與第一次等待秒數（之後每次加倍），每次都從 NAS 上的 .partial 續傳
+UPLOAD_RETRIES = int(os.environ.get("UPLOAD_RETRIES", 5))
+UPLOAD_RETRY_DELAY = int(os.environ.get("UPLOAD_RETRY_DELAY", 30))
+
 # NAS 遠端路徑 (相對路徑)
 NAS_FASTQ_PATH = "Bee_metagenomics/Bee_metagenomics/fastq_data"
 NAS_SRA_PATH = "Bee_metagenomics/Bee_metagenomics/sra_files"
 
+# NAS 檔案清單快照（nas_inventory.py）: 遠端目錄未變動時直接使用，最長保留時數
+NAS_INVENTORY_CACHE = "nas_inventory.json"
+NAS_INVENTORY_MAX_AGE_HOURS = float(os.environ.get("NAS_INVENTORY_MAX_AGE_HOURS", 24))
+
+# 多節點工作佇列（work_queue.py）: 多台機器同時執行時，以 NAS 上的租約檔分配樣本，
+# 每個樣本同時只有一台處理，當機節點的租約過期後由其他節點接手；單機執行時不需要開啟
+WORK_QUEUE = os.environ.get("WORK_QUEUE", "no").lower() in ["yes", "true", "1"]
+NAS_LEASE_PATH = os.environ.get("NAS_LEASE_PATH", "Bee_metagenomics/Bee_metagenomics/leases")
+# 節點名稱（容器的主機名稱每次重建都會改變，建議明確設定，重新啟動時才能沿用自己的租約）
+NODE_ID = os.environ.get("NODE_ID", socket.gethostname())
+# 租約有效秒數（每 1/3 續約一次），以及其他節點持有的樣本多久重新檢查一次
+LEASE_TTL_SECONDS = float(os.environ.get("LEASE_TTL_SECONDS", 600))
+LEASE_POLL_SECONDS = float(os.environ.get("LEASE_POLL_SECONDS", 120))
+
 # ============================================
 # 本地路徑配置 (改為相對路徑)
 # ============================================
@@ -78,31 +108,190 @@ FASTQ_OUTPUT_DIR = str(DATA_DIR / "fastq_output")
 MAX_WORKERS = int(os.environ.get("MAX_WORKERS", 8))
 
 # fasterq-dump 線程數（每個樣本用幾個線程解壓）
+# 啟用 CPU_SCHEDULER 時只用於顯示與關閉排程器的情況
 FASTERQ_THREADS = int(os.environ.get("FASTERQ_THREADS", 4))
 
+# CPU 線程分配（cpu_scheduler.py）: 每次解壓前依剩餘核心數與 SRA 大小決定線程數，
+# 所有解壓的線程總和不超過 CPU_TOTAL_THREADS；設為 no 則每個樣本固定使用 FASTERQ_THREADS
+CPU_SCHEDULER = os.environ.get("CPU_SCHEDULER", "yes").lower() in ["yes", "true", "1"]
+CPU_TOTAL_THREADS = int(os.environ.get("CPU_TOTAL_THREADS", os.cpu_count() or 4))
+FASTERQ_MIN_THREADS = int(os.environ.get("FASTERQ_MIN_THREADS", 2))
+FASTERQ_MAX_THREADS = int(os.environ.get("FASTERQ_MAX_THREADS", CPU_TOTAL_THREADS))
+# 每多少 GB 的 SRA 多給一個線程（小檔案多開線程也快不了多少）
+FASTERQ_GB_PER_THREAD = float(os.environ.get("FASTERQ_GB_PER_THREAD", 0.5))
+# 取樣 /proc/stat 的間隔（秒）
+CPU_SAMPLE_SECONDS = float(os.environ.get("CPU_SAMPLE_SECONDS", 2))
+
 # 使用 aria2 加速下載（多連接下載，可提升 4-10 倍速度）
 USE_ARIA2 = os.environ.get("USE_ARIA2", "yes").lower() in ["yes", "true", "1"]
 
 # aria2 連接數（每個檔案使用多少個連接同時下載）
 ARIA2_CONNECTIONS = int(os.environ.get("ARIA2_CONNECTIONS", 16))
 
+# 共用的 aria2 常駐程序（JSON-RPC，aria2_rpc.py）: 所有下載線程把下載排入同一個 aria2，
+# 由它統一限制連線數與頻寬；設為 no 則每個樣本各自執行一次 aria2c
+ARIA2_RPC = os.environ.get("ARIA2_RPC", "yes").lower() in ["yes", "true", "1"]
+ARIA2_RPC_PORT = int(os.environ.get("ARIA2_RPC_PORT", 6800))
+ARIA2_RPC_SECRET = os.environ.get("ARIA2_RPC_SECRET", "")
+# 同時進行的下載數（其餘在 aria2 佇列中等待）與所有下載合計的連線上限
+# 每個下載的連線數 = min(ARIA2_CONNECTIONS, ARIA2_GLOBAL_CONNECTIONS // ARIA2_MAX_CONCURRENT)
+ARIA2_MAX_CONCURRENT = int(os.environ.get("ARIA2_MAX_CONCURRENT", MAX_WORKERS))
+ARIA2_GLOBAL_CONNECTIONS = int(os.environ.get("ARIA2_GLOBAL_CONNECTIONS", 64))
+# 全域頻寬上限（aria2 格式，例如 50M；0 表示不限制）
+ARIA2_MAX_DOWNLOAD_LIMIT = os.environ.get("ARIA2_MAX_DOWNLOAD_LIMIT", "0")
+# 未完成下載的 session 檔，aria2 重啟後續傳
+ARIA2_SESSION_FILE = str(DATA_DIR / "aria2.session")
+
+# 下載引擎: auto / aria2 / http / prefetch
+# auto: 有 aria2c 且 USE_ARIA2 開啟時用 aria2，否則用內建的多段 HTTP 下載（http_downloader.py）
+# 任何引擎在所有鏡像都失敗時都會回退到 prefetch
+DOWNLOAD_ENGINE = os.environ.get("DOWNLOAD_ENGINE", "auto").lower()
+
+# 內建 HTTP 引擎的並行連線數與每段大小 (MB)
+HTTP_DOWNLOAD_CONNECTIONS = int(os.environ.get("HTTP_DOWNLOAD_CONNECTIONS", 8))
+HTTP_SEGMENT_MB = int(os.environ.get("HTTP_SEGMENT_MB", 64))
+
+# 多鏡像 hedged 下載: 先以小的 Range 請求探測所有鏡像，從最快的開始下載；
+# 內建 HTTP 引擎在速度明顯落後時中途改用其他鏡像，aria2 則把所有鏡像交給 --uri-selector=adaptive
+# 設為 no 則依序嘗試每個鏡像
+DOWNLOAD_HEDGE = os.environ.get("DOWNLOAD_HEDGE", "yes").lower() in ["yes", "true", "1"]
+# 探測每個鏡像下載的大小 (KB)
+HEDGE_PROBE_KB = int(os.environ.get("HEDGE_PROBE_KB", 256))
+# 每隔幾秒檢查一次目前鏡像的速度
+HEDGE_CHECK_SECONDS = float(os.environ.get("HEDGE_CHECK_SECONDS", 30))
+# 每條連線的速度低於其他鏡像探測速度的這個比例時換鏡像
+HEDGE_SWITCH_RATIO = float(os.environ.get("HEDGE_SWITCH_RATIO", 0.3))
+
+# 鏡像記分板（每個鏡像的成功率、TTFB、速度，依時段與 accession 前綴統計，用來排序鏡像）
+MIRROR_DB_FILE = os.environ.get("MIRROR_DB_FILE", "mirror_scores.db")
+# 統計的半衰期（天），越短越快反映鏡像近期的狀況
+MIRROR_HALF_LIFE_DAYS = float(os.environ.get("MIRROR_HALF_LIFE_DAYS", 7))
+
+# ENA 直接下載 FASTQ（ena_fastq.py）: ENA 有現成 fastq.gz（且有 MD5）的樣本直接下載 gzip 檔，
+# 跳過 SRA 下載、vdb-validate 與 fasterq-dump；沒有或下載失敗時改走 SRA 流程
+ENA_FASTQ = os.environ.get("ENA_FASTQ", "yes").lower() in ["yes", "true", "1"]
+# 每個 fastq.gz 的連線數（雙端樣本的兩個檔案同時下載）
+ENA_FASTQ_CONNECTIONS = int(os.environ.get("ENA_FASTQ_CONNECTIONS", 4))
+
+# SRA 校驗（sra_checksum.py）: 下載的 .sra 與 NCBI metadata 的 MD5 相符時跳過 vdb-validate，
+# 沒有 MD5 或不相符時才執行 vdb-validate；相符時仍以這個機率抽樣執行 vdb-validate 稽核（0 表示不稽核）
+VALIDATE_AUDIT_RATE = float(os.environ.get("VALIDATE_AUDIT_RATE", 0.05))
+# 校驗耗時與省下的時間 / 讀取量（python sra_checksum.py 可查看）
+VALIDATION_STATS_FILE = os.environ.get("VALIDATION_STATS_FILE", "validation_stats.json")
+
+# 停滯偵測: 超過這些秒數沒有任何位元組進度（檔案增長、aria2 進度、SFTP 寫入）就終止並重試，
+# 下載換鏡像、上傳換連線；PREFETCH_TIMEOUT 等整體超時仍保留作為最後防線。0 表示不偵測
+DOWNLOAD_STALL_SECONDS = float(os.environ.get("DOWNLOAD_STALL_SECONDS", 600))
+DUMP_STALL_SECONDS = float(os.environ.get("DUMP_STALL_SECONDS", 1800))
+UPLOAD_STALL_SECONDS = float(os.environ.get("UPLOAD_STALL_SECONDS", 300))
+# 解壓停滯後在階段內重試的次數
+DUMP_STALL_RETRIES = int(os.environ.get("DUMP_STALL_RETRIES", 1))
+STALL_POLL_SECONDS = float(os.environ.get("STALL_POLL_SECONDS", 5))
+# 停滯事件記錄（JSONL，python stall_watchdog.py 可彙總）
+STALL_LOG_FILE = os.environ.get("STALL_LOG_FILE", "stall_events.jsonl")
+
+# 部分下載（SRA_TEMP_DIR/<run>）的保留時間（小時）
+# 重啟或重試時會續傳，超過這個時間沒有更新的才在啟動時回收；0 表示永不回收
+PARTIAL_MAX_AGE_HOURS = float(os.environ.get("PARTIAL_MAX_AGE_HOURS", 72))
+
+# ============================================
+# 分階段管線配置
+# ============================================
+# 使用分階段管線（下載 → 校驗 → 解壓 → 上傳 各自獨立的工作線程）
+# 設為 no 則回到每個樣本在一個線程中依序處理的舊模式
+USE_PIPELINE = os.environ.get("USE_PIPELINE", "yes").lower() in ["yes", "true", "1"]
+
+# 各階段的工作線程數
+# 下載階段沿用 MAX_WORKERS；解壓階段依 CPU 核心數 / FASTERQ_THREADS 決定
+DOWNLOAD_WORKERS = int(os.environ.get("DOWNLOAD_WORKERS", MAX_WORKERS))
+VALIDATE_WORKERS = int(os.environ.get("VALIDATE_WORKERS", 2))
+DUMP_WORKERS = int(os.environ.get("DUMP_WORKERS", max(1, (os.cpu_count() or 4) // FASTERQ_THREADS)))
+UPLOAD_WORKERS = int(os.environ.get("UPLOAD_WORKERS", 2))
+
+# 階段之間交接佇列的容量（限制等待中的 SRA/FASTQ 數量，避免佔滿磁碟）
+STAGE_QUEUE_SIZE = int(os.environ.get("STAGE_QUEUE_SIZE", 2))
+
+# asyncio 管線（async_orchestrator.py）: 校驗與解壓以 asyncio 子程序執行，不再每個樣本佔一個線程；
+# 下載與 SFTP 上傳在各自有界的線程池（DOWNLOAD_WORKERS / UPLOAD_WORKERS）中執行
+ASYNC_PIPELINE = os.environ.get("ASYNC_PIPELINE", "no").lower() in ["yes", "true", "1"]
+# 同時在管線中的樣本數（取代 STAGE_QUEUE_SIZE 的背壓；磁碟仍由磁碟預約控制）
+ASYNC_MAX_RUNS = int(os.environ.get("ASYNC_MAX_RUNS", MAX_WORKERS * 4))
+
+# 串流解壓上傳（僅 Linux）: fasterq-dump 透過 FIFO 直接寫入 NAS，FASTQ 不落地本地磁碟
+# 串流失敗時自動回退到一般的「解壓成檔案 → 上傳」流程
+STREAM_TO_NAS = os.environ.get("STREAM_TO_NAS", "no").lower() in ["yes", "true", "1"]
+
+# 上傳暫存區: 解壓完成的 FASTQ 移到暫存區後由背景線程上傳，NAS 斷線時只重試不判定失敗
+USE_UPLOAD_SPOOL = os.environ.get("USE_UPLOAD_SPOOL", "yes").lower() in ["yes", "true", "1"]
+UPLOAD_SPOOL_DIR = str(DATA_DIR / "upload_spool")
+# 暫存區容量上限 (GB)，滿了之後上傳階段等待，進而讓上游的解壓暫停
+SPOOL_BUDGET_GB = float(os.environ.get("SPOOL_BUDGET_GB", 200))
+# 上傳失敗後的重試等待（秒），每次加倍直到上限
+SPOOL_RETRY_DELAY = int(os.environ.get("SPOOL_RETRY_DELAY", 60))
+SPOOL_MAX_RETRY_DELAY = int(os.environ.get("SPOOL_MAX_RETRY_DELAY", 1800))
+# 本次執行中每個樣本最多嘗試上傳的次數，超過時判定失敗（檔案保留，下次啟動續傳）；0 表示不限制
+SPOOL_MAX_ATTEMPTS = int(os.environ.get("SPOOL_MAX_ATTEMPTS", 48))
+
+# ============================================
+# 磁碟空間預約（准入控制）
+# ============================================
+# 每個樣本開始前預約尖峰佔用量（SRA + 解壓暫存 + FASTQ），空間不足時等待而非失敗
+# 磁碟至少保留的空間 (GB)
+DISK_FLOOR_GB = float(os.environ.get("DISK_FLOOR_GB", 10))
+# 可預約的總量 (GB)，0 表示自動使用啟動時的可用空間 - DISK_FLOOR_GB
+DISK_BUDGET_GB = float(os.environ.get("DISK_BUDGET_GB", 0))
+# 沒有大小資訊時假設的 SRA 大小 (GB)
+DEFAULT_SRA_GB = float(os.environ.get("DEFAULT_SRA_GB", 5))
+# FASTQ 大小約為 SRA 的幾倍（有歷史記錄後改用實際中位數）
+FASTQ_SIZE_RATIO = float(os.environ.get("FASTQ_SIZE_RATIO", 4.0))
+# fasterq-dump 暫存空間約為 FASTQ 大小的幾倍
+DUMP_TEMP_RATIO = float(os.environ.get("DUMP_TEMP_RATIO", 1.0))
+# 實際 SRA / FASTQ 大小的歷史記錄
+DISK_HISTORY_FILE = "disk_history.json"
+
+# ============================================
+# 下載排序策略
+# ============================================
+# alphabetical: 依樣本 ID | shortest: 小檔案優先 | largest: 大檔案優先 | interleave: 大小交錯
+SCHEDULE_POLICY = os.environ.get("SCHEDULE_POLICY", "interleave").lower()
+# 樣本 metadata 快取（ENA 大小/MD5、NCBI layout/spots 等，python metadata_cache.py prefetch 可預先抓取）
+METADATA_DB_FILE = os.environ.get("METADATA_DB_FILE", "run_metadata.db")
+# 預估 makespan 用: 單一下載線程的速度 (Mbps) 與每個樣本的固定處理時間 (分鐘)
+EXPECTED_MBPS_PER_WORKER = float(os.environ.get("EXPECTED_MBPS_PER_WORKER", 5))
+RUN_OVERHEAD_MINUTES = float(os.environ.get("RUN_OVERHEAD_MINUTES", 10))
+
 # ============================================
 # 進度檔案配置
 # ============================================
 # 樣本清單檔案
 RUNS_FILE = "runs.txt"
 
-# 進度記錄檔案
+# 舊的 JSON 進度記錄檔案（僅在第一次使用狀態資料庫時匯入）
 PROGRESS_FILE = "download_progress.json"
 
+# 樣本狀態資料庫（SQLite）
+STATE_DB_FILE = os.environ.get("STATE_DB_FILE", "download_state.db")
+
 # 日誌檔案
 LOG_FILE = "downloader.log"
 
 # ============================================
 # 重試配置
 # ============================================
-# 下載失敗重試次數
-MAX_RETRIES = 3
+# 同一次執行中自動重試失敗的樣本（failure_policy.py 依錯誤類型決定是否重試、等待多久）
+# 設為 no 則失敗的樣本要等下一次啟動才會重試
+RETRY_FAILED = os.environ.get("RETRY_FAILED", "yes").lower() in ["yes", "true", "1"]
+
+# 每個樣本在同一次執行中的重試總次數
+MAX_RETRIES = int(os.environ.get("MAX_RETRIES", 3))
+
+# 各錯誤類型的重試次數上限（例如 "network=4,nas=5,corrupt=1"，未列出的使用 failure_policy.py 的預設值）
+RETRY_BUDGETS = os.environ.get("RETRY_BUDGETS", "")
+
+# 第一次重試前的等待（秒），之後每次加倍直到上限，並加上 ±RETRY_JITTER 比例的隨機抖動
+RETRY_BACKOFF_SECONDS = float(os.environ.get("RETRY_BACKOFF_SECONDS", 60))
+RETRY_MAX_BACKOFF_SECONDS = float(os.environ.get("RETRY_MAX_BACKOFF_SECONDS", 1800))
+RETRY_JITTER = float(os.environ.get("RETRY_JITTER", 0.25))
 
 # 重試等待時間（秒）
 RETRY_DELAY = 5
@@ -112,7 +301,7 @@ RETRY_DELAY = 5
 # ============================================
 def check_and_create_paths():
     """檢查並創建必要的本地目錄"""
-    paths = [SRA_TEMP_DIR, FASTQ_TEMP_DIR, FASTQ_OUTPUT_DIR]
+    paths = [SRA_TEMP_DIR, FASTQ_TEMP_DIR, FASTQ_OUTPUT_DIR, UPLOAD_SPOOL_DIR]
     print("1️⃣  檢查本地目錄:")
     for path in paths:
         path_obj = Path(path)
@@ -136,6 +325,9 @@ if __name__ == "__main__":
     print(f"  - NAS User: {NAS_USER}")
     print(f"  - NAS Pass: {'*' * len(NAS_PASS) if NAS_PASS else '(Not Set)'}")
     print(f"  - Concurrency: {MAX_WORKERS} workers, {FASTERQ_THREADS} threads/worker")
+    print(f"  - Pipeline: {('async' if ASYNC_PIPELINE else 'on') if USE_PIPELINE else 'off'} "
+          f"(download={DOWNLOAD_WORKERS}, validate={VALIDATE_WORKERS}, "
+          f"dump={DUMP_WORKERS}, upload={UPLOAD_WORKERS}, queue={STAGE_QUEUE_SIZE})")
 
     print("\n✅ 配置檔案正常")
     print("   現在路徑為相對路徑，並可透過環境變數覆寫。")
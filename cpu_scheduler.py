@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CPU 線程分配（fasterq-dump / 解壓）
+原本每個樣本固定使用 FASTERQ_THREADS 個線程，不管同時有幾個樣本在解壓:
+8 個樣本同時解壓時 32 個線程搶 16 個硬體線程，只有一個樣本在解壓時又讓其他核心閒置。
+
+這裡改為每次啟動 fasterq-dump 前向排程器要線程數:
+- 依樣本大小決定需要的線程數（小檔案多開線程也快不了多少）
+- 不超過目前剩下的核心: 總核心數 - max(已分配的線程, /proc/stat 量到的忙碌核心)
+  （下載、上傳的加密與其他程式也會佔用 CPU）
+- 所有已分配的線程總和不超過邏輯核心數；剩下不到 min_threads 時等待其他樣本結束
+- 登記子程序 pid 後，從 /proc/<pid>/stat 追蹤實際使用的 CPU，結束時回報實際用了幾個核心
+
+非 Linux（沒有 /proc）時只依已分配的線程數分配。
+
+用法:
+    python cpu_scheduler.py         # 顯示目前的 CPU 使用率與分配結果範例
+"""
+
+import math
+import os
+import threading
+import time
+from pathlib import Path
+
+GB = 1024**3
+
+_CLK_TCK = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+def read_cpu_times(stat_file="/proc/stat"):
+    """讀取 /proc/stat 的總 CPU 時間，回傳 (忙碌 ticks, 總 ticks)；沒有 /proc 時回傳 None"""
+    try:
+        with open(stat_file, "r") as f:
+            fields = f.readline().split()
+    except OSError:
+        return None
+    if not fields or fields[0] != "cpu":
+        return None
+    values = [int(v) for v in fields[1:]]
+    idle = values[3] + (values[4] if len(values) > 4 else 0)  # idle + iowait
+    # guest / guest_nice 已包含在 user / nice 中
+    total = sum(values[:8])
+    return total - idle, total
+
+
+def read_process_cpu(pid):
+    """讀取 /proc/<pid>/stat 的 utime + stime（秒，包含所有線程）；程序已結束時回傳 None"""
+    try:
+        with open(f"/proc/{pid}/stat", "r") as f:
+            data = f.read()
+    except OSError:
+        return None
+    # comm 欄位可能含有空白，從最後一個 ')' 之後開始解析
+    fields = data[data.rfind(")") + 2:].split()
+    try:
+        return (int(fields[11]) + int(fields[12])) / _CLK_TCK
+    except (IndexError, ValueError):
+        return None
+
+
+class CPUScheduler:
+    """依剩餘核心數與樣本大小分配線程（線程安全）"""
+
+    def __init__(self, total_threads=None, min_threads=1, max_threads=None, gb_per_thread=0.5,
+                 sample_interval=2.0, stat_file="/proc/stat"):
+        """
+        Args:
+            total_threads: 可分配的總線程數（None 表示邏輯核心數）
+            min_threads: 每個樣本至少的線程數，剩下的不夠時等待
+            max_threads: 每個樣本最多的線程數（None 表示 total_threads）
+            gb_per_thread: 每多少 GB 的輸入多給一個線程
+            sample_interval: 取樣 /proc 的間隔（秒）
+            stat_file: /proc/stat 的路徑
+        """
+        self.total_threads = total_threads or os.cpu_count() or 4
+        self.min_threads = max(1, min(min_threads, self.total_threads))
+        self.max_threads = max(self.min_threads, min(max_threads or self.total_threads, self.total_threads))
+        self.gb_per_thread = gb_per_thread
+        self.sample_interval = sample_interval
+        self.stat_file = stat_file
+
+        self._grants = {}  # run_id -> {"threads", "started", "pids", "pid_cpu"}
+        self._cond = threading.Condition()
+        self._last_times = read_cpu_times(stat_file)
+        self._last_sample = time.time()
+        self._busy_cores = 0.0
+        self._thread = None
+
+    # ==================== /proc 取樣 ====================
+
+    def _sample(self):
+        """更新系統忙碌核心數與各樣本子程序的 CPU 時間（呼叫時需持有鎖）"""
+        now = time.time()
+        if now - self._last_sample < self.sample_interval:
+            return
+        times = read_cpu_times(self.stat_file)
+        if times is not None and self._last_times is not None:
+            busy = times[0] - self._last_times[0]
+            total = times[1] - self._last_times[1]
+            if total > 0:
+                self._busy_cores = busy / total * self.total_threads
+        self._last_times = times
+        self._last_sample = now
+
+        for grant in self._grants.values():
+            for pid in list(grant["pids"]):
+                cpu = read_process_cpu(pid)
+                if cpu is None:
+                    # 程序已結束，保留最後一次讀到的值
+                    grant["pids"].discard(pid)
+                    continue
+                grant["pid_cpu"][pid] = cpu
+
+    def _monitor(self):
+        while True:
+            time.sleep(self.sample_interval)
+            with self._cond:
+                if not any(grant["pids"] for grant in self._grants.values()):
+                    self._thread = None
+                    return
+                self._sample()
+                self._cond.notify_all()
+
+    def busy_cores(self):
+        """最近一次取樣時系統忙碌的核心數（包含 fasterq-dump 以外的程式）"""
+        with self._cond:
+            self._sample()
+            return self._busy_cores
+
+    # ==================== 分配 / 釋放 ====================
+
+    def desired_threads(self, input_bytes):
+        """依輸入大小（SRA 或 gzip 檔）決定需要的線程數"""
+        if not input_bytes or self.gb_per_thread <= 0:
+            return self.max_threads
+        wanted = math.ceil(input_bytes / GB / self.gb_per_thread)
+        return max(self.min_threads, min(self.max_threads, wanted))
+
+    def allocated_threads(self):
+        with self._cond:
+            return self._allocated()
+
+    def _allocated(self):
+        return sum(grant["threads"] for grant in self._grants.values())
+
+    def _free(self):
+        return self.total_threads - max(self._allocated(), math.ceil(self._busy_cores - 0.5))
+
+    def acquire(self, run_id, input_bytes=None, max_threads=None):
+        """
+        分配線程，剩下的核心不夠 min_threads 時阻塞等待
+
+        Args:
+            run_id: 樣本 ID
+            input_bytes: 輸入大小（用來決定需要的線程數）
+            max_threads: 這次最多使用的線程數（例如單線程的工具，None 表示不另外限制）
+
+        Returns:
+            int: 分配到的線程數
+        """
+        wanted = self.desired_threads(input_bytes)
+        min_threads = self.min_threads
+        if max_threads is not None:
+            wanted = min(wanted, max(1, max_threads))
+            min_threads = min(min_threads, wanted)
+        waited = False
+        start = time.time()
+
+        with self._cond:
+            while True:
+                self._sample()
+                if not self._grants:
+                    # 沒有其他樣本在解壓時一定放行（系統負載來自其他程式也不能永遠等待）
+                    threads = min(wanted, max(min_threads, self._free()))
+                    break
+                free = self._free()
+                if free >= min_threads:
+                    threads = min(wanted, free)
+                    break
+                if not waited:
+                    print(f"    ⏳ {run_id} 等待 CPU (已分配 {self._allocated()}/{self.total_threads} 線程, "
+                          f"忙碌 {self._busy_cores:.1f} 核心)", flush=True)
+                    waited = True
+                self._cond.wait(timeout=self.sample_interval)
+
+            self._grants[run_id] = {
+                "threads": threads, "started": time.time(), "pids": set(), "pid_cpu": {},
+            }
+
+        if waited:
+            print(f"    ✅ {run_id} 取得 CPU (等待 {time.time() - start:.0f} 秒)", flush=True)
+        return threads
+
+    def attach(self, run_id, pid):
+        """登記樣本的子程序，從 /proc/<pid>/stat 追蹤實際使用的 CPU"""
+        with self._cond:
+            grant = self._grants.get(run_id)
+            if grant is None:
+                return
+            grant["pids"].add(pid)
+            cpu = read_process_cpu(pid)
+            if cpu is not None:
+                grant["pid_cpu"][pid] = cpu
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._monitor, name="cpu-scheduler", daemon=True)
+                self._thread.start()
+
+    def release(self, run_id):
+        """
+        釋放樣本的線程
+
+        Returns:
+            dict: {"threads": 分配的線程數, "cores_used": 實際平均使用的核心數（沒有登記子程序時為 None）,
+                   "elapsed": 秒數}；沒有分配時回傳 None
+        """
+        with self._cond:
+            grant = self._grants.pop(run_id, None)
+            self._cond.notify_all()
+        if grant is None:
+            return None
+
+        elapsed = time.time() - grant["started"]
+        cores_used = None
+        if grant["pid_cpu"]:
+            cores_used = sum(grant["pid_cpu"].values()) / max(elapsed, 0.001)
+        return {"threads": grant["threads"], "cores_used": cores_used, "elapsed": elapsed}
+
+
+_default_scheduler = None
+_default_scheduler_lock = threading.Lock()
+
+
+def get_cpu_scheduler():
+    """取得依 config.py 設定建立的共用排程器"""
+    global _default_scheduler
+    with _default_scheduler_lock:
+        if _default_scheduler is None:
+            from config import (CPU_SAMPLE_SECONDS, CPU_TOTAL_THREADS, FASTERQ_GB_PER_THREAD,
+                                FASTERQ_MAX_THREADS, FASTERQ_MIN_THREADS)
+
+            _default_scheduler = CPUScheduler(
+                total_threads=CPU_TOTAL_THREADS,
+                min_threads=FASTERQ_MIN_THREADS,
+                max_threads=FASTERQ_MAX_THREADS,
+                gb_per_thread=FASTERQ_GB_PER_THREAD,
+                sample_interval=CPU_SAMPLE_SECONDS,
+            )
+        return _default_scheduler
+
+
+if __name__ == "__main__":
+    scheduler = get_cpu_scheduler()
+    if not Path(scheduler.stat_file).exists():
+        print("⚠️  沒有 /proc/stat，只依已分配的線程數分配")
+    time.sleep(scheduler.sample_interval)
+    print(f"🖥️  邏輯核心: {scheduler.total_threads}，目前忙碌: {scheduler.busy_cores():.1f} 核心")
+    print(f"   每個樣本 {scheduler.min_threads}-{scheduler.max_threads} 線程，"
+          f"每 {scheduler.gb_per_thread} GB 一個線程")
+    for size_gb in (0.2, 1, 4, 10, 50):
+        print(f"   {size_gb:>6} GB → {scheduler.desired_threads(size_gb * GB)} 線程")
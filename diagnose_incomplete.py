@@ -8,8 +8,9 @@ import sys
 from pathlib import Path
 sys.path.insert(0, str(Path(__file__).parent))
 
-from config import NAS_HOST, NAS_PORT, NAS_USER, NAS_PASS, NAS_FASTQ_PATH
+from config import NAS_HOST, NAS_PORT, NAS_USER, NAS_PASS
 from nas_uploader import NASUploader
+from nas_inventory import get_fastq_inventory
 
 def diagnose_incomplete_samples():
     """診斷不完整的樣本"""
@@ -35,7 +36,7 @@ def diagnose_incomplete_samples():
     
     try:
         # 列出 NAS 上的所有檔案
-        all_files = nas.sftp.listdir(NAS_FASTQ_PATH)
+        all_files = get_fastq_inventory().snapshot(nas, refresh="--refresh" in sys.argv)
         
         results = {
             'both_exist': [],  # 兩個檔案都存在
@@ -56,21 +57,12 @@ def diagnose_incomplete_samples():
                 print(f"✅ {sample}: 兩個檔案都存在")
             elif has_1 and not has_2:
                 results['only_1'].append(sample)
-                # 獲取檔案大小
-                try:
-                    stat = nas.sftp.stat(f"{NAS_FASTQ_PATH}/{file_1}")
-                    size_mb = stat.st_size / (1024 * 1024)
-                    print(f"⚠️  {sample}: 只有 _1 ({size_mb:.1f} MB)")
-                except:
-                    print(f"⚠️  {sample}: 只有 _1 (無法獲取大小)")
+                size_mb = all_files[file_1]['size'] / (1024 * 1024)
+                print(f"⚠️  {sample}: 只有 _1 ({size_mb:.1f} MB)")
             elif has_2 and not has_1:
                 results['only_2'].append(sample)
-                try:
-                    stat = nas.sftp.stat(f"{NAS_FASTQ_PATH}/{file_2}")
-                    size_mb = stat.st_size / (1024 * 1024)
-                    print(f"⚠️  {sample}: 只有 _2 ({size_mb:.1f} MB)")
-                except:
-                    print(f"⚠️  {sample}: 只有 _2 (無法獲取大小)")
+                size_mb = all_files[file_2]['size'] / (1024 * 1024)
+                print(f"⚠️  {sample}: 只有 _2 ({size_mb:.1f} MB)")
             else:
                 results['neither'].append(sample)
                 print(f"❌ {sample}: 兩個檔案都不存在")
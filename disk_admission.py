@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+磁碟空間預約（准入控制）
+每個樣本開始下載前先預約預估的尖峰佔用量（SRA + 解壓暫存 + FASTQ 輸出），
+空間不足時等待其他樣本釋放，而不是直接失敗；各階段完成後逐步釋放。
+"""
+
+import json
+import shutil
+import threading
+import time
+from pathlib import Path
+
+GB = 1024**3
+
+# 預約的組成部分
+PARTS = ("sra", "temp", "fastq")
+
+
+class DiskAdmissionController:
+    """以預約帳本控制同時處理的樣本不會一起把磁碟塞滿"""
+
+    def __init__(
+        self,
+        path,
+        floor_bytes,
+        budget_bytes=None,
+        history_file=None,
+        default_sra_bytes=5 * GB,
+        fastq_ratio=4.0,
+        temp_ratio=1.0,
+        gz_ratio=3.5,
+    ):
+        """
+        Args:
+            path: 資料所在的目錄（用來查詢磁碟空間）
+            floor_bytes: 磁碟至少保留的空間
+            budget_bytes: 可預約的總量（None 表示啟動時的可用空間 - floor_bytes）
+            history_file: 記錄實際 SRA/FASTQ 大小的 JSON 檔（用於之後的估算）
+            default_sra_bytes: 沒有任何資訊時假設的 SRA 大小
+            fastq_ratio: FASTQ 大小 / SRA 大小
+            temp_ratio: fasterq-dump 暫存大小 / FASTQ 大小
+            gz_ratio: 未壓縮 FASTQ / ENA fastq_bytes (gzip) 的比例
+        """
+        self.path = str(path)
+        self.floor_bytes = floor_bytes
+        if budget_bytes is None:
+            budget_bytes = max(0, shutil.disk_usage(self.path).free - floor_bytes)
+        self.budget_bytes = budget_bytes
+        self.history_file = Path(history_file) if history_file else None
+        self.default_sra_bytes = default_sra_bytes
+        self.fastq_ratio = fastq_ratio
+        self.temp_ratio = temp_ratio
+        self.gz_ratio = gz_ratio
+
+        self._reservations = {}  # run_id -> {"sra": bytes, "temp": bytes, "fastq": bytes}
+        self._cond = threading.Condition()
+        self._history_lock = threading.Lock()
+        self._history = self._load_history()
+
+    # ==================== 歷史記錄 ====================
+
+    def _load_history(self):
+        if self.history_file and self.history_file.exists():
+            try:
+                with open(self.history_file, "r", encoding="utf-8") as f:
+                    return json.load(f)
+            except Exception as e:
+                print(f"⚠️  載入磁碟使用歷史失敗 (忽略): {e}")
+        return {}
+
+    def record_actual(self, run_id, sra_bytes=None, fastq_bytes=None):
+        """記錄樣本實際的 SRA / FASTQ 大小"""
+        with self._history_lock:
+            entry = self._history.setdefault(run_id, {})
+            if sra_bytes is not None:
+                entry["sra_bytes"] = int(sra_bytes)
+            if fastq_bytes is not None:
+                entry["fastq_bytes"] = int(fastq_bytes)
+
+            if not self.history_file:
+                return
+            try:
+                temp_file = self.history_file.with_suffix(".tmp")
+                with open(temp_file, "w", encoding="utf-8") as f:
+                    json.dump(self._history, f)
+                temp_file.replace(self.history_file)
+            except Exception as e:
+                print(f"⚠️  儲存磁碟使用歷史失敗 (繼續執行): {e}")
+
+    def _observed_fastq_ratio(self):
+        """從歷史記錄計算 FASTQ / SRA 的中位數比例"""
+        ratios = sorted(
+            e["fastq_bytes"] / e["sra_bytes"]
+            for e in self._history.values()
+            if e.get("sra_bytes") and e.get("fastq_bytes")
+        )
+        if len(ratios) < 3:
+            return self.fastq_ratio
+        return ratios[len(ratios) // 2]
+
+    # ==================== 估算 ====================
+
+    def estimate(self, run_id, size_hint=None, sra_hint=None):
+        """
+        估算樣本的尖峰磁碟佔用量
+
+        Args:
+            run_id: 樣本 ID
+            size_hint: ENA 的 fastq_bytes（gzip 壓縮後大小），沒有則為 None
+            sra_hint: NCBI 記錄的 .sra 檔大小，沒有則為 None
+
+        Returns:
+            dict: {"sra": bytes, "temp": bytes, "fastq": bytes}
+        """
+        with self._history_lock:
+            known = dict(self._history.get(run_id, {}))
+            ratio = self._observed_fastq_ratio()
+
+        sra_bytes = known.get("sra_bytes") or sra_hint
+        fastq_bytes = known.get("fastq_bytes")
+
+        if fastq_bytes is None and size_hint:
+            fastq_bytes = int(size_hint * self.gz_ratio)
+        if sra_bytes is None:
+            sra_bytes = int(fastq_bytes / ratio) if fastq_bytes else self.default_sra_bytes
+        if fastq_bytes is None:
+            fastq_bytes = int(sra_bytes * ratio)
+
+        return {
+            "sra": sra_bytes,
+            "temp": int(fastq_bytes * self.temp_ratio),
+            "fastq": fastq_bytes,
+        }
+
+    # ==================== 預約 / 釋放 ====================
+
+    def reserved_bytes(self):
+        with self._cond:
+            return self._reserved_total()
+
+    def _reserved_total(self):
+        return sum(sum(r.values()) for r in self._reservations.values())
+
+    def _can_admit(self, need):
+        reserved = self._reserved_total()
+        if reserved == 0:
+            # 單一樣本超過預算時，等其他樣本都結束後單獨放行，避免永遠卡住
+            return True
+        if reserved + need > self.budget_bytes:
+            return False
+        try:
+            free = shutil.disk_usage(self.path).free
+        except OSError:
+            return True
+        return free >= self.floor_bytes
+
+    def acquire(self, run_id, footprint, poll_interval=30):
+        """
+        預約磁碟空間，空間不足時阻塞等待
+
+        Args:
+            run_id: 樣本 ID
+            footprint: estimate() 回傳的字典
+            poll_interval: 重新檢查實際可用空間的間隔（秒）
+        """
+        need = sum(footprint.values())
+        waited = False
+        start = time.time()
+
+        with self._cond:
+            while not self._can_admit(need):
+                if not waited:
+                    print(
+                        f"    ⏳ {run_id} 等待磁碟空間 (需要 {need / GB:.1f} GB, "
+                        f"已預約 {self._reserved_total() / GB:.1f} / {self.budget_bytes / GB:.1f} GB)",
+                        flush=True,
+                    )
+                    waited = True
+                self._cond.wait(timeout=poll_interval)
+
+            self._reservations[run_id] = dict(footprint)
+
+        if waited:
+            print(f"    ✅ {run_id} 取得磁碟空間 (等待 {time.time() - start:.0f} 秒)", flush=True)
+
+    def adjust(self, run_id, **parts):
+        """以實際大小修正已預約的部分（例如下載完成後得知真正的 SRA 大小）"""
+        with self._cond:
+            reservation = self._reservations.get(run_id)
+            if reservation is None:
+                return
+            for key, value in parts.items():
+                if key in reservation and value is not None:
+                    reservation[key] = int(value)
+            self._cond.notify_all()
+
+    def release(self, run_id, parts=None):
+        """
+        釋放預約
+
+        Args:
+            run_id: 樣本 ID
+            parts: 要釋放的部分（例如 ["sra", "temp"]），None 表示全部釋放
+        """
+        with self._cond:
+            reservation = self._reservations.get(run_id)
+            if reservation is None:
+                return
+            for key in parts if parts is not None else PARTS:
+                reservation[key] = 0
+            if not any(reservation.values()):
+                del self._reservations[run_id]
+            self._cond.notify_all()
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ENA 直接下載 FASTQ
+ENA 對大部分樣本（runs.txt 中多數的 ERR/DRR，以及同步過去的 SRR）都提供現成的 fastq.gz，
+直接下載 gzip 檔即可省掉 SRA 下載、vdb-validate 與耗 CPU 的 fasterq-dump，下載量也大約減半。
+
+流程:
+1. 從 metadata 快取（ENA filereport 的 fastq_ftp / fastq_md5）取得每個檔案的位置與 MD5
+2. 以內建多段 HTTP 引擎平行下載所有 fastq.gz，下載中同時計算 MD5 並比對
+3. 解壓成 .fastq（NAS 上的檔案清單、完整性檢查都以 .fastq 為準；有 pigz 時使用 pigz）
+4. 交給上傳階段
+
+檔名與 fasterq-dump --split-files 的輸出對齊:
+- 雙端: <run>_1.fastq / <run>_2.fastq（ENA 另外提供的未配對 <run>.fastq.gz 不下載）
+- 單端: ENA 的 <run>.fastq.gz 改名為 <run>_1.fastq（NAS 以 _1.fastq 判定樣本完成）
+
+ENA 沒有這個樣本的 FASTQ、MD5 缺漏或下載失敗時拋出 ENAFastqUnavailable，由呼叫端改走 SRA 流程。
+
+用法:
+    python ena_fastq.py ERR123456 [輸出目錄]     # 下載並解壓單一樣本
+"""
+
+import gzip
+import shutil
+import subprocess
+import sys
+import threading
+from pathlib import Path
+
+
+class ENAFastqUnavailable(Exception):
+    """無法使用 ENA 的 FASTQ，需要改走 SRA 下載 + fasterq-dump"""
+
+
+def _local_name(run_id, remote_name):
+    """ENA 檔名 → 本地 gzip 檔名（單端的無後綴檔改名為 _1）"""
+    if remote_name == f"{run_id}.fastq.gz":
+        return f"{run_id}_1.fastq.gz"
+    return remote_name
+
+
+def ena_fastq_plan(run_id, cache=None, offline=False):
+    """
+    取得樣本在 ENA 上的 FASTQ 檔案清單
+
+    Returns:
+        list: [{"name": 本地 gzip 檔名, "urls": [下載網址, ...], "md5": MD5}, ...]；ENA 沒有時回傳 []
+    """
+    if cache is None:
+        from metadata_cache import get_metadata_cache
+
+        cache = get_metadata_cache()
+    values = cache.ensure([run_id], ["fastq_ftp", "fastq_md5"], offline=offline).get(run_id, {})
+    locations = values.get("fastq_ftp") or []
+    md5s = values.get("fastq_md5") or []
+    if not locations:
+        return []
+    if len(md5s) != len(locations):
+        # 沒有 MD5 就無法確認下載完整，不如走 SRA 流程
+        return []
+
+    files = []
+    for location, md5 in zip(locations, md5s):
+        path = location.split("://", 1)[-1]
+        files.append({
+            "remote": path.rsplit("/", 1)[-1],
+            "urls": [f"https://{path}", f"http://{path}"],
+            "md5": md5.lower(),
+        })
+
+    names = {f["remote"] for f in files}
+    paired = f"{run_id}_1.fastq.gz" in names and f"{run_id}_2.fastq.gz" in names
+    plan = []
+    for f in files:
+        if paired and f["remote"] == f"{run_id}.fastq.gz":
+            continue
+        if not f["remote"].startswith(run_id) or not f["remote"].endswith(".fastq.gz"):
+            return []
+        plan.append({"name": _local_name(run_id, f["remote"]), "urls": f["urls"], "md5": f["md5"]})
+
+    local_names = [f["name"] for f in plan]
+    if len(set(local_names)) != len(local_names):
+        return []
+    return plan
+
+
+def download_ena_fastq(run_id, plan, dest_dir, connections=4, segment_size=64 * 1024 * 1024,
+                       stall_seconds=0, watchdog=None):
+    """
+    平行下載所有 fastq.gz 並比對 MD5（中斷後可從段落記錄續傳）
+
+    Args:
+        run_id: 樣本 ID
+        plan: ena_fastq_plan() 的結果
+        dest_dir: 本地目錄
+        connections: 每個檔案的連線數
+        segment_size: 每段大小
+        stall_seconds: 停滯時間（秒），需搭配 watchdog
+        watchdog: stall_watchdog.StallWatchdog（可選）
+
+    Returns:
+        list: 下載完成的 gzip 檔案路徑
+
+    Raises:
+        ENAFastqUnavailable: 任一檔案下載失敗或 MD5 不符
+    """
+    from http_downloader import DownloadError, SegmentedDownload
+
+    dest_dir = Path(dest_dir)
+    dest_dir.mkdir(parents=True, exist_ok=True)
+    results = {}
+    errors = []
+
+    def fetch(entry):
+        dest = dest_dir / entry["name"]
+        download = SegmentedDownload(
+            entry["urls"], dest, connections=connections, segment_size=segment_size,
+            expected_md5=entry["md5"], progress_interval=60,
+        )
+        try:
+            if watchdog is not None:
+                with watchdog.watch("download", run_id, stall_seconds, download.downloaded_bytes,
+                                    on_stall=download.cancel, detail=entry["urls"][0]) as watch:
+                    try:
+                        info = download.run()
+                    except DownloadError:
+                        watch.check()
+                        raise
+            else:
+                info = download.run()
+            results[entry["name"]] = (dest, info)
+        except Exception as e:
+            errors.append(f"{entry['name']}: {e}")
+
+    threads = [threading.Thread(target=fetch, args=(entry,), daemon=True) for entry in plan]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    if errors:
+        raise ENAFastqUnavailable("; ".join(errors))
+
+    total = sum(info["size"] for _, info in results.values())
+    elapsed = max(info["elapsed"] for _, info in results.values())
+    print(f"    📊 ENA FASTQ: {len(results)} 個檔案, {total / 1024**3:.2f} GB, "
+          f"{total / max(elapsed, 0.001) / 1024**2:.2f} MB/s, MD5 相符")
+    return [results[entry["name"]][0] for entry in plan]
+
+
+def pigz_available():
+    """有 pigz 時才能多線程解壓（否則以單線程的 gzip 模組解壓）"""
+    return shutil.which("pigz") is not None
+
+
+def decompress_fastq(gz_file, output_dir, threads=4, on_start=None):
+    """
+    解壓 fastq.gz 到 output_dir（先寫入暫存檔，完成後才改名），完成後刪除 gzip 檔
+
+    Args:
+        threads: pigz 的線程數（沒有 pigz 時固定單線程）
+        on_start: pigz 啟動後以 Popen 呼叫（例如登記 pid 追蹤 CPU 使用）
+
+    Returns:
+        Path: 解壓後的 .fastq
+    """
+    gz_file = Path(gz_file)
+    target = Path(output_dir) / gz_file.name[: -len(".gz")]
+    temp = target.with_name(target.name + ".tmp")
+
+    pigz = shutil.which("pigz")
+    if pigz:
+        with open(temp, "wb") as out:
+            process = subprocess.Popen([pigz, "-dc", "-p", str(threads), str(gz_file)], stdout=out,
+                                       stderr=subprocess.PIPE, text=True)
+            if on_start is not None:
+                on_start(process)
+            _, stderr = process.communicate()
+        if process.returncode != 0:
+            temp.unlink(missing_ok=True)
+            raise IOError(f"pigz 解壓失敗: {stderr[:200]}")
+    else:
+        try:
+            with gzip.open(gz_file, "rb") as src, open(temp, "wb") as out:
+                shutil.copyfileobj(src, out, 4 * 1024 * 1024)
+        except Exception:
+            temp.unlink(missing_ok=True)
+            raise
+
+    temp.replace(target)
+    gz_file.unlink()
+    return target
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("用法: python ena_fastq.py <RUN_ID> [輸出目錄]")
+        sys.exit(1)
+
+    run_id = sys.argv[1]
+    output_dir = Path(sys.argv[2]) if len(sys.argv) > 2 else Path(".")
+    plan = ena_fastq_plan(run_id)
+    if not plan:
+        print(f"❌ ENA 沒有 {run_id} 的 FASTQ（或缺少 MD5）")
+        sys.exit(1)
+    for entry in plan:
+        print(f"   {entry['name']}  {entry['md5']}  {entry['urls'][0]}")
+    try:
+        gz_files = download_ena_fastq(run_id, plan, output_dir)
+    except ENAFastqUnavailable as e:
+        print(f"❌ 下載失敗: {e}")
+        sys.exit(1)
+    for gz_file in gz_files:
+        print(f"✅ {decompress_fastq(gz_file, output_dir)}")
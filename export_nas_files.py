@@ -9,10 +9,11 @@ import csv
 from pathlib import Path
 sys.path.insert(0, str(Path(__file__).parent))
 
-from config import NAS_HOST, NAS_PORT, NAS_USER, NAS_PASS, NAS_FASTQ_PATH
+from config import NAS_HOST, NAS_PORT, NAS_USER, NAS_PASS
 from nas_uploader import NASUploader
+from nas_inventory import fastq_files as only_fastq, get_fastq_inventory
 
-def export_nas_files_to_csv(output_file='nas_fastq_files.csv'):
+def export_nas_files_to_csv(output_file='nas_fastq_files.csv', refresh=False):
     """
     列出 NAS 上所有 FASTQ 檔案並輸出為 CSV
     
@@ -35,41 +36,21 @@ def export_nas_files_to_csv(output_file='nas_fastq_files.csv'):
         return False
     
     try:
-        # 列出所有檔案
+        # 列出所有檔案（名稱與大小一次取得）
         print("📂 讀取檔案列表...")
-        all_files = nas.sftp.listdir(NAS_FASTQ_PATH)
-        fastq_files = [f for f in all_files if f.endswith('.fastq')]
+        fastq_files = only_fastq(get_fastq_inventory().snapshot(nas, refresh=refresh))
         
         print(f"✅ 找到 {len(fastq_files)} 個 FASTQ 檔案")
         print()
         
-        # 收集檔案資訊
-        print("📊 收集檔案大小資訊...")
         file_info = []
-        
         for i, filename in enumerate(sorted(fastq_files), 1):
-            try:
-                file_path = f"{NAS_FASTQ_PATH}/{filename}"
-                stat = nas.sftp.stat(file_path)
-                size_mb = stat.st_size / (1024 * 1024)
-                
-                file_info.append({
-                    'number': i,
-                    'filename': filename,
-                    'size_mb': round(size_mb, 2)
-                })
-                
-                # 進度顯示
-                if i % 100 == 0:
-                    print(f"  進度: {i}/{len(fastq_files)}")
-                
-            except Exception as e:
-                print(f"  ⚠️  無法讀取 {filename}: {e}")
-                file_info.append({
-                    'number': i,
-                    'filename': filename,
-                    'size_mb': 0.0
-                })
+            size_mb = fastq_files[filename]['size'] / (1024 * 1024)
+            file_info.append({
+                'number': i,
+                'filename': filename,
+                'size_mb': round(size_mb, 2)
+            })
         
         print(f"✅ 完成 {len(file_info)} 個檔案")
         print()
@@ -117,5 +98,5 @@ def export_nas_files_to_csv(output_file='nas_fastq_files.csv'):
         nas.disconnect()
 
 if __name__ == "__main__":
-    success = export_nas_files_to_csv()
+    success = export_nas_files_to_csv(refresh="--refresh" in sys.argv)
     sys.exit(0 if success else 1)
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+失敗分類與同一次執行中的退避重試
+原本樣本失敗後只寫入 mark_failed，要等下一次手動啟動才會重試；
+而且不分原因: 樣本已下架也會在下次啟動時重新下載一次。
+
+這裡依錯誤訊息（含 prefetch / fasterq-dump / vdb-validate 的 stderr 與例外類型名稱）分類，
+規則依序比對，第一個符合的類型生效:
+- not_found: 樣本不存在或已下架（永久性，不重試）
+- disk_full: 本地磁碟空間不足（其他樣本完成後就會釋放，等待較久再重試）
+- corrupt:   下載的檔案損毀（MD5 不符、校驗失敗），捨棄下載與 checkpoint 後重新下載
+- nas:       NAS / SFTP 連線或寫入錯誤
+- network:   下載時的網路錯誤、超時、停滯
+- unknown:   無法辨識（重試一次）
+
+暫時性的失敗在 RetryScheduler 中等待後重新提交到管線（舊模式為線程池），等待時間每次加倍並加上隨機抖動
+（多個樣本同時因 NAS 斷線失敗時不會同時重試）；每種類型有各自的重試次數上限，
+每個樣本另有總次數上限。
+
+用法:
+    python failure_policy.py        # 依類型彙總狀態資料庫中的失敗記錄
+"""
+
+import heapq
+import random
+import re
+import threading
+import time
+from collections import defaultdict
+
+# 依序比對，第一個符合的類型生效（較明確的類型在前）
+FAILURE_RULES = [
+    ("not_found", re.compile(
+        r"樣本不存在|item not found|no data for|no data \(\s*404\s*\)|invalid accession|"
+        r"(cannot|failed to) resolve accession|accession .*(not found|does not exist)|http 404",
+        re.IGNORECASE,
+    )),
+    ("disk_full", re.compile(
+        r"no space left|disk full|disk quota exceeded|storage exhausted|errno 28\b|enospc|磁碟空間不足",
+        re.IGNORECASE,
+    )),
+    ("corrupt", re.compile(
+        r"完整性校驗失敗|md5 不符|checksum|corrupt|damaged|bad magic|not a gzip|\bcrc\b|"
+        r"data inconsistent|truncated|unexpected end of (file|data)|檔案大小與預期不符|下載大小不符",
+        re.IGNORECASE,
+    )),
+    ("nas", re.compile(
+        r"nasconnectionerror|\bnas\b|sftp|ssh|paramiko|authentication|上傳失敗|"
+        r"socket is closed|server connection dropped",
+        re.IGNORECASE,
+    )),
+    ("network", re.compile(
+        r"timeoutexpired|stalldetected|停滯|timed? ?out|connection (reset|refused|aborted|closed|failed)|"
+        r"name resolution|name or service not known|network is unreachable|no route to host|"
+        r"failed to download|transfer incomplete|broken pipe|ssl|http 5\d\d|鏡像|連線|網路",
+        re.IGNORECASE,
+    )),
+]
+
+# 各類型在同一次執行中的重試次數上限
+DEFAULT_BUDGETS = {
+    "not_found": 0,
+    "disk_full": 3,
+    "corrupt": 1,
+    "nas": 5,
+    "network": 4,
+    "unknown": 1,
+}
+
+# 各類型的退避倍數（磁碟空間要等其他樣本完成才會釋放）
+DELAY_FACTORS = {
+    "disk_full": 4,
+}
+
+FAILURE_LABELS = {
+    "not_found": "樣本不存在",
+    "disk_full": "磁碟空間不足",
+    "corrupt": "檔案損毀",
+    "nas": "NAS 錯誤",
+    "network": "網路錯誤",
+    "unknown": "未知錯誤",
+}
+
+
+def classify_error(error, stage=None):
+    """
+    依錯誤訊息判斷失敗類型
+
+    Args:
+        error: 例外物件或錯誤訊息（例外的類型名稱也參與比對）
+        stage: 失敗的管線階段（訊息無法辨識時，上傳階段視為 NAS 錯誤）
+
+    Returns:
+        str: FAILURE_RULES 中的類型名稱或 "unknown"
+    """
+    text = str(error)
+    if isinstance(error, BaseException):
+        text = f"{type(error).__name__}: {text}"
+        if getattr(error, "errno", None) == 28:
+            return "disk_full"
+    for name, pattern in FAILURE_RULES:
+        if pattern.search(text):
+            return name
+    if stage == "upload":
+        return "nas"
+    return "unknown"
+
+
+def parse_budgets(text):
+    """解析 "network=4,nas=5" 格式的重試次數設定，未列出的類型使用預設值"""
+    budgets = dict(DEFAULT_BUDGETS)
+    for item in (text or "").split(","):
+        if "=" not in item:
+            continue
+        name, _, value = item.partition("=")
+        name = name.strip()
+        if name not in budgets:
+            print(f"⚠️  未知的錯誤類型 {name}，忽略")
+            continue
+        try:
+            budgets[name] = max(0, int(value))
+        except ValueError:
+            print(f"⚠️  無法解析 {item.strip()}，忽略")
+    return budgets
+
+
+class RetryPolicy:
+    """決定失敗的樣本是否重試、等待多久（只記錄本次執行，線程安全）"""
+
+    def __init__(self, budgets=None, max_retries=3, base_delay=60, max_delay=1800, jitter=0.25):
+        """
+        Args:
+            budgets: 各類型的重試次數上限（None 表示 DEFAULT_BUDGETS）
+            max_retries: 每個樣本不分類型的重試總次數上限
+            base_delay: 第一次重試前的等待秒數（之後每次加倍）
+            max_delay: 單次等待的上限
+            jitter: 隨機抖動比例（0.25 表示 ±25%）
+        """
+        self.budgets = dict(DEFAULT_BUDGETS if budgets is None else budgets)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+
+        self._retries = defaultdict(lambda: defaultdict(int))  # run_id -> 類型 -> 已重試次數
+        self._lock = threading.Lock()
+
+    def decide(self, run_id, failure):
+        """
+        登記一次失敗並決定是否重試
+
+        Returns:
+            float: 重試前的等待秒數；不重試（永久性錯誤或次數用完）時回傳 None
+        """
+        with self._lock:
+            counts = self._retries[run_id]
+            if counts[failure] >= self.budgets.get(failure, 0):
+                return None
+            if sum(counts.values()) >= self.max_retries:
+                return None
+            counts[failure] += 1
+            attempt = sum(counts.values())
+
+        delay = min(self.base_delay * 2 ** (attempt - 1), self.max_delay) * DELAY_FACTORS.get(failure, 1)
+        if self.jitter > 0:
+            delay *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        return delay
+
+    def retries(self, run_id):
+        """樣本在本次執行中已重試的次數"""
+        with self._lock:
+            return sum(self._retries.get(run_id, {}).values())
+
+
+class RetryScheduler:
+    """等待到期後重新提交樣本（背景線程）"""
+
+    def __init__(self, submit):
+        """
+        Args:
+            submit: 重新提交的函數 submit(job)，例如 pipeline.submit（可能因背壓阻塞）
+        """
+        self.submit = submit
+        self._heap = []  # (due, 序號, job)
+        self._counter = 0
+        self._submitting = 0
+        self._cond = threading.Condition()
+        self._stop = False
+        self._thread = None
+
+    def schedule(self, job, delay):
+        """delay 秒後重新提交 job"""
+        with self._cond:
+            self._counter += 1
+            heapq.heappush(self._heap, (time.time() + delay, self._counter, job))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._worker, name="retry-scheduler", daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+
+    def pending(self):
+        """等待重試（含提交中）的樣本數"""
+        with self._cond:
+            return len(self._heap) + self._submitting
+
+    def wait_idle(self):
+        """等待所有排定的重試都已提交"""
+        with self._cond:
+            while (self._heap or self._submitting) and not self._stop:
+                self._cond.wait()
+
+    def shutdown(self):
+        """停止並捨棄尚未到期的重試，回傳被捨棄的 run_id"""
+        with self._cond:
+            self._stop = True
+            dropped = [job["run_id"] for _, _, job in self._heap]
+            self._heap = []
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+        return dropped
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._stop:
+                    if self._heap and self._heap[0][0] <= time.time():
+                        break
+                    timeout = self._heap[0][0] - time.time() if self._heap else None
+                    self._cond.wait(timeout)
+                if self._stop:
+                    return
+                _, _, job = heapq.heappop(self._heap)
+                self._submitting += 1
+            try:
+                print(f"\n🔁 重新提交: {job['run_id']}", flush=True)
+                self.submit(job)
+            except Exception as e:
+                print(f"⚠️  重新提交 {job['run_id']} 失敗: {e}", flush=True)
+            finally:
+                with self._cond:
+                    self._submitting -= 1
+                    self._cond.notify_all()
+
+
+_default_policy = None
+_default_policy_lock = threading.Lock()
+
+
+def get_retry_policy():
+    """取得依 config.py 設定建立的共用重試策略"""
+    global _default_policy
+    with _default_policy_lock:
+        if _default_policy is None:
+            from config import MAX_RETRIES, RETRY_BACKOFF_SECONDS, RETRY_BUDGETS, RETRY_JITTER, RETRY_MAX_BACKOFF_SECONDS
+
+            _default_policy = RetryPolicy(
+                budgets=parse_budgets(RETRY_BUDGETS),
+                max_retries=MAX_RETRIES,
+                base_delay=RETRY_BACKOFF_SECONDS,
+                max_delay=RETRY_MAX_BACKOFF_SECONDS,
+                jitter=RETRY_JITTER,
+            )
+        return _default_policy
+
+
+if __name__ == "__main__":
+    from state_store import get_run_state_store
+
+    failed = get_run_state_store().failed_entries()
+    groups = defaultdict(list)
+    for entry in failed:
+        groups[classify_error(entry["error"] or "")].append(entry)
+
+    budgets = get_retry_policy().budgets
+    print(f"❌ 狀態資料庫中的失敗樣本: {len(failed)} 個")
+    for name in list(DEFAULT_BUDGETS):
+        entries = groups.get(name, [])
+        if not entries:
+            continue
+        retry = f"重試 {budgets[name]} 次" if budgets[name] else "不重試"
+        print(f"   {FAILURE_LABELS[name]:<10}{len(entries):>6} 個  ({retry})")
+        for entry in entries[:3]:
+            print(f"      {entry['run_id']:<14}{(entry['error'] or '')[:80]}")
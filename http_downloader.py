@@ -0,0 +1,604 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+內建的多段 HTTP 下載引擎（不需要 aria2）
+- 以 N 個並行的 Range 請求下載到預先配置大小的 .part 檔案
+- 每段的進度記錄在 <檔名>.segments.json，中斷後可從各段的位置續傳
+- 驗證 Content-Length / Content-Range，下載同時依序計算 MD5
+- 每個線程使用自己的 requests.Session（keep-alive 連線重複使用）
+
+多鏡像（hedged）模式:
+- 先以小的 Range 請求同時探測所有鏡像，從最快的開始下載
+- 下載中持續量測速度，明顯低於其他鏡像時把剩餘的段落改到較快的鏡像續傳
+- 收尾時閒置的連線會把進行中最大的段落切一半接手，避免最後一段拖慢整體
+
+用法:
+    python http_downloader.py <URL> [URL ...] <輸出檔案>
+"""
+
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+from pathlib import Path
+from urllib.parse import urlparse
+
+import requests
+
+MB = 1024 * 1024
+
+# 每次從回應讀取的大小
+READ_SIZE = 256 * 1024
+
+# 探測鏡像時下載的位元組數（用來量測首位元組時間與速度）
+PROBE_BYTES = 256 * 1024
+
+# 段落剩餘超過這個大小才切給閒置的連線
+MIN_SPLIT_SIZE = 4 * MB
+
+
+class DownloadError(Exception):
+    """下載失敗（重試後仍無法完成，或校驗不符）"""
+
+
+class DownloadCancelled(DownloadError):
+    """下載被 cancel() 中止（已下載的部分保留，可續傳）"""
+
+
+class _Reroute(Exception):
+    """改用其他鏡像，段落放回佇列從目前位置續傳（不計入重試次數）"""
+
+
+def probe(url, session=None, timeout=30, probe_bytes=1):
+    """
+    以 Range 請求探測檔案，並量測首位元組時間與速度
+
+    Returns:
+        dict: {"source": 原始網址, "url": 重導向後的網址, "size": 檔案大小或 None,
+               "ranges": 是否支援 Range, "validator": ETag 或 Last-Modified,
+               "ttfb": 首位元組秒數, "speed": bytes/s（不支援 Range 時為 0）,
+               "received": 探測下載的位元組數}
+    """
+    session = session or requests.Session()
+    start = time.time()
+    headers = {"Range": f"bytes=0-{probe_bytes - 1}"}
+    with session.get(url, headers=headers, stream=True, timeout=timeout, allow_redirects=True) as r:
+        ttfb = time.time() - start
+        if r.status_code == 404:
+            raise DownloadError(f"檔案不存在 (HTTP 404): {url}")
+        r.raise_for_status()
+        result = {
+            "source": url,
+            "url": r.url,
+            "validator": r.headers.get("ETag") or r.headers.get("Last-Modified"),
+            "ttfb": ttfb,
+            "speed": 0.0,
+        }
+        if r.status_code == 206:
+            match = re.match(r"bytes 0-\d+/(\d+)", r.headers.get("Content-Range", ""))
+            size = int(match.group(1)) if match else None
+            received = 0
+            for chunk in r.iter_content(64 * 1024):
+                received += len(chunk)
+                if received >= probe_bytes:
+                    break
+            result["speed"] = received / max(time.time() - start, 1e-6)
+            result.update(size=size, ranges=size is not None, received=received)
+            return result
+        length = r.headers.get("Content-Length")
+        result.update(size=int(length) if length else None, ranges=False, received=0)
+        return result
+
+
+def probe_mirrors(urls, probe_bytes=PROBE_BYTES, timeout=30, quiet=False, expected_size=None, all_results=None):
+    """
+    同時探測多個鏡像，依速度由快到慢排序
+
+    大小與其他鏡像不同的鏡像（不同版本的檔案）會被排除: 有 expected_size 時以它為準，
+    否則取最多鏡像回報的大小，同票時以列表中較前面的鏡像為準。
+
+    Args:
+        all_results: 傳入列表時，所有探測結果（包含失敗的，失敗者有 "error" 欄位）會加入其中
+
+    Returns:
+        list: probe() 的結果（只含可用的鏡像）
+    """
+    results = [None] * len(urls)
+
+    def run(i, url):
+        try:
+            results[i] = probe(url, timeout=timeout, probe_bytes=probe_bytes)
+        except Exception as e:
+            results[i] = {"source": url, "error": str(e)}
+
+    threads = [threading.Thread(target=run, args=(i, url), daemon=True) for i, url in enumerate(urls)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(timeout + 5)
+
+    if all_results is not None:
+        all_results.extend(r for r in results if r)
+    usable = [r for r in results if r and "error" not in r and r["size"]]
+    if usable:
+        sizes = [r["size"] for r in usable]
+        size = expected_size or max(sizes, key=lambda value: (sizes.count(value), -sizes.index(value)))
+        usable = [r for r in usable if r["size"] == size]
+    usable.sort(key=lambda r: (not r["ranges"], -r["speed"]))
+
+    if not quiet:
+        for r in results:
+            if r is None:
+                continue
+            host = urlparse(r["source"]).netloc
+            if "error" in r:
+                print(f"    🔎 {host}: ❌ {r['error'][:80]}")
+            else:
+                print(f"    🔎 {host}: 首位元組 {r['ttfb'] * 1000:.0f} ms, {r['speed'] / MB:.2f} MB/s"
+                      f"{'' if r in usable else ' (不使用)'}")
+    return usable
+
+
+class SegmentedDownload:
+    """單一檔案的多段下載（可指定多個鏡像）"""
+
+    def __init__(
+        self,
+        url,
+        dest,
+        connections=8,
+        segment_size=64 * MB,
+        expected_md5=None,
+        expected_size=None,
+        timeout=60,
+        max_retries=5,
+        progress_interval=30,
+        checkpoint_interval=2,
+        reroute_interval=30,
+        switch_ratio=0.3,
+        probe_bytes=PROBE_BYTES,
+    ):
+        """
+        Args:
+            url: 下載網址，或同一檔案的多個鏡像網址列表
+            dest: 完成後的檔案路徑
+            connections: 並行連線數
+            segment_size: 每段大小上限（檔案較小時自動縮小，讓每個連線都有工作）
+            expected_md5: 預期的 MD5（有則在完成時比對）
+            expected_size: 預期的大小（有則與伺服器回報的 Content-Length 比對）
+            timeout: 連線/讀取逾時秒數
+            max_retries: 每段失敗的重試次數（重試會輪流使用其他鏡像）
+            progress_interval: 顯示進度的間隔秒數（0 表示不顯示）
+            checkpoint_interval: 寫入段落記錄的間隔秒數
+            reroute_interval: 檢查是否改用其他鏡像的間隔秒數（只有多鏡像時）
+            switch_ratio: 目前每條連線的速度低於其他鏡像探測速度的這個比例時改用該鏡像
+            probe_bytes: 探測鏡像時下載的位元組數
+        """
+        self.urls = [url] if isinstance(url, str) else list(url)
+        self.url = self.urls[0]
+        self.dest = Path(dest)
+        self.part_file = self.dest.with_name(self.dest.name + ".part")
+        self.map_file = self.dest.with_name(self.dest.name + ".segments.json")
+        self.connections = max(1, int(connections))
+        self.segment_size = max(MB, int(segment_size))
+        self.expected_md5 = expected_md5
+        self.expected_size = expected_size
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.progress_interval = progress_interval
+        self.checkpoint_interval = checkpoint_interval
+        self.reroute_interval = reroute_interval
+        self.switch_ratio = switch_ratio
+        self.probe_bytes = probe_bytes
+
+        self.size = None
+        self.segments = []  # [[start, end(含), done], ...]
+        self.resumed_bytes = 0
+        self.mirrors = []  # probe() 結果，依速度排序
+        self.primary = 0  # 目前主要使用的鏡像
+        self.reroutes = 0
+        self.splits = 0
+        self._lock = threading.Lock()
+        self._cancel = threading.Event()
+        self._errors = []
+        self._pending = []
+        self._inflight = set()
+        self._retries = {}
+        self._generation = 0
+        self._fd = None
+        self._ranges = True
+        # 每個鏡像主機的統計: {host: {"requests", "errors", "bytes", "seconds", "ttfb_sum", "ttfb_count"}}
+        self.host_stats = {}
+        # 所有鏡像的探測結果（包含失敗的）
+        self.probe_results = []
+
+    # ==================== 狀態 ====================
+
+    def cancel(self):
+        """中止下載（保留已下載的部分與段落記錄）"""
+        self._cancel.set()
+
+    def downloaded_bytes(self):
+        with self._lock:
+            return sum(done for _, _, done in self.segments)
+
+    def status(self):
+        """每段的進度: [(start, end, done), ...]（依起點排序）"""
+        with self._lock:
+            return sorted(tuple(seg) for seg in self.segments)
+
+    def primary_host(self):
+        return urlparse(self.mirrors[self.primary]["url"]).netloc if self.mirrors else ""
+
+    def _contiguous_bytes(self):
+        """從檔案開頭起連續完成的位元組數（計算 MD5 用）"""
+        for start, end, done in self.status():
+            if done < end - start + 1:
+                return start + done
+        return self.size
+
+    # ==================== 段落記錄 ====================
+
+    def _plan_segments(self):
+        segment_size = min(self.segment_size, max(MB, -(-self.size // self.connections)))
+        return [
+            [start, min(start + segment_size, self.size) - 1, 0]
+            for start in range(0, self.size, segment_size)
+        ]
+
+    def _load_map(self, validator):
+        """載入段落記錄；大小不符或同一網址的 ETag 改變時捨棄"""
+        if not self.map_file.exists() or not self.part_file.exists():
+            return None
+        try:
+            with open(self.map_file, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+        except Exception:
+            return None
+        if saved.get("size") != self.size or self.part_file.stat().st_size != self.size:
+            return None
+        if saved.get("url") == self.url and validator and saved.get("validator") not in (None, validator):
+            return None
+        return saved["segments"]
+
+    def _save_map(self, validator):
+        # 先讓資料落地，再記錄進度，避免當機後記錄領先實際資料
+        os.fsync(self._fd)
+        data = {
+            "url": self.url,
+            "size": self.size,
+            "validator": validator,
+            "segments": self.status(),
+            "updated": time.time(),
+        }
+        temp_file = self.map_file.with_suffix(".tmp")
+        with open(temp_file, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        temp_file.replace(self.map_file)
+
+    def discard_partial(self):
+        """刪除 .part 與段落記錄"""
+        for path in (self.part_file, self.map_file):
+            if path.exists():
+                path.unlink()
+
+    # ==================== 下載 ====================
+
+    def _next_segment(self):
+        """取出下一個待下載的段落；佇列空了就切分進行中最大的段落，都沒有時回傳 None"""
+        with self._lock:
+            if self._pending:
+                index = self._pending.pop(0)
+                self._inflight.add(index)
+                return index
+            if not self._ranges:
+                return None
+
+            best, best_remaining = None, 2 * MIN_SPLIT_SIZE
+            for index in self._inflight:
+                start, end, done = self.segments[index]
+                remaining = end - (start + done) + 1
+                if remaining > best_remaining:
+                    best, best_remaining = index, remaining
+            if best is None:
+                return None
+
+            start, end, done = self.segments[best]
+            middle = start + done + best_remaining // 2
+            self.segments[best][1] = middle - 1
+            self.segments.append([middle, end, 0])
+            index = len(self.segments) - 1
+            self._inflight.add(index)
+            self.splits += 1
+            return index
+
+    def _mirror_for(self, index):
+        """段落使用的鏡像: 主要鏡像，重試時依次輪到其他鏡像"""
+        with self._lock:
+            mirror = self.mirrors[(self.primary + self._retries.get(index, 0)) % len(self.mirrors)]
+            return mirror, self._generation
+
+    def _account(self, mirror, request, ok):
+        """累計每個鏡像的請求統計（供記分板使用）"""
+        host = urlparse(mirror["source"]).netloc
+        with self._lock:
+            stats = self.host_stats.setdefault(
+                host, {"requests": 0, "errors": 0, "bytes": 0, "seconds": 0.0, "ttfb_sum": 0.0, "ttfb_count": 0}
+            )
+            stats["requests"] += 1
+            stats["errors"] += 0 if ok else 1
+            stats["bytes"] += request["bytes"]
+            stats["seconds"] += time.time() - request["started"]
+            if request["ttfb"] is not None:
+                stats["ttfb_sum"] += request["ttfb"]
+                stats["ttfb_count"] += 1
+
+    def _worker(self):
+        session = requests.Session()
+        try:
+            while not self._cancel.is_set():
+                index = self._next_segment()
+                if index is None:
+                    return
+                mirror, generation = self._mirror_for(index)
+                request = {"started": time.time(), "ttfb": None, "bytes": 0}
+                try:
+                    self._fetch_segment(session, mirror["url"], index, generation, request)
+                    self._account(mirror, request, ok=True)
+                    with self._lock:
+                        self._inflight.discard(index)
+                except DownloadCancelled:
+                    self._account(mirror, request, ok=True)
+                    return
+                except _Reroute:
+                    self._account(mirror, request, ok=True)
+                    with self._lock:
+                        self._inflight.discard(index)
+                        self._pending.insert(0, index)
+                except Exception as e:
+                    self._account(mirror, request, ok=False)
+                    with self._lock:
+                        self._inflight.discard(index)
+                        self._retries[index] = self._retries.get(index, 0) + 1
+                        if self._retries[index] > self.max_retries:
+                            self._errors.append(e)
+                            self._cancel.set()
+                            return
+                        # 放回佇列，下次從已完成的位置續傳
+                        self._pending.append(index)
+                        delay = 0 if len(self.mirrors) > 1 else min(2 ** self._retries[index], 30)
+                    time.sleep(delay)
+        finally:
+            session.close()
+
+    def _fetch_segment(self, session, url, index, generation, request):
+        with self._lock:
+            start, end, done = self.segments[index]
+        if not self._ranges:
+            # 不支援 Range 的伺服器只能從頭重新下載
+            done = 0
+        pos = start + done
+        if pos > end:
+            return
+
+        headers = {"Range": f"bytes={pos}-{end}"} if self._ranges else {}
+        with session.get(url, headers=headers, stream=True, timeout=self.timeout) as r:
+            request["ttfb"] = time.time() - request["started"]
+            if self._ranges:
+                if r.status_code != 206:
+                    raise DownloadError(f"伺服器未回應部分內容 (HTTP {r.status_code})")
+                content_range = r.headers.get("Content-Range", "")
+                if not content_range.startswith(f"bytes {pos}-"):
+                    raise DownloadError(f"Content-Range 不符: {content_range} (要求 {pos}-{end})")
+                expected = end - pos + 1
+                length = r.headers.get("Content-Length")
+                if length is not None and int(length) != expected:
+                    raise DownloadError(f"Content-Length 不符: {length} (預期 {expected})")
+            else:
+                r.raise_for_status()
+
+            for chunk in r.iter_content(READ_SIZE):
+                if self._cancel.is_set():
+                    raise DownloadCancelled()
+                if self._generation != generation:
+                    raise _Reroute()
+                if not chunk:
+                    continue
+                with self._lock:
+                    # 段落可能已被切分給其他連線，只寫到目前的結尾
+                    end = self.segments[index][1]
+                chunk = chunk[: end - pos + 1]
+                os.pwrite(self._fd, chunk, pos)
+                pos += len(chunk)
+                request["bytes"] += len(chunk)
+                with self._lock:
+                    end = self.segments[index][1]
+                    self.segments[index][2] = min(pos, end + 1) - start
+                if pos > end:
+                    break
+
+        with self._lock:
+            end = self.segments[index][1]
+        if pos <= end:
+            raise DownloadError(f"連線提前結束 ({pos}/{end + 1})")
+
+    def _maybe_reroute(self, speed):
+        """目前鏡像明顯比其他鏡像慢時改用較快的鏡像，進行中的段落從目前位置續傳"""
+        with self._lock:
+            active = max(1, len(self._inflight))
+        per_connection = speed / active
+        others = [m for i, m in enumerate(self.mirrors) if i != self.primary]
+        if not others or per_connection >= self.switch_ratio * max(m["speed"] for m in others):
+            return
+
+        # 探測結果可能過時，重新量測一次再決定
+        fresh = probe_mirrors([m["source"] for m in others], self.probe_bytes, self.timeout, quiet=True,
+                              expected_size=self.size)
+        fresh = [m for m in fresh if m["size"] == self.size and m["ranges"]]
+        if not fresh or per_connection >= self.switch_ratio * fresh[0]["speed"]:
+            return
+
+        best = fresh[0]
+        old_host = self.primary_host()
+        with self._lock:
+            for i, m in enumerate(self.mirrors):
+                if m["source"] == best["source"]:
+                    self.mirrors[i] = best
+                    self.primary = i
+            self._generation += 1
+            self.reroutes += 1
+        print(f"    🔀 {old_host} 每連線僅 {per_connection / MB:.2f} MB/s，"
+              f"剩餘段落改由 {self.primary_host()} ({best['speed'] / MB:.2f} MB/s) 續傳", flush=True)
+
+    def run(self):
+        """
+        執行下載（阻塞直到完成）
+
+        Returns:
+            dict: {"size": bytes, "md5": hex, "elapsed": 秒, "resumed_bytes": 續傳沿用的位元組數,
+                   "mirror": 最後使用的鏡像主機, "reroutes": 換鏡像次數, "splits": 切分段落次數}
+        """
+        start_time = time.time()
+        if len(self.urls) > 1:
+            self.mirrors = probe_mirrors(self.urls, self.probe_bytes, self.timeout,
+                                         expected_size=self.expected_size, all_results=self.probe_results)
+            if not self.mirrors:
+                raise DownloadError("所有鏡像都無法使用")
+        else:
+            try:
+                self.mirrors = [probe(self.url, timeout=self.timeout)]
+            except Exception as e:
+                self.probe_results.append({"source": self.url, "error": str(e)})
+                raise
+            self.probe_results.append(self.mirrors[0])
+        info = self.mirrors[0]
+        self.size = info["size"]
+        validator = info["validator"]
+        self._ranges = info["ranges"]
+
+        if not self.size:
+            raise DownloadError("伺服器未提供檔案大小，無法分段下載")
+        if self.expected_size and self.expected_size != self.size:
+            raise DownloadError(f"檔案大小與預期不符: {self.size} (預期 {self.expected_size})")
+
+        self.dest.parent.mkdir(parents=True, exist_ok=True)
+        saved = self._load_map(validator) if self._ranges else None
+        if saved:
+            self.segments = [list(seg) for seg in saved]
+            self.resumed_bytes = self.downloaded_bytes()
+            print(f"    ↩️  續傳: 已有 {self.resumed_bytes / MB:.1f} / {self.size / MB:.1f} MB")
+        else:
+            self.discard_partial()
+            self.segments = self._plan_segments() if self._ranges else [[0, self.size - 1, 0]]
+
+        self._fd = os.open(self.part_file, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(self._fd).st_size != self.size:
+                os.ftruncate(self._fd, self.size)
+                if hasattr(os, "posix_fallocate"):
+                    try:
+                        os.posix_fallocate(self._fd, 0, self.size)
+                    except OSError:
+                        pass  # 檔案系統不支援時只保留稀疏檔案
+
+            self._pending = [i for i, (s, e, d) in enumerate(self.segments) if d < e - s + 1]
+            workers = self.connections if self._ranges else 1
+            threads = [threading.Thread(target=self._worker, daemon=True) for _ in range(workers)]
+            for t in threads:
+                t.start()
+
+            md5 = hashlib.md5()
+            hashed = 0
+            last_checkpoint = last_report = last_reroute = time.time()
+            report_bytes = reroute_bytes = self.downloaded_bytes()
+
+            while any(t.is_alive() for t in threads):
+                time.sleep(0.5)
+                # 依序把已連續完成的部分加入 MD5（資料仍在頁快取中，讀取很便宜）
+                hashed = self._hash_until(md5, hashed, self._contiguous_bytes())
+
+                now = time.time()
+                if now - last_checkpoint >= self.checkpoint_interval:
+                    self._save_map(validator)
+                    last_checkpoint = now
+                if self.progress_interval and now - last_report >= self.progress_interval:
+                    current = self.downloaded_bytes()
+                    self._report(current, (current - report_bytes) / (now - last_report))
+                    last_report, report_bytes = now, current
+                if len(self.mirrors) > 1 and self._ranges and now - last_reroute >= self.reroute_interval:
+                    current = self.downloaded_bytes()
+                    self._maybe_reroute((current - reroute_bytes) / (now - last_reroute))
+                    last_reroute, reroute_bytes = time.time(), self.downloaded_bytes()
+
+            for t in threads:
+                t.join()
+            self._save_map(validator)
+
+            if self._errors:
+                raise DownloadError(f"下載失敗: {self._errors[0]}")
+            downloaded = self.downloaded_bytes()
+            if self._cancel.is_set() and downloaded != self.size:
+                raise DownloadCancelled("下載已中止")
+            if downloaded != self.size:
+                raise DownloadError(f"下載大小不符: {downloaded} / {self.size}")
+
+            hashed = self._hash_until(md5, hashed, self.size)
+            digest = md5.hexdigest()
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+        if self.expected_md5 and digest != self.expected_md5.lower():
+            self.discard_partial()
+            raise DownloadError(f"MD5 不符: {digest} (預期 {self.expected_md5})")
+
+        self.part_file.replace(self.dest)
+        self.map_file.unlink()
+        return {
+            "size": self.size,
+            "md5": digest,
+            "elapsed": time.time() - start_time,
+            "resumed_bytes": self.resumed_bytes,
+            "mirror": self.primary_host(),
+            "reroutes": self.reroutes,
+            "splits": self.splits,
+        }
+
+    def _hash_until(self, md5, hashed, limit):
+        while hashed < limit:
+            data = os.pread(self._fd, min(8 * MB, limit - hashed), hashed)
+            if not data:
+                break
+            md5.update(data)
+            hashed += len(data)
+        return hashed
+
+    def _report(self, current, speed):
+        status = self.status()
+        finished = sum(1 for s, e, d in status if d >= e - s + 1)
+        active = sum(1 for s, e, d in status if 0 < d < e - s + 1)
+        print(
+            f"    📶 {current / MB:.0f}/{self.size / MB:.0f} MB ({current / self.size:.0%}) "
+            f"{speed / MB:.2f} MB/s via {self.primary_host()} | "
+            f"段: {finished} 完成, {active} 進行中, {len(status)} 總數",
+            flush=True,
+        )
+
+
+def download(url, dest, connections=8, segment_size=64 * MB, expected_md5=None, **kwargs):
+    """下載單一檔案（SegmentedDownload 的便捷包裝；url 可為鏡像列表）"""
+    return SegmentedDownload(
+        url, dest, connections=connections, segment_size=segment_size, expected_md5=expected_md5, **kwargs
+    ).run()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("用法: python http_downloader.py <URL> [URL ...] <輸出檔案>")
+        sys.exit(1)
+    result = download(sys.argv[1:-1], sys.argv[-1], progress_interval=5)
+    print(f"✅ 完成: {result['size'] / MB:.1f} MB, {result['elapsed']:.1f} 秒, MD5 {result['md5']} "
+          f"(鏡像 {result['mirror']}, 換鏡像 {result['reroutes']} 次, 切分 {result['splits']} 次)")
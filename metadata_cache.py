@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+樣本 metadata 本地快取（SQLite）
+以 run accession 為鍵，儲存 ENA filereport 與 NCBI runinfo 的欄位，每個欄位有各自的有效期限:
+- layout 這類不會變的欄位保留很久，下載 URL 這類可能變動的欄位較短
+- 查不到的樣本也會記錄（較短的有效期限），避免每次都重新查詢
+
+先執行一次 prefetch 之後，排程、驗證與大小檢查腳本都直接讀快取，不需要連網。
+
+用法:
+    python metadata_cache.py prefetch            # 預先抓取 runs.txt 中所有樣本
+    python metadata_cache.py prefetch --refresh  # 忽略有效期限，全部重新抓取
+    python metadata_cache.py show SRR123 ...     # 顯示快取內容
+    python metadata_cache.py                     # 顯示快取統計
+"""
+
+import json
+import sqlite3
+import sys
+import threading
+import time
+from pathlib import Path
+
+import requests
+
+ENA_SEARCH_URL = "https://www.ebi.ac.uk/ena/portal/api/search"
+
+DAY = 24 * 3600
+
+# 欄位 -> (來源, 有效期限秒數)
+FIELDS = {
+    # ENA read_run
+    "fastq_bytes": ("ena", 90 * DAY),     # 所有 fastq.gz 大小總和
+    "fastq_md5": ("ena", 90 * DAY),       # 每個 fastq.gz 的 MD5（列表）
+    "fastq_ftp": ("ena", 7 * DAY),        # 每個 fastq.gz 的下載位置（列表）
+    "read_count": ("ena", 365 * DAY),
+    "base_count": ("ena", 365 * DAY),
+    # NCBI SRA
+    "layout": ("ncbi", 365 * DAY),        # SINGLE / PAIRED / UNKNOWN
+    "spots": ("ncbi", 365 * DAY),
+    "bases": ("ncbi", 365 * DAY),
+    "sra_size": ("ncbi", 90 * DAY),       # .sra 檔大小
+    "sra_md5": ("ncbi", 90 * DAY),        # .sra 檔 MD5（下載時比對，相符則跳過 vdb-validate）
+}
+
+# 來源查不到樣本時，記錄為 None 的有效期限
+NEGATIVE_TTL = 1 * DAY
+
+ENA_RETURN_FIELDS = "run_accession,fastq_bytes,fastq_md5,fastq_ftp,read_count,base_count"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS metadata (
+    run_id      TEXT NOT NULL,
+    field       TEXT NOT NULL,
+    value       TEXT,
+    fetched_at  REAL NOT NULL,
+    PRIMARY KEY (run_id, field)
+);
+"""
+
+
+# ==================== 資料來源 ====================
+
+def _split_list(value):
+    return [part for part in (value or "").split(";") if part]
+
+
+def _int_or_none(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def fetch_ena(run_ids, batch_size=200):
+    """
+    批次查詢 ENA read_run 欄位
+
+    Returns:
+        dict: {run_id: {欄位: 值}}（只含 ENA 來源的欄位）
+    """
+    run_ids = list(run_ids)
+    results = {}
+    for i in range(0, len(run_ids), batch_size):
+        batch = run_ids[i:i + batch_size]
+        data = {
+            "result": "read_run",
+            "includeAccessions": ",".join(batch),
+            "fields": ENA_RETURN_FIELDS,
+            "format": "tsv",
+        }
+        response = requests.post(ENA_SEARCH_URL, data=data, timeout=60)
+        response.raise_for_status()
+
+        lines = response.text.strip().split("\n")
+        if len(lines) < 2:
+            continue
+        header = lines[0].split("\t")
+        for line in lines[1:]:
+            row = dict(zip(header, line.split("\t")))
+            run_id = row.get("run_accession")
+            if not run_id:
+                continue
+            sizes = [int(s) for s in _split_list(row.get("fastq_bytes")) if s.isdigit()]
+            results[run_id] = {
+                "fastq_bytes": sum(sizes) or None,
+                "fastq_md5": _split_list(row.get("fastq_md5")) or None,
+                "fastq_ftp": _split_list(row.get("fastq_ftp")) or None,
+                "read_count": _int_or_none(row.get("read_count")),
+                "base_count": _int_or_none(row.get("base_count")),
+            }
+    return results
+
+
+def fetch_ncbi(run_ids):
+    """批次查詢 NCBI SRA 的 layout / spots / bases / 大小"""
+    from ncbi_client import get_ncbi_client
+
+    results = {}
+    for run_id, info in get_ncbi_client().fetch_run_info(run_ids).items():
+        results[run_id] = {
+            "layout": info["layout"],
+            "spots": info["spots"],
+            "bases": info["bases"],
+            "sra_size": info["size"],
+            "sra_md5": info.get("md5"),
+        }
+    return results
+
+
+SOURCES = {"ena": fetch_ena, "ncbi": fetch_ncbi}
+
+
+# ==================== 快取 ====================
+
+class RunMetadataCache:
+    """樣本 metadata 快取（線程安全）"""
+
+    def __init__(self, db_file="run_metadata.db", ttls=None):
+        """
+        Args:
+            db_file: SQLite 檔案
+            ttls: 覆寫部分欄位的有效期限 {欄位: 秒數}
+        """
+        self.db_file = Path(db_file)
+        self.ttls = {field: ttl for field, (_, ttl) in FIELDS.items()}
+        self.ttls.update(ttls or {})
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_file), timeout=30, check_same_thread=False, isolation_level=None)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _rows(self, run_ids, fields):
+        """讀取指定樣本與欄位的所有記錄: {run_id: {field: (value, fetched_at)}}"""
+        rows = {}
+        run_ids = list(run_ids)
+        with self._lock:
+            for i in range(0, len(run_ids), 500):
+                batch = run_ids[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                field_placeholders = ",".join("?" * len(fields))
+                cursor = self._conn.execute(
+                    f"SELECT run_id, field, value, fetched_at FROM metadata "
+                    f"WHERE run_id IN ({placeholders}) AND field IN ({field_placeholders})",
+                    batch + list(fields),
+                )
+                for run_id, field, value, fetched_at in cursor:
+                    rows.setdefault(run_id, {})[field] = (
+                        json.loads(value) if value is not None else None,
+                        fetched_at,
+                    )
+        return rows
+
+    def _is_fresh(self, field, value, fetched_at, now):
+        ttl = NEGATIVE_TTL if value is None else self.ttls[field]
+        return now - fetched_at < ttl
+
+    def get(self, run_ids, fields, include_stale=False):
+        """
+        讀取快取（不連網）
+
+        Returns:
+            dict: {run_id: {field: value}}，過期或不存在的欄位不會出現（include_stale=True 時仍回傳過期值）
+        """
+        now = time.time()
+        result = {}
+        for run_id, values in self._rows(run_ids, fields).items():
+            for field, (value, fetched_at) in values.items():
+                if include_stale or self._is_fresh(field, value, fetched_at, now):
+                    result.setdefault(run_id, {})[field] = value
+        return result
+
+    def stale(self, run_ids, fields):
+        """需要重新抓取的樣本: {來源: [run_id, ...]}"""
+        now = time.time()
+        rows = self._rows(run_ids, fields)
+        need = {}
+        for run_id in run_ids:
+            values = rows.get(run_id, {})
+            for field in fields:
+                entry = values.get(field)
+                if entry is None or not self._is_fresh(field, entry[0], entry[1], now):
+                    need.setdefault(FIELDS[field][0], []).append(run_id)
+        return {source: list(dict.fromkeys(ids)) for source, ids in need.items()}
+
+    def put(self, run_id, values, fetched_at=None):
+        """寫入單一樣本的多個欄位"""
+        self.put_many({run_id: values}, fetched_at)
+
+    def put_many(self, records, fetched_at=None):
+        """寫入多個樣本: {run_id: {field: value}}"""
+        fetched_at = fetched_at or time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for run_id, values in records.items():
+                    for field, value in values.items():
+                        self._conn.execute(
+                            "INSERT OR REPLACE INTO metadata (run_id, field, value, fetched_at) VALUES (?, ?, ?, ?)",
+                            (run_id, field, json.dumps(value) if value is not None else None, fetched_at),
+                        )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def refresh(self, source, run_ids):
+        """向來源抓取並寫入快取；來源中查不到的樣本記錄為 None（負快取）"""
+        if not run_ids:
+            return
+        fetched = SOURCES[source](run_ids)
+        source_fields = [field for field, (src, _) in FIELDS.items() if src == source]
+        records = {}
+        for run_id in run_ids:
+            values = fetched.get(run_id) or {}
+            records[run_id] = {field: values.get(field) for field in source_fields}
+        self.put_many(records)
+
+    def ensure(self, run_ids, fields, offline=False, refresh=False):
+        """
+        取得欄位值，缺少或過期的部分才向來源批次查詢
+
+        Args:
+            run_ids: 樣本 ID 列表
+            fields: 需要的欄位
+            offline: 只讀快取，不連網
+            refresh: 忽略有效期限全部重新抓取
+
+        Returns:
+            dict: {run_id: {field: value}}（查詢失敗時回傳快取中現有的值，包含已過期的）
+        """
+        run_ids = list(dict.fromkeys(run_ids))
+        fields = list(fields)
+        if not offline:
+            if refresh:
+                need = {}
+                for field in fields:
+                    need.setdefault(FIELDS[field][0], run_ids)
+            else:
+                need = self.stale(run_ids, fields)
+            for source, ids in need.items():
+                print(f"🌐 向 {source.upper()} 查詢 {len(ids)} 個樣本的 metadata...")
+                try:
+                    self.refresh(source, ids)
+                except Exception as e:
+                    print(f"⚠️  查詢 {source.upper()} 失敗，使用快取中的舊資料: {e}")
+        return self.get(run_ids, fields, include_stale=True)
+
+    def stats(self):
+        with self._lock:
+            runs = self._conn.execute("SELECT COUNT(DISTINCT run_id) FROM metadata").fetchone()[0]
+            rows = self._conn.execute(
+                "SELECT field, COUNT(*), SUM(value IS NULL), MIN(fetched_at) FROM metadata GROUP BY field"
+            ).fetchall()
+        return runs, rows
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_metadata_cache():
+    """取得依 config.py 設定建立的共用快取"""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            from config import METADATA_DB_FILE
+
+            _default_cache = RunMetadataCache(METADATA_DB_FILE)
+        return _default_cache
+
+
+def _read_runs_file(runs_file):
+    with open(runs_file, "r") as f:
+        return sorted({line.strip() for line in f if line.strip() and not line.startswith("#")})
+
+
+if __name__ == "__main__":
+    from config import RUNS_FILE
+
+    cache = get_metadata_cache()
+    args = sys.argv[1:]
+
+    if args and args[0] == "prefetch":
+        run_ids = _read_runs_file(RUNS_FILE)
+        print(f"📥 預先抓取 {RUNS_FILE} 中 {len(run_ids)} 個樣本的 metadata...")
+        start = time.time()
+        values = cache.ensure(run_ids, list(FIELDS), refresh="--refresh" in args)
+        complete = sum(1 for r in run_ids if values.get(r, {}).get("fastq_bytes") is not None)
+        print(f"✅ 完成 ({time.time() - start:.1f} 秒)，{complete}/{len(run_ids)} 個樣本有 ENA 大小資訊")
+
+    elif args and args[0] == "show":
+        values = cache.get(args[1:], list(FIELDS), include_stale=True)
+        for run_id in args[1:]:
+            print(f"\n📊 {run_id}")
+            for field in FIELDS:
+                print(f"   {field:<12} {values.get(run_id, {}).get(field, '(未快取)')}")
+
+    else:
+        runs, rows = cache.stats()
+        print("=" * 60)
+        print(f"📊 metadata 快取: {cache.db_file} ({runs} 個樣本)")
+        print("=" * 60)
+        print(f"   {'欄位':<14}{'筆數':>8}{'查無資料':>10}{'最舊 (天前)':>14}")
+        for field, count, missing, oldest in rows:
+            print(f"   {field:<14}{count:>8}{missing or 0:>10}{(time.time() - oldest) / DAY:>14.1f}")
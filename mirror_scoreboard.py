@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+鏡像健康度與速度記分板（SQLite）
+記錄每個鏡像主機的成功率、首位元組時間 (TTFB) 與持續速度，
+依「時段（小時）」與「accession 前綴（SRR/ERR/DRR）」分別統計，跨執行保存。
+每次下載前用來排序候選鏡像；optimize_download_speed.py 的測速結果也寫進同一個資料庫。
+
+統計以指數衰減累加（預設半衰期 7 天），較新的紀錄權重較高。
+細分的統計（某小時 + 某前綴）樣本不足時，依序退回到較粗的統計:
+    (小時, 前綴) → (小時, 全部) → (全部, 前綴) → (全部, 全部)
+
+用法:
+    python mirror_scoreboard.py            # 顯示各鏡像的整體統計
+    python mirror_scoreboard.py SRR123     # 顯示這個樣本在目前時段的鏡像排序
+"""
+
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from urllib.parse import urlparse
+
+# 不分時段 / 不分前綴的統計列
+ANY_HOUR = -1
+ANY_PREFIX = "*"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS mirror_stats (
+    host        TEXT NOT NULL,
+    hour        INTEGER NOT NULL,
+    prefix      TEXT NOT NULL,
+    attempts    REAL NOT NULL DEFAULT 0,
+    successes   REAL NOT NULL DEFAULT 0,
+    ttfb_sum    REAL NOT NULL DEFAULT 0,
+    ttfb_count  REAL NOT NULL DEFAULT 0,
+    bytes       REAL NOT NULL DEFAULT 0,
+    seconds     REAL NOT NULL DEFAULT 0,
+    updated_at  REAL NOT NULL,
+    PRIMARY KEY (host, hour, prefix)
+);
+"""
+
+
+def mirror_host(url):
+    """鏡像網址 → 主機名稱（已經是主機名稱時原樣回傳）"""
+    return urlparse(url).netloc or url
+
+
+def accession_prefix(run_id):
+    """SRR123456 → SRR（不同前綴來自不同的資料庫，鏡像表現可能不同）"""
+    prefix = ""
+    for ch in run_id or "":
+        if not ch.isalpha():
+            break
+        prefix += ch.upper()
+    return prefix or ANY_PREFIX
+
+
+class MirrorScoreboard:
+    """鏡像記分板（線程安全）"""
+
+    def __init__(self, db_file="mirror_scores.db", half_life_days=7.0, min_samples=3):
+        """
+        Args:
+            db_file: SQLite 檔案
+            half_life_days: 統計的半衰期（天）
+            min_samples: 細分統計至少需要的（衰減後）嘗試次數，不足時退回較粗的統計
+        """
+        self.db_file = Path(db_file)
+        self.half_life = half_life_days * 24 * 3600
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_file), timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _decay(self, updated_at, now):
+        return 0.5 ** (max(0.0, now - updated_at) / self.half_life)
+
+    # ==================== 記錄 ====================
+
+    def record(self, url, ok, ttfb=None, nbytes=0, seconds=0.0, run_id=None, when=None):
+        """
+        記錄一次對鏡像的請求或下載
+
+        Args:
+            url: 鏡像網址或主機名稱
+            ok: 是否成功
+            ttfb: 首位元組秒數（未知為 None）
+            nbytes: 傳輸的位元組數
+            seconds: 傳輸花費的秒數（每條連線的時間，用來計算持續速度）
+            run_id: 樣本 ID（用來取得 accession 前綴）
+            when: 發生時間（epoch 秒，預設為現在）
+        """
+        now = when or time.time()
+        host = mirror_host(url)
+        hour = datetime.fromtimestamp(now).hour
+        prefix = accession_prefix(run_id)
+        keys = {(hour, prefix), (hour, ANY_PREFIX), (ANY_HOUR, prefix), (ANY_HOUR, ANY_PREFIX)}
+
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for key_hour, key_prefix in keys:
+                    row = self._conn.execute(
+                        "SELECT * FROM mirror_stats WHERE host = ? AND hour = ? AND prefix = ?",
+                        (host, key_hour, key_prefix),
+                    ).fetchone()
+                    decay = self._decay(row["updated_at"], now) if row else 0.0
+
+                    def aged(field):
+                        return row[field] * decay if row else 0.0
+
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO mirror_stats "
+                        "(host, hour, prefix, attempts, successes, ttfb_sum, ttfb_count, bytes, seconds, updated_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (
+                            host, key_hour, key_prefix,
+                            aged("attempts") + 1,
+                            aged("successes") + (1 if ok else 0),
+                            aged("ttfb_sum") + (ttfb or 0.0),
+                            aged("ttfb_count") + (1 if ttfb is not None else 0),
+                            aged("bytes") + nbytes,
+                            aged("seconds") + seconds,
+                            now,
+                        ),
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def record_probes(self, probe_results, run_id=None):
+        """記錄鏡像探測結果（http_downloader.probe_mirrors 的 all_results）"""
+        for result in probe_results:
+            self.record(result["source"], "error" not in result, ttfb=result.get("ttfb"), run_id=run_id)
+
+    def record_download(self, download, run_id=None):
+        """記錄一次 SegmentedDownload 的探測結果與各鏡像的傳輸統計"""
+        self.record_probes(download.probe_results, run_id)
+        for host, stats in download.host_stats.items():
+            self.record(
+                host,
+                stats["errors"] == 0,
+                ttfb=stats["ttfb_sum"] / stats["ttfb_count"] if stats["ttfb_count"] else None,
+                nbytes=stats["bytes"],
+                seconds=stats["seconds"],
+                run_id=run_id,
+            )
+
+    # ==================== 排序 ====================
+
+    def summary(self, url, run_id=None, when=None):
+        """
+        取得鏡像在指定時段與前綴的統計（樣本不足時退回較粗的統計）
+
+        Returns:
+            dict 或 None: {"host", "scope", "attempts", "success_rate", "ttfb", "throughput"}
+        """
+        now = when or time.time()
+        host = mirror_host(url)
+        hour = datetime.fromtimestamp(now).hour
+        prefix = accession_prefix(run_id)
+        scopes = [(hour, prefix), (hour, ANY_PREFIX), (ANY_HOUR, prefix), (ANY_HOUR, ANY_PREFIX)]
+
+        with self._lock:
+            rows = {
+                (row["hour"], row["prefix"]): row
+                for row in self._conn.execute("SELECT * FROM mirror_stats WHERE host = ?", (host,))
+            }
+
+        for scope in scopes:
+            row = rows.get(scope)
+            if row is None:
+                continue
+            decay = self._decay(row["updated_at"], now)
+            attempts = row["attempts"] * decay
+            if round(attempts, 3) < self.min_samples and scope != scopes[-1]:
+                continue
+            return {
+                "host": host,
+                "scope": scope,
+                "attempts": attempts,
+                # 加上先驗（1 成功 / 2 次），樣本少時不會直接變成 0% 或 100%
+                "success_rate": (row["successes"] * decay + 1) / (attempts + 2),
+                "ttfb": row["ttfb_sum"] / row["ttfb_count"] if row["ttfb_count"] else None,
+                "throughput": row["bytes"] / row["seconds"] if row["seconds"] else None,
+            }
+        return None
+
+    def rank(self, urls, run_id=None, when=None, verbose=False):
+        """
+        依預期表現排序候選鏡像（成功率 × 持續速度，速度相同時 TTFB 較低者優先）
+
+        沒有紀錄的鏡像以目前最快鏡像一半的分數排序（排在表現好的鏡像之後、表現差的之前），
+        確保新鏡像也有機會被嘗試；分數相同時保留原本的順序。
+        """
+        summaries = [self.summary(url, run_id, when) for url in urls]
+        known = [s["throughput"] for s in summaries if s and s["throughput"]]
+        optimistic = max(known) if known else 1.0
+
+        def score(item):
+            index, summary = item
+            if summary is None:
+                return (-optimistic * 0.5, 0.0, index)
+            throughput = summary["throughput"] or optimistic
+            return (-summary["success_rate"] * throughput, summary["ttfb"] or 0.0, index)
+
+        ordered = sorted(enumerate(summaries), key=score)
+        if verbose:
+            for index, summary in ordered:
+                host = mirror_host(urls[index])
+                if summary is None:
+                    print(f"    📊 {host}: 尚無紀錄")
+                else:
+                    speed = f"{summary['throughput'] / 1024**2:.2f} MB/s" if summary["throughput"] else "速度未知"
+                    ttfb = f"{summary['ttfb'] * 1000:.0f} ms" if summary["ttfb"] is not None else "-"
+                    print(f"    📊 {host}: 成功率 {summary['success_rate']:.0%}, {speed}, TTFB {ttfb} "
+                          f"({summary['attempts']:.1f} 次)")
+        return [urls[index] for index, _ in ordered]
+
+    def stats(self):
+        """各鏡像的整體統計（不分時段、不分前綴）"""
+        with self._lock:
+            hosts = [
+                row["host"]
+                for row in self._conn.execute("SELECT DISTINCT host FROM mirror_stats ORDER BY host")
+            ]
+        now = time.time()
+        return [self.summary(host, when=now) for host in hosts]
+
+    def hourly(self, url):
+        """鏡像在各時段的速度: {hour: bytes/s}"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT hour, bytes, seconds FROM mirror_stats WHERE host = ? AND prefix = ? AND hour >= 0",
+                (mirror_host(url), ANY_PREFIX),
+            ).fetchall()
+        return {row["hour"]: row["bytes"] / row["seconds"] for row in rows if row["seconds"]}
+
+
+_default_scoreboard = None
+_default_scoreboard_lock = threading.Lock()
+
+
+def get_mirror_scoreboard():
+    """取得依 config.py 設定建立的共用記分板"""
+    global _default_scoreboard
+    with _default_scoreboard_lock:
+        if _default_scoreboard is None:
+            from config import MIRROR_DB_FILE, MIRROR_HALF_LIFE_DAYS
+
+            _default_scoreboard = MirrorScoreboard(MIRROR_DB_FILE, MIRROR_HALF_LIFE_DAYS)
+        return _default_scoreboard
+
+
+if __name__ == "__main__":
+    scoreboard = get_mirror_scoreboard()
+
+    if len(sys.argv) > 1:
+        from aria2_wrapper import SRA_MIRRORS
+
+        run_id = sys.argv[1]
+        urls = [template.format(run_id=run_id, prefix=run_id[:6]) for template in SRA_MIRRORS]
+        print(f"🌐 {run_id} 在 {datetime.now().hour} 點的鏡像排序:")
+        scoreboard.rank(urls, run_id, verbose=True)
+        sys.exit(0)
+
+    print("=" * 80)
+    print(f"📊 鏡像記分板: {scoreboard.db_file}")
+    print("=" * 80)
+    print(f"   {'主機':<42}{'次數':>8}{'成功率':>8}{'TTFB':>10}{'速度':>14}")
+    for summary in scoreboard.stats():
+        if summary is None:
+            continue
+        ttfb = f"{summary['ttfb'] * 1000:.0f} ms" if summary["ttfb"] is not None else "-"
+        speed = f"{summary['throughput'] / 1024**2:.2f} MB/s" if summary["throughput"] else "-"
+        print(f"   {summary['host']:<42}{summary['attempts']:>8.1f}{summary['success_rate']:>8.0%}{ttfb:>10}{speed:>14}")
+        hourly = scoreboard.hourly(summary["host"])
+        if hourly:
+            best = max(hourly, key=hourly.get)
+            worst = min(hourly, key=hourly.get)
+            print(f"      最快時段 {best:02d} 點 ({hourly[best] / 1024**2:.2f} MB/s), "
+                  f"最慢時段 {worst:02d} 點 ({hourly[worst] / 1024**2:.2f} MB/s)")
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+NAS 檔案清單（含本地快照快取）
+以 listdir_attr 一次取得目錄中所有檔案的名稱、大小與修改時間，
+不再對每個檔案各發一次 stat；結果存成本地快照，
+下次只要遠端目錄的修改時間沒變（沒有新增、刪除或重命名）就直接使用快照。
+
+本專案的上傳都是寫入 .partial 後重命名，因此檔案完成時目錄修改時間一定會改變；
+另設最長快取時間，以防有人在 NAS 上直接覆寫檔案內容。
+
+用法:
+    python nas_inventory.py              # 顯示 FASTQ 目錄清單摘要（必要時更新快照）
+    python nas_inventory.py --refresh    # 強制重新列出
+"""
+
+import json
+import stat
+import sys
+import time
+from pathlib import Path
+
+
+def fetch_listing(sftp, remote_dir):
+    """
+    一次列出遠端目錄（不含子目錄）
+
+    Returns:
+        dict: {檔名: {"size": bytes, "mtime": epoch 秒}}
+    """
+    files = {}
+    for attr in sftp.listdir_attr(remote_dir):
+        if attr.st_mode is not None and stat.S_ISDIR(attr.st_mode):
+            continue
+        files[attr.filename] = {"size": attr.st_size, "mtime": attr.st_mtime}
+    return files
+
+
+class NASInventory:
+    """單一遠端目錄的檔案清單與本地快照"""
+
+    def __init__(self, remote_dir, cache_file="nas_inventory.json", max_age_hours=24):
+        self.remote_dir = remote_dir
+        self.cache_file = Path(cache_file)
+        self.max_age_seconds = max_age_hours * 3600
+
+    def _load_cache(self):
+        if not self.cache_file.exists():
+            return {}
+        try:
+            with open(self.cache_file, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"⚠️  載入 NAS 清單快取失敗 (重新列出): {e}")
+            return {}
+
+    def _save_cache(self, entry):
+        cache = self._load_cache()
+        cache[self.remote_dir] = entry
+        try:
+            temp_file = self.cache_file.with_suffix(".tmp")
+            with open(temp_file, "w", encoding="utf-8") as f:
+                json.dump(cache, f)
+            temp_file.replace(self.cache_file)
+        except Exception as e:
+            print(f"⚠️  儲存 NAS 清單快取失敗 (繼續執行): {e}")
+
+    def cached(self):
+        """只讀取本地快照（不連 NAS），沒有快照時回傳 None"""
+        entry = self._load_cache().get(self.remote_dir)
+        return entry["files"] if entry else None
+
+    def snapshot(self, nas, refresh=False):
+        """
+        取得目錄清單；遠端目錄沒有變動時直接使用快照（只需要一次 stat）
+
+        Args:
+            nas: 已連接的 NASUploader
+            refresh: 強制重新列出
+
+        Returns:
+            dict: {檔名: {"size": bytes, "mtime": epoch 秒}}
+        """
+        entry = self._load_cache().get(self.remote_dir)
+        dir_mtime = nas.sftp.stat(self.remote_dir).st_mtime
+
+        if (
+            entry
+            and not refresh
+            and entry.get("dir_mtime") == dir_mtime
+            # SFTP 的修改時間只精確到秒，同一秒內拍的快照可能漏掉之後的變動
+            and entry.get("fetched_at", 0) > dir_mtime + 1
+            and time.time() - entry.get("fetched_at", 0) < self.max_age_seconds
+        ):
+            print(f"📂 使用 NAS 清單快照 ({len(entry['files'])} 個檔案，目錄未變動)")
+            return entry["files"]
+
+        files = fetch_listing(nas.sftp, self.remote_dir)
+        if entry:
+            old = entry["files"]
+            added = len(files.keys() - old.keys())
+            removed = len(old.keys() - files.keys())
+            changed = sum(1 for name in files.keys() & old.keys() if files[name] != old[name])
+            print(f"📂 更新 NAS 清單快照: {len(files)} 個檔案 (新增 {added}, 移除 {removed}, 變更 {changed})")
+        else:
+            print(f"📂 建立 NAS 清單快照: {len(files)} 個檔案")
+
+        self._save_cache({"dir_mtime": dir_mtime, "fetched_at": time.time(), "files": files})
+        return files
+
+
+def fastq_files(files):
+    """只保留 .fastq 檔案"""
+    return {name: info for name, info in files.items() if name.endswith(".fastq")}
+
+
+def get_fastq_inventory():
+    """依 config.py 建立 FASTQ 目錄的清單物件"""
+    from config import NAS_FASTQ_PATH, NAS_INVENTORY_CACHE, NAS_INVENTORY_MAX_AGE_HOURS
+
+    return NASInventory(NAS_FASTQ_PATH, NAS_INVENTORY_CACHE, NAS_INVENTORY_MAX_AGE_HOURS)
+
+
+if __name__ == "__main__":
+    from config import NAS_HOST, NAS_PORT, NAS_USER, NAS_PASS
+    from nas_uploader import NASUploader
+
+    inventory = get_fastq_inventory()
+    nas = NASUploader(NAS_HOST, NAS_PORT, NAS_USER, NAS_PASS)
+    if not nas.connect():
+        sys.exit(1)
+    try:
+        files = fastq_files(inventory.snapshot(nas, refresh="--refresh" in sys.argv))
+    finally:
+        nas.disconnect()
+
+    total = sum(info["size"] for info in files.values())
+    print("=" * 60)
+    print(f"📊 {inventory.remote_dir}")
+    print("=" * 60)
+    print(f"FASTQ 檔案: {len(files)} 個")
+    print(f"總大小: {total / 1024**3:.2f} GB")
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+NAS SFTP 連接池
+多個工作線程共用已驗證的 SFTP 連接，只有真正要存取 NAS 時才借出，
+借出前做健康檢查，斷線時以指數退避重新連接。
+減少 SSH 握手次數，也減少群暉 NAS 同時要維持的連線數。
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+from nas_uploader import NASUploader
+
+
+class NASConnectionError(Exception):
+    """重試後仍無法連接 NAS"""
+
+
+class SFTPConnectionPool:
+    """線程安全的 SFTP 連接池"""
+
+    def __init__(
+        self,
+        host,
+        port,
+        username,
+        password,
+        max_size=4,
+        connect_retries=5,
+        backoff=2.0,
+        max_backoff=60.0,
+        idle_timeout=300.0,
+    ):
+        """
+        Args:
+            max_size: 最多同時存在的連接數（借出 + 閒置）
+            connect_retries: 建立新連接的最大嘗試次數
+            backoff: 第一次重試前的等待秒數（之後每次加倍）
+            max_backoff: 單次等待的上限
+            idle_timeout: 閒置超過此秒數的連接會被關閉
+        """
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.max_size = max(1, int(max_size))
+        self.connect_retries = max(1, int(connect_retries))
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.idle_timeout = idle_timeout
+
+        self._idle = []  # [(uploader, 歸還時間)]
+        self._total = 0  # 目前存在的連接數（含正在建立中的）
+        self._cond = threading.Condition()
+        self._closed = False
+
+    def _connect_with_backoff(self):
+        """建立新連接，失敗時以指數退避重試"""
+        delay = self.backoff
+        for attempt in range(1, self.connect_retries + 1):
+            uploader = NASUploader(self.host, self.port, self.username, self.password)
+            if uploader.connect():
+                return uploader
+            uploader.disconnect()
+            if attempt < self.connect_retries:
+                print(f"    ⚠️ NAS 連接失敗，{delay:.0f}秒後重試 ({attempt}/{self.connect_retries})...")
+                time.sleep(delay)
+                delay = min(delay * 2, self.max_backoff)
+        raise NASConnectionError(f"NAS連接失敗 (已重試 {self.connect_retries} 次): {self.host}")
+
+    def _discard(self, uploader):
+        try:
+            uploader.disconnect()
+        except Exception:
+            pass
+        with self._cond:
+            self._total -= 1
+            self._cond.notify()
+
+    def checkout(self):
+        """借出一個可用的連接（池滿時等待其他線程歸還）"""
+        while True:
+            with self._cond:
+                if self._closed:
+                    raise NASConnectionError("連接池已關閉")
+                while not self._idle and self._total >= self.max_size:
+                    self._cond.wait()
+
+                if self._idle:
+                    uploader, returned_at = self._idle.pop()
+                    create = False
+                else:
+                    self._total += 1
+                    create = True
+
+            if create:
+                try:
+                    return self._connect_with_backoff()
+                except Exception:
+                    with self._cond:
+                        self._total -= 1
+                        self._cond.notify()
+                    raise
+
+            # 閒置太久或健康檢查失敗的連接直接丟棄，改用下一個
+            if time.time() - returned_at > self.idle_timeout or not uploader.is_alive():
+                self._discard(uploader)
+                continue
+            return uploader
+
+    def checkin(self, uploader, broken=False):
+        """歸還連接；broken=True 或連接已失效時關閉它"""
+        if broken or self._closed or not uploader.transport or not uploader.transport.is_active():
+            self._discard(uploader)
+            return
+        with self._cond:
+            self._idle.append((uploader, time.time()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """
+        借出連接的 context manager:
+
+            with pool.connection() as nas:
+                nas.upload_file(...)
+
+        區塊內發生例外時連接會被關閉而不是歸還，避免把半壞的連接交給別人。
+        """
+        uploader = self.checkout()
+        try:
+            yield uploader
+        except BaseException:
+            self.checkin(uploader, broken=True)
+            raise
+        else:
+            self.checkin(uploader)
+
+    def close_all(self):
+        """關閉所有閒置連接，並拒絕之後的借出"""
+        with self._cond:
+            self._closed = True
+            idle = self._idle
+            self._idle = []
+        for uploader, _ in idle:
+            self._discard(uploader)
+
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+def get_nas_pool():
+    """取得依 config.py 設定建立的共用連接池"""
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            from config import (
+                NAS_HOST, NAS_PORT, NAS_USER, NAS_PASS,
+                NAS_POOL_SIZE, NAS_CONNECT_RETRIES, NAS_IDLE_TIMEOUT,
+            )
+            _default_pool = SFTPConnectionPool(
+                NAS_HOST, NAS_PORT, NAS_USER, NAS_PASS,
+                max_size=NAS_POOL_SIZE,
+                connect_retries=NAS_CONNECT_RETRIES,
+                idle_timeout=NAS_IDLE_TIMEOUT,
+            )
+        return _default_pool
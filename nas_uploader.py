@@ -11,8 +11,26 @@ import posixpath  # 用於處理遠端 POSIX 路徑
 from pathlib import Path
 from datetime import datetime
 import time
+import hashlib
+import threading
 from tqdm import tqdm
 
+# 多通道上傳預設值
+DEFAULT_CHUNK_SIZE = 64 * 1024 * 1024
+DEFAULT_PARALLEL_MIN_SIZE = 256 * 1024 * 1024
+
+# 上傳中的遠端暫存檔副檔名（完成並驗證大小後才重命名）
+PARTIAL_SUFFIX = ".partial"
+
+# 續傳前抽樣比對的區塊數與每塊大小
+RESUME_SAMPLE_BLOCKS = 8
+RESUME_SAMPLE_SIZE = 64 * 1024
+
+
+def parallel_window(channels):
+    """並行上傳時允許同時在途的區塊數（最早未完成區塊之後）"""
+    return channels * 2
+
 class NASUploader:
     """群暉 NAS SFTP 上傳器"""
     
@@ -42,6 +60,16 @@ class NASUploader:
             print(f"❌ SFTP 連接失敗: {e}")
             return False
     
+    def is_alive(self):
+        """檢查連接是否仍可用（傳輸層存活且能完成一次 SFTP 往返）"""
+        try:
+            if not self.transport or not self.transport.is_active() or not self.sftp:
+                return False
+            self.sftp.stat(".")
+            return True
+        except Exception:
+            return False
+
     def disconnect(self):
         """關閉 SFTP 連接"""
         try:
@@ -71,17 +99,38 @@ class NASUploader:
                     self.sftp.mkdir(remote_path)
                     print(f"✅ 創建遠端目錄: {remote_path}")
     
-    def upload_file(self, local_file, remote_path, show_progress=True):
+    def upload_file(
+        self,
+        local_file,
+        remote_path,
+        show_progress=True,
+        channels=1,
+        chunk_size=DEFAULT_CHUNK_SIZE,
+        parallel_min_size=DEFAULT_PARALLEL_MIN_SIZE,
+        progress_callback=None,
+    ):
         """
-        上傳單個檔案到 NAS
+        上傳單個檔案到 NAS（可續傳）
+
+        先寫入 <remote_path>.partial，大小驗證通過後才重命名為正式檔名。
+        若遠端已有先前中斷留下的 .partial，且抽樣比對確認內容與本地檔案開頭相同，
+        則從該位置繼續上傳，不必從頭開始。
         
         Args:
             local_file: 本地檔案路徑
             remote_path: 遠端檔案完整路徑（包含檔名）
             show_progress: 是否顯示進度
+            channels: SFTP 通道數，大於 1 時大檔案切塊並行寫入
+            chunk_size: 並行上傳時每塊的大小
+            parallel_min_size: 檔案至少多大才使用並行上傳
+            progress_callback: 每寫入一個區塊後以「遠端已寫入的位元組數」呼叫（停滯偵測用）
         
         Returns:
             bool: 上傳是否成功
+
+        Raises:
+            SFTP 連線中斷時拋出原本的例外（paramiko.SSHException、EOFError、OSError），
+            讓連接池丟棄這個連接；其他失敗回傳 False
         """
         local_file = Path(local_file)
         if not local_file.exists():
@@ -90,49 +139,246 @@ class NASUploader:
         
         # 從遠端路徑中分離出目錄和檔名（使用 POSIX 路徑處理）
         remote_file = remote_path  # remote_path 已經是完整路徑
+        remote_partial = remote_file + PARTIAL_SUFFIX
         remote_dir = posixpath.dirname(remote_path)  # 使用 POSIX 路徑處理
         
-        # 確保遠端目錄存在
-        if remote_dir:
-            self.create_remote_dir(remote_dir)
-        
         # 獲取檔案大小
         file_size = local_file.stat().st_size
         file_size_mb = file_size / (1024 * 1024)
         
-        print(f"📤 上傳: {local_file.name} ({file_size_mb:.1f} MB)")
+        parallel = channels > 1 and file_size >= parallel_min_size
+        print(f"📤 上傳: {local_file.name} ({file_size_mb:.1f} MB"
+              f"{f', {channels} 通道' if parallel else ''})")
         
         try:
+            # 確保遠端目錄存在（SFTP 在這裡斷線時與上傳中斷一樣拋出，由呼叫端換連接重試）
+            if remote_dir:
+                self.create_remote_dir(remote_dir)
+
             start_time = time.time()
+
+            # 並行上傳時，最後 window 個區塊內可能有尚未寫入的空洞，續傳時需倒回重寫
+            rewind = parallel_window(channels) * chunk_size if parallel else 0
+            start_offset = self._resume_offset(local_file, remote_partial, file_size, rewind)
+            if start_offset:
+                print(f"  ↩️  從 {start_offset / (1024 * 1024):.1f} MB 處續傳")
             
-            if show_progress:
-                # 帶進度條的上傳
-                uploaded = [0]  # 使用列表避免閉包問題
-                
-                # 使用 tqdm 建立進度條
-                with tqdm(total=file_size, unit='B', unit_scale=True, desc=f"上傳 {local_file.name}") as pbar:
-                    self.sftp.put(str(local_file), remote_file, callback=lambda sent, total: pbar.update(sent - pbar.n))
-            
+            if parallel:
+                self._upload_parallel(
+                    local_file, remote_partial, file_size, channels, chunk_size, show_progress, start_offset,
+                    progress_callback,
+                )
             else:
-                # 無進度條上傳
-                self.sftp.put(str(local_file), remote_file)
+                self._upload_sequential(
+                    local_file, remote_partial, file_size, show_progress, start_offset, progress_callback
+                )
             
             # 驗證檔案大小
-            remote_size = self.sftp.stat(remote_file).st_size
+            remote_size = self.sftp.stat(remote_partial).st_size
             if remote_size != file_size:
                 print(f"   - ❌ 上傳失敗: 檔案大小不匹配 (本地: {file_size}, 遠端: {remote_size})")
                 return False
+
+            self.replace_remote_file(remote_partial, remote_file)
             
             elapsed = time.time() - start_time
-            speed = file_size_mb / elapsed if elapsed > 0 else 0
+            speed = (file_size - start_offset) / (1024 * 1024) / elapsed if elapsed > 0 else 0
             
             print(f"  ✅ 上傳完成 ({elapsed:.1f}秒, {speed:.2f} MB/s)")
             return True
             
         except Exception as e:
+            if isinstance(e, (paramiko.SSHException, EOFError)) or not self.is_alive():
+                raise
             print(f"  ❌ 上傳失敗: {e}")
             return False
+
+    def _resume_offset(self, local_file, remote_partial, file_size, rewind=0):
+        """
+        決定續傳的起始位置
+
+        遠端 .partial 不存在、比本地檔案大，或抽樣區塊與本地不符時回傳 0（從頭上傳）。
+        """
+        try:
+            remote_size = self.sftp.stat(remote_partial).st_size
+        except FileNotFoundError:
+            return 0
+
+        if remote_size > file_size:
+            return 0
+        offset = max(0, remote_size - rewind)
+        if offset == 0:
+            return 0
+        if not self._prefix_matches(local_file, remote_partial, offset):
+            print(f"  ⚠️  遠端殘留檔案內容與本地不符，從頭上傳")
+            return 0
+        return offset
+
+    def _prefix_matches(self, local_file, remote_path, length, samples=RESUME_SAMPLE_BLOCKS, block_size=RESUME_SAMPLE_SIZE):
+        """抽樣比對本地與遠端檔案前 length 位元組中的數個區塊"""
+        block_size = min(block_size, length)
+        last = length - block_size
+        offsets = sorted({last * k // max(1, samples - 1) for k in range(samples)})
+
+        local_hash = hashlib.md5()
+        remote_hash = hashlib.md5()
+        with open(local_file, "rb") as src, self.sftp.open(remote_path, "rb") as dst:
+            for offset in offsets:
+                src.seek(offset)
+                local_hash.update(src.read(block_size))
+                dst.seek(offset)
+                remote_hash.update(dst.read(block_size))
+        return local_hash.digest() == remote_hash.digest()
+
+    def _upload_sequential(self, local_file, remote_file, file_size, show_progress, start_offset=0,
+                           progress_callback=None):
+        """單一通道依序寫入（從 start_offset 開始）"""
+        mode = "r+b" if start_offset else "wb"
+        with open(local_file, "rb") as src, self.sftp.open(remote_file, mode) as dst, \
+                tqdm(total=file_size, initial=start_offset, unit='B', unit_scale=True,
+                     desc=f"上傳 {local_file.name}", disable=not show_progress) as pbar:
+            dst.set_pipelined(True)
+            src.seek(start_offset)
+            dst.seek(start_offset)
+            sent = start_offset
+            while True:
+                data = src.read(1024 * 1024)
+                if not data:
+                    break
+                dst.write(data)
+                pbar.update(len(data))
+                sent += len(data)
+                if progress_callback:
+                    progress_callback(sent)
+            # 捨棄先前嘗試留下、超出本地大小的內容
+            dst.truncate(file_size)
     
+    def _upload_parallel(self, local_file, remote_file, file_size, channels, chunk_size, show_progress, start_offset=0,
+                         progress_callback=None):
+        """
+        多通道切塊上傳: 在同一個 SSH 連線上開多個 SFTP 通道，
+        各自把不同的位元組範圍寫到遠端檔案的對應位置。
+        單一通道受限於 SSH 視窗大小，高延遲連線下多通道可以疊加吞吐量。
+
+        區塊只能在「最早未完成區塊 + window」的範圍內領取，
+        因此中斷時未寫入的空洞一定落在遠端檔案最後 window 個區塊內，續傳時倒回即可。
+        """
+        if start_offset:
+            start_offset -= start_offset % chunk_size
+        else:
+            # 從頭上傳時先建立（截斷）遠端檔案，之後各通道以 r+ 模式寫入自己的範圍
+            self.sftp.open(remote_file, "wb").close()
+
+        total_chunks = (file_size + chunk_size - 1) // chunk_size
+        window = parallel_window(channels)
+        state = {"next": start_offset // chunk_size, "low": start_offset // chunk_size, "sent": start_offset}
+        done = set()
+        cond = threading.Condition()
+        errors = []
+        pbar = tqdm(total=file_size, initial=start_offset, unit='B', unit_scale=True,
+                    desc=f"上傳 {local_file.name}", disable=not show_progress)
+
+        def worker():
+            sftp = None
+            try:
+                sftp = paramiko.SFTPClient.from_transport(self.transport)
+                with open(local_file, "rb") as src, sftp.open(remote_file, "r+b") as dst:
+                    dst.set_pipelined(True)
+                    while True:
+                        with cond:
+                            while not errors and state["next"] < total_chunks and state["next"] >= state["low"] + window:
+                                cond.wait()
+                            if errors or state["next"] >= total_chunks:
+                                return
+                            index = state["next"]
+                            state["next"] += 1
+                        offset = index * chunk_size
+                        remaining = min(chunk_size, file_size - offset)
+                        src.seek(offset)
+                        dst.seek(offset)
+                        while remaining > 0:
+                            data = src.read(min(remaining, 1024 * 1024))
+                            if not data:
+                                raise IOError(f"本地檔案提前結束 (offset {offset})")
+                            dst.write(data)
+                            remaining -= len(data)
+                            with cond:
+                                pbar.update(len(data))
+                                state["sent"] += len(data)
+                                transferred = state["sent"]
+                            if progress_callback:
+                                progress_callback(transferred)
+                        dst.flush()
+                        with cond:
+                            done.add(index)
+                            while state["low"] in done:
+                                done.remove(state["low"])
+                                state["low"] += 1
+                            cond.notify_all()
+            except Exception as e:
+                with cond:
+                    errors.append(e)
+                    cond.notify_all()
+            finally:
+                if sftp:
+                    sftp.close()
+
+        workers = min(channels, max(1, total_chunks - state["next"]))
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(workers)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        pbar.close()
+
+        if errors:
+            raise errors[0]
+        self.sftp.truncate(remote_file, file_size)
+
+    def upload_stream(self, stream, remote_path, chunk_size=1024 * 1024, progress_callback=None):
+        """
+        將一個資料流（例如 FIFO）直接寫入 NAS 檔案，不經過本地磁碟
+
+        Args:
+            stream: 可讀取的二進位資料流，讀到 EOF 時結束
+            remote_path: 遠端檔案完整路徑（包含檔名）
+            chunk_size: 每次讀取的大小
+            progress_callback: 每寫入一次後以累計寫入的位元組數呼叫
+
+        Returns:
+            int: 寫入的位元組數
+        """
+        remote_dir = posixpath.dirname(remote_path)
+        if remote_dir:
+            self.create_remote_dir(remote_dir)
+
+        written = 0
+        with self.sftp.open(remote_path, "wb") as remote_file:
+            # 不等待每個寫入的回應，大幅提升高延遲連線的吞吐量
+            remote_file.set_pipelined(True)
+            while True:
+                data = stream.read(chunk_size)
+                if not data:
+                    break
+                remote_file.write(data)
+                written += len(data)
+                if progress_callback:
+                    progress_callback(written)
+
+        return written
+
+    def replace_remote_file(self, src_path, dst_path):
+        """將遠端檔案重命名為目標名稱（目標已存在時覆蓋）"""
+        try:
+            self.sftp.posix_rename(src_path, dst_path)
+        except IOError:
+            # 伺服器不支援 posix-rename 擴充時，先刪除目標再重命名
+            try:
+                self.sftp.remove(dst_path)
+            except FileNotFoundError:
+                pass
+            self.sftp.rename(src_path, dst_path)
+
     def upload_fastq_pair(self, run_id, local_dir, remote_base="/homes/bioailab/fastq_data"):
         """
         上傳一對 FASTQ 檔案（_1 和 _2）
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+NCBI Entrez 批次查詢客戶端
+- 每次 efetch 最多送出數百個 run accession（POST），不再一個樣本一個請求
+- 帶上 config.py 的 NCBI_API_KEY（每秒 10 次，沒有 key 時每秒 3 次）
+- 令牌桶限速，多線程共用也不會超過 NCBI 的限制
+- 共用 requests.Session（keep-alive），以串流方式解析 XML，
+  一次取得每個 run 的 LIBRARY_LAYOUT、spots、bases 與大小
+
+用法:
+    python ncbi_client.py SRR123 ERR456 ...
+"""
+
+import sys
+import threading
+import time
+import xml.etree.ElementTree as ET
+
+import requests
+
+EUTILS_BASE = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils"
+
+# NCBI 規定: 有 API key 每秒 10 次，沒有則每秒 3 次
+RATE_WITH_KEY = 10
+RATE_WITHOUT_KEY = 3
+
+
+class TokenBucket:
+    """令牌桶限速器（線程安全）"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """取得一個令牌，不足時等待"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class NCBIClient:
+    """NCBI E-utilities 客戶端"""
+
+    def __init__(self, api_key=None, email=None, tool="auto_downloader", batch_size=200, max_retries=3, timeout=120):
+        self.api_key = api_key
+        self.email = email
+        self.tool = tool
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.timeout = timeout
+        # 保守起見每秒少用一次，避免與其他程式共用 key 時觸發 429
+        rate = RATE_WITH_KEY if api_key else RATE_WITHOUT_KEY
+        self.limiter = TokenBucket(max(1, rate - 1), capacity=1)
+        self.session = requests.Session()
+
+    def _params(self, **params):
+        if self.api_key:
+            params["api_key"] = self.api_key
+        if self.email:
+            params["email"] = self.email
+        params["tool"] = self.tool
+        return params
+
+    def _post(self, endpoint, data):
+        """送出請求（限速 + 對 429/5xx 退避重試），回傳串流中的 response"""
+        url = f"{EUTILS_BASE}/{endpoint}"
+        delay = 1.0
+        for attempt in range(1, self.max_retries + 1):
+            self.limiter.acquire()
+            try:
+                response = self.session.post(url, data=self._params(**data), timeout=self.timeout, stream=True)
+                if response.status_code == 429 or response.status_code >= 500:
+                    response.close()
+                    raise requests.HTTPError(f"HTTP {response.status_code}")
+                response.raise_for_status()
+                response.raw.decode_content = True
+                return response
+            except (requests.ConnectionError, requests.Timeout, requests.HTTPError) as e:
+                if attempt == self.max_retries:
+                    raise
+                print(f"  ⚠️  NCBI 請求失敗 ({e})，{delay:.0f}秒後重試 ({attempt}/{self.max_retries})")
+                time.sleep(delay)
+                delay *= 2
+
+    def fetch_run_info(self, run_ids):
+        """
+        批次查詢 run 的 layout、spots、bases、大小
+
+        Returns:
+            dict: {run_id: {"layout": "SINGLE"/"PAIRED"/"UNKNOWN",
+                            "spots": int, "bases": int, "size": int, "md5": str 或 None}}
+            查不到的 run 不會出現在結果中
+        """
+        run_ids = list(dict.fromkeys(run_ids))
+        wanted = set(run_ids)
+        results = {}
+        for i in range(0, len(run_ids), self.batch_size):
+            batch = run_ids[i:i + self.batch_size]
+            response = self._post("efetch.fcgi", {"db": "sra", "id": ",".join(batch), "rettype": "xml"})
+            try:
+                for run_id, info in parse_experiment_packages(response.raw):
+                    if run_id in wanted:
+                        results[run_id] = info
+            finally:
+                response.close()
+        return results
+
+    def fetch_layouts(self, run_ids):
+        """只取 layout: {run_id: "SINGLE"/"PAIRED"/"UNKNOWN"}（查不到的為 UNKNOWN）"""
+        info = self.fetch_run_info(run_ids)
+        return {run_id: info.get(run_id, {}).get("layout", "UNKNOWN") for run_id in run_ids}
+
+
+def _sra_md5(run):
+    """RUN 元素中 SRA 格式（非 SRA Lite）檔案的 MD5，也就是各鏡像提供下載的 .sra"""
+    for sra_file in run.iter("SRAFile"):
+        name = (sra_file.get("semantic_name") or "").lower()
+        if sra_file.get("sratoolkit") == "1" and "lite" not in name and sra_file.get("md5"):
+            return sra_file.get("md5").lower()
+    return None
+
+
+def parse_experiment_packages(stream):
+    """
+    串流解析 efetch 的 EXPERIMENT_PACKAGE_SET，逐一產生 (run_id, info)
+    每處理完一個 EXPERIMENT_PACKAGE 就釋放它，記憶體用量與批次大小無關
+    """
+    for _, elem in ET.iterparse(stream, events=("end",)):
+        if elem.tag != "EXPERIMENT_PACKAGE":
+            continue
+
+        layout = "UNKNOWN"
+        layout_elem = elem.find(".//LIBRARY_LAYOUT")
+        if layout_elem is not None:
+            if layout_elem.find("PAIRED") is not None:
+                layout = "PAIRED"
+            elif layout_elem.find("SINGLE") is not None:
+                layout = "SINGLE"
+
+        for run in elem.iter("RUN"):
+            run_id = run.get("accession")
+            if run_id:
+                yield run_id, {
+                    "layout": layout,
+                    "spots": _to_int(run.get("total_spots")),
+                    "bases": _to_int(run.get("total_bases")),
+                    "size": _to_int(run.get("size")),
+                    "md5": _sra_md5(run),
+                }
+        elem.clear()
+
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+
+def get_ncbi_client():
+    """取得依 config.py 設定（API key、email）建立的共用客戶端"""
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            from config import NCBI_API_KEY, NCBI_EMAIL
+
+            _default_client = NCBIClient(api_key=NCBI_API_KEY, email=NCBI_EMAIL)
+        return _default_client
+
+
+if __name__ == "__main__":
+    ids = sys.argv[1:]
+    if not ids:
+        print("用法: python ncbi_client.py SRR123 ERR456 ...")
+        sys.exit(1)
+    for run_id, info in get_ncbi_client().fetch_run_info(ids).items():
+        print(f"{run_id}\t{info['layout']}\tspots={info['spots']}\tbases={info['bases']}\tsize={info['size']}")
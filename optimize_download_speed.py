@@ -52,6 +52,53 @@ def test_network_speed():
         print(f"   ❌ 下載測試失敗: {e}")
 
 
+def test_mirror_speed(run_id=None, sample_mb=4):
+    """
+    測試每個 SRA 鏡像的首位元組時間與單連線速度，結果寫入鏡像記分板
+    （下載程式會用同一份記分板排序鏡像）
+    """
+    print("\n" + "=" * 80)
+    print("🪞 SRA 鏡像速度測試")
+    print("=" * 80)
+
+    if run_id is None:
+        try:
+            from config import RUNS_FILE
+            with open(RUNS_FILE, "r") as f:
+                run_id = next(line.strip() for line in f if line.strip() and not line.startswith("#"))
+        except Exception as e:
+            print(f"   ❌ 無法從 runs.txt 取得測試樣本: {e}")
+            return
+
+    try:
+        from aria2_wrapper import get_sra_download_url
+        from http_downloader import probe
+        from mirror_scoreboard import get_mirror_scoreboard, mirror_host
+    except ImportError as e:
+        print(f"   ❌ 導入失敗: {e}")
+        return
+
+    scoreboard = get_mirror_scoreboard()
+    print(f"   測試樣本: {run_id}（每個鏡像下載前 {sample_mb} MB）")
+    for url in get_sra_download_url(run_id, ranked=False):
+        host = mirror_host(url)
+        start = time.time()
+        try:
+            result = probe(url, timeout=30, probe_bytes=sample_mb * 1024 * 1024)
+        except Exception as e:
+            scoreboard.record(url, False, run_id=run_id)
+            print(f"   ❌ {host}: {e}")
+            continue
+        elapsed = time.time() - start
+        scoreboard.record(url, True, ttfb=result["ttfb"], nbytes=result["received"],
+                          seconds=elapsed if result["received"] else 0.0, run_id=run_id)
+        speed = f"{result['speed'] * 8 / 1e6:.2f} Mbps" if result["ranges"] else "不支援 Range"
+        print(f"   ✅ {host}: TTFB {result['ttfb'] * 1000:.0f} ms, {speed}")
+
+    print("\n   目前的鏡像排序（含過去的紀錄）:")
+    get_sra_download_url(run_id, verbose=True)
+
+
 def show_optimization_tips():
     """顯示優化建議"""
     print("\n" + "=" * 80)
@@ -151,6 +198,9 @@ def main():
     # 測試網路速度
     test_network_speed()
     
+    # 測試各 SRA 鏡像（結果寫入鏡像記分板）
+    test_mirror_speed(sys.argv[1] if len(sys.argv) > 1 else None)
+    
     # 檢查 Aspera
     check_aspera_installation()
     
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+分階段處理管線
+每個階段（下載、校驗、解壓、上傳）有獨立的工作線程數，
+階段之間以有界佇列交接，讓網路、CPU 與 NAS 頻寬可以同時保持忙碌
+"""
+
+import queue
+import threading
+
+# 佇列中用來通知工作線程結束的標記
+_STOP = object()
+
+
+class Stage:
+    """管線中的單一階段"""
+
+    def __init__(self, name, func, workers=1):
+        """
+        Args:
+            name: 階段名稱（例如 "download"），失敗時會作為 step 回報
+            func: 處理函數，接收 job 字典並回傳（可修改後的）job 字典
+            workers: 此階段的工作線程數
+        """
+        self.name = name
+        self.func = func
+        self.workers = max(1, int(workers))
+
+
+class StagePipeline:
+    """
+    多階段管線
+
+    job 是一個字典（至少包含 "run_id"），依序流經每個階段。
+    任一階段拋出例外時，job 離開管線並呼叫 on_error；
+    流經所有階段後呼叫 on_done。
+    """
+
+    def __init__(self, stages, queue_size=2, on_done=None, on_error=None):
+        """
+        Args:
+            stages: Stage 列表（依執行順序）
+            queue_size: 每個階段輸入佇列的容量（0 表示不限制）
+            on_done: 完成回呼 on_done(job)
+            on_error: 失敗回呼 on_error(job, stage_name, exception)
+        """
+        self.stages = list(stages)
+        self.queue_size = queue_size
+        self.on_done = on_done
+        self.on_error = on_error
+
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in self.stages]
+        self._threads = []
+        self._outstanding = 0  # 已提交但尚未離開管線的 job 數
+        self._cond = threading.Condition()
+        self._started = False
+
+    def start(self):
+        """啟動所有階段的工作線程"""
+        if self._started:
+            return
+        self._started = True
+
+        for index, stage in enumerate(self.stages):
+            for n in range(stage.workers):
+                t = threading.Thread(
+                    target=self._worker,
+                    args=(index,),
+                    name=f"{stage.name}-{n + 1}",
+                    daemon=True,
+                )
+                t.start()
+                self._threads.append(t)
+
+    def submit(self, job):
+        """提交 job 到第一個階段（佇列滿時會阻塞，形成背壓）"""
+        if not self._started:
+            self.start()
+        with self._cond:
+            self._outstanding += 1
+        self._queues[0].put(job)
+
+    def join(self):
+        """等待所有已提交的 job 離開管線"""
+        with self._cond:
+            while self._outstanding > 0:
+                self._cond.wait()
+
+    def shutdown(self):
+        """通知所有工作線程結束並等待它們退出"""
+        for index, stage in enumerate(self.stages):
+            for _ in range(stage.workers):
+                self._queues[index].put(_STOP)
+        for t in self._threads:
+            t.join()
+        self._threads = []
+        self._started = False
+
+    def queue_sizes(self):
+        """回傳各階段目前佇列中的 job 數（用於顯示狀態）"""
+        return {stage.name: self._queues[i].qsize() for i, stage in enumerate(self.stages)}
+
+    def _finish(self):
+        with self._cond:
+            self._outstanding -= 1
+            if self._outstanding <= 0:
+                self._cond.notify_all()
+
+    def _worker(self, index):
+        stage = self.stages[index]
+        in_queue = self._queues[index]
+        is_last = index == len(self.stages) - 1
+
+        while True:
+            job = in_queue.get()
+            if job is _STOP:
+                break
+
+            try:
+                job = stage.func(job)
+            except Exception as e:
+                try:
+                    if self.on_error:
+                        self.on_error(job, stage.name, e)
+                finally:
+                    self._finish()
+                continue
+
+            if is_last:
+                try:
+                    if self.on_done:
+                        self.on_done(job)
+                finally:
+                    self._finish()
+            else:
+                # 下一階段佇列滿時在此阻塞，避免產生過多中間檔案
+                self._queues[index + 1].put(job)
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+依檔案大小排序下載佇列
+- alphabetical: 依樣本 ID 排序（舊行為）
+- shortest:     小檔案優先，盡早完成較多樣本
+- largest:      大檔案優先，縮短整體完成時間 (makespan)
+- interleave:   大小交錯，平衡磁碟與網路負載
+
+預期大小使用 ENA filereport 的 fastq_bytes（與 check_sample_sizes.py 相同來源），
+由 metadata_cache 快取在本地，重複執行不需要再連網。
+"""
+
+import heapq
+import sys
+from pathlib import Path
+
+from metadata_cache import get_metadata_cache
+
+POLICIES = ("alphabetical", "shortest", "largest", "interleave")
+
+
+# ==================== 預期大小 ====================
+
+def load_expected_sizes(run_ids, cache=None, refresh=False, offline=False):
+    """
+    取得樣本的預期大小（ENA fastq_bytes，來自 metadata 快取，缺少或過期的才連網查詢）
+
+    Returns:
+        dict: {run_id: bytes}
+    """
+    cache = cache or get_metadata_cache()
+    values = cache.ensure(run_ids, ["fastq_bytes"], offline=offline, refresh=refresh)
+    return {r: v["fastq_bytes"] for r, v in values.items() if v.get("fastq_bytes")}
+
+
+# ==================== 排序策略 ====================
+
+def _filled_sizes(run_ids, sizes):
+    """沒有大小資訊的樣本以已知大小的中位數代替"""
+    known = sorted(sizes[r] for r in run_ids if sizes.get(r))
+    default = known[len(known) // 2] if known else 1
+    return {r: sizes.get(r) or default for r in run_ids}
+
+
+def order_runs(run_ids, sizes, policy="alphabetical"):
+    """
+    依策略排序樣本
+
+    Args:
+        run_ids: 樣本 ID 列表
+        sizes: {run_id: bytes}
+        policy: POLICIES 之一
+
+    Returns:
+        list: 排序後的樣本 ID
+    """
+    if policy not in POLICIES:
+        raise ValueError(f"未知的排序策略: {policy} (可用: {', '.join(POLICIES)})")
+
+    runs = sorted(run_ids)
+    if policy == "alphabetical":
+        return runs
+
+    filled = _filled_sizes(runs, sizes)
+    by_size = sorted(runs, key=lambda r: (filled[r], r))
+
+    if policy == "shortest":
+        return by_size
+    if policy == "largest":
+        return by_size[::-1]
+
+    # interleave: 最大、最小、次大、次小...
+    ordered = []
+    lo, hi = 0, len(by_size) - 1
+    while lo <= hi:
+        ordered.append(by_size[hi])
+        hi -= 1
+        if lo <= hi:
+            ordered.append(by_size[lo])
+            lo += 1
+    return ordered
+
+
+def predict_makespan(order, sizes, workers, bytes_per_second, overhead_seconds=0):
+    """
+    模擬依序把樣本分派給最早空閒的工作線程
+
+    Args:
+        order: 排序後的樣本 ID
+        sizes: {run_id: bytes}
+        workers: 並行數
+        bytes_per_second: 單一工作線程的下載速度
+        overhead_seconds: 每個樣本的固定額外時間（校驗、解壓等）
+
+    Returns:
+        tuple: (makespan 秒, 平均完成時間 秒)
+    """
+    if not order:
+        return 0.0, 0.0
+
+    filled = _filled_sizes(order, sizes)
+    free_at = [0.0] * max(1, workers)
+    heapq.heapify(free_at)
+    completions = []
+    for run_id in order:
+        start = heapq.heappop(free_at)
+        end = start + filled[run_id] / bytes_per_second + overhead_seconds
+        completions.append(end)
+        heapq.heappush(free_at, end)
+    return max(completions), sum(completions) / len(completions)
+
+
+def report_policies(run_ids, sizes, workers, bytes_per_second, overhead_seconds=0):
+    """列印每個策略的預估 makespan 與平均完成時間"""
+    known = sum(1 for r in run_ids if sizes.get(r))
+    total_gb = sum(_filled_sizes(list(run_ids), sizes).values()) / (1024**3) if run_ids else 0
+    print(f"\n📐 排序策略預估（{len(run_ids)} 個樣本，{known} 個有大小資訊，約 {total_gb:.1f} GB，"
+          f"{workers} 個並行，每線程 {bytes_per_second * 8 / 1e6:.1f} Mbps）")
+    print(f"   {'策略':<14}{'預估完成 (小時)':>16}{'平均完成 (小時)':>16}")
+    results = {}
+    for policy in POLICIES:
+        order = order_runs(run_ids, sizes, policy)
+        makespan, mean_done = predict_makespan(order, sizes, workers, bytes_per_second, overhead_seconds)
+        results[policy] = (makespan, mean_done)
+        print(f"   {policy:<14}{makespan / 3600:>16.1f}{mean_done / 3600:>16.1f}")
+    return results
+
+
+if __name__ == "__main__":
+    from config import (
+        RUNS_FILE, SCHEDULE_POLICY, DOWNLOAD_WORKERS,
+        EXPECTED_MBPS_PER_WORKER, RUN_OVERHEAD_MINUTES,
+    )
+
+    runs_file = Path(sys.argv[1] if len(sys.argv) > 1 else RUNS_FILE)
+    with open(runs_file, "r") as f:
+        run_ids = sorted({line.strip() for line in f if line.strip() and not line.startswith("#")})
+
+    sizes = load_expected_sizes(run_ids)
+    report_policies(
+        run_ids, sizes, DOWNLOAD_WORKERS,
+        EXPECTED_MBPS_PER_WORKER * 1e6 / 8, RUN_OVERHEAD_MINUTES * 60,
+    )
+    print(f"\n目前設定的策略: {SCHEDULE_POLICY}")
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+以 MD5 取代 vdb-validate
+vdb-validate 每次下載後都要重新讀完整個 SRA 檔（最長 30 分鐘）。
+NCBI 的 run metadata 記錄了 .sra 檔的 MD5（metadata 快取的 sra_md5 欄位）:
+- 內建 HTTP 引擎在下載時就邊收邊算 MD5，下載完成寫入 <run>.sra.md5，校驗階段不必再讀檔
+- 其他引擎（aria2、prefetch）在校驗階段讀一次檔案計算 MD5（仍比 vdb-validate 快得多）
+MD5 與 metadata 相符就跳過 vdb-validate；沒有 MD5、不相符，或被抽中做抽樣稽核時才執行。
+
+每次校驗的耗時記錄在 VALIDATION_STATS_FILE，用 vdb-validate 的平均速度估算每次跳過省下的時間與讀取量。
+
+用法:
+    python sra_checksum.py          # 顯示累計省下的時間與讀取量
+"""
+
+import hashlib
+import json
+import random
+import threading
+from pathlib import Path
+
+MD5_SUFFIX = ".md5"
+
+
+def md5_sidecar(sra_file):
+    return Path(sra_file).with_name(Path(sra_file).name + MD5_SUFFIX)
+
+
+def write_md5_sidecar(sra_file, md5):
+    """記錄下載時串流計算的 MD5（先寫暫存檔再改名）"""
+    sidecar = md5_sidecar(sra_file)
+    temp = sidecar.with_name(sidecar.name + ".tmp")
+    temp.write_text(md5.lower() + "\n", encoding="utf-8")
+    temp.replace(sidecar)
+
+
+def read_md5_sidecar(sra_file):
+    """讀取下載時記錄的 MD5；沒有記錄或記錄比 SRA 檔舊時回傳 None"""
+    sidecar = md5_sidecar(sra_file)
+    try:
+        if sidecar.stat().st_mtime < Path(sra_file).stat().st_mtime:
+            return None
+        return sidecar.read_text(encoding="utf-8").strip().lower() or None
+    except OSError:
+        return None
+
+
+def file_md5(path, chunk_size=8 * 1024 * 1024):
+    """讀取整個檔案計算 MD5"""
+    digest = hashlib.md5()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def should_audit(rate):
+    """抽樣稽核: MD5 相符時仍以 rate 的機率執行 vdb-validate"""
+    return rate > 0 and random.random() < rate
+
+
+class ValidationStats:
+    """校驗耗時與省下的時間 / 讀取量（JSON 檔，線程安全）"""
+
+    # 還沒有 vdb-validate 的實測記錄時，假設的速度 (bytes/s)
+    DEFAULT_VALIDATE_RATE = 100 * 1024 * 1024
+
+    def __init__(self, stats_file="validation_stats.json"):
+        self.stats_file = Path(stats_file) if stats_file else None
+        self._lock = threading.Lock()
+        self._stats = {
+            "validate_runs": 0, "validate_seconds": 0.0, "validate_bytes": 0,
+            "skipped_runs": 0, "saved_seconds": 0.0, "saved_bytes": 0,
+            "streamed_runs": 0, "hashed_runs": 0,
+            "audits": 0, "audit_failures": 0, "mismatches": 0,
+        }
+        if self.stats_file and self.stats_file.exists():
+            try:
+                with open(self.stats_file, "r", encoding="utf-8") as f:
+                    self._stats.update(json.load(f))
+            except Exception as e:
+                print(f"⚠️  載入校驗統計失敗 (重新開始): {e}")
+
+    def _save(self):
+        if not self.stats_file:
+            return
+        try:
+            temp_file = self.stats_file.with_suffix(".tmp")
+            with open(temp_file, "w", encoding="utf-8") as f:
+                json.dump(self._stats, f, indent=2)
+            temp_file.replace(self.stats_file)
+        except Exception as e:
+            print(f"⚠️  儲存校驗統計失敗 (繼續執行): {e}")
+
+    def validate_rate(self):
+        """vdb-validate 的平均速度 (bytes/s)"""
+        with self._lock:
+            if self._stats["validate_seconds"] > 0 and self._stats["validate_bytes"] > 0:
+                return self._stats["validate_bytes"] / self._stats["validate_seconds"]
+        return self.DEFAULT_VALIDATE_RATE
+
+    def record_validate(self, nbytes, seconds, audit=False, ok=True):
+        """記錄一次 vdb-validate"""
+        with self._lock:
+            self._stats["validate_runs"] += 1
+            self._stats["validate_seconds"] += seconds
+            self._stats["validate_bytes"] += nbytes
+            if audit:
+                self._stats["audits"] += 1
+                if not ok:
+                    self._stats["audit_failures"] += 1
+            self._save()
+
+    def record_mismatch(self):
+        with self._lock:
+            self._stats["mismatches"] += 1
+            self._save()
+
+    def record_skip(self, nbytes, hash_seconds, streamed):
+        """
+        記錄一次以 MD5 取代 vdb-validate
+
+        Returns:
+            tuple: (省下的秒數, 省下的讀取位元組數)
+        """
+        estimated = nbytes / self.validate_rate()
+        saved_seconds = max(0.0, estimated - hash_seconds)
+        # 串流計算的 MD5 完全不需要重新讀檔；事後計算仍要讀一次
+        saved_bytes = nbytes if streamed else 0
+        with self._lock:
+            self._stats["skipped_runs"] += 1
+            self._stats["saved_seconds"] += saved_seconds
+            self._stats["saved_bytes"] += saved_bytes
+            self._stats["streamed_runs" if streamed else "hashed_runs"] += 1
+            self._save()
+        return saved_seconds, saved_bytes
+
+    def summary(self):
+        with self._lock:
+            return dict(self._stats)
+
+
+_default_stats = None
+_default_stats_lock = threading.Lock()
+
+
+def get_validation_stats():
+    """取得依 config.py 設定建立的共用統計"""
+    global _default_stats
+    with _default_stats_lock:
+        if _default_stats is None:
+            from config import VALIDATION_STATS_FILE
+
+            _default_stats = ValidationStats(VALIDATION_STATS_FILE)
+        return _default_stats
+
+
+def print_summary(stats):
+    s = stats.summary()
+    total = s["skipped_runs"] + s["validate_runs"] - s["audits"]
+    print(f"🔍 SRA 校驗: {s['skipped_runs']}/{total} 個樣本以 MD5 取代 vdb-validate "
+          f"(串流 {s['streamed_runs']}, 事後計算 {s['hashed_runs']})，"
+          f"省下約 {s['saved_seconds'] / 3600:.1f} 小時、{s['saved_bytes'] / 1024**3:.1f} GB 讀取")
+    print(f"   抽樣稽核 {s['audits']} 次 (失敗 {s['audit_failures']})，MD5 不符 {s['mismatches']} 次，"
+          f"vdb-validate 平均 {stats.validate_rate() / 1024**2:.0f} MB/s")
+
+
+if __name__ == "__main__":
+    print_summary(get_validation_stats())
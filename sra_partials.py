@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SRA 部分下載的保留、檢查與回收
+容器重啟或樣本重試時不再刪除 SRA_TEMP_DIR/<run>，而是檢查留下的部分檔案能否續傳:
+- aria2:     <run>.sra + <run>.sra.aria2（控制檔），aria2c --continue 續傳
+- 內建 HTTP: <run>.sra.part + <run>.sra.segments.json（段落記錄），見 http_downloader.py
+- prefetch:  <run>.sra.tmp（+ .lock），prefetch --resume yes 續傳
+- 已完成:    只有 <run>.sra（內建 HTTP 另有下載時計算的 <run>.sra.md5），跳過下載直接進入校驗
+
+不一致的狀態（只剩控制檔、段落記錄與 .part 不成對等）會被清除後重新下載；
+超過保留時間沒有更新的部分下載由 gc_stale_partials() 回收。
+
+用法:
+    python sra_partials.py          # 列出所有部分下載
+    python sra_partials.py --gc     # 回收超過保留時間的部分下載
+"""
+
+import json
+import shutil
+import sys
+import time
+from pathlib import Path
+
+# 各引擎留下的檔案（相對於 <run>.sra 的副檔名）
+ENGINE_SUFFIXES = {
+    "aria2": (".aria2",),
+    "http": (".part", ".segments.json"),
+    "prefetch": (".tmp", ".lock"),
+}
+
+
+def _sibling(sra_file, suffix):
+    return sra_file.with_name(sra_file.name + suffix)
+
+
+def _remove(path):
+    try:
+        if path.is_dir():
+            shutil.rmtree(path)
+        elif path.exists():
+            path.unlink()
+    except OSError as e:
+        print(f"    ⚠️  無法刪除 {path.name}: {e}")
+
+
+def inspect_partial(sra_file):
+    """
+    判斷 SRA 目錄中留下的下載狀態
+
+    Returns:
+        dict: {"kind": "none"/"complete"/"aria2"/"http"/"prefetch"/"broken",
+               "bytes": 已下載的位元組數（估計）, "mtime": 最後更新時間, "reason": 說明}
+    """
+    sra_file = Path(sra_file)
+    run_dir = sra_file.parent
+    if not run_dir.exists():
+        return {"kind": "none", "bytes": 0, "mtime": 0, "reason": ""}
+
+    files = [f for f in run_dir.iterdir() if f.is_file()]
+    if not files:
+        return {"kind": "none", "bytes": 0, "mtime": run_dir.stat().st_mtime, "reason": ""}
+    mtime = max(f.stat().st_mtime for f in files)
+
+    aria2_control = _sibling(sra_file, ".aria2")
+    http_part = _sibling(sra_file, ".part")
+    http_map = _sibling(sra_file, ".segments.json")
+    prefetch_tmp = _sibling(sra_file, ".tmp")
+
+    if aria2_control.exists():
+        if not sra_file.exists():
+            return {"kind": "broken", "bytes": 0, "mtime": mtime, "reason": "只有 aria2 控制檔，沒有資料檔"}
+        return {"kind": "aria2", "bytes": _allocated_bytes(sra_file), "mtime": mtime, "reason": ""}
+
+    if http_part.exists() or http_map.exists():
+        if not (http_part.exists() and http_map.exists()):
+            return {"kind": "broken", "bytes": 0, "mtime": mtime, "reason": "段落記錄與 .part 檔不成對"}
+        return {"kind": "http", "bytes": _segment_bytes(http_map), "mtime": mtime, "reason": ""}
+
+    if prefetch_tmp.exists():
+        return {"kind": "prefetch", "bytes": prefetch_tmp.stat().st_size, "mtime": mtime, "reason": ""}
+
+    if sra_file.exists():
+        return {"kind": "complete", "bytes": sra_file.stat().st_size, "mtime": mtime, "reason": ""}
+
+    return {"kind": "broken", "bytes": 0, "mtime": mtime, "reason": "無法辨識的殘留檔案"}
+
+
+def _allocated_bytes(path):
+    # aria2 會先建立完整大小的檔案，實際佔用的區塊才接近已下載的量
+    st = path.stat()
+    blocks = getattr(st, "st_blocks", None)
+    return st.st_size if blocks is None else min(st.st_size, blocks * 512)
+
+
+def _segment_bytes(map_file):
+    try:
+        with open(map_file, "r", encoding="utf-8") as f:
+            return sum(done for _, _, done in json.load(f)["segments"])
+    except Exception:
+        return 0
+
+
+def prepare_resume(sra_file, engine, expected_size=None):
+    """
+    下載前檢查並整理部分下載，保留可續傳的檔案
+
+    Args:
+        sra_file: 目標 SRA 檔案路徑
+        engine: 這次使用的引擎（aria2 / http / prefetch）
+        expected_size: 預期的 SRA 大小（metadata 快取的 sra_size，只用於顯示）
+
+    Returns:
+        dict: inspect_partial() 的結果；kind 為 "complete" 表示不需要下載
+    """
+    sra_file = Path(sra_file)
+    state = inspect_partial(sra_file)
+    kind = state["kind"]
+
+    if kind == "none":
+        return state
+
+    if kind == "complete":
+        # 各引擎都是下載完成才產生沒有控制檔的 <run>.sra，內容是否完整交給校驗階段確認
+        size = state["bytes"]
+        note = ""
+        if expected_size and size != expected_size:
+            note = f"，與 NCBI 記錄的 {expected_size / 1024**3:.2f} GB 不同"
+        print(f"    ♻️  沿用既有的 SRA 檔案 ({size / 1024**3:.2f} GB{note})，跳過下載")
+        return state
+
+    if kind == "broken":
+        print(f"    🗑️  部分下載狀態不一致 ({state['reason']})，清除後重新下載")
+        discard_partial(sra_file)
+        return {**state, "kind": "none", "bytes": 0}
+
+    if kind != engine:
+        # 其他引擎的部分檔案格式不相容，留著只會佔用雙倍空間
+        print(f"    🗑️  捨棄 {kind} 留下的部分下載 ({state['bytes'] / 1024**3:.2f} GB)，本次使用 {engine}")
+        discard_partial(sra_file)
+        return {**state, "kind": "none", "bytes": 0}
+
+    # prefetch 的鎖檔來自已結束的程序（同一樣本同時只有一個線程處理），留著會讓 prefetch 卡住
+    for lock_file in sra_file.parent.glob("*.lock"):
+        _remove(lock_file)
+
+    age = (time.time() - state["mtime"]) / 3600
+    print(f"    ↩️  保留 {kind} 部分下載: {state['bytes'] / 1024**3:.2f} GB ({age:.1f} 小時前更新)，續傳")
+    return state
+
+
+def discard_partial(sra_file):
+    """刪除目標 SRA 檔案與所有引擎的部分下載檔案（保留目錄）"""
+    sra_file = Path(sra_file)
+    _remove(sra_file)
+    for suffixes in ENGINE_SUFFIXES.values():
+        for suffix in suffixes:
+            _remove(_sibling(sra_file, suffix))
+    _remove(_sibling(sra_file, ".md5"))
+    if sra_file.parent.exists():
+        for leftover in sra_file.parent.glob("*.lock"):
+            _remove(leftover)
+
+
+def gc_stale_partials(base_dir, max_age_hours, active=()):
+    """
+    回收超過保留時間沒有更新的 SRA 目錄
+
+    Args:
+        base_dir: SRA_TEMP_DIR
+        max_age_hours: 最後一次更新超過幾小時就刪除（<= 0 表示不回收）
+        active: 目前正在處理或等待處理的樣本（不回收）
+
+    Returns:
+        tuple: (刪除的目錄數, 釋放的位元組數)
+    """
+    base_dir = Path(base_dir)
+    if max_age_hours <= 0 or not base_dir.exists():
+        return 0, 0
+
+    cutoff = time.time() - max_age_hours * 3600
+    active = set(active)
+    removed = freed = 0
+    for run_dir in base_dir.iterdir():
+        if not run_dir.is_dir() or run_dir.name in active:
+            continue
+        files = [f for f in run_dir.rglob("*") if f.is_file()]
+        newest = max((f.stat().st_mtime for f in files), default=run_dir.stat().st_mtime)
+        if newest >= cutoff:
+            continue
+        size = sum(f.stat().st_size for f in files)
+        try:
+            shutil.rmtree(run_dir)
+        except OSError as e:
+            print(f"⚠️  無法回收 {run_dir.name}: {e}")
+            continue
+        print(f"🗑️  回收過期的部分下載: {run_dir.name} ({size / 1024**3:.2f} GB, "
+              f"{(time.time() - newest) / 3600:.0f} 小時未更新)")
+        removed += 1
+        freed += size
+    return removed, freed
+
+
+def list_partials(base_dir):
+    """列出所有 SRA 目錄的下載狀態: [(run_id, state), ...]"""
+    base_dir = Path(base_dir)
+    if not base_dir.exists():
+        return []
+    return [
+        (run_dir.name, inspect_partial(run_dir / f"{run_dir.name}.sra"))
+        for run_dir in sorted(base_dir.iterdir())
+        if run_dir.is_dir()
+    ]
+
+
+if __name__ == "__main__":
+    from config import PARTIAL_MAX_AGE_HOURS, SRA_TEMP_DIR
+
+    if "--gc" in sys.argv:
+        removed, freed = gc_stale_partials(SRA_TEMP_DIR, PARTIAL_MAX_AGE_HOURS)
+        print(f"✅ 回收 {removed} 個目錄，釋放 {freed / 1024**3:.2f} GB")
+        sys.exit(0)
+
+    partials = list_partials(SRA_TEMP_DIR)
+    print("=" * 60)
+    print(f"📂 {SRA_TEMP_DIR} ({len(partials)} 個樣本目錄，保留 {PARTIAL_MAX_AGE_HOURS:.0f} 小時)")
+    print("=" * 60)
+    for run_id, state in partials:
+        age = (time.time() - state["mtime"]) / 3600 if state["mtime"] else 0
+        print(f"   {run_id:<14}{state['kind']:<10}{state['bytes'] / 1024**3:>8.2f} GB{age:>8.1f} 小時前  {state['reason']}")
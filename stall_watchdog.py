@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+停滯偵測（watchdog）
+原本的子程序超時是全有或全無: prefetch / fasterq-dump 3 小時、上傳 2 小時，
+卡住的連線要等到超時才會被發現，而正常但很慢的大檔案又可能被誤殺。
+
+這裡改為追蹤「位元組進度」:
+- 輸出檔案 / 目錄的增長（prefetch、fasterq-dump）
+- 工具輸出中解析出的進度（aria2c 的下載量）
+- 程式內的進度回呼（內建 HTTP 引擎、SFTP 上傳）
+超過設定的時間沒有任何進度就判定停滯，由呼叫端終止這次嘗試並換鏡像 / 換連線重試。
+每次停滯都寫入 JSONL 事件記錄（STALL_LOG_FILE）供事後分析。
+
+用法:
+    python stall_watchdog.py        # 依階段與鏡像彙總停滯事件
+"""
+
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+
+
+class StallDetected(Exception):
+    """操作超過停滯時間沒有進度，已被終止"""
+
+    def __init__(self, stage, run_id, idle, detail=None):
+        message = f"{stage} {run_id} 停滯: {idle:.0f} 秒沒有進度"
+        if detail:
+            message += f" ({detail})"
+        super().__init__(message)
+        self.stage = stage
+        self.run_id = run_id
+        self.idle = idle
+        self.detail = detail
+
+
+class Watch:
+    """
+    一個受監控的操作（由 StallWatchdog.watch() 建立，以 with 使用）
+
+    進度來源可以是 progress_fn（監控線程定期呼叫，回傳值改變即視為有進度），
+    或由操作本身呼叫 progress(value) 回報。
+    """
+
+    def __init__(self, watchdog, stage, run_id, window, progress_fn=None, on_stall=None, detail=None):
+        self.watchdog = watchdog
+        self.stage = stage
+        self.run_id = run_id
+        self.window = window
+        self.progress_fn = progress_fn
+        self.on_stall = on_stall
+        self.detail = detail
+        self.started = time.time()
+        self.last_change = self.started
+        self.last_value = None
+        self.stalled = False
+        self.idle = 0.0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self.watchdog._register(self)
+        return self
+
+    def __exit__(self, *exc):
+        self.watchdog._unregister(self)
+        return False
+
+    def progress(self, value):
+        """回報目前的進度（累計的位元組數等），與上次不同時重新計時"""
+        with self._lock:
+            if value != self.last_value:
+                self.last_value = value
+                self.last_change = time.time()
+
+    def touch(self):
+        """沒有位元組進度但不算停滯（例如仍在佇列中等待），重新計時"""
+        with self._lock:
+            self.last_change = time.time()
+
+    def check(self):
+        """已判定停滯時拋出 StallDetected"""
+        if self.stalled:
+            raise StallDetected(self.stage, self.run_id, self.idle, self.describe())
+
+    def describe(self):
+        """補充資訊（detail 可以是函數，例如回傳目前使用的鏡像）"""
+        if callable(self.detail):
+            try:
+                return self.detail()
+            except Exception:
+                return None
+        return self.detail
+
+    def _poll(self, now):
+        """監控線程呼叫: 更新進度，第一次超過停滯時間時回傳 True"""
+        if self.progress_fn is not None:
+            try:
+                self.progress(self.progress_fn())
+            except Exception:
+                pass
+        with self._lock:
+            if self.stalled or not self.window or self.window <= 0:
+                return False
+            self.idle = now - self.last_change
+            if self.idle < self.window:
+                return False
+            self.stalled = True
+            return True
+
+
+class StallWatchdog:
+    """以單一監控線程檢查所有進行中的操作（線程安全）"""
+
+    def __init__(self, log_file="stall_events.jsonl", poll_interval=5.0):
+        """
+        Args:
+            log_file: 停滯事件記錄（JSONL），None 表示不記錄
+            poll_interval: 檢查間隔（秒）
+        """
+        self.log_file = Path(log_file) if log_file else None
+        self.poll_interval = poll_interval
+        self._watches = set()
+        self._lock = threading.Lock()
+        self._log_lock = threading.Lock()
+        self._thread = None
+
+    def watch(self, stage, run_id, window, progress_fn=None, on_stall=None, detail=None):
+        """
+        建立一個監控
+
+        Args:
+            stage: 階段名稱（download / dump / upload ...）
+            run_id: 樣本 ID
+            window: 停滯時間（秒），<= 0 表示不監控
+            progress_fn: 回傳目前進度的函數（可選）
+            on_stall: 判定停滯時呼叫（在監控線程中），用來終止操作
+            detail: 記錄在事件中的補充資訊（鏡像網址、檔名等），也可以是回傳補充資訊的函數
+        """
+        return Watch(self, stage, run_id, window, progress_fn, on_stall, detail)
+
+    def _register(self, watch):
+        with self._lock:
+            self._watches.add(watch)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._monitor, name="stall-watchdog", daemon=True)
+                self._thread.start()
+
+    def _unregister(self, watch):
+        with self._lock:
+            self._watches.discard(watch)
+
+    def _monitor(self):
+        while True:
+            time.sleep(self.poll_interval)
+            with self._lock:
+                watches = list(self._watches)
+            now = time.time()
+            for watch in watches:
+                if not watch._poll(now):
+                    continue
+                detail = watch.describe()
+                print(f"    ⏸️  {watch.stage} {watch.run_id} 已 {watch.idle:.0f} 秒沒有進度，判定停滯"
+                      f"{f' ({detail})' if detail else ''}", flush=True)
+                self.record(watch)
+                if watch.on_stall is not None:
+                    try:
+                        watch.on_stall()
+                    except Exception as e:
+                        print(f"    ⚠️  終止停滯的操作失敗: {e}")
+
+    # ==================== 事件記錄 ====================
+
+    def record(self, watch):
+        """寫入一筆停滯事件"""
+        if self.log_file is None:
+            return
+        event = {
+            "time": datetime.now().isoformat(timespec="seconds"),
+            "stage": watch.stage,
+            "run_id": watch.run_id,
+            "idle_seconds": round(watch.idle, 1),
+            "window": watch.window,
+            "elapsed_seconds": round(time.time() - watch.started, 1),
+            "progress": watch.last_value if isinstance(watch.last_value, (int, float)) else None,
+            "detail": watch.describe(),
+        }
+        with self._log_lock:
+            try:
+                with open(self.log_file, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(event, ensure_ascii=False) + "\n")
+            except OSError as e:
+                print(f"⚠️  無法寫入停滯記錄: {e}")
+
+    def events(self):
+        """讀取所有停滯事件"""
+        if self.log_file is None or not self.log_file.exists():
+            return []
+        events = []
+        with open(self.log_file, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    events.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+        return events
+
+    # ==================== 子程序 ====================
+
+    def run_monitored(self, cmd, stage, run_id, window, progress_fn=None, line_parser=None,
+                      timeout=None, detail=None, on_start=None):
+        """
+        執行子程序並監控進度（取代 subprocess.run(capture_output=True, text=True, timeout=...)）
+
+        Args:
+            cmd: 指令
+            stage, run_id, window, progress_fn, detail: 見 watch()
+            line_parser: 解析每一行輸出，回傳進度值（或 None 表示這行不是進度）
+            timeout: 整體超時（秒），保留作為最後防線，超過時拋出 subprocess.TimeoutExpired
+            on_start: 子程序啟動後以 Popen 呼叫（例如登記 pid 追蹤 CPU 使用）
+
+        Returns:
+            subprocess.CompletedProcess
+
+        Raises:
+            StallDetected: 停滯，子程序已被終止
+        """
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        if on_start is not None:
+            on_start(process)
+        output = {"stdout": [], "stderr": []}
+
+        with self.watch(stage, run_id, window, progress_fn, on_stall=process.kill, detail=detail) as watch:
+            def reader(name, pipe):
+                for line in pipe:
+                    output[name].append(line)
+                    if line_parser is not None:
+                        value = line_parser(line)
+                        if value is not None:
+                            watch.progress(value)
+
+            readers = [
+                threading.Thread(target=reader, args=("stdout", process.stdout), daemon=True),
+                threading.Thread(target=reader, args=("stderr", process.stderr), daemon=True),
+            ]
+            for t in readers:
+                t.start()
+            try:
+                process.wait(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+                raise
+            finally:
+                for t in readers:
+                    t.join(timeout=10)
+            watch.check()
+
+        return subprocess.CompletedProcess(
+            cmd, process.returncode, stdout="".join(output["stdout"]), stderr="".join(output["stderr"])
+        )
+
+
+# ==================== 進度來源 ====================
+
+_ARIA2_PROGRESS = re.compile(r"\[#\w+\s+([\d.]+)([KMGT]?i?B)/")
+_UNITS = {"B": 1, "KiB": 1024, "MiB": 1024**2, "GiB": 1024**3, "TiB": 1024**4}
+
+
+def parse_aria2_progress(line):
+    """解析 aria2c 的進度行 `[#2089b0 400.0MiB/1.1GiB(35%) CN:16 DL:21MiB]`，回傳已下載位元組數"""
+    match = _ARIA2_PROGRESS.search(line)
+    if not match:
+        return None
+    return int(float(match.group(1)) * _UNITS.get(match.group(2), 1))
+
+
+def path_progress(*paths, pattern="*"):
+    """
+    目錄（遞迴）或檔案的大小與實際佔用區塊的總和，任何一個增長都代表有寫入
+    不存在的路徑視為 0
+    """
+    total = 0
+    for path in paths:
+        path = Path(path)
+        if path.is_file():
+            files = [path]
+        elif path.is_dir():
+            files = path.rglob(pattern)
+        else:
+            continue
+        for f in files:
+            try:
+                st = f.stat()
+            except OSError:
+                continue
+            if not os.path.isfile(f):
+                continue
+            total += st.st_size + getattr(st, "st_blocks", 0) * 512
+    return total
+
+
+_default_watchdog = None
+_default_watchdog_lock = threading.Lock()
+
+
+def get_stall_watchdog():
+    """取得依 config.py 設定建立的共用 watchdog"""
+    global _default_watchdog
+    with _default_watchdog_lock:
+        if _default_watchdog is None:
+            from config import STALL_LOG_FILE, STALL_POLL_SECONDS
+
+            _default_watchdog = StallWatchdog(STALL_LOG_FILE, STALL_POLL_SECONDS)
+        return _default_watchdog
+
+
+if __name__ == "__main__":
+    from mirror_scoreboard import mirror_host
+
+    watchdog = get_stall_watchdog()
+    events = watchdog.events()
+    print("=" * 70)
+    print(f"⏸️  停滯事件: {watchdog.log_file} ({len(events)} 筆)")
+    print("=" * 70)
+    if not events:
+        sys.exit(0)
+
+    by_stage = defaultdict(list)
+    by_source = defaultdict(int)
+    for event in events:
+        by_stage[event["stage"]].append(event)
+        if event.get("detail"):
+            by_source[mirror_host(event["detail"])] += 1
+
+    for stage, stage_events in sorted(by_stage.items()):
+        elapsed = sorted(e["elapsed_seconds"] for e in stage_events)
+        runs = len({e["run_id"] for e in stage_events})
+        print(f"   {stage:<12}{len(stage_events):>6} 次  {runs:>5} 個樣本  "
+              f"停滯前已執行 (中位數) {elapsed[len(elapsed) // 2] / 60:.1f} 分鐘")
+    if by_source:
+        print("\n   依來源:")
+        for source, count in sorted(by_source.items(), key=lambda item: -item[1]):
+            print(f"   {source:<50}{count:>6} 次")
+    print("\n   最近 10 筆:")
+    for event in events[-10:]:
+        print(f"   {event['time']}  {event['stage']:<10}{event['run_id']:<14}"
+              f"{event['idle_seconds']:>6.0f}s  {event.get('detail') or ''}")
@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SQLite 樣本狀態資料庫（取代 download_progress.json）
+- 每個樣本一列，status 欄位有索引
+- 每次成功/失敗都記錄在 attempts 表中
+- WAL 模式 + 交易更新，多線程同時寫入也安全
+- 每個樣本各階段的 checkpoint（已校驗的 SRA、解壓出的 FASTQ 與大小、已上傳的檔案），
+  重試或重新啟動時從第一個未完成的階段繼續；樣本完成時一併清除
+- 提供一次性的 JSON 進度檔（含備份）匯入工具
+
+用法:
+    python state_store.py              # 顯示狀態統計
+    python state_store.py --import     # 強制重新匯入 JSON 進度檔與所有備份
+"""
+
+import glob
+import json
+import sqlite3
+import sys
+import threading
+from datetime import datetime
+from pathlib import Path
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id      TEXT PRIMARY KEY,
+    status      TEXT NOT NULL,
+    step        TEXT,
+    error       TEXT,
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    updated_at  TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_runs_status ON runs(status);
+
+CREATE TABLE IF NOT EXISTS attempts (
+    id      INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id  TEXT NOT NULL,
+    status  TEXT NOT NULL,
+    step    TEXT,
+    error   TEXT,
+    time    TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_attempts_run ON attempts(run_id);
+
+CREATE TABLE IF NOT EXISTS checkpoints (
+    run_id      TEXT NOT NULL,
+    stage       TEXT NOT NULL,
+    data        TEXT NOT NULL,
+    updated_at  TEXT NOT NULL,
+    PRIMARY KEY (run_id, stage)
+);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key    TEXT PRIMARY KEY,
+    value  TEXT
+);
+"""
+
+STATUS_COMPLETED = "completed"
+STATUS_FAILED = "failed"
+
+
+class RunStateStore:
+    """樣本狀態資料庫（線程安全）"""
+
+    def __init__(self, db_file="download_state.db"):
+        self.db_file = Path(db_file)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            str(self.db_file), timeout=30, check_same_thread=False, isolation_level=None
+        )
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _transaction(self, statements):
+        """在單一交易中執行多個 (sql, params)"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for sql, params in statements:
+                    self._conn.execute(sql, params)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    # ==================== 狀態更新 ====================
+
+    def mark_completed(self, run_id, time=None):
+        """標記為完成"""
+        time = time or datetime.now().isoformat()
+        self._transaction([
+            (
+                "INSERT INTO runs (run_id, status, step, error, attempts, updated_at) "
+                "VALUES (?, ?, NULL, NULL, 1, ?) "
+                "ON CONFLICT(run_id) DO UPDATE SET status=excluded.status, step=NULL, error=NULL, "
+                "attempts=runs.attempts + 1, updated_at=excluded.updated_at",
+                (run_id, STATUS_COMPLETED, time),
+            ),
+            (
+                "INSERT INTO attempts (run_id, status, step, error, time) VALUES (?, ?, NULL, NULL, ?)",
+                (run_id, STATUS_COMPLETED, time),
+            ),
+            ("DELETE FROM checkpoints WHERE run_id = ?", (run_id,)),
+        ])
+
+    def mark_failed(self, run_id, step, error, time=None):
+        """標記為失敗（保留完整的嘗試歷史）"""
+        time = time or datetime.now().isoformat()
+        error = str(error)
+        self._transaction([
+            (
+                "INSERT INTO runs (run_id, status, step, error, attempts, updated_at) "
+                "VALUES (?, ?, ?, ?, 1, ?) "
+                "ON CONFLICT(run_id) DO UPDATE SET status=excluded.status, step=excluded.step, "
+                "error=excluded.error, attempts=runs.attempts + 1, updated_at=excluded.updated_at",
+                (run_id, STATUS_FAILED, step, error, time),
+            ),
+            (
+                "INSERT INTO attempts (run_id, status, step, error, time) VALUES (?, ?, ?, ?, ?)",
+                (run_id, STATUS_FAILED, step, error, time),
+            ),
+        ])
+
+    # ==================== 階段 checkpoint ====================
+
+    def save_checkpoint(self, run_id, stage, data, time=None):
+        """記錄樣本完成了某個階段（data 為可 JSON 序列化的字典，同一階段覆蓋舊記錄）"""
+        time = time or datetime.now().isoformat()
+        self._transaction([
+            (
+                "INSERT OR REPLACE INTO checkpoints (run_id, stage, data, updated_at) VALUES (?, ?, ?, ?)",
+                (run_id, stage, json.dumps(data, ensure_ascii=False), time),
+            ),
+        ])
+
+    def checkpoints(self, run_id):
+        """樣本目前的 checkpoint: {stage: data}"""
+        rows = self._query("SELECT stage, data FROM checkpoints WHERE run_id = ?", (run_id,))
+        return {r["stage"]: json.loads(r["data"]) for r in rows}
+
+    def clear_checkpoints(self, run_id, stages=None):
+        """清除樣本的 checkpoint（stages 為 None 時全部清除）"""
+        if stages is None:
+            self._transaction([("DELETE FROM checkpoints WHERE run_id = ?", (run_id,))])
+            return
+        self._transaction([
+            ("DELETE FROM checkpoints WHERE run_id = ? AND stage = ?", (run_id, stage)) for stage in stages
+        ])
+
+    def checkpointed_ids(self):
+        """有 checkpoint（尚未完成）的樣本 ID"""
+        rows = self._query("SELECT DISTINCT run_id FROM checkpoints")
+        return {row["run_id"] for row in rows}
+
+    # ==================== 查詢 ====================
+
+    def get(self, run_id):
+        """取得單一樣本的狀態（不存在時回傳 None）"""
+        rows = self._query("SELECT * FROM runs WHERE run_id = ?", (run_id,))
+        return dict(rows[0]) if rows else None
+
+    def completed_ids(self):
+        """所有已完成的樣本 ID"""
+        rows = self._query("SELECT run_id FROM runs WHERE status = ?", (STATUS_COMPLETED,))
+        return {row["run_id"] for row in rows}
+
+    def failed_entries(self):
+        """目前處於失敗狀態的樣本（格式與舊 JSON 的 failed 列表相同）"""
+        rows = self._query(
+            "SELECT run_id, step, error, updated_at FROM runs WHERE status = ? ORDER BY updated_at",
+            (STATUS_FAILED,),
+        )
+        return [
+            {"run_id": r["run_id"], "step": r["step"], "error": r["error"], "time": r["updated_at"]}
+            for r in rows
+        ]
+
+    def status_counts(self):
+        """各狀態的樣本數"""
+        rows = self._query("SELECT status, COUNT(*) AS n FROM runs GROUP BY status")
+        return {r["status"]: r["n"] for r in rows}
+
+    def attempt_history(self, run_id):
+        """單一樣本的所有嘗試記錄（依時間排序）"""
+        rows = self._query(
+            "SELECT status, step, error, time FROM attempts WHERE run_id = ? ORDER BY time, id",
+            (run_id,),
+        )
+        return [dict(r) for r in rows]
+
+    def get_meta(self, key):
+        rows = self._query("SELECT value FROM meta WHERE key = ?", (key,))
+        return rows[0]["value"] if rows else None
+
+    def set_meta(self, key, value):
+        self._transaction([
+            ("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value))),
+        ])
+
+    # ==================== JSON 匯入 ====================
+
+    def import_json_progress(self, progress_file="download_progress.json", include_backups=True):
+        """
+        匯入舊的 JSON 進度檔與其備份（一次性遷移）
+
+        備份依檔名中的時間戳由舊到新處理，最後處理主檔案；
+        已完成的樣本不會被較舊的失敗記錄覆蓋，失敗記錄全部保留在 attempts 表。
+
+        Returns:
+            dict: {"files": 檔案數, "completed": 完成數, "failed": 失敗數}
+        """
+        progress_file = Path(progress_file)
+        files = []
+        if include_backups:
+            pattern = str(progress_file.parent / f"{progress_file.stem}_backup_*.json")
+            files.extend(sorted(glob.glob(pattern)))
+            bak = progress_file.with_suffix(".bak")
+            if bak.exists():
+                files.insert(0, str(bak))
+        if progress_file.exists():
+            files.append(str(progress_file))
+
+        completed = set()
+        failures = {}  # (run_id, time, step) -> entry，去除各備份間重複的記錄
+        loaded = 0
+        for path in files:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    text = f.read()
+                # 部分損壞的備份在 JSON 後面有多餘的資料，只取第一個完整的物件
+                data, _ = json.JSONDecoder().raw_decode(text.lstrip())
+            except Exception as e:
+                print(f"   ⚠️  略過無法讀取的檔案 {Path(path).name}: {e}")
+                continue
+            loaded += 1
+            file_time = datetime.fromtimestamp(Path(path).stat().st_mtime).isoformat()
+
+            completed.update(r for r in data.get("completed", []) if isinstance(r, str))
+            for entry in data.get("failed", []):
+                if isinstance(entry, str):
+                    entry = {"run_id": entry, "step": "unknown_process", "error": "", "time": file_time}
+                if not isinstance(entry, dict) or not entry.get("run_id"):
+                    continue
+                time = entry.get("time") or file_time
+                failures[(entry["run_id"], time, entry.get("step"))] = {
+                    "run_id": entry["run_id"],
+                    "step": entry.get("step"),
+                    "error": entry.get("error", ""),
+                    "time": time,
+                }
+
+        # 只匯入資料庫中尚未有紀錄的樣本，不覆蓋新系統已寫入的狀態
+        existing = {r["run_id"] for r in self._query("SELECT run_id FROM runs")}
+        now = datetime.now().isoformat()
+        statements = []
+
+        for entry in sorted(failures.values(), key=lambda e: e["time"]):
+            statements.append((
+                "INSERT INTO attempts (run_id, status, step, error, time) SELECT ?, ?, ?, ?, ? "
+                "WHERE NOT EXISTS (SELECT 1 FROM attempts WHERE run_id = ? AND time = ? AND step IS ?)",
+                (entry["run_id"], STATUS_FAILED, entry["step"], entry["error"], entry["time"],
+                 entry["run_id"], entry["time"], entry["step"]),
+            ))
+
+        latest_failure = {}
+        for entry in sorted(failures.values(), key=lambda e: e["time"]):
+            latest_failure[entry["run_id"]] = entry
+        attempt_counts = {}
+        for run_id, _, _ in failures:
+            attempt_counts[run_id] = attempt_counts.get(run_id, 0) + 1
+
+        for run_id in sorted(completed - existing):
+            statements.append((
+                "INSERT INTO runs (run_id, status, step, error, attempts, updated_at) VALUES (?, ?, NULL, NULL, ?, ?)",
+                (run_id, STATUS_COMPLETED, attempt_counts.get(run_id, 0) + 1, now),
+            ))
+        failed_only = set(latest_failure) - completed - existing
+        for run_id in sorted(failed_only):
+            entry = latest_failure[run_id]
+            statements.append((
+                "INSERT INTO runs (run_id, status, step, error, attempts, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (run_id, STATUS_FAILED, entry["step"], entry["error"], attempt_counts[run_id], entry["time"]),
+            ))
+        statements.append((
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+            ("json_imported", now),
+        ))
+        self._transaction(statements)
+
+        return {
+            "files": loaded,
+            "completed": len(completed - existing),
+            "failed": len(failed_only),
+        }
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def get_run_state_store():
+    """取得依 config.py 設定建立的共用狀態資料庫（各階段記錄 checkpoint 用）"""
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            from config import STATE_DB_FILE
+
+            _default_store = RunStateStore(STATE_DB_FILE)
+        return _default_store
+
+
+if __name__ == "__main__":
+    from config import STATE_DB_FILE, PROGRESS_FILE
+
+    store = RunStateStore(STATE_DB_FILE)
+
+    if "--import" in sys.argv:
+        print(f"📥 匯入 {PROGRESS_FILE} 與其備份...")
+        result = store.import_json_progress(PROGRESS_FILE)
+        print(f"✅ 讀取 {result['files']} 個檔案，新增 {result['completed']} 個完成、{result['failed']} 個失敗")
+
+    counts = store.status_counts()
+    print("=" * 60)
+    print(f"📊 狀態資料庫: {STATE_DB_FILE}")
+    print("=" * 60)
+    print(f"✅ 已完成: {counts.get(STATUS_COMPLETED, 0)} 個")
+    print(f"❌ 失敗: {counts.get(STATUS_FAILED, 0)} 個")
+    print(f"↩️  有 checkpoint 可續做: {len(store.checkpointed_ids())} 個")
+    imported = store.get_meta("json_imported")
+    print(f"📥 JSON 匯入時間: {imported or '(尚未匯入)'}")
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+串流解壓上傳模組
+fasterq-dump 的輸出透過具名管道 (FIFO) 直接寫入 NAS，
+FASTQ 不會在本地磁碟上完整落地，省下一次完整寫入與讀取
+
+僅支援 Linux（需要 os.mkfifo，且暫存目錄所在的檔案系統必須支援 FIFO）。
+無法串流時拋出 StreamingUnavailable，由呼叫端改用一般的檔案模式。
+"""
+
+import os
+import shutil
+import stat
+import subprocess
+import threading
+import time
+from pathlib import Path
+
+
+class StreamingUnavailable(Exception):
+    """串流模式失敗，需要回退到檔案模式"""
+
+    def __init__(self, message, files=None):
+        super().__init__(message)
+        # fasterq-dump 若以一般檔案取代了 FIFO，已解壓的檔案會放在這裡，
+        # 呼叫端可以直接上傳而不必重新解壓
+        self.files = files or []
+
+
+def fastq_output_names(run_id):
+    """fasterq-dump --split-files 可能產生的檔名（雙端 _1/_2，單端可能不帶後綴）"""
+    return [f"{run_id}_1.fastq", f"{run_id}_2.fastq", f"{run_id}.fastq"]
+
+
+def _is_fifo(path):
+    try:
+        return stat.S_ISFIFO(os.stat(path).st_mode)
+    except FileNotFoundError:
+        return False
+
+
+class _StreamReader(threading.Thread):
+    """從一個 FIFO 讀取資料並寫入 NAS 的暫存檔"""
+
+    def __init__(self, fifo_path, nas_uploader, remote_path):
+        super().__init__(name=f"stream-{fifo_path.name}", daemon=True)
+        self.fifo_path = fifo_path
+        self.nas_uploader = nas_uploader
+        self.remote_path = remote_path
+        self.written = 0
+        self.streamed = 0  # 串流進行中已寫入的位元組數（停滯偵測用）
+        self.error = None
+
+    def _progress(self, written):
+        self.streamed = written
+
+    def run(self):
+        try:
+            with open(self.fifo_path, "rb", buffering=0) as stream:
+                self.written = self.nas_uploader.upload_stream(
+                    stream, self.remote_path, progress_callback=self._progress
+                )
+        except Exception as e:
+            self.error = e
+
+
+def stream_dump_to_nas(run_id, cmd, fifo_dir, nas_uploader, remote_dir, output_dir, timeout, watch=None,
+                       on_start=None):
+    """
+    執行 fasterq-dump 並把輸出直接串流到 NAS
+
+    Args:
+        run_id: 樣本 ID
+        cmd: fasterq-dump 指令（輸出目錄必須是 fifo_dir）
+        fifo_dir: 放置 FIFO 的本地目錄
+        nas_uploader: 已連接的 NASUploader
+        remote_dir: NAS 上的 FASTQ 目錄
+        output_dir: 回退時用來存放已落地 FASTQ 的本地目錄
+        timeout: fasterq-dump 超時（秒）
+        watch: stall_watchdog 的 Watch（可選），以寫入 NAS 的位元組數回報進度，停滯時終止
+        on_start: fasterq-dump 啟動後以 Popen 呼叫（可選）
+
+    Returns:
+        list: [(遠端檔名, 位元組數), ...]
+    """
+    if not hasattr(os, "mkfifo"):
+        raise StreamingUnavailable("此平台不支援 FIFO")
+
+    fifo_dir = Path(fifo_dir)
+    if fifo_dir.exists():
+        shutil.rmtree(fifo_dir)
+    fifo_dir.mkdir(parents=True, exist_ok=True)
+
+    readers = []
+    hold_fds = []
+    process_ok = False
+    try:
+        for name in fastq_output_names(run_id):
+            fifo_path = fifo_dir / name
+            try:
+                os.mkfifo(fifo_path)
+            except OSError as e:
+                raise StreamingUnavailable(f"無法建立 FIFO ({e})")
+
+            # 主線程以讀寫模式保持 FIFO 開啟:
+            # 讀取線程開啟時不會阻塞，且在我們關閉之前不會提前讀到 EOF
+            hold_fds.append(os.open(fifo_path, os.O_RDWR))
+
+            reader = _StreamReader(fifo_path, nas_uploader, f"{remote_dir}/{name}.partial")
+            reader.start()
+            readers.append(reader)
+
+        start_time = time.time()
+        process = subprocess.Popen(
+            cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+        )
+        if on_start is not None:
+            on_start(process)
+        while True:
+            try:
+                _, stderr = process.communicate(timeout=2)
+                break
+            except subprocess.TimeoutExpired:
+                pass
+            # 讀取端出錯後 FIFO 會被寫滿，fasterq-dump 將永遠阻塞，必須立即終止
+            failed = next((r for r in readers if r.error), None)
+            if watch is not None:
+                watch.progress(sum(r.streamed for r in readers))
+            stalled = watch is not None and watch.stalled
+            if failed or stalled or time.time() - start_time > timeout:
+                process.kill()
+                process.communicate()
+                if failed:
+                    raise StreamingUnavailable(f"串流上傳失敗: {failed.error}")
+                if stalled:
+                    raise StreamingUnavailable(f"串流模式停滯 ({watch.idle:.0f} 秒沒有寫入 NAS)")
+                raise StreamingUnavailable("fasterq-dump 串流模式超時")
+        elapsed = time.time() - start_time
+
+        # fasterq-dump 已結束，關閉保留的寫入端讓讀取線程收到 EOF
+        for fd in hold_fds:
+            os.close(fd)
+        hold_fds = []
+        for reader in readers:
+            reader.join()
+
+        if process.returncode != 0:
+            raise StreamingUnavailable(f"fasterq-dump 串流模式失敗: {stderr[:200]}")
+
+        # fasterq-dump 若刪除 FIFO 並建立一般檔案，代表串流沒有發生
+        materialized = [
+            fifo_dir / name for name in fastq_output_names(run_id)
+            if (fifo_dir / name).exists() and not _is_fifo(fifo_dir / name)
+        ]
+        if materialized and any(r.written > 0 for r in readers):
+            # 部分檔案走了 FIFO、部分落地，無法拼出完整結果，只能重新解壓
+            for f in materialized:
+                f.unlink()
+            raise StreamingUnavailable("fasterq-dump 只有部分輸出寫入 FIFO")
+        if materialized:
+            Path(output_dir).mkdir(parents=True, exist_ok=True)
+            moved = []
+            for f in materialized:
+                target = Path(output_dir) / f.name
+                shutil.move(str(f), str(target))
+                moved.append(target)
+            raise StreamingUnavailable("fasterq-dump 以一般檔案取代了 FIFO", files=moved)
+
+        for reader in readers:
+            if reader.error:
+                raise StreamingUnavailable(f"串流上傳失敗: {reader.error}")
+
+        # 沒有被 fasterq-dump 使用的檔名（例如雙端樣本的無後綴檔）會留下空的暫存檔
+        for reader in readers:
+            if reader.written == 0:
+                try:
+                    nas_uploader.sftp.remove(reader.remote_path)
+                except Exception:
+                    pass
+
+        streamed = [r for r in readers if r.written > 0]
+        if not streamed:
+            raise StreamingUnavailable("fasterq-dump 沒有輸出任何 FASTQ")
+
+        # 驗證大小後才把暫存檔改為正式檔名，避免不完整的檔案被當成已完成
+        uploaded = []
+        for reader in streamed:
+            final_path = reader.remote_path[: -len(".partial")]
+            remote_size = nas_uploader.sftp.stat(reader.remote_path).st_size
+            if remote_size != reader.written:
+                raise StreamingUnavailable(
+                    f"串流檔案大小不匹配 (串流: {reader.written}, 遠端: {remote_size})"
+                )
+            nas_uploader.replace_remote_file(reader.remote_path, final_path)
+            uploaded.append((Path(final_path).name, reader.written))
+
+        total_gb = sum(size for _, size in uploaded) / (1024**3)
+        print(f"✅ 串流解壓上傳完成 ({elapsed:.1f}秒, {total_gb:.2f} GB, {len(uploaded)} 個檔案)")
+        process_ok = True
+        return uploaded
+
+    finally:
+        for fd in hold_fds:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        if not process_ok:
+            # 移除 NAS 上的暫存檔
+            for reader in readers:
+                reader.join(timeout=5)
+                try:
+                    nas_uploader.sftp.remove(reader.remote_path)
+                except Exception:
+                    pass
+        shutil.rmtree(fifo_dir, ignore_errors=True)
@@ -0,0 +1,117 @@
+"""
+測試失敗分類與退避重試（prefetch / fasterq-dump / vdb-validate 的實際錯誤訊息）
+"""
+
+import subprocess
+import sys
+import threading
+import time
+
+print("=" * 70)
+print("🧪 測試失敗分類與重試策略")
+print("=" * 70)
+
+try:
+    from failure_policy import RetryPolicy, RetryScheduler, classify_error, parse_budgets
+    from stall_watchdog import StallDetected
+except Exception as e:
+    print(f"❌ 導入失敗: {e}")
+    sys.exit(1)
+
+# (錯誤, 階段, 預期類型)；錯誤訊息與 complete_downloader.py 拋出的格式相同
+CASES = [
+    # prefetch
+    ("樣本不存在於SRA數據庫（可能已下架）: SRR0000001", "download", "not_found"),
+    ("Prefetch失敗: 2024-05-02T03:11:52 prefetch.3.0.10 err: name not found while resolving query within "
+     "virtual file system module - failed to resolve accession 'SRR0000001' - no data ( 404 )",
+     "download", "not_found"),
+    ("Prefetch失敗: 2024-05-02T03:11:52 prefetch.3.0.10 err: timeout exhausted while reading file within "
+     "network system module - Cannot KStreamRead", "download", "network"),
+    ("Prefetch失敗: 2024-05-02T03:11:52 prefetch.3.0.10 err: connection failed while opening file within "
+     "network system module - mbedtls_ssl_handshake returned -76", "download", "network"),
+    ("Prefetch失敗: 2024-05-02T03:11:52 prefetch.3.0.10 err: transfer incomplete while reading file within "
+     "network system module - Cannot KStreamRead", "download", "network"),
+    ("Prefetch顯示成功但檔案不存在（可能是網路中斷或格式錯誤）。STDOUT: ", "download", "network"),
+    ("下載失敗: 檔案不存在 (HTTP 404): https://sra-pub-run-odp.s3.amazonaws.com/sra/SRR1/SRR1", "download",
+     "not_found"),
+    ("MD5 不符: 0cc175b9c0f1b6a831c399e269772661 (預期 92eb5ffee6ae2fec3ad71c777531578f)", "download", "corrupt"),
+    # fasterq-dump
+    ("Fasterq-dump失敗: 2024-05-02T04:00:01 fasterq-dump.3.0.10 err: storage exhausted while writing file "
+     "within file system module - failed to write to output", "dump", "disk_full"),
+    ("Fasterq-dump失敗: 2024-05-02T04:00:01 fasterq-dump.3.0.10 err: cmn_iter.c cmn_read_uint8_array( #81234 )"
+     ".VCursorCellDataDirect() -> RC(rcVDB,rcBlob,rcValidating,rcBlob,rcCorrupt)", "dump", "corrupt"),
+    (OSError(28, "No space left on device"), "dump", "disk_full"),
+    # 檔名中的 fastq 不代表失敗在解壓（舊的 step 判斷會誤判）
+    ("FASTQ上傳失敗: SRR0000001_1.fastq (已嘗試 5 次)", "upload", "nas"),
+    # vdb-validate
+    ("SRA檔案完整性校驗失敗，檔案可能下載不完整 (實際大小: 1.23 GB)", "validate", "corrupt"),
+    ("vdb-validate.3.0.10 err: data inconsistent while validating blob within virtual database module - "
+     "blob #4097 checksum mismatch", "validate", "corrupt"),
+    # NAS / 停滯 / 超時
+    ("NAS連接失敗 (已重試 5 次): nas.example.org", None, "nas"),
+    ("Error reading SSH protocol banner", "upload", "nas"),
+    (StallDetected("download", "SRR0000001", 600, "aria2"), "download", "network"),
+    (subprocess.TimeoutExpired(["prefetch", "SRR0000001"], 10800), "download", "network"),
+    ("something unexpected", "dump", "unknown"),
+    ("something unexpected", "upload", "nas"),
+]
+
+print("\n[測試 1] 錯誤分類...")
+wrong = 0
+for error, stage, expected in CASES:
+    got = classify_error(error, stage)
+    if got != expected:
+        wrong += 1
+        print(f"❌ {str(error)[:70]}\n   分類: {got} (應為 {expected})")
+print(f"{'✅' if not wrong else '❌'} {len(CASES) - wrong}/{len(CASES)} 個分類正確")
+
+print("\n[測試 2] 各類型的重試次數上限...")
+try:
+    policy = RetryPolicy(budgets=parse_budgets("network=2"), max_retries=3, base_delay=10, jitter=0)
+    print(f"✅ 永久性錯誤不重試: {policy.decide('SRR1', 'not_found')} (應為 None)")
+    print(f"   corrupt 只重試一次: {[policy.decide('SRR2', 'corrupt') is not None for _ in range(2)]} "
+          f"(應為 [True, False])")
+    print(f"   network 依 RETRY_BUDGETS 重試兩次: {[policy.decide('SRR3', 'network') is not None for _ in range(3)]} "
+          f"(應為 [True, True, False])")
+    decisions = [policy.decide("SRR4", failure) is not None for failure in ("network", "nas", "nas", "nas")]
+    print(f"   每個樣本總共最多 3 次: {decisions} (應為 [True, True, True, False])")
+    print(f"   已重試次數: {policy.retries('SRR4')} (應為 3)")
+except Exception as e:
+    print(f"❌ 失敗: {e}")
+
+print("\n[測試 3] 指數退避與抖動...")
+try:
+    policy = RetryPolicy(budgets={"nas": 10, "disk_full": 10}, max_retries=10, base_delay=10, max_delay=60, jitter=0)
+    delays = [policy.decide("SRR1", "nas") for _ in range(5)]
+    print(f"✅ 每次加倍直到上限: {delays} (應為 [10, 20, 40, 60, 60])")
+    print(f"   磁碟空間不足等待較久: {policy.decide('SRR2', 'disk_full')} (應為 40)")
+
+    policy = RetryPolicy(budgets={"network": 1}, max_retries=1, base_delay=100, jitter=0.25)
+    delays = [policy.decide(f"SRR{i}", "network") for i in range(200)]
+    print(f"   抖動範圍: {min(delays):.0f}-{max(delays):.0f} 秒 (應在 75-125 之間)，"
+          f"不全相同: {len(set(delays)) > 1} (應為 True)")
+except Exception as e:
+    print(f"❌ 失敗: {e}")
+
+print("\n[測試 4] 到期後依序重新提交...")
+try:
+    submitted = []
+    scheduler = RetryScheduler(lambda job: submitted.append(job["run_id"]))
+    scheduler.schedule({"run_id": "LATE"}, 0.3)
+    scheduler.schedule({"run_id": "EARLY"}, 0.1)
+    print(f"✅ 等待重試: {scheduler.pending()} (應為 2)")
+    waiter = threading.Thread(target=scheduler.wait_idle, daemon=True)
+    waiter.start()
+    waiter.join(5)
+    print(f"   wait_idle 結束: {not waiter.is_alive()} (應為 True)")
+    print(f"   提交順序: {submitted} (應為 ['EARLY', 'LATE'])")
+    scheduler.schedule({"run_id": "NEVER"}, 60)
+    start = time.time()
+    print(f"   shutdown 捨棄未到期的重試: {scheduler.shutdown()} (應為 ['NEVER'])，"
+          f"立即結束: {time.time() - start < 2} (應為 True)")
+except Exception as e:
+    print(f"❌ 失敗: {e}")
+
+print("\n" + "=" * 70)
+print("✅ 所有測試完成!")
+print("=" * 70)
@@ -0,0 +1,199 @@
+"""
+測試內建多段 HTTP 下載引擎（本地支援 Range 的 HTTP 伺服器）
+"""
+
+import hashlib
+import os
+import re
+import shutil
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+print("=" * 70)
+print("🧪 測試多段 HTTP 下載引擎")
+print("=" * 70)
+
+try:
+    from http_downloader import DownloadCancelled, DownloadError, SegmentedDownload
+    from stall_watchdog import StallDetected, StallWatchdog
+except Exception as e:
+    print(f"❌ 導入失敗: {e}")
+    sys.exit(1)
+
+TEST_DIR = Path("test_http_download")
+DATA = os.urandom(5 * 1024 * 1024 + 123)
+DATA_MD5 = hashlib.md5(DATA).hexdigest()
+
+# 每次回應送出的區塊延遲（秒），測試中止/續傳時調大
+SLOW = {"delay": 0.0}
+RANGE_REQUESTS = []
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        # /other 模擬內容不同（大小不同）的鏡像
+        data = DATA + b"different" if self.path == "/other" else DATA
+        match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        if self.path == "/norange" or not match:
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            try:
+                self.wfile.write(data)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            return
+
+        start = int(match.group(1))
+        end = int(match.group(2)) if match.group(2) else len(data) - 1
+        RANGE_REQUESTS.append((start, end))
+        probing = start == 0 and end < 1024 * 1024
+        delay = SLOW["delay"]
+        if self.path == "/lagging" and probing:
+            # 探測時回應較慢，但實際下載很快的鏡像
+            time.sleep(0.3)
+        if self.path == "/stalling" and not probing:
+            # 探測時很快，實際下載時變慢的鏡像
+            delay = 0.5
+        if self.path == "/frozen" and start >= 1024 * 1024:
+            # 第一段之後完全沒有回應的鏡像
+            delay = 60
+        self.send_response(206)
+        self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("ETag", '"test-etag"')
+        self.end_headers()
+        try:
+            for pos in range(start, end + 1, 64 * 1024):
+                self.wfile.write(data[pos:min(pos + 64 * 1024, end + 1)])
+                if delay:
+                    time.sleep(delay)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+server = ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+server.daemon_threads = True
+threading.Thread(target=server.serve_forever, daemon=True).start()
+BASE_URL = f"http://127.0.0.1:{server.server_address[1]}"
+TEST_DIR.mkdir(exist_ok=True)
+
+print("\n[測試 1] 多段下載並比對 MD5...")
+try:
+    dest = TEST_DIR / "full.sra"
+    download = SegmentedDownload(f"{BASE_URL}/file", dest, connections=4, segment_size=1024 * 1024,
+                                 expected_md5=DATA_MD5, progress_interval=0)
+    result = download.run()
+    print(f"✅ 下載完成: {result['size']} bytes")
+    print(f"   內容相同: {dest.read_bytes() == DATA} (應為 True)")
+    print(f"   MD5 相同: {result['md5'] == DATA_MD5} (應為 True)")
+    print(f"   段落數: {len(download.segments)} (應為 6)")
+    print(f"   已移除 .part 與段落記錄: {not download.part_file.exists() and not download.map_file.exists()}")
+except Exception as e:
+    print(f"❌ 失敗: {e}")
+
+print("\n[測試 2] 中止後從段落記錄續傳...")
+try:
+    dest = TEST_DIR / "resume.sra"
+    SLOW["delay"] = 0.05
+    download = SegmentedDownload(f"{BASE_URL}/file", dest, connections=3, segment_size=1024 * 1024,
+                                 progress_interval=0, checkpoint_interval=0.2)
+    threading.Timer(0.5, download.cancel).start()
+    try:
+        download.run()
+        print("❌ 應該被中止")
+    except DownloadCancelled:
+        kept = download.downloaded_bytes()
+        print(f"✅ 已中止，保留 {kept} bytes，段落記錄存在: {download.map_file.exists()}")
+
+    SLOW["delay"] = 0.0
+    RANGE_REQUESTS.clear()
+    resumed = SegmentedDownload(f"{BASE_URL}/file", dest, connections=3, segment_size=1024 * 1024,
+                                expected_md5=DATA_MD5, progress_interval=0)
+    result = resumed.run()
+    print(f"✅ 續傳完成，沿用 {result['resumed_bytes']} bytes (應大於 0)")
+    print(f"   內容相同: {dest.read_bytes() == DATA} (應為 True)")
+    print(f"   續傳沒有從頭重新下載: {all(start > 0 for start, end in RANGE_REQUESTS if end > 0)} (應為 True)")
+except Exception as e:
+    print(f"❌ 失敗: {e}")
+
+print("\n[測試 3] MD5 不符時拒絕並清除部分檔案...")
+try:
+    dest = TEST_DIR / "bad.sra"
+    try:
+        SegmentedDownload(f"{BASE_URL}/file", dest, expected_md5="0" * 32, progress_interval=0).run()
+        print("❌ 應該拋出 DownloadError")
+    except DownloadError as e:
+        print(f"✅ 已拒絕: {e}")
+        print(f"   未留下檔案: {not dest.exists() and not dest.with_name('bad.sra.part').exists()} (應為 True)")
+except Exception as e:
+    print(f"❌ 失敗: {e}")
+
+print("\n[測試 4] 伺服器不支援 Range 時以單一連線下載...")
+try:
+    dest = TEST_DIR / "norange.sra"
+    result = SegmentedDownload(f"{BASE_URL}/norange", dest, progress_interval=0).run()
+    print(f"✅ 下載完成，內容相同: {dest.read_bytes() == DATA} (應為 True)")
+except DownloadError as e:
+    print(f"✅ 伺服器不支援 Range，已回報錯誤: {e}")
+except Exception as e:
+    print(f"❌ 失敗: {e}")
+
+print("\n[測試 5] 多鏡像: 排除大小不同的鏡像，下載變慢時改用其他鏡像...")
+try:
+    dest = TEST_DIR / "hedged.sra"
+    download = SegmentedDownload(
+        [f"{BASE_URL}/stalling", f"{BASE_URL}/other", f"{BASE_URL}/lagging"],
+        dest, connections=4, segment_size=1024 * 1024, expected_md5=DATA_MD5,
+        progress_interval=0, reroute_interval=1,
+    )
+    result = download.run()
+    print(f"✅ 下載完成，內容相同: {dest.read_bytes() == DATA} (應為 True)")
+    print(f"   換鏡像次數: {result['reroutes']} (應大於 0)")
+    print(f"   最後使用: {download.mirrors[download.primary]['source'].rsplit('/', 1)[-1]} (應為 lagging)")
+    print(f"   切分段落次數: {result['splits']}")
+except Exception as e:
+    print(f"❌ 失敗: {e}")
+
+print("\n[測試 6] 停滯偵測: 沒有進度時中止下載並保留段落記錄...")
+try:
+    dest = TEST_DIR / "frozen.sra"
+    log_file = TEST_DIR / "stall_events.jsonl"
+    watchdog = StallWatchdog(log_file, poll_interval=0.2)
+    download = SegmentedDownload(f"{BASE_URL}/frozen", dest, connections=2, segment_size=1024 * 1024,
+                                 progress_interval=0, checkpoint_interval=0.2, timeout=2)
+    watch = watchdog.watch("download", "TEST", 1.5, download.downloaded_bytes,
+                           on_stall=download.cancel, detail="frozen")
+    start = time.time()
+    try:
+        with watch:
+            download.run()
+        print("❌ 應該被中止")
+    except DownloadError:
+        try:
+            watch.check()
+            print("❌ 應該判定停滯")
+        except StallDetected as e:
+            print(f"✅ 已判定停滯並中止 ({time.time() - start:.1f}秒): {e}")
+    print(f"   保留段落記錄: {download.map_file.exists()} (應為 True)")
+    print(f"   已記錄停滯事件: {len(watchdog.events())} 筆 (應為 1)")
+except Exception as e:
+    print(f"❌ 失敗: {e}")
+
+print("\n[測試 7] 清理測試檔案...")
+try:
+    server.shutdown()
+    shutil.rmtree(TEST_DIR)
+    print(f"✅ 清理完成")
+except Exception as e:
+    print(f"⚠️  清理失敗: {e}")
+
+print("\n" + "=" * 70)
+print("✅ 所有測試完成!")
+print("=" * 70)
@@ -1,13 +1,14 @@
 """
-測試 JSON 保存的安全性
+測試進度儲存的安全性（SQLite 狀態資料庫）
 """
 
 import json
+import threading
 from pathlib import Path
 import sys
 
 print("=" * 70)
-print("🧪 測試 JSON 保存邏輯")
+print("🧪 測試進度儲存邏輯")
 print("=" * 70)
 
 # 導入 ProgressManager
@@ -21,71 +22,71 @@ except Exception as e:
     print(f"❌ 導入失敗: {e}")
     sys.exit(1)
 
-print("\n[測試 1] 初始化 ProgressManager...")
+TEST_JSON = Path("test_progress.json")
+TEST_DB = Path("test_state.db")
+
+print("\n[測試 1] 從舊 JSON 匯入...")
 try:
-    pm = ProgressManager("test_progress.json")
+    with open(TEST_JSON, "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "completed": ["TEST001", "TEST002"],
+                "failed": [{"run_id": "TEST003", "step": "dumping", "error": "x", "time": "2025-01-01T00:00:00"}],
+                "remaining": [],
+            },
+            f,
+        )
+
+    pm = ProgressManager(TEST_JSON, TEST_DB)
     print(f"✅ 初始化成功")
-    print(f"   已完成: {len(pm.progress.get('completed', []))}")
+    print(f"   已完成: {len(pm.progress.get('completed', []))} (應為 2)")
+    print(f"   失敗: {len(pm.progress.get('failed', []))} (應為 1)")
 except Exception as e:
     print(f"❌ 失敗: {e}")
     sys.exit(1)
 
-print("\n[測試 2] 測試保存功能...")
+print("\n[測試 2] 測試標記完成/失敗...")
 try:
-    # 添加一些測試數據
-    pm.progress["completed"] = ["TEST001", "TEST002", "TEST003"]
-    pm.progress["failed"] = []
-
-    pm.save_progress()
+    pm.mark_failed("TEST004", "upload", "NAS timeout")
+    pm.mark_completed("TEST003")
     print(f"✅ 保存成功")
-
-    # 驗證檔案存在且可讀
-    test_file = Path("test_progress.json")
-    if test_file.exists():
-        with open(test_file, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        print(f"✅ 檔案格式正確")
-        print(f"   完成數: {len(data['completed'])}")
-    else:
-        print(f"❌ 檔案不存在!")
-
+    print(f"   TEST003 狀態: {pm.store.get('TEST003')['status']} (應為 completed)")
+    print(f"   TEST003 嘗試次數: {len(pm.store.attempt_history('TEST003'))} (應為 2)")
 except Exception as e:
     print(f"❌ 失敗: {e}")
     import traceback
 
     traceback.print_exc()
 
-print("\n[測試 3] 測試多次保存 (觸發自動備份)...")
+print("\n[測試 3] 測試多線程同時寫入...")
 try:
-    for i in range(12):
-        pm.progress["completed"].append(f"TEST{i:03d}")
-        pm.save_progress()
-        if i == 9:
-            print(f"   保存 {i+1} 次 (應該觸發備份)")
-
-    print(f"✅ 多次保存成功")
-
-    # 檢查備份檔案
-    backup_files = list(Path(".").glob("test_progress_backup_*.json"))
-    print(f"   備份檔案數: {len(backup_files)}")
+    def worker(n):
+        for i in range(50):
+            run_id = f"T{n:02d}_{i:03d}"
+            pm.mark_failed(run_id, "prefetch", "timeout")
+            pm.mark_completed(run_id)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    # 重新開啟資料庫確認資料已寫入
+    pm2 = ProgressManager(TEST_JSON, TEST_DB)
+    print(f"✅ 多線程寫入成功")
+    print(f"   已完成: {len(pm2.progress['completed'])} (應為 {2 + 1 + 8 * 50})")
 
 except Exception as e:
     print(f"❌ 失敗: {e}")
 
 print("\n[測試 4] 清理測試檔案...")
 try:
-    test_file = Path("test_progress.json")
-    if test_file.exists():
-        test_file.unlink()
-
-    for backup in Path(".").glob("test_progress_backup_*.json"):
-        backup.unlink()
-
-    for temp in Path(".").glob("test_progress.tmp"):
-        temp.unlink()
-
-    for bak in Path(".").glob("test_progress.bak"):
-        bak.unlink()
+    pm.store.close()
+    pm2.store.close()
+    for path in [TEST_JSON, TEST_DB, Path("test_state.db-wal"), Path("test_state.db-shm")]:
+        if path.exists():
+            path.unlink()
 
     print(f"✅ 清理完成")
 except Exception as e:
@@ -95,7 +96,7 @@ print("\n" + "=" * 70)
 print("✅ 所有測試完成!")
 print("=" * 70)
 print("\n💡 改進說明:")
-print("  1. ✅ 使用臨時檔案 + 備份檔案,防止寫入失敗導致資料遺失")
-print("  2. ✅ 每10次保存或每30分鐘自動創建帶時間戳的備份")
-print("  3. ✅ 如果保存失敗會自動恢復備份")
-print("  4. ✅ 所有操作都有錯誤處理")
+print("  1. ✅ 進度改存 SQLite (WAL)，每次更新是一個交易，不再重寫整個 JSON")
+print("  2. ✅ 每個樣本一列，狀態欄位有索引，所有嘗試記錄保留在 attempts 表")
+print("  3. ✅ 多線程寫入有鎖保護")
+print("  4. ✅ 第一次使用時自動匯入舊 JSON 進度檔與所有備份")
@@ -0,0 +1,188 @@
+"""
+測試上傳暫存區（背景上傳、退避重試、無法重試的錯誤）
+"""
+
+import shutil
+import sys
+import threading
+import time
+from pathlib import Path
+
+print("=" * 70)
+print("🧪 測試上傳暫存區")
+print("=" * 70)
+
+try:
+    from upload_spool import MANIFEST_NAME, UploadSpool
+except Exception as e:
+    print(f"❌ 導入失敗: {e}")
+    sys.exit(1)
+
+TEST_DIR = Path("test_upload_spool")
+SPOOL_DIR = TEST_DIR / "spool"
+SRC_DIR = TEST_DIR / "src"
+
+
+def make_files(run_id, count=2, size=1024):
+    SRC_DIR.mkdir(parents=True, exist_ok=True)
+    files = []
+    for i in range(1, count + 1):
+        f = SRC_DIR / f"{run_id}_{i}.fastq"
+        f.write_bytes(b"A" * size)
+        files.append(f)
+    return files
+
+
+def wait_idle(spool, timeout=10):
+    """在背景等待 wait_idle()，回傳是否在 timeout 秒內結束"""
+    t = threading.Thread(target=spool.wait_idle, daemon=True)
+    t.start()
+    t.join(timeout)
+    return not t.is_alive()
+
+
+class Recorder:
+    def __init__(self, fail_times=0):
+        self.fail_times = fail_times
+        self.uploaded = []
+        self.done = []
+        self.failed = []
+        self.calls = 0
+
+    def upload(self, local_file):
+        self.calls += 1
+        if self.calls <= self.fail_times:
+            raise ConnectionError("模擬 NAS 斷線")
+        self.uploaded.append(local_file.name)
+
+    def on_uploaded(self, run_id):
+        self.done.append(run_id)
+
+    def on_failed(self, run_id, error):
+        self.failed.append((run_id, str(error)))
+
+
+def make_spool(recorder, max_attempts=48):
+    spool = UploadSpool(
+        SPOOL_DIR, budget_bytes=10 * 1024 * 1024,
+        upload_func=recorder.upload, on_uploaded=recorder.on_uploaded, on_failed=recorder.on_failed,
+        workers=2, retry_delay=0.05, max_retry_delay=0.2, max_attempts=max_attempts,
+    )
+    spool.start()
+    return spool
+
+
+shutil.rmtree(TEST_DIR, ignore_errors=True)
+
+print("\n[測試 1] 加入暫存區後背景上傳...")
+try:
+    rec = Recorder()
+    spool = make_spool(rec)
+    files = make_files("SRR001")
+    spool.add("SRR001", files)
+    print(f"✅ 已加入，原檔已移走: {not any(f.exists() for f in files)} (應為 True)")
+    print(f"   wait_idle 結束: {wait_idle(spool)} (應為 True)")
+    print(f"   上傳檔案: {sorted(rec.uploaded)} (應為 SRR001_1, SRR001_2)")
+    print(f"   完成回呼: {rec.done} (應為 ['SRR001'])")
+    print(f"   暫存區已清除: {not (SPOOL_DIR / 'SRR001').exists()} (應為 True)")
+    spool.shutdown()
+except Exception as e:
+    print(f"❌ 失敗: {e}")
+
+print("\n[測試 2] 上傳失敗時退避重試，成功後完成...")
+try:
+    rec = Recorder(fail_times=3)
+    spool = make_spool(rec)
+    spool.add("SRR002", make_files("SRR002", count=1))
+    print(f"✅ wait_idle 結束: {wait_idle(spool)} (應為 True)")
+    print(f"   嘗試次數: {rec.calls} (應為 4)")
+    print(f"   完成回呼: {rec.done} (應為 ['SRR002'])，失敗回呼: {rec.failed} (應為 [])")
+    spool.shutdown()
+except Exception as e:
+    print(f"❌ 失敗: {e}")
+
+print("\n[測試 3] 暫存區檔案遺失時直接判定失敗，不無限重試...")
+try:
+    # 模擬重新啟動時 manifest 還在但檔案已遺失
+    run_dir = SPOOL_DIR / "SRR003"
+    run_dir.mkdir(parents=True)
+    (run_dir / MANIFEST_NAME).write_text(
+        '{"run_id": "SRR003", "files": ["SRR003_1.fastq"], "uploaded": [], "bytes": 0, "attempts": 0}',
+        encoding="utf-8",
+    )
+    rec = Recorder()
+    spool = make_spool(rec)
+    print(f"✅ 載入的樣本: {spool.load_pending()} (應為 ['SRR003'])")
+    print(f"   wait_idle 結束: {wait_idle(spool)} (應為 True)")
+    print(f"   上傳嘗試: {rec.calls} (應為 0)")
+    print(f"   失敗回呼: {[run_id for run_id, _ in rec.failed]} (應為 ['SRR003'])")
+    print(f"   已清除暫存區: {not run_dir.exists()} (應為 True)")
+    print(f"   失敗數: {spool.failed_count} (應為 1)")
+    spool.shutdown()
+except Exception as e:
+    print(f"❌ 失敗: {e}")
+
+print("\n[測試 4] 執行中 manifest 損壞時直接判定失敗...")
+try:
+    rec = Recorder()
+    spool = make_spool(rec)
+    run_dir = SPOOL_DIR / "SRR004"
+    run_dir.mkdir(parents=True)
+    (run_dir / MANIFEST_NAME).write_text("{broken", encoding="utf-8")
+    with spool._cond:
+        spool._bytes["SRR004"] = 0
+        spool._schedule("SRR004", time.time())
+    print(f"✅ wait_idle 結束: {wait_idle(spool)} (應為 True)")
+    print(f"   失敗回呼: {[run_id for run_id, _ in rec.failed]} (應為 ['SRR004'])")
+    spool.shutdown()
+except Exception as e:
+    print(f"❌ 失敗: {e}")
+
+print("\n[測試 5] 重試次數用完時判定失敗，檔案保留到下次啟動...")
+try:
+    rec = Recorder(fail_times=100)
+    spool = make_spool(rec, max_attempts=3)
+    spool.add("SRR005", make_files("SRR005", count=1))
+    print(f"✅ wait_idle 結束: {wait_idle(spool)} (應為 True)")
+    print(f"   嘗試次數: {rec.calls} (應為 3)")
+    print(f"   失敗回呼: {[run_id for run_id, _ in rec.failed]} (應為 ['SRR005'])")
+    print(f"   檔案保留: {(SPOOL_DIR / 'SRR005' / 'SRR005_1.fastq').exists()} (應為 True)")
+    spool.shutdown()
+
+    rec = Recorder()
+    spool = make_spool(rec)
+    print(f"   下次啟動載入: {spool.load_pending()} (應為 ['SRR005'])")
+    print(f"   續傳完成: {wait_idle(spool) and rec.done == ['SRR005']} (應為 True)")
+    spool.shutdown()
+except Exception as e:
+    print(f"❌ 失敗: {e}")
+
+print("\n[測試 6] 只續傳指定的樣本，其餘留在磁碟上或清除...")
+try:
+    for run_id in ("SRR006", "SRR007"):
+        run_dir = SPOOL_DIR / run_id
+        run_dir.mkdir(parents=True)
+        (run_dir / f"{run_id}_1.fastq").write_bytes(b"A" * 1024)
+        (run_dir / MANIFEST_NAME).write_text(
+            f'{{"run_id": "{run_id}", "files": ["{run_id}_1.fastq"], "uploaded": [], "bytes": 1024, "attempts": 0}}',
+            encoding="utf-8",
+        )
+    rec = Recorder()
+    spool = make_spool(rec)
+    print(f"✅ 磁碟上的樣本: {spool.scan_pending()} (應為 ['SRR006', 'SRR007'])")
+    print(f"   載入: {spool.load_pending(['SRR006'])} (應為 ['SRR006'])")
+    print(f"   wait_idle 結束: {wait_idle(spool)} (應為 True)，完成回呼: {rec.done} (應為 ['SRR006'])")
+    print(f"   未載入的仍在磁碟上: {spool.scan_pending()} (應為 ['SRR007'])")
+    spool.discard("SRR007")
+    print(f"   清除後: {spool.scan_pending()} (應為 [])，上傳嘗試: {rec.calls} (應為 1)")
+    spool.shutdown()
+except Exception as e:
+    print(f"❌ 失敗: {e}")
+
+print("\n[測試 7] 清理測試檔案...")
+shutil.rmtree(TEST_DIR, ignore_errors=True)
+print("✅ 清理完成")
+
+print("\n" + "=" * 70)
+print("✅ 所有測試完成!")
+print("=" * 70)
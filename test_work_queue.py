@@ -0,0 +1,248 @@
+"""
+測試 NAS 租約工作佇列（exclusive create、接手過期租約的改名競爭、沿用自己的租約、續約）
+以記憶體中的假 SFTP 模擬多個節點共用的 NAS
+"""
+
+import io
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+print("=" * 70)
+print("🧪 測試 NAS 租約工作佇列")
+print("=" * 70)
+
+try:
+    from work_queue import NASWorkQueue
+except Exception as e:
+    print(f"❌ 導入失敗: {e}")
+    sys.exit(1)
+
+LEASE_DIR = "/leases"
+
+
+class FakeFile(io.StringIO):
+    def __init__(self, sftp, path, data=""):
+        super().__init__(data)
+        self.sftp = sftp
+        self.path = path
+
+    def close(self):
+        if self.path is not None:
+            with self.sftp.lock:
+                self.sftp.files[self.path] = (self.getvalue(), time.time())
+        super().close()
+
+
+class FakeSFTP:
+    """只實作租約需要的操作；錯誤與 paramiko 相同（不存在時 FileNotFoundError，其他失敗 IOError）"""
+
+    def __init__(self):
+        self.files = {}  # path -> (內容, mtime)
+        self.lock = threading.Lock()
+        self.after_rename = None
+
+    def open(self, path, mode="r"):
+        with self.lock:
+            if mode == "x":
+                if path in self.files:
+                    raise IOError("Failure")
+                self.files[path] = ("", time.time())
+                return FakeFile(self, path)
+            if mode == "r":
+                if path not in self.files:
+                    raise FileNotFoundError(path)
+                return FakeFile(None, None, self.files[path][0])
+        return FakeFile(self, path)
+
+    def stat(self, path):
+        with self.lock:
+            if path not in self.files:
+                raise FileNotFoundError(path)
+            return type("Attr", (), {"st_mtime": self.files[path][1]})()
+
+    def rename(self, src, dst):
+        with self.lock:
+            if src not in self.files or dst in self.files:
+                raise IOError("Failure")
+            self.files[dst] = self.files.pop(src)
+        hook, self.after_rename = self.after_rename, None
+        if hook:
+            hook()
+
+    def posix_rename(self, src, dst):
+        with self.lock:
+            if src not in self.files:
+                raise FileNotFoundError(src)
+            self.files[dst] = self.files.pop(src)
+
+    def remove(self, path):
+        with self.lock:
+            if path not in self.files:
+                raise FileNotFoundError(path)
+            del self.files[path]
+
+    def listdir(self, path):
+        with self.lock:
+            return [p[len(path) + 1:] for p in self.files if p.startswith(path + "/")]
+
+
+class FakeNAS:
+    def __init__(self, sftp):
+        self.sftp = sftp
+
+    def create_remote_dir(self, path):
+        pass
+
+    def replace_remote_file(self, src, dst):
+        self.sftp.posix_rename(src, dst)
+
+    def is_alive(self):
+        return True
+
+    def disconnect(self):
+        pass
+
+
+class FakePool:
+    def __init__(self, sftp):
+        self.nas = FakeNAS(sftp)
+
+    @contextmanager
+    def connection(self):
+        yield self.nas
+
+
+def make_queue(sftp, node_id, ttl=600):
+    return NASWorkQueue(FakePool(sftp), LEASE_DIR, node_id, ttl=ttl, skew=0, poll_interval=0.1)
+
+
+def lease_of(sftp, run_id):
+    data, _ = sftp.files[f"{LEASE_DIR}/{run_id}.lease"]
+    return json.loads(data)
+
+
+def expire(sftp, run_id):
+    """把租約改成已過期（模擬持有的節點當機）"""
+    lease = lease_of(sftp, run_id)
+    lease["expires"] = time.time() - 10
+    sftp.files[f"{LEASE_DIR}/{run_id}.lease"] = (json.dumps(lease), time.time())
+
+
+print("\n[測試 1] exclusive create: 同一個樣本只有一個節點取得...")
+try:
+    sftp = FakeSFTP()
+    node_a, node_b = make_queue(sftp, "node-a"), make_queue(sftp, "node-b")
+    print(f"✅ node-a 取得: {node_a.claim('SRR001')} (應為 True)")
+    print(f"   node-b 取得: {node_b.claim('SRR001')} (應為 False)")
+    print(f"   租約持有者: {lease_of(sftp, 'SRR001')['node']} (應為 node-a)")
+    node_b.release("SRR001")
+    print(f"   node-b 釋放後租約仍在: {f'{LEASE_DIR}/SRR001.lease' in sftp.files} (應為 True)")
+    node_a.release("SRR001")
+    print(f"   node-a 釋放後 node-b 取得: {node_b.claim('SRR001')} (應為 True)")
+    node_a.shutdown()
+    node_b.shutdown()
+except Exception as e:
+    print(f"❌ 失敗: {e}")
+
+print("\n[測試 2] 同一個節點重新啟動時沿用自己的租約...")
+try:
+    sftp = FakeSFTP()
+    node_a = make_queue(sftp, "node-a")
+    node_a.claim("SRR002")
+    before = lease_of(sftp, "SRR002")["expires"]
+    time.sleep(0.01)
+    restarted = make_queue(sftp, "node-a")
+    print(f"✅ 重新啟動後取得: {restarted.claim('SRR002')} (應為 True)")
+    print(f"   已續約: {lease_of(sftp, 'SRR002')['expires'] > before} (應為 True)")
+    print(f"   其他節點取得: {make_queue(sftp, 'node-b').claim('SRR002')} (應為 False)")
+    restarted.shutdown()
+except Exception as e:
+    print(f"❌ 失敗: {e}")
+
+print("\n[測試 3] 接手過期的租約...")
+try:
+    sftp = FakeSFTP()
+    make_queue(sftp, "node-a").claim("SRR003")
+    expire(sftp, "SRR003")
+    node_b = make_queue(sftp, "node-b")
+    print(f"✅ node-b 接手: {node_b.claim('SRR003')} (應為 True)")
+    print(f"   租約持有者: {lease_of(sftp, 'SRR003')['node']} (應為 node-b)")
+    print(f"   沒有殘留 .stale: {not any('.stale.' in p for p in sftp.files)} (應為 True)")
+    print(f"   node-c 取得剛接手的租約: {make_queue(sftp, 'node-c').claim('SRR003')} (應為 False)")
+    node_b.shutdown()
+except Exception as e:
+    print(f"❌ 失敗: {e}")
+
+print("\n[測試 4] 兩個節點同時接手: 只有改名成功的一個取得...")
+try:
+    sftp = FakeSFTP()
+    make_queue(sftp, "node-a").claim("SRR004")
+    expire(sftp, "SRR004")
+    node_b, node_c = make_queue(sftp, "node-b"), make_queue(sftp, "node-c")
+    results = {}
+
+    # node-b 改名成 .stale 之後、建立新租約之前，node-c 也嘗試改名
+    sftp.after_rename = lambda: results.setdefault("node-c", node_c._steal(FakeNAS(sftp), "SRR004"))
+    results["node-b"] = node_b._steal(FakeNAS(sftp), "SRR004")
+    print(f"✅ node-b: {results['node-b']} (應為 True)，node-c: {results['node-c']} (應為 False)")
+    print(f"   租約持有者: {lease_of(sftp, 'SRR004')['node']} (應為 node-b)")
+    print(f"   沒有殘留 .stale: {not any('.stale.' in p for p in sftp.files)} (應為 True)")
+except Exception as e:
+    print(f"❌ 失敗: {e}")
+
+print("\n[測試 5] 改名後發現原節點剛好續約: 改名回去，不接手...")
+try:
+    sftp = FakeSFTP()
+    make_queue(sftp, "node-a").claim("SRR005")
+    # node-b 讀到過期的租約後 node-a 才續約，node-b 改名後讀到的是新的租約
+    print(f"✅ node-b 接手: {make_queue(sftp, 'node-b')._steal(FakeNAS(sftp), 'SRR005')} (應為 False)")
+    print(f"   租約持有者: {lease_of(sftp, 'SRR005')['node']} (應為 node-a)")
+    print(f"   沒有殘留 .stale: {not any('.stale.' in p for p in sftp.files)} (應為 True)")
+except Exception as e:
+    print(f"❌ 失敗: {e}")
+
+print("\n[測試 6] 續約與發現租約被接手...")
+try:
+    sftp = FakeSFTP()
+    node_a = make_queue(sftp, "node-a", ttl=0.3)
+    node_a.claim("SRR006")
+    node_a.claim("SRR007")
+    before = lease_of(sftp, "SRR006")["expires"]
+    time.sleep(0.25)
+    print(f"✅ 背景續約: {lease_of(sftp, 'SRR006')['expires'] > before} (應為 True)")
+
+    # 模擬 node-a 續約太晚，租約被 node-b 接手
+    sftp.remove(f"{LEASE_DIR}/SRR007.lease")
+    make_queue(sftp, "node-b").claim("SRR007")
+    time.sleep(0.25)
+    print(f"   lost(): {sorted(node_a.lost())} (應為 ['SRR007'])")
+    print(f"   held(): {sorted(node_a.held())} (應為 ['SRR006'])")
+    node_a.shutdown()
+    print(f"   shutdown 只刪除自己的租約: {sorted(p for p in sftp.files if p.endswith('.lease'))} "
+          f"(應為 ['{LEASE_DIR}/SRR007.lease'])")
+except Exception as e:
+    print(f"❌ 失敗: {e}")
+
+print("\n[測試 7] claims(): 其他節點持有的樣本等待，完成的略過，釋放的接手...")
+try:
+    sftp = FakeSFTP()
+    node_a, node_b = make_queue(sftp, "node-a"), make_queue(sftp, "node-b")
+    node_b.claim("SRR009")
+    node_b.claim("SRR010")
+    claimed = []
+    gen = node_a.claims(["SRR008", "SRR009", "SRR010"], is_done=lambda: {"SRR009"})
+    claimed.append(next(gen))
+    node_b.release("SRR010")
+    claimed.extend(gen)
+    print(f"✅ 取得: {claimed} (應為 ['SRR008', 'SRR010'])")
+    node_a.shutdown()
+    node_b.shutdown()
+except Exception as e:
+    print(f"❌ 失敗: {e}")
+
+print("\n" + "=" * 70)
+print("✅ 所有測試完成!")
+print("=" * 70)
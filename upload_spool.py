@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地上傳暫存區 (spool)
+解壓完成的 FASTQ 先移到暫存區並寫下 manifest，由背景線程上傳到 NAS；
+NAS 無法連線或很慢時只會重試（指數退避），不會讓樣本失敗，下載與解壓照常進行。
+暫存區有容量上限，滿了才讓上游等待。manifest 存在磁碟上，下次啟動時先續傳。
+
+無法重試的錯誤（暫存區檔案遺失、manifest 無法讀取）直接判定失敗並清除該樣本的暫存區；
+本次執行重試超過 max_attempts 次時也判定失敗，但檔案與 manifest 留在磁碟上，下次啟動續傳。
+
+目錄結構:
+    <spool_dir>/<run_id>/manifest.json
+    <spool_dir>/<run_id>/<run_id>_1.fastq ...
+"""
+
+import heapq
+import json
+import shutil
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+MANIFEST_NAME = "manifest.json"
+
+
+class SpoolError(Exception):
+    """暫存區內容損壞（檔案遺失、manifest 無法讀取），重試也不會成功"""
+
+
+class UploadSpool:
+    """持久化的背景上傳佇列"""
+
+    def __init__(
+        self,
+        spool_dir,
+        budget_bytes,
+        upload_func,
+        on_uploaded=None,
+        workers=2,
+        retry_delay=60,
+        max_retry_delay=1800,
+        on_failed=None,
+        max_attempts=48,
+    ):
+        """
+        Args:
+            spool_dir: 暫存區目錄
+            budget_bytes: 暫存區最多容納的位元組數（超過時 add() 等待）
+            upload_func: upload_func(local_file) 上傳單一檔案，失敗時拋出例外
+            on_uploaded: on_uploaded(run_id) 樣本所有檔案上傳完成後呼叫
+            workers: 背景上傳線程數
+            retry_delay: 第一次失敗後的等待秒數（之後每次加倍）
+            max_retry_delay: 單次等待的上限
+            on_failed: on_failed(run_id, error) 樣本放棄上傳時呼叫（無法重試的錯誤或次數用完）
+            max_attempts: 本次執行中每個樣本最多嘗試的次數（0 表示不限制）
+        """
+        self.spool_dir = Path(spool_dir)
+        self.budget_bytes = budget_bytes
+        self.upload_func = upload_func
+        self.on_uploaded = on_uploaded
+        self.workers = max(1, int(workers))
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.on_failed = on_failed
+        self.max_attempts = max_attempts
+
+        self._cond = threading.Condition()
+        self._due = []  # heap: (下次嘗試時間, 序號, run_id)
+        self._seq = 0
+        self._bytes = {}  # run_id -> 佔用位元組
+        self._active = set()  # 正在上傳的 run_id
+        self._attempts = {}  # run_id -> 本次執行中失敗的次數
+        self._stopping = False
+        self._threads = []
+        self.uploaded_count = 0
+        self.failed_count = 0
+
+    # ==================== manifest ====================
+
+    def _manifest_path(self, run_id):
+        return self.spool_dir / run_id / MANIFEST_NAME
+
+    def _read_manifest(self, run_id):
+        with open(self._manifest_path(run_id), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _load_manifest(self, run_id):
+        """讀取 manifest，無法讀取時拋出 SpoolError"""
+        try:
+            manifest = self._read_manifest(run_id)
+            if not isinstance(manifest.get("files"), list) or not isinstance(manifest.get("uploaded"), list):
+                raise ValueError("缺少 files / uploaded")
+        except (OSError, ValueError, AttributeError) as e:
+            raise SpoolError(f"暫存區 manifest 無法讀取: {self._manifest_path(run_id)} ({e})")
+        return manifest
+
+    def _write_manifest(self, manifest):
+        path = self._manifest_path(manifest["run_id"])
+        temp_file = path.with_suffix(".tmp")
+        with open(temp_file, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2, ensure_ascii=False)
+        temp_file.replace(path)
+
+    def _schedule(self, run_id, due):
+        self._seq += 1
+        heapq.heappush(self._due, (due, self._seq, run_id))
+        self._cond.notify_all()
+
+    # ==================== 對外介面 ====================
+
+    def start(self):
+        self.spool_dir.mkdir(parents=True, exist_ok=True)
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker, name=f"spool-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def scan_pending(self):
+        """列出上次執行留在磁碟上、尚未排入上傳的樣本"""
+        if not self.spool_dir.exists():
+            return []
+        with self._cond:
+            return [
+                manifest_file.parent.name
+                for manifest_file in sorted(self.spool_dir.glob(f"*/{MANIFEST_NAME}"))
+                if manifest_file.parent.name not in self._bytes
+            ]
+
+    def load_pending(self, run_ids=None):
+        """
+        載入上次執行留下的 manifest，排入上傳佇列（應在排程新下載之前呼叫）
+
+        Args:
+            run_ids: 只載入這些樣本（None 表示 scan_pending() 列出的全部樣本）
+        """
+        pending = []
+        for run_id in self.scan_pending() if run_ids is None else run_ids:
+            manifest_file = self._manifest_path(run_id)
+            try:
+                manifest = self._read_manifest(run_id)
+            except Exception as e:
+                print(f"⚠️  略過無法讀取的暫存區 manifest {manifest_file}: {e}")
+                continue
+            size = sum(
+                (manifest_file.parent / name).stat().st_size
+                for name in manifest["files"]
+                if (manifest_file.parent / name).exists()
+            )
+            with self._cond:
+                if run_id in self._bytes:
+                    continue
+                self._bytes[run_id] = size
+                self._schedule(run_id, time.time())
+            pending.append(run_id)
+        return pending
+
+    def discard(self, run_id):
+        """清除尚未排入上傳的樣本（例如已由其他節點完成）"""
+        with self._cond:
+            if run_id in self._bytes:
+                return
+        self._remove_run_dir(run_id)
+
+    def add(self, run_id, files):
+        """
+        把解壓完成的檔案移入暫存區並排入上傳（暫存區已滿時等待）
+
+        Args:
+            run_id: 樣本 ID
+            files: 本地 FASTQ 檔案路徑列表
+        """
+        files = [Path(f) for f in files]
+        size = sum(f.stat().st_size for f in files)
+
+        waited = False
+        with self._cond:
+            # 暫存區是空的時候單獨放行，避免超大樣本永遠卡住
+            while self._bytes and sum(self._bytes.values()) + size > self.budget_bytes:
+                if not waited:
+                    print(f"    ⏳ {run_id} 等待上傳暫存區空間 "
+                          f"(已用 {sum(self._bytes.values()) / 1024**3:.1f} / {self.budget_bytes / 1024**3:.1f} GB)",
+                          flush=True)
+                    waited = True
+                self._cond.wait(timeout=60)
+            self._bytes[run_id] = size
+
+        run_dir = self.spool_dir / run_id
+        run_dir.mkdir(parents=True, exist_ok=True)
+        for f in files:
+            shutil.move(str(f), str(run_dir / f.name))
+
+        manifest = {
+            "run_id": run_id,
+            "files": [f.name for f in files],
+            "uploaded": [],
+            "bytes": size,
+            "created": datetime.now().isoformat(),
+            "attempts": 0,
+            "last_error": None,
+        }
+        self._write_manifest(manifest)
+
+        with self._cond:
+            self._schedule(run_id, time.time())
+        print(f"    📦 {run_id} 已移入上傳暫存區 ({size / 1024**3:.2f} GB)", flush=True)
+
+    def pending_ids(self):
+        with self._cond:
+            return set(self._bytes)
+
+    def spooled_bytes(self):
+        with self._cond:
+            return sum(self._bytes.values())
+
+    def wait_idle(self, status_interval=300):
+        """等待暫存區清空，期間定期顯示剩餘數量"""
+        last_report = 0
+        with self._cond:
+            while self._bytes:
+                if time.time() - last_report >= status_interval:
+                    print(f"\n📦 等待上傳暫存區清空: 剩餘 {len(self._bytes)} 個樣本, "
+                          f"{sum(self._bytes.values()) / 1024**3:.1f} GB", flush=True)
+                    last_report = time.time()
+                self._cond.wait(timeout=status_interval)
+
+    def shutdown(self):
+        """停止背景線程（未完成的樣本留在磁碟上，下次啟動續傳）"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        for t in self._threads:
+            t.join(timeout=5)
+
+    # ==================== 背景上傳 ====================
+
+    def _next_due(self):
+        """取出下一個到期的樣本（沒有時阻塞），停止時回傳 None"""
+        with self._cond:
+            while not self._stopping:
+                now = time.time()
+                if self._due and self._due[0][0] <= now:
+                    _, _, run_id = heapq.heappop(self._due)
+                    self._active.add(run_id)
+                    return run_id
+                timeout = self._due[0][0] - now if self._due else None
+                self._cond.wait(timeout=timeout)
+            return None
+
+    def _worker(self):
+        while True:
+            run_id = self._next_due()
+            if run_id is None:
+                return
+            try:
+                self._upload_run(run_id)
+            except SpoolError as e:
+                print(f"    ❌ {run_id} 暫存區上傳失敗（無法重試）: {e}", flush=True)
+                self._remove_run_dir(run_id)
+                self._give_up(run_id, e)
+            except Exception as e:
+                self._retry_later(run_id, e)
+            else:
+                with self._cond:
+                    self._active.discard(run_id)
+                    self._bytes.pop(run_id, None)
+                    self._attempts.pop(run_id, None)
+                    self.uploaded_count += 1
+                    self._cond.notify_all()
+                if self.on_uploaded:
+                    try:
+                        self.on_uploaded(run_id)
+                    except Exception as e:
+                        print(f"⚠️  {run_id} 上傳完成回呼失敗: {e}")
+
+    def _upload_run(self, run_id):
+        run_dir = self.spool_dir / run_id
+        manifest = self._load_manifest(run_id)
+
+        for name in manifest["files"]:
+            if name in manifest["uploaded"]:
+                continue
+            local_file = run_dir / name
+            if not local_file.exists():
+                raise SpoolError(f"暫存區檔案遺失: {local_file}")
+            self.upload_func(local_file)
+            manifest["uploaded"].append(name)
+            self._write_manifest(manifest)
+
+        # 全部上傳完成，移除暫存區中的檔案與 manifest
+        shutil.rmtree(run_dir)
+        print(f"    ✅ {run_id} 暫存區上傳完成，已清除本地檔案", flush=True)
+
+    def _retry_later(self, run_id, error):
+        try:
+            manifest = self._read_manifest(run_id)
+            manifest["attempts"] = manifest.get("attempts", 0) + 1
+            manifest["last_error"] = str(error)
+            self._write_manifest(manifest)
+        except Exception:
+            pass
+
+        with self._cond:
+            attempts = self._attempts[run_id] = self._attempts.get(run_id, 0) + 1
+        if self.max_attempts and attempts >= self.max_attempts:
+            # 檔案與 manifest 保留在磁碟上，下次啟動時續傳
+            print(f"    ❌ {run_id} 上傳失敗 {attempts} 次，本次執行不再重試: {error}", flush=True)
+            self._give_up(run_id, error)
+            return
+
+        delay = min(self.retry_delay * 2 ** (attempts - 1), self.max_retry_delay)
+        print(f"    ⚠️  {run_id} 上傳失敗 (第 {attempts} 次)，{delay:.0f}秒後重試: {error}", flush=True)
+        with self._cond:
+            self._active.discard(run_id)
+            self._schedule(run_id, time.time() + delay)
+
+    def _remove_run_dir(self, run_id):
+        run_dir = self.spool_dir / run_id
+        try:
+            if run_dir.exists():
+                shutil.rmtree(run_dir)
+        except OSError as e:
+            print(f"    ⚠️  無法清除暫存區 {run_dir}: {e}", flush=True)
+
+    def _give_up(self, run_id, error):
+        """放棄上傳: 不再排入重試，通知等待中的線程並呼叫 on_failed"""
+        with self._cond:
+            self._active.discard(run_id)
+            self._bytes.pop(run_id, None)
+            self._attempts.pop(run_id, None)
+            self.failed_count += 1
+            self._cond.notify_all()
+        if self.on_failed:
+            try:
+                self.on_failed(run_id, error)
+            except Exception as e:
+                print(f"⚠️  {run_id} 上傳失敗回呼失敗: {e}")
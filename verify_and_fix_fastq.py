@@ -11,12 +11,12 @@
 import sys
 from pathlib import Path
 from collections import defaultdict
-import posixpath
 
 # 導入配置
 try:
     from config import *
     from nas_uploader import NASUploader
+    from nas_inventory import fastq_files, get_fastq_inventory
 except ImportError as e:
     print(f"❌ 導入失敗: {e}")
     print("請確保 config.py 和 nas_uploader.py 在同一目錄")
@@ -52,23 +52,17 @@ def read_runs_file():
 
 
 def list_nas_fastq_files(nas_uploader):
-    """列出 NAS 上所有的 FASTQ 檔案"""
+    """列出 NAS 上所有的 FASTQ 檔案（含大小，一次取得）"""
     print(f"\n🔍 掃描 NAS 上的 FASTQ 檔案...")
     
     try:
-        # 列出遠端目錄
-        remote_path = NAS_CONFIG['fastq_path']
-        files = nas_uploader.sftp.listdir(remote_path)
-        
-        # 過濾出 .fastq 檔案
-        fastq_files = [f for f in files if f.endswith('.fastq')]
-        
-        print(f"✅ 找到 {len(fastq_files)} 個 FASTQ 檔案")
-        return fastq_files
+        files = fastq_files(get_fastq_inventory().snapshot(nas_uploader, refresh="--refresh" in sys.argv))
+        print(f"✅ 找到 {len(files)} 個 FASTQ 檔案")
+        return files
     
     except Exception as e:
         print(f"❌ 列出 NAS 檔案失敗: {e}")
-        return []
+        return {}
 
 
 def analyze_fastq_files(fastq_files):
@@ -98,13 +92,10 @@ def analyze_fastq_files(fastq_files):
     return samples
 
 
-def get_file_size(nas_uploader, remote_file_path):
-    """獲取遠端檔案大小"""
-    try:
-        stat = nas_uploader.sftp.stat(remote_file_path)
-        return stat.st_size
-    except Exception:
-        return -1
+def get_file_size(nas_files, filename):
+    """從 NAS 清單取得檔案大小（不存在時回傳 -1）"""
+    info = nas_files.get(filename)
+    return info["size"] if info else -1
 
 
 def verify_and_fix():
@@ -133,10 +124,10 @@ def verify_and_fix():
     
     try:
         # 3. 列出 NAS 上的 FASTQ 檔案
-        fastq_files = list_nas_fastq_files(nas_uploader)
+        nas_files = list_nas_fastq_files(nas_uploader)
         
         # 4. 分析檔案
-        samples = analyze_fastq_files(fastq_files)
+        samples = analyze_fastq_files(nas_files)
         
         # 5. 檢查結果
         print(f"\n{'='*80}")
@@ -203,14 +194,11 @@ def verify_and_fix():
         # 8. 檢查檔案大小異常
         print(f"\n🔍 檢查檔案大小異常...")
         size_issues = []
-        remote_base = NAS_CONFIG['fastq_path']
         
-        for run_id in complete_samples[:50]:  # 抽查前 50 個
-            file_1 = posixpath.join(remote_base, f"{run_id}_1.fastq")
-            file_2 = posixpath.join(remote_base, f"{run_id}_2.fastq")
-            
-            size_1 = get_file_size(nas_uploader, file_1)
-            size_2 = get_file_size(nas_uploader, file_2)
+        # 大小已在清單中，不需要額外的 stat，因此檢查所有完整樣本
+        for run_id in complete_samples:
+            size_1 = get_file_size(nas_files, f"{run_id}_1.fastq")
+            size_2 = get_file_size(nas_files, f"{run_id}_2.fastq")
             
             # 檢查檔案大小（成對的檔案大小不應相差太大）
             if size_1 > 0 and size_2 > 0:
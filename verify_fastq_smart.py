@@ -7,59 +7,25 @@
 import sys
 from pathlib import Path
 from collections import defaultdict
-import requests
-import xml.etree.ElementTree as ET
-import time
 
 sys.path.insert(0, str(Path(__file__).parent))
 
-from config import NAS_HOST, NAS_PORT, NAS_USER, NAS_PASS, NAS_FASTQ_PATH, RUNS_FILE
+from config import NAS_HOST, NAS_PORT, NAS_USER, NAS_PASS, RUNS_FILE
 from nas_uploader import NASUploader
+from nas_inventory import fastq_files as only_fastq, get_fastq_inventory
+from metadata_cache import get_metadata_cache
 
 def check_sample_layout_batch(run_ids):
     """
-    批量查詢樣本的 layout
+    批量查詢樣本的 layout（優先讀 metadata 快取，缺少的才批次向 NCBI 查詢）
     
     Returns:
-        dict: {run_id: 'SINGLE' or 'PAIRED'}
+        dict: {run_id: 'SINGLE' or 'PAIRED' or 'UNKNOWN'}
     """
     print("🔍 查詢樣本 layout (SINGLE/PAIRED)...")
     
-    layouts = {}
-    for i, run_id in enumerate(run_ids, 1):
-        try:
-            url = f"https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi"
-            params = {
-                'db': 'sra',
-                'id': run_id,
-                'rettype': 'xml'
-            }
-            
-            response = requests.get(url, params=params, timeout=30)
-            response.raise_for_status()
-            
-            root = ET.fromstring(response.text)
-            
-            # 查找 LIBRARY_LAYOUT
-            layout = 'UNKNOWN'
-            for layout_elem in root.iter('LIBRARY_LAYOUT'):
-                if layout_elem.find('SINGLE') is not None:
-                    layout = 'SINGLE'
-                elif layout_elem.find('PAIRED') is not None:
-                    layout = 'PAIRED'
-                break
-            
-            layouts[run_id] = layout
-            
-            if i % 10 == 0:
-                print(f"  進度: {i}/{len(run_ids)}")
-            
-            # 避免 API 限制
-            time.sleep(0.3)
-            
-        except Exception as e:
-            print(f"  ⚠️  {run_id}: 查詢失敗 - {e}")
-            layouts[run_id] = 'UNKNOWN'
+    values = get_metadata_cache().ensure(run_ids, ['layout'])
+    layouts = {run_id: values.get(run_id, {}).get('layout') or 'UNKNOWN' for run_id in run_ids}
     
     print(f"✅ 完成 {len(layouts)} 個樣本的 layout 查詢")
     return layouts
@@ -98,8 +64,7 @@ def verify_fastq_smart():
         return False
     
     try:
-        all_files = nas.sftp.listdir(NAS_FASTQ_PATH)
-        fastq_files = [f for f in all_files if f.endswith('.fastq')]
+        fastq_files = list(only_fastq(get_fastq_inventory().snapshot(nas, refresh="--refresh" in sys.argv)))
         
         print(f"✅ NAS 上有 {len(fastq_files)} 個 FASTQ 檔案")
         print()
@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多台機器共用的工作佇列（NAS 上的租約檔）
+多台實驗室機器同時執行這個容器時，原本各自讀同一份 runs.txt，只能靠 NAS 上已有的
+FASTQ 避免重複，正在處理中的樣本會被好幾台同時下載。
+
+這裡在 NAS 上為每個處理中的樣本放一個租約檔 <LEASE_PATH>/<run>.lease（JSON: 節點、到期時間）:
+- 取得: SFTP 以 exclusive create（O_CREAT | O_EXCL）建立租約檔，只有一台會成功
+- 續約: 持有租約的節點定期（TTL / 3）重寫到期時間（寫暫存檔後 posix-rename）
+- 接手: 租約過期（節點當機）時，先把租約檔改名為 .stale.<節點>（只有一台改名會成功），
+        確認改名的確實是過期的租約後，再以 exclusive create 取得
+- 釋放: 樣本完成或失敗時刪除租約檔，其他節點可以立即接手（失敗的樣本由其他節點重試）
+
+同一個 NODE_ID 重新啟動時會直接沿用自己留下的租約（繼續續傳部分下載）。
+續約使用專屬的 SFTP 連接，不和上傳、串流解壓搶連接池（連接池被長時間佔滿時續約不會延誤）。
+續約時發現租約已被接手的樣本列在 lost() 中，呼叫端應停止處理這些樣本。
+各節點的時鐘需大致同步（NTP），判定過期時另外保留 skew 秒的容許誤差。
+
+用法:
+    python work_queue.py            # 列出 NAS 上目前的租約
+    python work_queue.py --expired  # 只列出已過期的租約
+"""
+
+import json
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+LEASE_SUFFIX = ".lease"
+
+
+class NASWorkQueue:
+    """以 NAS 租約檔協調多個節點（線程安全）"""
+
+    def __init__(self, pool, lease_dir, node_id, ttl=600, skew=60, poll_interval=120, connect=None):
+        """
+        Args:
+            pool: nas_pool.SFTPConnectionPool（取得、釋放、查詢租約時借用）
+            lease_dir: NAS 上放租約檔的目錄
+            node_id: 這個節點的名稱（預設為主機名稱）
+            ttl: 租約有效秒數，持有期間每 ttl / 3 秒續約一次
+            skew: 判定過期時容許的時鐘誤差（秒）
+            poll_interval: 其他節點持有的樣本，隔多久重新檢查一次（秒）
+            connect: 建立續約專屬連接的函數，回傳已連線的 NASUploader（None 表示續約也從連接池借用）
+        """
+        self.pool = pool
+        self.lease_dir = lease_dir.rstrip("/")
+        self.node_id = node_id
+        self.ttl = ttl
+        self.skew = skew
+        self.poll_interval = poll_interval
+        self.connect = connect
+
+        self._held = set()
+        self._lost = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._dir_ready = False
+        self._heartbeat_nas = None
+
+    def _path(self, run_id):
+        return f"{self.lease_dir}/{run_id}{LEASE_SUFFIX}"
+
+    def _record(self, run_id):
+        now = time.time()
+        return json.dumps({
+            "run_id": run_id,
+            "node": self.node_id,
+            "heartbeat": now,
+            "expires": now + self.ttl,
+        })
+
+    def _ensure_dir(self, nas):
+        if not self._dir_ready:
+            nas.create_remote_dir(self.lease_dir)
+            self._dir_ready = True
+
+    # ==================== 租約檔操作 ====================
+
+    def _create(self, nas, run_id):
+        """exclusive create 租約檔，已存在時回傳 False"""
+        try:
+            with nas.sftp.open(self._path(run_id), "x") as f:
+                f.write(self._record(run_id))
+            return True
+        except IOError:
+            # 已存在時 SFTP 伺服器回傳 SSH_FX_FAILURE（paramiko 拋出 IOError）
+            return False
+
+    def _read(self, nas, path):
+        """
+        讀取租約檔，不存在時回傳 None
+        內容不完整（建立後還沒寫入就當機）時以檔案修改時間 + ttl 作為到期時間
+        """
+        try:
+            with nas.sftp.open(path, "r") as f:
+                data = f.read()
+            lease = json.loads(data)
+            if isinstance(lease, dict) and "expires" in lease:
+                return lease
+        except FileNotFoundError:
+            return None
+        except (IOError, ValueError):
+            pass
+        try:
+            mtime = nas.sftp.stat(path).st_mtime or 0
+        except FileNotFoundError:
+            return None
+        return {"node": None, "expires": mtime + self.ttl}
+
+    def _expired(self, lease):
+        return lease["expires"] + self.skew < time.time()
+
+    def _renew(self, nas, run_id):
+        """重寫到期時間（寫暫存檔後取代，讀取端不會看到寫一半的內容）"""
+        temp = f"{self._path(run_id)}.{self.node_id}.tmp"
+        with nas.sftp.open(temp, "w") as f:
+            f.write(self._record(run_id))
+        nas.replace_remote_file(temp, self._path(run_id))
+
+    def _steal(self, nas, run_id):
+        """接手過期的租約；其他節點搶先接手或原節點剛好續約時回傳 False"""
+        path = self._path(run_id)
+        stale = f"{path}.stale.{self.node_id}.{uuid.uuid4().hex[:8]}"
+        try:
+            # 一般的 SFTP rename 在來源不存在時失敗，多個節點同時改名只有一個會成功
+            nas.sftp.rename(path, stale)
+        except IOError:
+            return False
+        lease = self._read(nas, stale)
+        if lease is not None and not self._expired(lease):
+            # 讀取之後原節點剛好續約，改名回去
+            try:
+                nas.sftp.rename(stale, path)
+            except IOError:
+                nas.sftp.remove(stale)
+            return False
+        nas.sftp.remove(stale)
+        return self._create(nas, run_id)
+
+    # ==================== 取得 / 釋放 ====================
+
+    def claim(self, run_id):
+        """
+        嘗試取得樣本的租約
+
+        Returns:
+            bool: True 表示這個節點可以處理這個樣本
+        """
+        with self.pool.connection() as nas:
+            self._ensure_dir(nas)
+            claimed = self._create(nas, run_id)
+            if not claimed:
+                lease = self._read(nas, self._path(run_id))
+                if lease is None:
+                    # 其他節點剛好釋放
+                    claimed = self._create(nas, run_id)
+                elif lease.get("node") == self.node_id:
+                    # 自己上次留下的租約（重新啟動），直接沿用
+                    self._renew(nas, run_id)
+                    claimed = True
+                elif self._expired(lease):
+                    claimed = self._steal(nas, run_id)
+                    if claimed:
+                        print(f"    🔁 接手 {lease.get('node') or '未知節點'} 過期的租約: {run_id}", flush=True)
+
+        if claimed:
+            with self._lock:
+                self._held.add(run_id)
+                self._lost.discard(run_id)
+            self._start_heartbeat()
+        return claimed
+
+    def release(self, run_id):
+        """釋放租約（只刪除自己持有的租約檔）"""
+        with self._lock:
+            if run_id not in self._held:
+                return
+            self._held.discard(run_id)
+        try:
+            with self.pool.connection() as nas:
+                lease = self._read(nas, self._path(run_id))
+                if lease is not None and lease.get("node") == self.node_id:
+                    nas.sftp.remove(self._path(run_id))
+        except Exception as e:
+            # 刪除失敗也沒關係，租約會自然過期
+            print(f"    ⚠️  釋放租約失敗 {run_id}: {e}")
+
+    def held(self):
+        with self._lock:
+            return set(self._held)
+
+    def lost(self):
+        """續約時發現已被其他節點接手的樣本"""
+        with self._lock:
+            return set(self._lost)
+
+    # ==================== 續約 ====================
+
+    def _start_heartbeat(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._heartbeat, name="lease-heartbeat", daemon=True)
+            self._thread.start()
+
+    @contextmanager
+    def _heartbeat_connection(self):
+        """續約用的連接: 有 connect 時使用專屬連接（失效時重新建立），否則從連接池借用"""
+        if self.connect is None:
+            with self.pool.connection() as nas:
+                yield nas
+            return
+        if self._heartbeat_nas is not None and not self._heartbeat_nas.is_alive():
+            self._close_heartbeat_connection()
+        if self._heartbeat_nas is None:
+            self._heartbeat_nas = self.connect()
+        try:
+            yield self._heartbeat_nas
+        except BaseException:
+            self._close_heartbeat_connection()
+            raise
+
+    def _close_heartbeat_connection(self):
+        if self._heartbeat_nas is not None:
+            try:
+                self._heartbeat_nas.disconnect()
+            except Exception:
+                pass
+            self._heartbeat_nas = None
+
+    def _heartbeat(self):
+        while not self._stop.wait(self.ttl / 3):
+            held = self.held()
+            if not held:
+                continue
+            try:
+                with self._heartbeat_connection() as nas:
+                    for run_id in held:
+                        if run_id not in self.held():
+                            # 剛被釋放
+                            continue
+                        lease = self._read(nas, self._path(run_id))
+                        if lease is None or lease.get("node") != self.node_id:
+                            with self._lock:
+                                self._held.discard(run_id)
+                                self._lost.add(run_id)
+                            owner = lease.get("node") if lease else None
+                            print(f"    ⚠️  {run_id} 的租約已被 {owner or '其他節點'} 接手（續約太晚？）", flush=True)
+                            continue
+                        self._renew(nas, run_id)
+            except Exception as e:
+                # 這次續約失敗，下次再試；連續失敗超過 ttl 時其他節點會接手
+                print(f"    ⚠️  續約失敗 ({len(held)} 個租約): {e}", flush=True)
+
+    def shutdown(self):
+        """停止續約並釋放所有租約（未完成的樣本讓其他節點立即接手）"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+        self._close_heartbeat_connection()
+        for run_id in self.held():
+            self.release(run_id)
+
+    # ==================== 分派 ====================
+
+    def claims(self, run_ids, is_done=None):
+        """
+        依序產生這個節點取得租約的樣本（在提交到管線前逐一取得，背壓時不會預先佔住樣本）
+
+        其他節點持有的樣本先跳過，全部跑過一輪後每 poll_interval 秒重新檢查:
+        已完成（is_done() 回傳的集合中）的略過，租約過期或被釋放的接手。
+
+        Args:
+            run_ids: 要處理的樣本（依排程順序）
+            is_done: 回傳已完成樣本集合的函數（例如 NAS 上已有的樣本）
+        """
+        waiting = []
+        for run_id in run_ids:
+            if self._try_claim(run_id):
+                yield run_id
+            else:
+                waiting.append(run_id)
+
+        if waiting:
+            print(f"\n🤝 {len(waiting)} 個樣本由其他節點處理中，每 {self.poll_interval:.0f} 秒檢查是否需要接手")
+        while waiting:
+            if self._stop.wait(self.poll_interval):
+                return
+            done = set(is_done()) if is_done is not None else set()
+            still_waiting = []
+            for run_id in waiting:
+                if run_id in done:
+                    continue
+                if self._try_claim(run_id):
+                    yield run_id
+                else:
+                    still_waiting.append(run_id)
+            waiting = still_waiting
+
+    def _try_claim(self, run_id):
+        try:
+            return self.claim(run_id)
+        except Exception as e:
+            print(f"    ⚠️  無法取得 {run_id} 的租約: {e}")
+            return False
+
+    # ==================== 查詢 ====================
+
+    def leases(self):
+        """列出 NAS 上所有租約"""
+        with self.pool.connection() as nas:
+            self._ensure_dir(nas)
+            names = [n for n in nas.sftp.listdir(self.lease_dir) if n.endswith(LEASE_SUFFIX)]
+            result = []
+            for name in sorted(names):
+                lease = self._read(nas, f"{self.lease_dir}/{name}")
+                if lease is not None:
+                    lease.setdefault("run_id", name[: -len(LEASE_SUFFIX)])
+                    result.append(lease)
+            return result
+
+
+_default_queue = None
+_default_queue_lock = threading.Lock()
+
+
+def get_work_queue():
+    """取得依 config.py 設定建立的共用工作佇列"""
+    global _default_queue
+    with _default_queue_lock:
+        if _default_queue is None:
+            from config import (LEASE_POLL_SECONDS, LEASE_TTL_SECONDS, NAS_HOST, NAS_LEASE_PATH, NAS_PASS,
+                                NAS_PORT, NAS_USER, NODE_ID)
+            from nas_pool import NASConnectionError, get_nas_pool
+            from nas_uploader import NASUploader
+
+            def connect():
+                uploader = NASUploader(NAS_HOST, NAS_PORT, NAS_USER, NAS_PASS)
+                if not uploader.connect():
+                    uploader.disconnect()
+                    raise NASConnectionError(f"續約連接失敗: {NAS_HOST}")
+                return uploader
+
+            _default_queue = NASWorkQueue(
+                get_nas_pool(), NAS_LEASE_PATH, NODE_ID, ttl=LEASE_TTL_SECONDS, poll_interval=LEASE_POLL_SECONDS,
+                connect=connect,
+            )
+        return _default_queue
+
+
+if __name__ == "__main__":
+    queue = get_work_queue()
+    leases = queue.leases()
+    if "--expired" in sys.argv:
+        leases = [lease for lease in leases if queue._expired(lease)]
+    print(f"🤝 {queue.lease_dir}: {len(leases)} 個租約 (本節點: {queue.node_id})")
+    now = time.time()
+    for lease in leases:
+        remaining = lease["expires"] - now
+        state = f"剩 {remaining:.0f} 秒" if remaining > 0 else f"已過期 {-remaining:.0f} 秒"
+        print(f"   {lease['run_id']:<14}{lease.get('node') or '?':<24}{state}")